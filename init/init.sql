@@ -1,4 +1,6 @@
 -- CORREGIDO: crear estaciones primero, luego logs que referencian estaciones.
+-- El script es idempotente: además de inicializar una base vacía, se puede volver a ejecutar
+-- sobre una base existente para migrar una weather_logs sin particionar (ver más abajo).
 CREATE TABLE IF NOT EXISTS weather_stations (
     id SERIAL PRIMARY KEY,
     name VARCHAR(100) NOT NULL,
@@ -9,8 +11,37 @@ CREATE TABLE IF NOT EXISTS weather_stations (
     altitude DOUBLE PRECISION
 );
 
+-- Avisa a los consumidores de cualquier cambio en weather_stations para que recarguen su caché
+-- de estaciones (utils/stations.py, LISTEN weather_stations_changed).
+CREATE OR REPLACE FUNCTION notificar_cambio_estaciones() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('weather_stations_changed', TG_OP);
+    RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS trg_weather_stations_cambio ON weather_stations;
+CREATE TRIGGER trg_weather_stations_cambio
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON weather_stations
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio_estaciones();
+
+-- Migración: una weather_logs previa (tabla única sin particionar) se aparta para crear la
+-- tabla particionada; sus filas se copian al final del script.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class
+        WHERE oid = to_regclass('weather_logs') AND relkind = 'r'
+    ) THEN
+        ALTER TABLE weather_logs RENAME TO weather_logs_sin_particionar;
+        ALTER TABLE weather_logs_sin_particionar RENAME CONSTRAINT weather_logs_pkey TO weather_logs_sin_particionar_pkey;
+    END IF;
+END$$;
+
+-- weather_logs particionada por rango mensual de `dates`. El consumidor inserta en la tabla
+-- padre y PostgreSQL enruta cada fila a su partición. La clave primaria debe incluir la
+-- clave de partición.
 CREATE TABLE IF NOT EXISTS weather_logs (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     id_station INTEGER NOT NULL REFERENCES weather_stations(id),
     dates TIMESTAMP WITH TIME ZONE NOT NULL,
     temperature_celsius REAL,
@@ -18,25 +49,210 @@ CREATE TABLE IF NOT EXISTS weather_logs (
     wind VARCHAR(5),
     wind_speed REAL,
     pressure REAL,
+    -- Momento de la inserción: la retención reagrega los buckets que reciben lecturas tardías
+    ingested_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
     -- CHECK básico para evitar valores absurdos
-    CHECK (temperature_celsius IS NULL OR (temperature_celsius > -100 AND temperature_celsius < 100))
+    CHECK (temperature_celsius IS NULL OR (temperature_celsius > -100 AND temperature_celsius < 100)),
+    PRIMARY KEY (id, dates)
+) PARTITION BY RANGE (dates);
+
+-- Migración: las filas existentes reciben '-infinity' (ya están agregadas, no son tardías);
+-- las nuevas, now(). Ninguno de los dos pasos reescribe la tabla.
+ALTER TABLE weather_logs ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT '-infinity';
+ALTER TABLE weather_logs ALTER COLUMN ingested_at SET DEFAULT now();
+
+-- Recoge las filas de meses sin partición (fechas muy antiguas o futuras) para que una
+-- inserción nunca falle; crear_particiones_weather_logs() las mueve a su partición.
+CREATE TABLE IF NOT EXISTS weather_logs_default PARTITION OF weather_logs DEFAULT;
+
+-- Índices declarados en la tabla padre (se crean en cada partición):
+-- - Único (id_station, dates): clave natural de una lectura. El consumidor inserta con
+--   ON CONFLICT DO NOTHING, así que una reentrega o un reintento no duplica filas. Sirve
+--   también para las últimas lecturas / rango temporal de una estación (recorrido inverso).
+-- - BRIN (dates): rangos temporales de todas las estaciones; las filas llegan casi en orden
+--   de fecha, así que el índice ocupa unas pocas páginas por partición.
+-- Migración: en una base existente se eliminan antes los duplicados (se conserva el menor id)
+-- y el índice único sustituye al anterior idx_weather_logs_station_dates.
+DO $$
+BEGIN
+    IF to_regclass('uq_weather_logs_station_dates') IS NULL THEN
+        DELETE FROM weather_logs a
+        USING weather_logs b
+        WHERE a.id_station = b.id_station AND a.dates = b.dates AND a.id > b.id;
+    END IF;
+END$$;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_weather_logs_station_dates ON weather_logs (id_station, dates);
+DROP INDEX IF EXISTS idx_weather_logs_station_dates;
+CREATE INDEX IF NOT EXISTS idx_weather_logs_dates_brin ON weather_logs USING BRIN (dates) WITH (pages_per_range = 32);
+-- BRIN (ingested_at): lecturas tardías desde la última reagregación (ingested_at crece con
+-- el orden físico de inserción).
+CREATE INDEX IF NOT EXISTS idx_weather_logs_ingested_brin ON weather_logs USING BRIN (ingested_at) WITH (pages_per_range = 32);
+
+-- Agregados por estación (retention.py): una fila por estación y hora/día con min/máx/media
+-- de cada magnitud y la dirección de viento dominante. Sustituyen a las lecturas crudas una
+-- vez que estas superan la edad de retención.
+CREATE TABLE IF NOT EXISTS weather_logs_hourly (
+    id_station INTEGER NOT NULL REFERENCES weather_stations(id),
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    readings INTEGER NOT NULL,
+    temperature_min REAL,
+    temperature_max REAL,
+    temperature_avg REAL,
+    humidity_min REAL,
+    humidity_max REAL,
+    humidity_avg REAL,
+    wind_speed_min REAL,
+    wind_speed_max REAL,
+    wind_speed_avg REAL,
+    pressure_min REAL,
+    pressure_max REAL,
+    pressure_avg REAL,
+    wind_dominant VARCHAR(5),
+    PRIMARY KEY (id_station, bucket)
 );
+CREATE TABLE IF NOT EXISTS weather_logs_daily (LIKE weather_logs_hourly INCLUDING ALL);
+CREATE INDEX IF NOT EXISTS idx_weather_logs_hourly_bucket ON weather_logs_hourly USING BRIN (bucket);
+CREATE INDEX IF NOT EXISTS idx_weather_logs_daily_bucket ON weather_logs_daily (bucket);
 
-INSERT INTO weather_stations (name, city, country, latitude, longitude, altitude) VALUES
+-- Hasta dónde (exclusivo) está agregado cada nivel: cada pasada solo procesa lo posterior.
+-- `reagregado`: ingested_at a partir del cual quedan lecturas tardías por reagregar.
+CREATE TABLE IF NOT EXISTS weather_rollup_watermarks (
+    rollup VARCHAR(20) PRIMARY KEY,
+    hasta TIMESTAMP WITH TIME ZONE NOT NULL,
+    actualizado TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    reagregado TIMESTAMP WITH TIME ZONE
+);
+ALTER TABLE weather_rollup_watermarks ADD COLUMN IF NOT EXISTS reagregado TIMESTAMP WITH TIME ZONE;
+
+-- Segmentos del spool local del consumidor ya cargados en weather_logs (SPOOL_ENABLED). Se
+-- insertan en la misma transacción que sus filas: un segmento registrado no se vuelve a cargar.
+CREATE TABLE IF NOT EXISTS weather_spool_replayed (
+    segment VARCHAR(64) PRIMARY KEY,
+    rows_loaded INTEGER NOT NULL,
+    replayed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Marca de escritura de cada instancia del consumidor (INGEST_WATERMARK_INTERVAL_S): filas
+-- nuevas escritas desde su arranque y momento de la última actualización. El servicio de
+-- consultas invalida su caché de respuestas cuando cambia.
+CREATE TABLE IF NOT EXISTS weather_ingest_watermarks (
+    instancia VARCHAR(128) PRIMARY KEY,
+    filas BIGINT NOT NULL,
+    escrito TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Agregados móviles del consumidor (ROLLING_FLUSH_INTERVAL_S > 0): una fila por estación y
+-- ventana ('last', '1m', '5m', '1h') que se sobrescribe en cada volcado.
+CREATE TABLE IF NOT EXISTS weather_station_rolling (
+    id_station INTEGER NOT NULL REFERENCES weather_stations(id),
+    ventana VARCHAR(5) NOT NULL,
+    readings INTEGER NOT NULL,
+    temperature_avg REAL,
+    temperature_min REAL,
+    temperature_max REAL,
+    humidity_avg REAL,
+    humidity_min REAL,
+    humidity_max REAL,
+    wind_speed_avg REAL,
+    wind_speed_min REAL,
+    wind_speed_max REAL,
+    pressure_avg REAL,
+    pressure_min REAL,
+    pressure_max REAL,
+    actualizado TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (id_station, ventana)
+);
+
+-- Crea las particiones mensuales que falten desde el mes de `desde` (por defecto, el actual)
+-- hasta `meses_adelante` meses después del actual. Si la partición DEFAULT ya contiene filas
+-- de un mes nuevo, se mueven a la partición creada. Los límites de mes se calculan en la zona
+-- horaria de la sesión. El consumidor la invoca periódicamente (DB_PARTITION_MAINTENANCE_INTERVAL_S).
+CREATE OR REPLACE FUNCTION crear_particiones_weather_logs(meses_adelante INTEGER DEFAULT 3, desde DATE DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    mes DATE := date_trunc('month', COALESCE(desde, current_date))::date;
+    hasta DATE := (date_trunc('month', current_date) + make_interval(months => meses_adelante))::date;
+    siguiente DATE;
+    nombre TEXT;
+    creadas INTEGER := 0;
+BEGIN
+    -- Serializa consumidores concurrentes que ejecutan el mantenimiento a la vez.
+    PERFORM pg_advisory_xact_lock(hashtext('crear_particiones_weather_logs'));
+    WHILE mes <= hasta LOOP
+        siguiente := (mes + INTERVAL '1 month')::date;
+        nombre := format('weather_logs_%s', to_char(mes, 'YYYY_MM'));
+        IF to_regclass(nombre) IS NULL THEN
+            -- PostgreSQL no permite crear la partición si DEFAULT tiene filas de su rango.
+            CREATE TEMP TABLE IF NOT EXISTS weather_logs_a_mover (LIKE weather_logs) ON COMMIT DROP;
+            WITH movidas AS (
+                DELETE FROM weather_logs_default WHERE dates >= mes AND dates < siguiente RETURNING *
+            )
+            INSERT INTO weather_logs_a_mover SELECT * FROM movidas;
+            EXECUTE format('CREATE TABLE %I PARTITION OF weather_logs FOR VALUES FROM (%L) TO (%L)', nombre, mes, siguiente);
+            INSERT INTO weather_logs SELECT * FROM weather_logs_a_mover;
+            TRUNCATE weather_logs_a_mover;
+            creadas := creadas + 1;
+        END IF;
+        mes := siguiente;
+    END LOOP;
+    RETURN creadas;
+END$$;
+
+INSERT INTO weather_stations (name, city, country, latitude, longitude, altitude)
+SELECT * FROM (VALUES
 ('Estacion Norte', 'Ciudad A', 'Colombia', 4.700, -74.050, 2550),
 ('Estacion Sur',  'Ciudad B', 'Chile', 4.500, -74.100, 2450),
 ('Estacion Este', 'Ciudad C', 'Argentina', 4.650, -73.950, 2600),
 ('Estacion Oeste', 'Ciudad D', 'Romania', 4.720, -74.200, 2400),
-('Estacion Central','Ciudad E', 'Colombia', 4.680, -74.080, 2500);
+('Estacion Central','Ciudad E', 'Colombia', 4.680, -74.080, 2500)
+) AS v
+WHERE NOT EXISTS (SELECT 1 FROM weather_stations);
+
+-- Las estaciones del generador de carga (PUBLISH_MODE=load) no forman parte del esquema: se
+-- cargan a propósito con init/load_test/seed_stations.sql (ver el final del script).
+
+-- Particiones iniciales: el mes anterior, el actual y los 3 siguientes.
+SELECT crear_particiones_weather_logs(3, (current_date - INTERVAL '1 month')::date);
+
+-- Migración (continuación): copia las filas de la tabla sin particionar, creando antes las
+-- particiones de todo su historial, y conserva los id existentes.
+DO $$
+DECLARE
+    primer_mes DATE;
+BEGIN
+    IF to_regclass('weather_logs_sin_particionar') IS NOT NULL THEN
+        SELECT date_trunc('month', MIN(dates))::date INTO primer_mes FROM weather_logs_sin_particionar;
+        IF primer_mes IS NOT NULL THEN
+            PERFORM crear_particiones_weather_logs(3, primer_mes);
+        END IF;
+        INSERT INTO weather_logs (id, id_station, dates, temperature_celsius, humidity, wind, wind_speed, pressure)
+        SELECT id, id_station, dates, temperature_celsius, humidity, wind, wind_speed, pressure
+        FROM weather_logs_sin_particionar
+        ORDER BY id
+        ON CONFLICT (id_station, dates) DO NOTHING;
+        PERFORM setval(pg_get_serial_sequence('weather_logs', 'id'), COALESCE((SELECT MAX(id) FROM weather_logs), 0) + 1, false);
+        DROP TABLE weather_logs_sin_particionar;
+    END IF;
+END$$;
 
 -- Asegurar que la constraint existe también para tablas ya creadas (idempotente)
 DO $$
 BEGIN
     IF NOT EXISTS (
-        SELECT 1 FROM pg_constraint WHERE conname = 'chk_temperature_range'
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'chk_temperature_range' AND conrelid = 'weather_logs'::regclass
     ) THEN
         ALTER TABLE weather_logs
           ADD CONSTRAINT chk_temperature_range
           CHECK (temperature_celsius IS NULL OR (temperature_celsius > -100 AND temperature_celsius < 100));
     END IF;
-END$$;
\ No newline at end of file
+END$$;
+
+-- Migración: una versión anterior de este script creaba las estaciones simuladas 6-9999 en
+-- todas las bases; se eliminan las que nada referencia (con lecturas se conservan por la FK).
+DELETE FROM weather_stations s
+WHERE s.city = 'Simulada' AND s.name LIKE 'Estacion Simulada %'
+  AND NOT EXISTS (SELECT 1 FROM weather_logs l WHERE l.id_station = s.id)
+  AND NOT EXISTS (SELECT 1 FROM weather_logs_hourly h WHERE h.id_station = s.id)
+  AND NOT EXISTS (SELECT 1 FROM weather_station_rolling r WHERE r.id_station = s.id);
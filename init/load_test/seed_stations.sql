@@ -0,0 +1,13 @@
+-- Estaciones del generador de carga del producer (PUBLISH_MODE=load). No se ejecuta al crear la
+-- base: docker-entrypoint-initdb.d solo lee los scripts de init/, no sus subdirectorios. Cargarlo
+-- solo en entornos de prueba de carga:
+--
+--   docker compose exec -T db psql -U postgres -d postgres < init/load_test/seed_stations.sql
+--
+-- IDs 9000-9999 (PRIMERA_ESTACION_CARGA y MAX_ESTACIONES_CARGA en load_generator.py), reservados
+-- para carga dentro del rango que acepta la validación del consumidor. Idempotente. No mueve la
+-- secuencia de weather_stations: las estaciones reales siguen numerándose desde la última real.
+INSERT INTO weather_stations (id, name, city, country)
+SELECT g, 'Estacion de carga ' || g, 'Carga', 'N/A'
+FROM generate_series(9000, 9999) AS g
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,560 @@
+# Motor asyncio del consumidor (CONSUMER_ENGINE=async), alternativo al bucle síncrono de main.py.
+# Usa **aio-pika** para RabbitMQ y **asyncpg** (con pool de conexiones) para PostgreSQL, de modo que
+# la recepción de mensajes, la validación y las escrituras en la DB se solapan en lugar de
+# ejecutarse una detrás de otra. Mantiene la semántica de procesar_mensaje:
+# - JSON o datos inválidos: publicar en DLQ y ACK.
+# - Sobres (x-readings): solo las lecturas inválidas a la DLQ; un ACK cuando las válidas son durables.
+# - Error transitorio de la DB: spool local si está activo (utils.spool; lo reproduce el hilo
+#   de main.py), si no reintento diferido (utils.retry) o NACK con requeue=True si no hay
+#   niveles de reintento configurados.
+# - Fila rechazada por la DB (FK, CHECK): esa fila a la DLQ y ACK.
+# - Éxito: ACK solo después del commit.
+# - Duplicado (message_id ya escrito o lectura ya en weather_logs): ACK sin insertar.
+
+import time
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+import aio_pika
+import asyncpg
+
+from utils.config import (
+    RABBIT_USER, RABBIT_PASS, RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_EXCHANGE, RABBITMQ_QUEUE, ROUTING_KEY,
+    RABBITMQ_DLQ_EXCHANGE, RABBITMQ_DLQ_QUEUE, RABBITMQ_SHARDS, CONSUMER_SHARDS,
+    RETRY_DELAYS_S, RETRY_MAX_ATTEMPTS, RETRY_EXCHANGE_PREFIX, SPOOL_BYPASS_S, DEDUP_CACHE_SIZE,
+    POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_SSLMODE,
+    DB_MAX_RETRIES, DB_RETRY_BASE_SLEEP, RABBIT_RECONNECT_DELAY,
+    DB_BATCH_SIZE, DB_BATCH_LINGER_MS, CONSUMER_PREFETCH, DB_WRITE_ENGINE,
+    ASYNC_DB_POOL_SIZE, ASYNC_DB_CONCURRENCY,
+)
+from utils.metrics import (
+    contar_insertadas, registrar_lecturas, MESSAGES_DUPLICATED, MESSAGES_RETRIED, RETRIES_EXHAUSTED,
+    VALIDATION_ERRORS, BATCH_ROWS, DB_TRANSITORIO, ETAPA_ACK, ETAPA_COMMIT, ETAPA_DECODIFICACION, ETAPA_DLQ,
+    ETAPA_INSERCION, ETAPA_VALIDACION, contar_fallos, etapa, observar_latencia, seguir_en_vuelo,
+)
+from utils.validation import ErrorValidacion, normalizar, validar_lote
+from utils.encoding import HEADER_LECTURAS, ErrorDecodificacion, desempaquetar
+from utils.retry import argumentos_nivel, cabeceras_reintento, nivel_siguiente, nombre_nivel, reintentos
+from utils.dedup import IdsRecientes
+from utils.dlq import DECODIFICACION, DESCONOCIDO, RECHAZO_DB, REINTENTOS_AGOTADOS, VALIDACION, cabeceras_dlq
+from utils.spool import Spool, SpoolLleno
+from utils.sharding import ARGUMENTOS_COLA_SHARD, cola_shard, parsear_shards, routing_key_shard
+from utils.stations import CacheEstaciones
+
+logger = logging.getLogger("CONSUMER_LOG")
+log_mensajes = logging.getLogger("CONSUMER_LOG.mensajes")
+
+COLUMNAS = ["id_station", "dates", "temperature_celsius", "humidity", "wind", "wind_speed", "pressure"]
+
+# asyncpg usa placeholders posicionales ($1..$n) en lugar de %s. Igual que en main.py, una
+# lectura ya guardada (clave única id_station, dates) se ignora.
+INSERT_SQL_ASYNC = """
+INSERT INTO weather_logs (
+    id_station, dates, temperature_celsius, humidity,
+    wind, wind_speed, pressure
+) VALUES ($1, $2, $3, $4, $5, $6, $7)
+ON CONFLICT (id_station, dates) DO NOTHING
+"""
+
+# Motor 'insert' para lotes: una sola sentencia con un array por columna. A diferencia de
+# executemany, la etiqueta de estado ('INSERT 0 <n>') cuenta solo las filas nuevas, así que
+# las lecturas ya guardadas van a rows_duplicate_total como en el motor síncrono.
+INSERT_LOTE_SQL_ASYNC = """
+INSERT INTO weather_logs (
+    id_station, dates, temperature_celsius, humidity,
+    wind, wind_speed, pressure
+)
+SELECT * FROM unnest($1::int[], $2::timestamptz[], $3::real[], $4::real[], $5::text[], $6::real[], $7::real[])
+ON CONFLICT (id_station, dates) DO NOTHING
+"""
+
+# Motor 'copy': COPY a una tabla temporal de la sesión y de ahí a weather_logs, porque COPY no
+# admite ON CONFLICT (mismas sentencias que COPY_TEMP_SQL / COPY_MOVER_SQL de main.py)
+COPY_TEMP_SQL_ASYNC = """
+CREATE TEMP TABLE IF NOT EXISTS weather_logs_entrada (
+    id_station INTEGER, dates TIMESTAMP WITH TIME ZONE, temperature_celsius REAL, humidity REAL,
+    wind VARCHAR(5), wind_speed REAL, pressure REAL
+) ON COMMIT DELETE ROWS
+"""
+
+COPY_MOVER_SQL_ASYNC = """
+INSERT INTO weather_logs (
+    id_station, dates, temperature_celsius, humidity,
+    wind, wind_speed, pressure
+)
+SELECT id_station, dates, temperature_celsius, humidity, wind, wind_speed, pressure
+FROM weather_logs_entrada
+ON CONFLICT (id_station, dates) DO NOTHING
+"""
+
+
+def filas_insertadas(estado: str) -> int:
+    """Filas nuevas según la etiqueta de estado de asyncpg ('INSERT 0 <n>')."""
+    return int(estado.rsplit(" ", 1)[-1])
+
+# Equivalentes asyncpg de OperationalError (transitorio) e IntegrityError/DataError (fila inválida).
+# Además de los errores de conexión del cliente (clase SQLSTATE 08) son transitorios los que envía
+# el servidor al reiniciarse o al failover: clase 57 (AdminShutdownError 57P01,
+# CannotConnectNowError 57P03, statement_timeout) y clase 53 (TooManyConnectionsError 53300).
+# psycopg2 los lanza como OperationalError, así que el motor síncrono ya los reintenta.
+ERRORES_TRANSITORIOS = (
+    OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError,
+    asyncpg.exceptions.OperatorInterventionError, asyncpg.exceptions.InsufficientResourcesError,
+)
+ERRORES_DE_FILA = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+
+
+# ==============================
+# CONEXIÓN A PostgreSQL (asyncpg)
+# ==============================
+
+async def crear_pool_con_reintentos(max_retries: int = DB_MAX_RETRIES) -> asyncpg.Pool:
+    """Crea el pool asyncpg con el mismo backoff exponencial que connect_db_with_retry."""
+    attempt = 0
+    while True:
+        try:
+            pool = await asyncpg.create_pool(
+                host=POSTGRES_HOST, port=POSTGRES_PORT, user=POSTGRES_USER,
+                password=POSTGRES_PASSWORD, database=POSTGRES_DB, ssl=POSTGRES_SSLMODE,
+                min_size=1, max_size=ASYNC_DB_POOL_SIZE,
+            )
+            logger.info("Pool asyncpg conectado a PostgreSQL (max=%d).", ASYNC_DB_POOL_SIZE)
+            return pool
+        except ERRORES_TRANSITORIOS as e:
+            attempt += 1
+            logger.warning("Error conectando a PostgreSQL (intento %d/%d): %s", attempt, max_retries, str(e))
+            if attempt >= max_retries:
+                logger.error("No se pudo conectar a PostgreSQL después de %d intentos.", max_retries)
+                raise
+            sleep_time = DB_RETRY_BASE_SLEEP * (2 ** (attempt - 1))
+            logger.info("Reintentando en %.1f segundos...", sleep_time)
+            await asyncio.sleep(sleep_time)
+
+
+# ==============================
+# CONSUMIDOR ASÍNCRONO
+# ==============================
+
+class ConsumidorAsync:
+    """Recibe mensajes en el callback de aio-pika y los escribe en lotes desde tareas aparte.
+
+    El callback solo decodifica, valida y encola; ASYNC_DB_CONCURRENCY tareas escritoras
+    toman hasta DB_BATCH_SIZE filas (o lo llegado en DB_BATCH_LINGER_MS) y las escriben
+    con conexiones del pool, mientras el callback sigue recibiendo. El número de mensajes
+    en memoria está acotado por el prefetch del canal.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, dlq_exchange: aio_pika.abc.AbstractExchange,
+                 niveles: Optional[List[aio_pika.abc.AbstractExchange]] = None, spool: Optional[Spool] = None,
+                 estaciones: Optional[CacheEstaciones] = None):
+        self.pool = pool
+        self.dlq_exchange = dlq_exchange
+        # Exchanges de los niveles de reintento diferido, del más corto al más largo
+        self.niveles = niveles or []
+        self.spool = spool
+        # message_id de los mensajes ya escritos: un duplicado reciente se confirma sin ir a la DB
+        self.escritos = IdsRecientes(DEDUP_CACHE_SIZE)
+        # Caché de weather_stations de main.py (sin cargar = se aceptan todas las estaciones)
+        self.estaciones = estaciones or CacheEstaciones()
+        # Elementos: (mensaje, filas válidas, cuerpo en la DLQ de la fila j; None = mensaje original).
+        # Las filas de un sobre viajan juntas para escribirse en la misma transacción.
+        self._cola: "asyncio.Queue[Tuple[aio_pika.abc.AbstractIncomingMessage, List[tuple], Optional[Callable[[int], bytes]]]]" = asyncio.Queue()
+        self._escritores: List[asyncio.Task] = []
+        # Mensajes recibidos sin ACK/NACK y filas en la cola de escritura (gauges de en vuelo)
+        self.en_vuelo = 0
+        self.filas_pendientes = 0
+        seguir_en_vuelo(self)
+
+    def iniciar_escritores(self) -> None:
+        for _ in range(ASYNC_DB_CONCURRENCY):
+            self._escritores.append(asyncio.create_task(self._escritor()))
+
+    async def detener(self) -> None:
+        for tarea in self._escritores:
+            tarea.cancel()
+        await asyncio.gather(*self._escritores, return_exceptions=True)
+
+    # ---- Recepción ----
+
+    async def on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        """Equivalente asíncrono de procesar_mensaje (hasta la escritura en DB)."""
+        log_mensajes.info("Mensaje recibido. Delivery tag=%s", message.delivery_tag)
+        self.en_vuelo += 1
+
+        if self.escritos.contiene(message.message_id):
+            MESSAGES_DUPLICATED.inc()
+            log_mensajes.info("Mensaje duplicado (message_id=%s), se descarta. Delivery tag=%s",
+                              message.message_id, message.delivery_tag)
+            await self._ack(message)
+            return
+
+        try:
+            with etapa(ETAPA_DECODIFICACION):
+                sobre = desempaquetar(message.body, message.content_type, message.content_encoding, message.headers)
+        except ErrorDecodificacion as e:
+            logger.error("Cuerpo inválido (%s). Enviando a DLQ.", e)
+            contar_fallos(DECODIFICACION)
+            await self._a_dlq_y_ack(message, DECODIFICACION, str(e))
+            return
+
+        if sobre.es_lote:
+            with etapa(ETAPA_VALIDACION):
+                validas, errores = self.estaciones.filtrar(*validar_lote(sobre.lecturas))
+            # La validación es determinista: en un reintento las inválidas ya están en la DLQ.
+            if reintentos(message.headers) > 0:
+                errores = []
+            for i, e in errores:
+                VALIDATION_ERRORS.labels(code=e.codigo).inc()
+                contar_fallos(VALIDACION)
+                logger.warning("Lectura %d/%d inválida (%s: %s) -> DLQ. Delivery tag=%s",
+                               i + 1, len(sobre), e.codigo, e, message.delivery_tag)
+                await self._publicar_dlq(message, sobre.cuerpo(i), motivo=VALIDACION, detalle=f"{e.codigo}: {e}")
+            if not validas:
+                await self._ack(message)
+                return
+            indices = [i for i, _ in validas]
+            await self._encolar((message, [fila for _, fila in validas], lambda j: sobre.cuerpo(indices[j])))
+            return
+
+        try:
+            with etapa(ETAPA_VALIDACION):
+                fila = self.estaciones.verificar(normalizar(sobre.lecturas[0]))
+        except ErrorValidacion as e:
+            VALIDATION_ERRORS.labels(code=e.codigo).inc()
+            contar_fallos(VALIDACION)
+            logger.warning("Datos inválidos (%s: %s) -> DLQ. Delivery tag=%s", e.codigo, e, message.delivery_tag)
+            await self._a_dlq_y_ack(message, VALIDACION, f"{e.codigo}: {e}")
+            return
+
+        await self._encolar((message, [fila], None))
+
+    async def _encolar(self, elemento: tuple) -> None:
+        self.filas_pendientes += len(elemento[1])
+        await self._cola.put(elemento)
+
+    async def _ack(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        self.en_vuelo -= 1
+        with etapa(ETAPA_ACK):
+            await message.ack()
+
+    async def _nack(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        self.en_vuelo -= 1
+        with etapa(ETAPA_ACK):
+            await message.nack(requeue=True)
+
+    async def _publicar_dlq(self, message: aio_pika.abc.AbstractIncomingMessage, lectura: Optional[bytes] = None,
+                            headers: Optional[dict] = None, motivo: str = DESCONOCIDO, detalle: str = "") -> None:
+        """Publica en la DLQ el mensaje original o, si se indica, una sola lectura de su sobre.
+
+        Como publish_to_dlq, registra el motivo y el detalle en las cabeceras x-dlq-*.
+        """
+        if lectura is None:
+            body, content_encoding = message.body, message.content_encoding
+            headers = message.headers if headers is None else headers
+        else:
+            headers = {k: v for k, v in (message.headers or {}).items() if k != HEADER_LECTURAS}
+            body, content_encoding = lectura, None
+        try:
+            with etapa(ETAPA_DLQ):
+                await self.dlq_exchange.publish(
+                    aio_pika.Message(
+                        body=body,
+                        headers=cabeceras_dlq(headers, motivo, detalle),
+                        content_type=message.content_type,
+                        content_encoding=content_encoding,
+                        message_id=message.message_id,
+                        timestamp=message.timestamp,
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    ),
+                    routing_key=ROUTING_KEY,
+                )
+            log_mensajes.info("Mensaje publicado en DLQ: %s", RABBITMQ_DLQ_QUEUE)
+        except Exception:
+            logger.exception("Fallo al publicar en DLQ.")
+
+    async def _a_dlq_y_ack(self, message: aio_pika.abc.AbstractIncomingMessage, motivo: str, detalle: str) -> None:
+        try:
+            await self._publicar_dlq(message, motivo=motivo, detalle=detalle)
+        finally:
+            await self._ack(message)
+
+    # ---- Escritura ----
+
+    async def _escritor(self) -> None:
+        loop = asyncio.get_running_loop()
+        linger_s = DB_BATCH_LINGER_MS / 1000.0
+        while True:
+            lote = [await self._cola.get()]
+            n_filas = len(lote[0][1])
+            limite = loop.time() + linger_s
+            while n_filas < DB_BATCH_SIZE:
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self._cola.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+                n_filas += len(lote[-1][1])
+            self.filas_pendientes -= n_filas
+            try:
+                await self._escribir(lote)
+            except Exception:
+                # Nunca debe morir una tarea escritora: el lote pasa a reintento diferido.
+                logger.exception("Error inesperado escribiendo lote asíncrono, reintento diferido.")
+                await self._nack_lote(lote, "error inesperado")
+
+    async def _escribir(self, lote: list) -> None:
+        filas = [fila for _, filas_msg, _ in lote for fila in filas_msg]
+        if self.spool is not None and self.spool.derivando:
+            # La DB acaba de fallar: al spool sin esperar a otro timeout de conexión
+            await self._nack_lote(lote, "DB no disponible")
+            return
+        BATCH_ROWS.observe(len(filas))
+        try:
+            async with self.pool.acquire() as conn:
+                # Transacción explícita para medir por separado la escritura y el commit
+                transaccion = conn.transaction()
+                await transaccion.start()
+                try:
+                    with etapa(ETAPA_INSERCION):
+                        if DB_WRITE_ENGINE == "copy":
+                            await conn.execute(COPY_TEMP_SQL_ASYNC)
+                            await conn.copy_records_to_table("weather_logs_entrada", records=filas, columns=COLUMNAS)
+                            insertadas = filas_insertadas(await conn.execute(COPY_MOVER_SQL_ASYNC))
+                        else:
+                            insertadas = filas_insertadas(await conn.execute(INSERT_LOTE_SQL_ASYNC, *zip(*filas)))
+                except BaseException:
+                    await transaccion.rollback()
+                    raise
+                with etapa(ETAPA_COMMIT):
+                    await transaccion.commit()
+        except ERRORES_TRANSITORIOS as e:
+            logger.warning("Error transitorio de DB en lote asíncrono, se devuelven %d mensajes. Error: %s", len(lote), str(e))
+            contar_fallos(DB_TRANSITORIO, len(lote))
+            if self.spool is not None:
+                self.spool.marcar_caida(SPOOL_BYPASS_S)
+            await self._nack_lote(lote, str(e))
+            return
+        except Exception:
+            logger.warning("Lote rechazado por la DB. Reintentando fila a fila para aislar las inválidas.")
+            await self._escribir_aislando(lote)
+            return
+
+        contar_insertadas(len(filas), insertadas)
+        registrar_lecturas(filas)
+        log_mensajes.info("Lote de %d filas escrito (motor async).", len(filas))
+        self._latencias(lote)
+        await self._ack_escritos(lote)
+
+    async def _escribir_aislando(self, lote: list) -> None:
+        """Una transacción con un savepoint por fila; solo las filas rechazadas van a la DLQ."""
+        # Error de cada fila rechazada por (índice del mensaje, índice de la fila en el mensaje)
+        rechazadas = {}
+        insertadas = 0
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    for i, (_, filas, _) in enumerate(lote):
+                        for j, fila in enumerate(filas):
+                            try:
+                                # Transacción anidada = SAVEPOINT
+                                async with conn.transaction():
+                                    insertadas += filas_insertadas(await conn.execute(INSERT_SQL_ASYNC, *fila))
+                            except ERRORES_DE_FILA as e:
+                                logger.warning("Fila rechazada por la DB (station=%s): %s", fila[0], str(e).strip())
+                                rechazadas[(i, j)] = str(e).strip()
+        except ERRORES_TRANSITORIOS as e:
+            logger.warning("Error transitorio durante reintento fila a fila, se devuelve el lote. Error: %s", str(e))
+            contar_fallos(DB_TRANSITORIO, len(lote))
+            if self.spool is not None:
+                self.spool.marcar_caida(SPOOL_BYPASS_S)
+            await self._nack_lote(lote, str(e))
+            return
+        except Exception:
+            # Fallo inesperado fuera de las filas (no se pudo aislar): todo el lote a la DLQ.
+            logger.exception("No se pudo aislar las filas inválidas. Moviendo lote a DLQ.")
+            rechazadas = {(i, j): "no se pudo aislar la fila" for i, (_, filas, _) in enumerate(lote) for j in range(len(filas))}
+            insertadas = 0
+
+        guardadas = [fila for i, (_, filas, _) in enumerate(lote) for j, fila in enumerate(filas) if (i, j) not in rechazadas]
+        contar_insertadas(len(guardadas), insertadas)
+        contar_fallos(RECHAZO_DB, len(rechazadas))
+        registrar_lecturas(guardadas)
+        for i, (message, filas, cuerpo_dlq) in enumerate(lote):
+            for j in range(len(filas)):
+                if (i, j) in rechazadas:
+                    logger.warning("Fila irreparable en lote. Moviendo a DLQ. Delivery tag=%s", message.delivery_tag)
+                    await self._publicar_dlq(message, cuerpo_dlq(j) if cuerpo_dlq is not None else None,
+                                             motivo=RECHAZO_DB, detalle=rechazadas[(i, j)])
+        self._latencias(lote)
+        await self._ack_escritos(lote)
+
+    @staticmethod
+    def _latencias(lote: list) -> None:
+        """Lag de extremo a extremo de los mensajes de un lote recién confirmado en la DB."""
+        ahora = time.time()
+        for message, _, _ in lote:
+            observar_latencia(message.headers, ahora)
+
+    async def _ack_escritos(self, lote: list) -> None:
+        """Los mensajes del lote ya son durables (DB, spool o DLQ): ACK y a la caché de ids."""
+        for message, _, _ in lote:
+            await self._ack(message)
+        self.escritos.agregar(*(message.message_id for message, _, _ in lote))
+
+    async def _nack_lote(self, lote: list, motivo: str) -> None:
+        if self.spool is not None:
+            filas = [fila for _, filas_msg, _ in lote for fila in filas_msg]
+            try:
+                # agregar() hace fsync: fuera del event loop
+                await asyncio.get_running_loop().run_in_executor(None, self.spool.agregar, filas)
+            except (SpoolLleno, OSError) as e:
+                logger.error("No se pudieron guardar %d filas en el spool: %s", len(filas), e)
+            else:
+                logger.warning("DB no disponible: %d filas guardadas en el spool local.", len(filas))
+                await self._ack_escritos(lote)
+                return
+        for message, _, _ in lote:
+            await self._reintentar(message, motivo)
+
+    async def _reintentar(self, message: aio_pika.abc.AbstractIncomingMessage, motivo: str) -> None:
+        """Republica el mensaje en su siguiente nivel de reintento (o en la DLQ) y lo confirma."""
+        if not self.niveles:
+            await self._nack(message)
+            return
+        nombres = [exchange.name for exchange in self.niveles]
+        nivel = nivel_siguiente(message.headers, nombres, RETRY_MAX_ATTEMPTS)
+        headers = cabeceras_reintento(message.headers, motivo)
+        try:
+            if nivel is None:
+                logger.error("Mensaje sin éxito tras %d reintentos. Moviendo a DLQ. Delivery tag=%s",
+                             reintentos(message.headers), message.delivery_tag)
+                await self._publicar_dlq(message, headers=headers, motivo=REINTENTOS_AGOTADOS, detalle=motivo)
+                RETRIES_EXHAUSTED.inc()
+            else:
+                await self.niveles[nombres.index(nivel)].publish(
+                    aio_pika.Message(
+                        body=message.body,
+                        headers=headers,
+                        content_type=message.content_type,
+                        content_encoding=message.content_encoding,
+                        message_id=message.message_id,
+                        timestamp=message.timestamp,
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    ),
+                    routing_key=message.routing_key,
+                )
+                MESSAGES_RETRIED.labels(tier=nivel).inc()
+        except Exception:
+            logger.exception("No se pudo republicar el mensaje para reintento, NACK+requeue.")
+            await self._nack(message)
+            return
+        await self._ack(message)
+
+
+# ==============================
+# INICIALIZACIÓN Y LOOP
+# ==============================
+
+# Event loop y canal en uso, para que el hilo del autoescalado de main.py cambie el prefetch
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_canal: Optional[aio_pika.abc.AbstractRobustChannel] = None
+_prefetch = CONSUMER_PREFETCH
+
+
+def aplicar_decision(decision) -> None:
+    """Aplica el prefetch de una decisión del autoescalado (utils.autoscaling.Decision).
+
+    Se llama desde otro hilo: set_qos se programa en el event loop. El número de workers no
+    aplica a este motor (la concurrencia la dan los escritores de ASYNC_DB_CONCURRENCY).
+    """
+    global _prefetch
+    if decision.prefetch == _prefetch or _loop is None or _canal is None:
+        return
+    _prefetch = decision.prefetch
+    asyncio.run_coroutine_threadsafe(_canal.set_qos(prefetch_count=_prefetch), _loop)
+
+
+async def _run(spool: Optional[Spool], estaciones: Optional[CacheEstaciones]) -> None:
+    global _loop, _canal
+    pool = await crear_pool_con_reintentos()
+
+    while True:
+        try:
+            # connect_robust restablece conexión, canal y consumidores si RabbitMQ se reinicia.
+            connection = await aio_pika.connect_robust(
+                host=RABBITMQ_HOST, port=RABBITMQ_PORT, login=RABBIT_USER, password=RABBIT_PASS, heartbeat=60
+            )
+            break
+        except (aio_pika.exceptions.AMQPConnectionError, OSError) as e:
+            logger.warning("No se puede conectar a RabbitMQ: %s. Reintentando en %.1f s...", e, RABBIT_RECONNECT_DELAY)
+            await asyncio.sleep(RABBIT_RECONNECT_DELAY)
+
+    consumidor = None
+    try:
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=CONSUMER_PREFETCH)
+        _loop, _canal = asyncio.get_running_loop(), channel
+
+        # Declarar exchanges y colas (durable), igual que el motor síncrono
+        exchange = await channel.declare_exchange(RABBITMQ_EXCHANGE, aio_pika.ExchangeType.DIRECT, durable=True)
+        if RABBITMQ_SHARDS:
+            # Sin reparto dinámico: 'auto' equivale a 'all' (x-single-active-consumer deja en
+            # espera a las demás instancias suscritas a la misma cola).
+            propios = parsear_shards(CONSUMER_SHARDS, RABBITMQ_SHARDS)
+            colas = []
+            for shard in range(RABBITMQ_SHARDS):
+                cola = await channel.declare_queue(
+                    cola_shard(RABBITMQ_QUEUE, shard), durable=True, arguments=ARGUMENTOS_COLA_SHARD
+                )
+                await cola.bind(exchange, routing_key=routing_key_shard(ROUTING_KEY, shard))
+                if propios is None or shard in propios:
+                    colas.append(cola)
+        else:
+            queue = await channel.declare_queue(RABBITMQ_QUEUE, durable=True)
+            await queue.bind(exchange, routing_key=ROUTING_KEY)
+            colas = [queue]
+
+        dlq_exchange = await channel.declare_exchange(RABBITMQ_DLQ_EXCHANGE, aio_pika.ExchangeType.DIRECT, durable=True)
+        dlq_queue = await channel.declare_queue(RABBITMQ_DLQ_QUEUE, durable=True)
+        await dlq_queue.bind(dlq_exchange, routing_key=ROUTING_KEY)
+
+        # Niveles de reintento diferido (TTL + dead-letter de vuelta al exchange principal)
+        niveles = []
+        for retraso in RETRY_DELAYS_S:
+            nombre = nombre_nivel(RETRY_EXCHANGE_PREFIX, retraso)
+            nivel = await channel.declare_exchange(nombre, aio_pika.ExchangeType.FANOUT, durable=True)
+            cola_nivel = await channel.declare_queue(nombre, durable=True, arguments=argumentos_nivel(retraso, RABBITMQ_EXCHANGE))
+            await cola_nivel.bind(nivel)
+            niveles.append(nivel)
+
+        consumidor = ConsumidorAsync(pool, dlq_exchange, niveles, spool, estaciones)
+        consumidor.iniciar_escritores()
+
+        logger.info("Motor async: esperando mensajes en %s (prefetch=%d, escritores=%d)...",
+                    ", ".join(f"'{cola.name}'" for cola in colas), CONSUMER_PREFETCH, ASYNC_DB_CONCURRENCY)
+        for cola in colas:
+            await cola.consume(consumidor.on_message, no_ack=False)
+
+        # Corre indefinidamente; la reconexión la gestiona connect_robust.
+        await asyncio.Future()
+    finally:
+        _canal = None
+        if consumidor is not None:
+            await consumidor.detener()
+        await connection.close()
+        await pool.close()
+
+
+def run(spool: Optional[Spool] = None, estaciones: Optional[CacheEstaciones] = None) -> None:
+    """Punto de entrada del motor asyncio (lo invoca main.main() con CONSUMER_ENGINE=async).
+
+    `spool` es el spool local de main.py (None si SPOOL_ENABLED=false); su reproducción corre
+    en el hilo que arranca main.main(), igual que la recarga de la caché `estaciones`.
+    """
+    try:
+        asyncio.run(_run(spool, estaciones))
+    except KeyboardInterrupt:
+        logger.info("Consumidor (motor async) detenido por teclado.")
@@ -0,0 +1,412 @@
+# Herramienta de la DLQ: clasifica y reprocesa en bloque los mensajes de weather_dlq_queue.
+# Proceso independiente del consumidor, como retention.py:
+#
+#   python dlq_tool.py resumen [--max N]
+#   python dlq_tool.py reprocesar [--modo republicar|insertar] [--motivo M ...] [--max N]
+#                                  [--lote B] [--tasa R] [--puerto-metricas P]
+#
+# resumen: lee hasta N mensajes sin confirmarlos y los agrupa por el motivo con el que
+# llegaron a la DLQ (x-dlq-reason, ver utils.dlq) y por el resultado de validarlos de nuevo
+# con las reglas actuales. Al cerrar el canal, RabbitMQ los devuelve intactos a la cola.
+#
+# reprocesar: recorre como mucho los mensajes que había en la DLQ al empezar, en lotes de B
+# (prefetch = B). Cada mensaje se decodifica y valida de nuevo:
+# - Lecturas ahora válidas: 'republicar' las publica otra vez en el exchange principal (con
+#   la routing key de su shard) para que las procese el consumidor; 'insertar' las escribe
+#   directamente en weather_logs con un INSERT por lote y ON CONFLICT DO NOTHING.
+# - Lecturas que siguen siendo inválidas, filas rechazadas por la DB, mensajes ilegibles y
+#   los que no coinciden con --motivo vuelven al final de la DLQ con el motivo actualizado.
+# El original se confirma después del commit o de la confirmación del broker (publisher
+# confirms), así que una interrupción no pierde nada: lo no confirmado vuelve a la DLQ y lo
+# que se repita lo descarta la clave única de weather_logs. --tasa limita los mensajes por
+# segundo; el progreso se registra en el log y, con --puerto-metricas, en /metrics.
+
+import sys
+import time
+import uuid
+import argparse
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import pika
+import psycopg2
+from psycopg2 import DataError, IntegrityError
+from psycopg2.extras import execute_values
+from prometheus_client import Counter, Gauge, start_http_server
+
+from utils.logger import setup_logger
+from utils.config import (
+    LOG_DIR,
+    RABBIT_USER, RABBIT_PASS, RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_EXCHANGE, ROUTING_KEY,
+    RABBITMQ_DLQ_EXCHANGE, RABBITMQ_DLQ_QUEUE, RABBITMQ_SHARDS,
+    POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_SSLMODE,
+)
+from utils.dlq import (
+    DECODIFICACION, MOTIVOS, RECHAZO_DB, VALIDACION, HEADER_DETALLE_DLQ, HEADER_FECHA_DLQ, HEADER_MOTIVO_DLQ,
+    HEADER_REPROCESOS_DLQ, cabeceras_dlq, motivo_dlq, reprocesos,
+)
+from utils.encoding import HEADER_LECTURAS, HEADER_PUBLICADO, ErrorDecodificacion, Sobre, desempaquetar
+from utils.retry import HEADER_MOTIVO, HEADER_REINTENTOS
+from utils.sharding import routing_key_shard, shard_de
+from utils.validation import ErrorValidacion, validar_lote
+
+logger = setup_logger("DLQ_LOG", f"{LOG_DIR}/dlq_tool.log")
+
+MODOS = ("republicar", "insertar")
+# Sin mensajes nuevos durante este tiempo se da la DLQ por recorrida
+ESPERA_INACTIVIDAD_S = 5.0
+# `resumen` no confirma lo que lee: todo queda en el prefetch del cliente hasta cerrar el canal,
+# así que se acota a --max mensajes (por defecto RESUMEN_MAX; prefetch_count es de 16 bits)
+RESUMEN_MAX = 10000
+PREFETCH_MAX = 65535
+# message_id original de un mensaje republicado desde la DLQ (el republicado lleva uno nuevo)
+HEADER_ID_ORIGINAL = "x-dlq-original-id"
+# Cabeceras que no acompañan a un mensaje republicado: vuelve como nuevo, con sus reintentos a
+# cero y sin el instante de publicación original (no cuenta en el lag de extremo a extremo)
+_CABECERAS_DLQ = (HEADER_MOTIVO_DLQ, HEADER_DETALLE_DLQ, HEADER_FECHA_DLQ, HEADER_REPROCESOS_DLQ,
+                  HEADER_REINTENTOS, HEADER_MOTIVO, HEADER_PUBLICADO)
+
+INSERT_SQL = """
+INSERT INTO weather_logs (
+    id_station, dates, temperature_celsius, humidity,
+    wind, wind_speed, pressure
+) VALUES (%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (id_station, dates) DO NOTHING
+"""
+
+INSERT_BATCH_SQL = """
+INSERT INTO weather_logs (
+    id_station, dates, temperature_celsius, humidity,
+    wind, wind_speed, pressure
+) VALUES %s
+ON CONFLICT (id_station, dates) DO NOTHING
+"""
+
+# Progreso (servidor de métricas opcional: --puerto-metricas)
+DLQ_MENSAJES = Counter('dlq_tool_messages_total', 'Mensajes de la DLQ reprocesados, por resultado', ['result'])
+DLQ_LECTURAS = Counter('dlq_tool_readings_recovered_total', 'Lecturas recuperadas de la DLQ', ['mode'])
+DLQ_PENDIENTES = Gauge('dlq_tool_pending_messages', 'Mensajes de la DLQ que quedan por recorrer en esta ejecución')
+DLQ_TASA = Gauge('dlq_tool_rate_messages_per_second', 'Mensajes de la DLQ reprocesados por segundo')
+
+
+# ==============================
+# CLASIFICACIÓN
+# ==============================
+
+class Clasificacion(NamedTuple):
+    """Resultado de volver a decodificar y validar un mensaje de la DLQ."""
+    motivo: str                                    # x-dlq-reason con el que llegó a la DLQ
+    sobre: Optional[Sobre]                         # None si sigue sin poder decodificarse
+    validas: List[Tuple[int, tuple]]               # (índice de la lectura, fila normalizada)
+    invalidas: List[Tuple[int, ErrorValidacion]]   # (índice de la lectura, error)
+    error: str = ""                                # Error de decodificación
+
+    @property
+    def estado(self) -> str:
+        """'valido', 'parcial', 'invalido:<código>' o 'ilegible'."""
+        if self.sobre is None:
+            return "ilegible"
+        if not self.invalidas:
+            return "valido"
+        if not self.validas:
+            return f"invalido:{self.invalidas[0][1].codigo}"
+        return "parcial"
+
+
+def clasificar(body: bytes, properties) -> Clasificacion:
+    motivo = motivo_dlq(properties.headers)
+    try:
+        sobre = desempaquetar(body, properties.content_type, properties.content_encoding, properties.headers)
+    except ErrorDecodificacion as e:
+        return Clasificacion(motivo, None, [], [], str(e))
+    validas, invalidas = validar_lote(sobre.lecturas)
+    return Clasificacion(motivo, sobre, validas, invalidas)
+
+
+def routing_key_estacion(id_station: int) -> str:
+    """Routing key con la que el productor publica las lecturas de la estación."""
+    if not RABBITMQ_SHARDS:
+        return ROUTING_KEY
+    return routing_key_shard(ROUTING_KEY, shard_de(id_station, RABBITMQ_SHARDS))
+
+
+def propiedades_republicar(properties, lectura: bool) -> pika.BasicProperties:
+    """Propiedades para volver al exchange principal.
+
+    Sin cabeceras de DLQ ni de reintentos y con un message_id nuevo: el original puede seguir
+    en la caché de duplicados del consumidor (utils.dedup) si otra lectura del mismo sobre se
+    escribió. `lectura` indica una lectura suelta extraída de un sobre (sin compresión).
+    """
+    omitir = _CABECERAS_DLQ + ((HEADER_LECTURAS,) if lectura else ())
+    headers = {k: v for k, v in (properties.headers or {}).items() if k not in omitir}
+    if properties.message_id:
+        headers.setdefault(HEADER_ID_ORIGINAL, properties.message_id)
+    return pika.BasicProperties(
+        content_type=properties.content_type,
+        content_encoding=None if lectura else properties.content_encoding,
+        delivery_mode=2, headers=headers or None, message_id=uuid.uuid4().hex, timestamp=properties.timestamp,
+    )
+
+
+def propiedades_devolver(properties, lectura: bool, motivo: str, detalle: str) -> pika.BasicProperties:
+    """Propiedades para devolver un mensaje (o una lectura de su sobre) al final de la DLQ."""
+    headers = cabeceras_dlq(properties.headers, motivo, detalle)
+    headers[HEADER_REPROCESOS_DLQ] = reprocesos(properties.headers) + 1
+    if lectura:
+        headers.pop(HEADER_LECTURAS, None)
+    return pika.BasicProperties(
+        content_type=properties.content_type,
+        content_encoding=None if lectura else properties.content_encoding,
+        delivery_mode=2, headers=headers, message_id=properties.message_id, timestamp=properties.timestamp,
+    )
+
+
+# ==============================
+# REPROCESADO
+# ==============================
+
+class Limitador:
+    """Limita el ritmo a `tasa` mensajes por segundo (0 = sin límite), esperando antes de cada lote."""
+
+    def __init__(self, tasa: float, reloj: Callable[[], float] = time.monotonic,
+                 dormir: Callable[[float], None] = time.sleep):
+        self.tasa = tasa
+        self.reloj = reloj
+        self.dormir = dormir
+        self._siguiente: Optional[float] = None
+
+    def esperar(self, n: int) -> None:
+        if self.tasa <= 0:
+            return
+        ahora = self.reloj()
+        if self._siguiente is None or self._siguiente < ahora:
+            self._siguiente = ahora
+        else:
+            self.dormir(self._siguiente - ahora)
+        self._siguiente += n / self.tasa
+
+
+class Reprocesador:
+    """Resuelve lotes de mensajes de la DLQ sobre un canal con publisher confirms.
+
+    - procesar(entregas): clasifica el lote, recupera las lecturas válidas (republicar o
+      insertar), devuelve el resto a la DLQ y confirma todo el lote con un ACK múltiple.
+    - resultados: mensajes por resultado ('recuperado', 'parcial', 'devuelto', 'omitido').
+    """
+
+    def __init__(self, channel, modo: str, motivos: Sequence[str] = (), conn=None):
+        if modo not in MODOS:
+            raise ValueError(f"Modo inválido: {modo!r} (use {' o '.join(MODOS)}).")
+        self.channel = channel
+        self.modo = modo
+        self.motivos = set(motivos)
+        self.conn = conn
+        self.resultados: Dict[str, int] = {}
+        self.lecturas = 0
+
+    def procesar(self, entregas: List[tuple]) -> None:
+        """`entregas`: (method, properties, body) consecutivos del canal, tal como se recibieron."""
+        plan = [(properties, body, clasificar(body, properties)) for _, properties, body in entregas]
+        rechazadas: Dict[Tuple[int, int], str] = {}
+        if self.modo == "insertar":
+            rechazadas = self._insertar([
+                ((k, i), fila) for k, (_, _, c) in enumerate(plan) if self._seleccionado(c) for i, fila in c.validas
+            ])
+        for k, (properties, body, c) in enumerate(plan):
+            resultado = self._resolver(properties, body, c, {i: e for (m, i), e in rechazadas.items() if m == k})
+            self.resultados[resultado] = self.resultados.get(resultado, 0) + 1
+            DLQ_MENSAJES.labels(result=resultado).inc()
+        # Todo el lote ya está escrito, republicado o de vuelta en la DLQ
+        self.channel.basic_ack(delivery_tag=entregas[-1][0].delivery_tag, multiple=True)
+
+    def _seleccionado(self, c: Clasificacion) -> bool:
+        return c.sobre is not None and (not self.motivos or c.motivo in self.motivos)
+
+    def _insertar(self, filas: List[Tuple[Tuple[int, int], tuple]]) -> Dict[Tuple[int, int], str]:
+        """Escribe las filas en una transacción; devuelve el error de las que rechaza la DB."""
+        rechazadas: Dict[Tuple[int, int], str] = {}
+        if not filas:
+            return rechazadas
+        with self.conn.cursor() as cur:
+            try:
+                execute_values(cur, INSERT_BATCH_SQL, [fila for _, fila in filas], page_size=len(filas))
+            except (IntegrityError, DataError):
+                # Alguna fila no entra (p. ej. estación inexistente): se aíslan con un SAVEPOINT por fila
+                self.conn.rollback()
+                for clave, fila in filas:
+                    cur.execute("SAVEPOINT fila")
+                    try:
+                        cur.execute(INSERT_SQL, fila)
+                    except (IntegrityError, DataError) as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT fila")
+                        rechazadas[clave] = str(e).strip()
+                    else:
+                        cur.execute("RELEASE SAVEPOINT fila")
+        self.conn.commit()
+        return rechazadas
+
+    def _resolver(self, properties, body: bytes, c: Clasificacion, rechazadas: Dict[int, str]) -> str:
+        if c.sobre is None:
+            self._devolver(body, propiedades_devolver(properties, False, DECODIFICACION, c.error))
+            return "devuelto"
+        if not self._seleccionado(c):
+            # Otro motivo: vuelve a la DLQ tal cual
+            self._devolver(body, properties)
+            return "omitido"
+
+        sobre = c.sobre
+        recuperables = [(i, fila) for i, fila in c.validas if i not in rechazadas]
+        if self.modo == "republicar" and recuperables:
+            # Sobre completo si todas sus lecturas son válidas y van al mismo shard; si no, una a una
+            claves = {routing_key_estacion(fila[0]) for _, fila in recuperables}
+            if not c.invalidas and len(claves) == 1:
+                self._republicar(claves.pop(), body, propiedades_republicar(properties, False))
+            else:
+                for i, fila in recuperables:
+                    self._republicar(routing_key_estacion(fila[0]), sobre.cuerpo(i),
+                                     propiedades_republicar(properties, sobre.es_lote))
+        for i, e in c.invalidas:
+            self._devolver(sobre.cuerpo(i), propiedades_devolver(properties, sobre.es_lote, VALIDACION, f"{e.codigo}: {e}"))
+        for i, error in rechazadas.items():
+            self._devolver(sobre.cuerpo(i), propiedades_devolver(properties, sobre.es_lote, RECHAZO_DB, error))
+
+        self.lecturas += len(recuperables)
+        DLQ_LECTURAS.labels(mode=self.modo).inc(len(recuperables))
+        if not recuperables:
+            return "devuelto"
+        return "recuperado" if len(recuperables) == len(sobre) else "parcial"
+
+    def _republicar(self, routing_key: str, body: bytes, properties) -> None:
+        # mandatory: si ninguna cola lo recibe, basic_publish lanza UnroutableError y el lote
+        # queda sin confirmar en la DLQ
+        self.channel.basic_publish(RABBITMQ_EXCHANGE, routing_key, body, properties, mandatory=True)
+
+    def _devolver(self, body: bytes, properties) -> None:
+        self.channel.basic_publish(RABBITMQ_DLQ_EXCHANGE, ROUTING_KEY, body, properties)
+
+
+def mensajes_en_dlq(channel) -> int:
+    return channel.queue_declare(queue=RABBITMQ_DLQ_QUEUE, durable=True, passive=True).method.message_count
+
+
+def recorrer(channel, maximo: Optional[int], lote: int):
+    """Lotes de hasta `lote` entregas con como mucho los `maximo` primeros mensajes de la DLQ.
+
+    Termina al alcanzar el máximo o tras ESPERA_INACTIVIDAD_S sin mensajes; los que el broker
+    ya hubiera entregado de más vuelven a la cola al cancelar el consumo.
+    """
+    restantes = mensajes_en_dlq(channel) if maximo is None else min(maximo, mensajes_en_dlq(channel))
+    if restantes <= 0:
+        return
+    entregas: List[tuple] = []
+    try:
+        for method, properties, body in channel.consume(RABBITMQ_DLQ_QUEUE, inactivity_timeout=ESPERA_INACTIVIDAD_S):
+            if method is not None:
+                entregas.append((method, properties, body))
+                restantes -= 1
+            if entregas and (method is None or len(entregas) >= lote or restantes <= 0):
+                yield entregas, restantes
+                entregas = []
+            if method is None or restantes <= 0:
+                break
+    finally:
+        channel.cancel()
+
+
+def reprocesar(channel, reprocesador: Reprocesador, maximo: Optional[int], lote: int, tasa: float) -> None:
+    channel.basic_qos(prefetch_count=lote)
+    limitador = Limitador(tasa)
+    inicio = time.monotonic()
+    vistos = 0
+    for entregas, restantes in recorrer(channel, maximo, lote):
+        limitador.esperar(len(entregas))
+        reprocesador.procesar(entregas)
+        vistos += len(entregas)
+        ritmo = vistos / max(time.monotonic() - inicio, 1e-6)
+        DLQ_PENDIENTES.set(restantes)
+        DLQ_TASA.set(ritmo)
+        logger.info("DLQ: %d mensajes reprocesados, %d pendientes (%.0f msg/s). Resultados: %s. Lecturas recuperadas: %d.",
+                    vistos, restantes, ritmo, reprocesador.resultados, reprocesador.lecturas)
+    logger.info("Reprocesado terminado (%s): %d mensajes, %d lecturas recuperadas.",
+                reprocesador.modo, vistos, reprocesador.lecturas)
+
+
+def resumir(channel, maximo: Optional[int] = RESUMEN_MAX) -> Dict[Tuple[str, str], int]:
+    """Cuenta los mensajes por (motivo, estado) sin confirmarlos: al cerrar el canal vuelven a la DLQ."""
+    maximo = RESUMEN_MAX if maximo is None else maximo
+    if maximo > PREFETCH_MAX:
+        logger.warning("resumen: --max %d supera el prefetch máximo; se inspeccionan %d mensajes.", maximo, PREFETCH_MAX)
+        maximo = PREFETCH_MAX
+    # Sin confirmar, el prefetch debe cubrir los mensajes que se van a leer, y no más: el
+    # broker no entrega al cliente más de `maximo`
+    channel.basic_qos(prefetch_count=max(1, maximo))
+    conteo: Dict[Tuple[str, str], int] = {}
+    for entregas, _ in recorrer(channel, maximo, lote=max(1, min(1000, maximo))):
+        for _, properties, body in entregas:
+            c = clasificar(body, properties)
+            conteo[(c.motivo, c.estado)] = conteo.get((c.motivo, c.estado), 0) + 1
+    for (motivo, estado), n in sorted(conteo.items(), key=lambda item: -item[1]):
+        logger.info("%-20s %-28s %8d", motivo, estado, n)
+    logger.info("Total: %d mensajes; recuperables (valido o parcial): %d.", sum(conteo.values()),
+                sum(n for (_, estado), n in conteo.items() if estado in ("valido", "parcial")))
+    return conteo
+
+
+# ==============================
+# CLI
+# ==============================
+
+def parsear_argumentos(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m dlq_tool", description="Clasifica y reprocesa la DLQ.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    resumen = comandos.add_parser("resumen", help="Agrupa los mensajes por motivo y estado sin consumirlos.")
+    resumen.add_argument("--max", type=int, default=RESUMEN_MAX,
+                         help=f"Mensajes a inspeccionar (por defecto {RESUMEN_MAX}, como mucho {PREFETCH_MAX}).")
+    reproceso = comandos.add_parser("reprocesar", help="Recupera los mensajes que ahora son válidos.")
+    reproceso.add_argument("--modo", choices=MODOS, default="republicar")
+    reproceso.add_argument("--motivo", choices=MOTIVOS, action="append", default=[],
+                           help="Solo los mensajes con este motivo (repetible); el resto vuelve a la DLQ.")
+    reproceso.add_argument("--max", type=int, default=None, help="Mensajes a reprocesar (por defecto, todos).")
+    reproceso.add_argument("--lote", type=int, default=100, help="Mensajes por lote (y prefetch).")
+    reproceso.add_argument("--tasa", type=float, default=0.0, help="Mensajes por segundo como máximo (0 = sin límite).")
+    reproceso.add_argument("--puerto-metricas", type=int, default=0, help="Expone /metrics en este puerto (0 = no).")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parsear_argumentos(argv)
+    if getattr(args, "puerto_metricas", 0):
+        start_http_server(args.puerto_metricas)
+
+    connection = conn = None
+    try:
+        connection = pika.BlockingConnection(pika.ConnectionParameters(
+            host=RABBITMQ_HOST, port=RABBITMQ_PORT, credentials=pika.PlainCredentials(RABBIT_USER, RABBIT_PASS),
+        ))
+        channel = connection.channel()
+        if args.comando == "resumen":
+            resumir(channel, args.max)
+            return 0
+
+        channel.confirm_delivery()
+        if args.modo == "insertar":
+            conn = psycopg2.connect(
+                dbname=POSTGRES_DB, user=POSTGRES_USER, password=POSTGRES_PASSWORD,
+                host=POSTGRES_HOST, port=POSTGRES_PORT, sslmode=POSTGRES_SSLMODE,
+            )
+        reprocesar(channel, Reprocesador(channel, args.modo, args.motivo, conn), args.max, max(1, args.lote), args.tasa)
+        return 0
+    except (pika.exceptions.AMQPError, psycopg2.Error) as e:
+        logger.error("Reprocesado interrumpido: %s. Los mensajes sin confirmar siguen en la DLQ.", e)
+        return 1
+    except KeyboardInterrupt:
+        logger.info("Interrumpido por teclado. Los mensajes sin confirmar siguen en la DLQ.")
+        return 130
+    finally:
+        if conn is not None:
+            conn.close()
+        if connection is not None and connection.is_open:
+            connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,72 +4,135 @@
 # de cada mensaje; si es válido, lo inserta en la base de datos y registra el éxito con una métrica de **Prometheus**. 
 # Si el mensaje es inválido o causa un error no recuperable en la DB, es enviado a la DLQ para su posterior análisis.
 
+import io
 import os
-import json
+import csv
 import time
+import socket
 import logging
-from datetime import datetime
-from typing import Optional
+import functools
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 import pika
 import psycopg2
-from psycopg2 import OperationalError, sql
+from psycopg2 import OperationalError, InterfaceError, IntegrityError, DataError, sql
+from psycopg2.extras import execute_values
 
 # 1. IMPORTAR LA FUNCIÓN AVANZADA DE LOGGING
 # NOTA: La función setup_logger se espera que esté definida en utils.logger
 from utils.logger import setup_logger 
-
-from prometheus_client import start_http_server, Counter
+from utils.acks import AckAcumulado
+from utils.db_pool import PoolConexiones
+from utils.metrics import (
+    contar_insertadas, filas_escritas, registrar_lecturas, AGREGADOS_ESTACION, DB_RECONNECTS, VALIDATION_ERRORS,
+    MESSAGES_DUPLICATED,
+    MESSAGES_RETRIED, RETRIES_EXHAUSTED, SPOOL_ROWS_REPLAYED, SPOOL_ROWS_DISCARDED,
+    BATCH_ROWS, DB_TRANSITORIO, ETAPA_ACK, ETAPA_COMMIT, ETAPA_DECODIFICACION, ETAPA_DLQ, ETAPA_INSERCION,
+    ETAPA_VALIDACION, contar_fallos, etapa, observar_etapa, observar_latencia, seguir_en_vuelo,
+    AUTOSCALER_CONSUMER_UTILISATION, AUTOSCALER_DESIRED_WORKERS, AUTOSCALER_ERRORS, AUTOSCALER_QUEUE_DEPTH,
+    CONSUMER_PREFETCH_CURRENT, CONSUMER_WORKERS_ACTIVE, FLOW_FACTOR,
+)
+from utils.validation import ErrorValidacion, normalizar, validar_lote
+from utils.encoding import HEADER_LECTURAS, ErrorDecodificacion, Sobre, desempaquetar
+from utils.dedup import IdsRecientes
+from utils.dlq import DECODIFICACION, DESCONOCIDO, RECHAZO_DB, REINTENTOS_AGOTADOS, VALIDACION, cabeceras_dlq
+from utils.spool import EXTENSION, Spool, SpoolLleno, leer_segmento
+from utils.retry import argumentos_nivel, cabeceras_reintento, nivel_siguiente, nombre_nivel, reintentos
+from utils.sharding import (
+    APLICACION_RECLAMADOR, ARGUMENTOS_COLA_SHARD, ReclamadorShards, cola_shard, parsear_shards, routing_key_shard
+)
+from utils.autoscaling import Controlador, Decision, leer_colas, mensaje_flujo
+from utils.stations import CacheEstaciones
+
+from prometheus_client import start_http_server
 
 
 
 # ==============================
 # CONFIGURACIÓN DE LOGGING AVANZADA (¡CAMBIADO!)
 # ==============================
-LOG_DIR = os.getenv("LOG_DIR", "logs") # Directorio de logs dentro del contenedor
+from utils.config import LOG_DIR # Directorio de logs dentro del contenedor
 # Llama a tu función para configurar el logger.
 # Los logs irán a la consola Y al archivo 'logs/consumer.log'
 logger = setup_logger("CONSUMER_LOG", f"{LOG_DIR}/consumer.log")
+# Registros por mensaje o por lote: muestreados y limitados por segundo (LOG_SAMPLE_RATE, LOG_RATE_LIMIT)
+log_mensajes = logging.getLogger("CONSUMER_LOG.mensajes")
 
-# Contador de mensajes procesados
-MESSAGES_PROCESSED = Counter('messages_processed_total', 'Mensajes procesados correctamente')
+# Las métricas (messages_processed_total, throughput por motor) viven en utils.metrics.
+# El servidor Prometheus (puerto 8000) se arranca en main(): importar el módulo (p. ej. desde
+# los tests) no abre el puerto.
 
-# Arrancar el servidor Prometheus en puerto 8000 para exponer métricas
-start_http_server(8000)
-logger.info("Servidor de métricas Prometheus iniciado en puerto 8000")
 # ==============================
 # VARIABLES DE ENTORNO
 # ==============================
-RABBIT_USER = os.getenv("RABBIT_USER", "guest")
-RABBIT_PASS = os.getenv("RABBIT_PASS", "guest")
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
-RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", 5672))
-RABBITMQ_EXCHANGE = os.getenv("RABBITMQ_EXCHANGE", "weather_exchange")
-RABBITMQ_QUEUE = os.getenv("RABBITMQ_QUEUE", "weather_queue")
-ROUTING_KEY = os.getenv("ROUTING_KEY", "weather.data")
-
-# Dead Letter Queue (DLQ)
-RABBITMQ_DLQ_EXCHANGE = os.getenv("RABBITMQ_DLQ_EXCHANGE", "weather_dlq_exchange")
-RABBITMQ_DLQ_QUEUE = os.getenv("RABBITMQ_DLQ_QUEUE", "weather_dlq_queue")
-
-POSTGRES_DB = os.getenv("POSTGRES_DB", "postgres_db")
-POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
-POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "pass")
-POSTGRES_HOST = os.getenv("POSTGRES_HOST", "db")
-POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", 5432))
-POSTGRES_SSLMODE = os.getenv("POSTGRES_SSLMODE", "disable") # use 'require' if using SSL/TLS
-
-# Pool/retry settings
-DB_MAX_RETRIES = int(os.getenv("DB_MAX_RETRIES", 5))
-DB_RETRY_BASE_SLEEP = float(os.getenv("DB_RETRY_BASE_SLEEP", 1.0))
-RABBIT_RECONNECT_DELAY = float(os.getenv("RABBIT_RECONNECT_DELAY", 5.0))
-
-# SQL INSERT statement (parametrizado)
+# Definidas en utils.config para compartirlas con el motor asyncio y las herramientas.
+from utils.config import (
+    CONSUMER_ENGINE,
+    RABBIT_USER, RABBIT_PASS, RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_EXCHANGE, RABBITMQ_QUEUE, ROUTING_KEY,
+    RABBITMQ_DLQ_EXCHANGE, RABBITMQ_DLQ_QUEUE, RABBITMQ_SHARDS, CONSUMER_SHARDS, SHARD_REBALANCE_INTERVAL_S,
+    RETRY_DELAYS_S, RETRY_MAX_ATTEMPTS, RETRY_EXCHANGE_PREFIX,
+    DEDUP_CACHE_SIZE, STATION_CACHE_ENABLED, STATION_CACHE_TTL_S,
+    SPOOL_ENABLED, SPOOL_DIR, SPOOL_MAX_BYTES, SPOOL_SEGMENT_MAX_BYTES, SPOOL_REPLAY_INTERVAL_S, SPOOL_BYPASS_S,
+    POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_SSLMODE,
+    DB_MAX_RETRIES, DB_RETRY_BASE_SLEEP, RABBIT_RECONNECT_DELAY,
+    DB_BATCH_SIZE, DB_BATCH_LINGER_MS, CONSUMER_PREFETCH, CONSUMER_ACK_BATCH, CONSUMER_ACK_LINGER_MS,
+    DB_WRITE_ENGINE,
+    CONSUMER_WORKERS, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_LIFETIME_S, DB_POOL_TIMEOUT_S,
+    DB_KEEPALIVE_INTERVAL_S, DB_TCP_KEEPALIVE_IDLE_S,
+    DB_PARTITION_MONTHS_AHEAD, DB_PARTITION_MAINTENANCE_INTERVAL_S,
+    ROLLING_ENABLED, ROLLING_FLUSH_INTERVAL_S, INGEST_WATERMARK_INTERVAL_S,
+    AUTOSCALE_ENABLED, AUTOSCALE_INTERVAL_S, AUTOSCALE_MIN_WORKERS, AUTOSCALE_MAX_WORKERS, AUTOSCALE_MAX_PREFETCH,
+    AUTOSCALE_TARGET_LAG_S, AUTOSCALE_SCALE_DOWN_DELAY_S, RABBITMQ_MANAGEMENT_URL, RABBITMQ_VHOST,
+    FLOW_CONTROL_ENABLED, FLOW_CONTROL_EXCHANGE, FLOW_THROTTLE_DEPTH, FLOW_PAUSE_DEPTH, FLOW_RESUME_DEPTH,
+    FLOW_MIN_FACTOR,
+)
+
+# SQL INSERT statement (parametrizado). Una lectura ya guardada (misma estación e instante,
+# clave única de weather_logs) se ignora: las reentregas y los reintentos son idempotentes.
 INSERT_SQL = """
 INSERT INTO weather_logs (
     id_station, dates, temperature_celsius, humidity,
     wind, wind_speed, pressure
 ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (id_station, dates) DO NOTHING
+"""
+
+# SQL INSERT multi-fila (execute_values expande el %s con todas las filas del lote)
+INSERT_BATCH_SQL = """
+INSERT INTO weather_logs (
+    id_station, dates, temperature_celsius, humidity,
+    wind, wind_speed, pressure
+) VALUES %s
+ON CONFLICT (id_station, dates) DO NOTHING
+"""
+
+# COPY no admite ON CONFLICT: el lote se carga con COPY en CSV (desde un buffer en memoria)
+# en una tabla temporal de la sesión y se pasa a weather_logs con INSERT ... SELECT.
+COPY_TEMP_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS weather_logs_entrada (
+    id_station INTEGER, dates TIMESTAMP WITH TIME ZONE, temperature_celsius REAL, humidity REAL,
+    wind VARCHAR(5), wind_speed REAL, pressure REAL
+) ON COMMIT DELETE ROWS
+"""
+
+COPY_SQL = """
+COPY weather_logs_entrada (
+    id_station, dates, temperature_celsius, humidity,
+    wind, wind_speed, pressure
+) FROM STDIN WITH (FORMAT csv)
+"""
+
+COPY_MOVER_SQL = """
+INSERT INTO weather_logs (
+    id_station, dates, temperature_celsius, humidity,
+    wind, wind_speed, pressure
+)
+SELECT id_station, dates, temperature_celsius, humidity, wind, wind_speed, pressure
+FROM weather_logs_entrada
+ON CONFLICT (id_station, dates) DO NOTHING
 """
 
 # ==============================
@@ -85,6 +148,21 @@ def make_db_dsn() -> str:
     return dsn
 
 
+def opciones_conexion() -> dict:
+    """Parámetros de psycopg2.connect comunes a la conexión global y al pool.
+
+    Los keepalives TCP de libpq detectan conexiones muertas sin consultas extra.
+    """
+    return {
+        "password": POSTGRES_PASSWORD, # Se pasa la contraseña por separado
+        "sslmode": POSTGRES_SSLMODE,
+        "keepalives": 1,
+        "keepalives_idle": DB_TCP_KEEPALIVE_IDLE_S,
+        "keepalives_interval": 10,
+        "keepalives_count": 3,
+    }
+
+
 def connect_db_with_retry(max_retries: int = DB_MAX_RETRIES) -> psycopg2.extensions.connection:
     """Intentar conectarse a PostgreSQL con backoff exponencial.
     Lanza excepción si no es posible conectar tras max_retries.
@@ -93,8 +171,7 @@ def connect_db_with_retry(max_retries: int = DB_MAX_RETRIES) -> psycopg2.extensi
     while True:
         try:
             dsn = make_db_dsn()
-            # Se pasa la contraseña por separado
-            conn = psycopg2.connect(dsn, password=POSTGRES_PASSWORD, sslmode=POSTGRES_SSLMODE)
+            conn = psycopg2.connect(dsn, **opciones_conexion())
             # Desactivar autocommit para gestionar transacciones manualmente (INSERT/ROLLBACK)
             conn.autocommit = False
             logger.info("Conectado a PostgreSQL.")
@@ -117,135 +194,732 @@ _db_conn: Optional[psycopg2.extensions.connection] = None
 
 
 def get_db_conn() -> psycopg2.extensions.connection:
-    """Devuelve una conexión activa; reconecta si la conexión está cerrada o falla.
-    
-    Incluye un chequeo simple (SELECT 1) para verificar la salud de la conexión.
+    """Devuelve la conexión global; conecta si no existe o si está marcada como cerrada.
+
+    No hace ping previo (SELECT 1): la salud se detecta cuando una operación real falla
+    con OperationalError/InterfaceError (ver conexion_db y con_reconexion).
     """
     global _db_conn
-    try:
-        # Reconnecta si la conexión es None o ha sido cerrada (closed != 0)
-        if _db_conn is None or _db_conn.closed != 0:
-            _db_conn = connect_db_with_retry()
-        # simple check: ping
-        with _db_conn.cursor() as cur:
-            cur.execute("SELECT 1")
-        return _db_conn
-    except Exception as e:
-        # Si el ping falla o hay otro problema, intenta reconectar una vez más.
-        logger.warning("Problema con la conexión DB actual: %s. Reintentando conexión...", str(e))
+    # Reconnecta si la conexión es None o ha sido cerrada (closed != 0)
+    if _db_conn is None or _db_conn.closed != 0:
         _db_conn = connect_db_with_retry()
-        return _db_conn
+    return _db_conn
 
 
-# ==============================
-# VALIDACIÓN DE DATOS
-# ==============================
+# Pool de conexiones del modo multi-worker (None con un solo worker)
+_db_pool: Optional[PoolConexiones] = None
+
+
+def inicializar_pool() -> PoolConexiones:
+    """Crea el pool compartido por los workers (mismo DSN y opciones que connect_db_with_retry)."""
+    global _db_pool
+    _db_pool = PoolConexiones(
+        DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_LIFETIME_S, DB_POOL_TIMEOUT_S,
+        make_db_dsn(), **opciones_conexion()
+    )
+    logger.info("Pool de PostgreSQL creado (min=%d, max=%d, vida máx=%.0fs).",
+                DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_LIFETIME_S)
+    return _db_pool
+
+
+class ConexionPerdida(OperationalError):
+    """La conexión cayó antes del commit: la transacción quedó abortada y es seguro repetirla."""
+
+
+class CommitIncierto(OperationalError):
+    """La conexión cayó durante el commit: no se sabe si se confirmó, no se repite aquí."""
 
-def validar_datos(data: dict) -> bool:
-    """Valida rangos y tipos mínimos. Regresa True si válido, False si no.
-    
-    Cualquier error de tipo o valor lanza una excepción capturada para loggear.
+
+# Último uso de una conexión (para que el keepalive solo haga ping si está ociosa)
+_ultimo_uso_db = time.monotonic()
+
+
+@contextmanager
+def conexion_db() -> Iterator[psycopg2.extensions.connection]:
+    """Presta una conexión: del pool en modo multi-worker o la conexión global si no.
+
+    Si la operación falla y la conexión quedó cerrada, se descarta (la siguiente
+    operación reconecta), se cuenta en db_reconnects_total y se relanza como
+    ConexionPerdida para que con_reconexion pueda repetir la operación.
+    """
+    global _db_conn, _ultimo_uso_db
+    if _db_pool is None:
+        conn = get_db_conn()
+        contexto = None
+    else:
+        contexto = _db_pool.conexion()
+        conn = contexto.__enter__()
+    try:
+        yield conn
+    except (OperationalError, InterfaceError) as e:
+        if conn.closed == 0 or isinstance(e, ConexionPerdida):
+            raise
+        DB_RECONNECTS.inc()
+        if _db_pool is None and _db_conn is conn:
+            _db_conn = None
+        if isinstance(e, CommitIncierto):
+            raise
+        raise ConexionPerdida(f"Conexión a PostgreSQL perdida: {e}") from e
+    finally:
+        _ultimo_uso_db = time.monotonic()
+        if contexto is not None:
+            # El pool descarta las conexiones cerradas al devolverlas.
+            contexto.__exit__(None, None, None)
+
+
+def con_reconexion(operacion):
+    """Repite una vez la operación si falló porque la conexión cayó antes del commit.
+
+    La transacción de una conexión perdida nunca se confirmó, así que repetir el lote
+    completo en una conexión nueva no duplica filas. Si la conexión cayó durante el
+    commit (CommitIncierto) o vuelve a fallar, la excepción llega al llamador (NACK).
+    """
+    @functools.wraps(operacion)
+    def envoltura(*args, **kwargs):
+        try:
+            return operacion(*args, **kwargs)
+        except ConexionPerdida as e:
+            logger.warning("%s. Reconectando y repitiendo la operación en curso...", e)
+            return operacion(*args, **kwargs)
+    return envoltura
+
+
+def confirmar(conn: psycopg2.extensions.connection) -> None:
+    """commit() que distingue una caída de conexión durante la confirmación."""
+    try:
+        with etapa(ETAPA_COMMIT):
+            conn.commit()
+    except (OperationalError, InterfaceError) as e:
+        if conn.closed != 0:
+            raise CommitIncierto(f"Conexión perdida durante el commit: {e}") from e
+        raise
+
+
+def deshacer(conn: psycopg2.extensions.connection) -> None:
+    """rollback() que no enmascara el error original si la conexión ya está cerrada."""
+    if conn.closed == 0:
+        conn.rollback()
+
+
+def keepalive_db() -> None:
+    """Ping a la DB solo si la conexión lleva DB_KEEPALIVE_INTERVAL_S ociosa.
+
+    Se ejecuta desde el temporizador del propio bucle de pika del worker, así que no
+    comparte la conexión con otro hilo. Un fallo solo descarta la conexión.
     """
+    if time.monotonic() - _ultimo_uso_db < DB_KEEPALIVE_INTERVAL_S:
+        return
     try:
-        # Campos obligatorios
-        required = ["id_station", "dates", "temperature_celsius", "humidity", "wind", "wind_speed", "pressure"]
-        for k in required:
-            if k not in data:
-                raise ValueError(f"Falta campo requerido: {k}")
+        with conexion_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+    except Exception as e:
+        logger.warning("Keepalive de PostgreSQL fallido: %s. Se reconectará en la próxima escritura.", e)
 
-        id_station = int(data.get("id_station"))
-        if not (1 <= id_station <= 9999): # adaptar rango si se conoce
-            raise ValueError("id_station fuera de rango (1-9999).")
 
-        # fechas: intentar parsear
+def mantener_particiones() -> None:
+    """Crea por adelantado las particiones mensuales de weather_logs (hilo en segundo plano).
+
+    Usa una conexión propia y de corta duración para no compartir la de los workers.
+    Las inserciones nunca dependen de esto: sin partición, las filas caen en weather_logs_default.
+    """
+    while True:
         try:
-            _ = datetime.fromisoformat(data.get("dates"))
-        except Exception:
-            raise ValueError("Formato de fecha inválido. Use ISO 8601.")
+            conn = psycopg2.connect(make_db_dsn(), **opciones_conexion())
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("SELECT crear_particiones_weather_logs(%s);", (DB_PARTITION_MONTHS_AHEAD,))
+                    creadas = cur.fetchone()[0]
+                if creadas:
+                    logger.info("Particiones de weather_logs creadas: %d.", creadas)
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            logger.warning("No se pudieron crear las particiones de weather_logs: %s", e)
+        time.sleep(DB_PARTITION_MAINTENANCE_INTERVAL_S)
+
+
+# Columnas en el orden de utils.rolling.CAMPOS_AGREGADOS; ventana 'last' = última lectura
+ROLLING_UPSERT_SQL = """
+INSERT INTO weather_station_rolling (
+    id_station, ventana, readings,
+    temperature_avg, temperature_min, temperature_max,
+    humidity_avg, humidity_min, humidity_max,
+    wind_speed_avg, wind_speed_min, wind_speed_max,
+    pressure_avg, pressure_min, pressure_max,
+    actualizado
+) VALUES %s
+ON CONFLICT (id_station, ventana) DO UPDATE SET
+    readings = EXCLUDED.readings,
+    temperature_avg = EXCLUDED.temperature_avg, temperature_min = EXCLUDED.temperature_min, temperature_max = EXCLUDED.temperature_max,
+    humidity_avg = EXCLUDED.humidity_avg, humidity_min = EXCLUDED.humidity_min, humidity_max = EXCLUDED.humidity_max,
+    wind_speed_avg = EXCLUDED.wind_speed_avg, wind_speed_min = EXCLUDED.wind_speed_min, wind_speed_max = EXCLUDED.wind_speed_max,
+    pressure_avg = EXCLUDED.pressure_avg, pressure_min = EXCLUDED.pressure_min, pressure_max = EXCLUDED.pressure_max,
+    actualizado = EXCLUDED.actualizado
+"""
 
-        temp = float(data.get("temperature_celsius"))
-        if not (-50.0 <= temp <= 70.0):
-            raise ValueError("Temperatura fuera de rango (-50 a 70°C).")
 
-        hum = float(data.get("humidity"))
-        if not (0.0 <= hum <= 100.0):
-            raise ValueError("Humedad fuera de rango (0 a 100%).")
+def filas_agregados() -> List[tuple]:
+    """Instantánea de los agregados móviles como filas de weather_station_rolling."""
+    filas = []
+    for id_station, ultimos, ventanas in AGREGADOS_ESTACION.instantanea():
+        filas.append((id_station, "last", 1, *(v for valor in ultimos for v in (valor, valor, valor))))
+        for ventana, lecturas, resumenes in ventanas:
+            valores = (v for resumen in resumenes for v in (resumen or (None, None, None)))
+            filas.append((id_station, ventana, lecturas, *valores))
+    return filas
 
-        wind = str(data.get("wind")).upper()
-        allowed_winds = {"N","S","E","W","NE","NW","SE","SW"}
-        if wind not in allowed_winds:
-            raise ValueError("Dirección de viento inválida.")
 
-        ws = float(data.get("wind_speed"))
-        if not (0.0 <= ws <= 300.0):
-            raise ValueError("Velocidad de viento fuera de rango (0 a 300 km/h).")
+def volcar_agregados() -> None:
+    """Vuelca cada ROLLING_FLUSH_INTERVAL_S los agregados móviles a weather_station_rolling.
 
-        pres = float(data.get("pressure"))
-        if not (300.0 <= pres <= 1200.0): # rango ampliado para seguridad
-            raise ValueError("Presión fuera de rango (300 a 1200 hPa).")
+    Hilo en segundo plano con conexión propia, igual que mantener_particiones(). Un fallo
+    solo pierde ese volcado: los agregados siguen en memoria y en /metrics.
+    """
+    while True:
+        time.sleep(ROLLING_FLUSH_INTERVAL_S)
+        filas = filas_agregados()
+        if not filas:
+            continue
+        try:
+            conn = psycopg2.connect(make_db_dsn(), **opciones_conexion())
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, ROLLING_UPSERT_SQL, filas, template=f"({', '.join(['%s'] * 15)}, now())", page_size=1000)
+                conn.commit()
+                logger.info("Agregados móviles volcados: %d filas.", len(filas))
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            logger.warning("No se pudieron volcar los agregados móviles: %s", e)
 
-        return True
 
-    except Exception as e:
-        logger.error("Validación fallida: %s. Datos: %s", e, data)
+# Fila de esta instancia en weather_ingest_watermarks (ver publicar_marca_escritura)
+MARCA_ESCRITURA_SQL = """
+INSERT INTO weather_ingest_watermarks (instancia, filas, escrito) VALUES (%s, %s, now())
+ON CONFLICT (instancia) DO UPDATE SET filas = EXCLUDED.filas, escrito = EXCLUDED.escrito
+"""
+
+
+def publicar_marca_escritura() -> None:
+    """Publica cada INGEST_WATERMARK_INTERVAL_S, si hubo filas nuevas, la marca de escritura
+    de esta instancia (filas escritas y momento). El servicio de consultas invalida con ella
+    su caché. Hilo en segundo plano con conexión propia; los fallos solo retrasan la marca.
+    """
+    instancia = f"{socket.gethostname()}:{os.getpid()}"
+    publicadas = None
+    conn = None
+    while True:
+        time.sleep(INGEST_WATERMARK_INTERVAL_S)
+        filas = filas_escritas()
+        if filas == publicadas:
+            continue
+        try:
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(make_db_dsn(), **opciones_conexion())
+                conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(MARCA_ESCRITURA_SQL, (instancia, filas))
+            publicadas = filas
+        except psycopg2.Error as e:
+            logger.warning("No se pudo publicar la marca de escritura: %s", e)
+            if conn is not None:
+                conn.close()
+                conn = None
+
+
+# ==============================
+# SPOOL LOCAL (DB NO DISPONIBLE)
+# ==============================
+# Con SPOOL_ENABLED, un error transitorio de la DB no devuelve los mensajes a RabbitMQ: sus
+# filas ya validadas se guardan en el spool (utils.spool) y se confirman. reproducir_spool()
+# las carga después en weather_logs.
+
+_spool: Optional[Spool] = None
+
+SPOOL_YA_REPRODUCIDO_SQL = "SELECT 1 FROM weather_spool_replayed WHERE segment = %s"
+SPOOL_MARCA_SQL = "INSERT INTO weather_spool_replayed (segment, rows_loaded) VALUES (%s, %s)"
+
+
+def guardar_en_spool(filas: List[tuple]) -> bool:
+    """Guarda filas validadas en el spool. False si está desactivado, lleno o el disco falla."""
+    if _spool is None:
         return False
+    try:
+        _spool.agregar(filas)
+    except (SpoolLleno, OSError) as e:
+        logger.error("No se pudieron guardar %d filas en el spool: %s", len(filas), e)
+        return False
+    logger.warning("DB no disponible: %d filas guardadas en el spool local.", len(filas))
+    return True
+
+
+def marcar_db_caida() -> None:
+    """Tras un fallo de la DB, los lotes de los próximos SPOOL_BYPASS_S van directos al spool."""
+    if _spool is not None:
+        _spool.marcar_caida(SPOOL_BYPASS_S)
+
+
+def reproducir_segmento(conn: psycopg2.extensions.connection, ruta: str) -> None:
+    """Carga un segmento en weather_logs y lo marca como reproducido en la misma transacción.
+
+    Si el segmento ya figura en weather_spool_replayed (se cayó el proceso entre el commit y
+    el borrado del fichero) no se vuelve a insertar. Las filas que la DB rechaza (FK, CHECK)
+    se descartan con un SAVEPOINT por fila, como en insertar_filas_aislando_errores().
+    """
+    segmento = os.path.basename(ruta)[:-len(EXTENSION)]
+    with conn.cursor() as cur:
+        cur.execute(SPOOL_YA_REPRODUCIDO_SQL, (segmento,))
+        if cur.fetchone() is not None:
+            conn.rollback()
+            logger.info("Segmento %s del spool ya reproducido; solo se elimina.", segmento)
+            return
+        filas = [fila for lote in leer_segmento(ruta) for fila in lote]
+        descartadas = insertadas = 0
+        cur.execute("SAVEPOINT segmento")
+        try:
+            # Páginas de 1000 filas: rowcount solo informa de la última sentencia
+            for i in range(0, len(filas), 1000):
+                execute_values(cur, INSERT_BATCH_SQL, filas[i:i + 1000], page_size=1000)
+                insertadas += cur.rowcount
+        except (IntegrityError, DataError):
+            cur.execute("ROLLBACK TO SAVEPOINT segmento")
+            insertadas = 0
+            for fila in filas:
+                cur.execute("SAVEPOINT fila")
+                try:
+                    cur.execute(INSERT_SQL, fila)
+                except (IntegrityError, DataError) as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT fila")
+                    logger.error("Fila del spool rechazada por la DB (station=%s): %s", fila[0], str(e).strip())
+                    descartadas += 1
+                else:
+                    insertadas += cur.rowcount
+                    cur.execute("RELEASE SAVEPOINT fila")
+        cur.execute(SPOOL_MARCA_SQL, (segmento, insertadas))
+    conn.commit()
+    contar_insertadas(len(filas) - descartadas, insertadas)
+    SPOOL_ROWS_REPLAYED.inc(len(filas) - descartadas)
+    SPOOL_ROWS_DISCARDED.inc(descartadas)
+    logger.info("Segmento %s del spool reproducido: %d filas (%d descartadas).", segmento, len(filas), descartadas)
+
+
+def reproducir_spool() -> None:
+    """Hilo en segundo plano: vacía el spool en weather_logs cuando la DB vuelve a responder.
+
+    Usa una conexión propia, como mantener_particiones(), para no competir con los workers
+    por get_db_conn() ni por el pool. Las lecturas reproducidas no alimentan los agregados
+    móviles (son antiguas); sí cuentan como procesadas.
+    """
+    while True:
+        time.sleep(SPOOL_REPLAY_INTERVAL_S)
+        if _spool.vacio:
+            continue
+        try:
+            conn = psycopg2.connect(make_db_dsn(), **opciones_conexion())
+        except psycopg2.Error as e:
+            logger.info("Spool pendiente; la DB sigue sin responder: %s", str(e).strip())
+            continue
+        try:
+            # La DB responde: los workers vuelven a escribir directamente en ella
+            _spool.restablecer()
+            _spool.sellar()
+            for ruta in _spool.segmentos():
+                reproducir_segmento(conn, ruta)
+                _spool.eliminar(ruta)
+        except psycopg2.Error as e:
+            logger.warning("Reproducción del spool interrumpida: %s", e)
+        except OSError as e:
+            logger.error("No se pudo leer o borrar un segmento del spool: %s", e)
+        finally:
+            conn.close()
 
 
 # ==============================
 # OPERACIONES DE BD
 # ==============================
 
-def insertar_weather(data: dict) -> None:
-    """Inserta un registro en weather_logs. Realiza commit o lanza excepción en fallo."""
-    conn = get_db_conn() # Obtiene o restablece la conexión activa
-    try:
-        with conn.cursor() as cur:
-            # Ejecuta la inserción usando parámetros de psycopg2 para prevenir inyección SQL.
-            cur.execute(
-                INSERT_SQL,
-                (
-                    int(data["id_station"]),
-                    datetime.fromisoformat(data["dates"]),
-                    float(data["temperature_celsius"]),
-                    float(data["humidity"]),
-                    str(data["wind"]),
-                    float(data["wind_speed"]),
-                    float(data["pressure"]) 
-                )
-            )
-        conn.commit() # Confirma la transacción en la DB
-        logger.info("Inserción en DB exitosa (station=%s).", data.get("id_station"))
-        MESSAGES_PROCESSED.inc() # Incrementa la métrica de Prometheus
-    except Exception as e:
-        conn.rollback() # Revierte la transacción si falla la inserción
-        logger.exception("Error al insertar en DB, se hace rollback.")
-        raise # Relanza la excepción para que el callback la maneje
+@con_reconexion
+def insertar_weather(fila: tuple) -> None:
+    """Inserta una fila normalizada en weather_logs. Realiza commit o lanza excepción en fallo."""
+    with conexion_db() as conn: # Obtiene o restablece la conexión activa
+        try:
+            with conn.cursor() as cur:
+                # Ejecuta la inserción usando parámetros de psycopg2 para prevenir inyección SQL.
+                with etapa(ETAPA_INSERCION):
+                    cur.execute(INSERT_SQL, fila)
+                insertadas = cur.rowcount  # 0 si la lectura ya existía
+            confirmar(conn) # Confirma la transacción en la DB
+            log_mensajes.info("Inserción en DB exitosa (station=%s).", fila[0])
+            contar_insertadas(1, insertadas) # Incrementa la métrica de Prometheus
+            registrar_lecturas((fila,))
+        except Exception as e:
+            deshacer(conn) # Revierte la transacción si falla la inserción
+            logger.exception("Error al insertar en DB, se hace rollback.")
+            raise # Relanza la excepción para que el callback la maneje
+
+
+@con_reconexion
+def insertar_weather_lote(filas: List[tuple]) -> None:
+    """Inserta varias filas con un único INSERT multi-fila y un único commit.
+
+    Todo el lote es atómico: si una fila falla se revierte la transacción completa
+    y se relanza la excepción para que el llamador decida (reintento o fila a fila).
+    """
+    with conexion_db() as conn:
+        try:
+            with conn.cursor() as cur:
+                # Una sola sentencia (page_size = tamaño del lote): rowcount cuenta las nuevas
+                with etapa(ETAPA_INSERCION):
+                    execute_values(cur, INSERT_BATCH_SQL, filas, page_size=len(filas))
+                insertadas = cur.rowcount
+            confirmar(conn)
+            log_mensajes.info("Lote de %d filas insertado en DB (%d nuevas).", len(filas), insertadas)
+            contar_insertadas(len(filas), insertadas)
+            registrar_lecturas(filas)
+        except Exception:
+            deshacer(conn)
+            logger.exception("Error al insertar lote de %d filas, se hace rollback.", len(filas))
+            raise
+
+
+@con_reconexion
+def copiar_weather_lote(filas: List[tuple]) -> None:
+    """Carga varias filas con COPY ... FROM STDIN (CSV) en una sola transacción.
+
+    El buffer CSV se construye en memoria. Igual que insertar_weather_lote, el lote
+    es atómico y cualquier excepción se relanza tras el rollback.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for fila in filas:
+        writer.writerow(fila)
+    buffer.seek(0)
+
+    with conexion_db() as conn:
+        try:
+            with conn.cursor() as cur, etapa(ETAPA_INSERCION):
+                cur.execute(COPY_TEMP_SQL)
+                cur.copy_expert(COPY_SQL, buffer)
+                cur.execute(COPY_MOVER_SQL)
+                insertadas = cur.rowcount
+            confirmar(conn)
+            log_mensajes.info("Lote de %d filas cargado en DB vía COPY (%d nuevas).", len(filas), insertadas)
+            contar_insertadas(len(filas), insertadas)
+            registrar_lecturas(filas)
+        except Exception:
+            deshacer(conn)
+            logger.exception("Error en COPY de lote de %d filas, se hace rollback.", len(filas))
+            raise
+
+
+@con_reconexion
+def insertar_filas_aislando_errores(filas: List[tuple]) -> Dict[int, str]:
+    """Inserta las filas en una transacción usando un SAVEPOINT por fila.
+
+    Las filas que violan restricciones (FK, chk_temperature_range, tipos) se revierten
+    individualmente y el resto se confirma con un único commit.
+    Devuelve el error de cada fila rechazada, por índice. Los OperationalError se relanzan.
+    """
+    with conexion_db() as conn:
+        rechazadas: Dict[int, str] = {}
+        insertadas = 0
+        try:
+            with conn.cursor() as cur, etapa(ETAPA_INSERCION):
+                for i, fila in enumerate(filas):
+                    cur.execute("SAVEPOINT fila")
+                    try:
+                        cur.execute(INSERT_SQL, fila)
+                    except (IntegrityError, DataError) as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT fila")
+                        logger.warning("Fila rechazada por la DB (station=%s): %s", fila[0], str(e).strip())
+                        rechazadas[i] = str(e).strip()
+                    else:
+                        insertadas += cur.rowcount
+                        cur.execute("RELEASE SAVEPOINT fila")
+            confirmar(conn)
+            contar_insertadas(len(filas) - len(rechazadas), insertadas)
+            registrar_lecturas(fila for i, fila in enumerate(filas) if i not in rechazadas)
+            return rechazadas
+        except Exception:
+            deshacer(conn)
+            logger.exception("Error al insertar fila a fila, se hace rollback.")
+            raise
+
+
+# Motor usado por los lotes (configurable para comparar ambos en la misma carga)
+escribir_lote = copiar_weather_lote if DB_WRITE_ENGINE == "copy" else insertar_weather_lote
 
 
 # ==============================
 # RABBITMQ - DLQ PUBLISH
 # ==============================
 
-def publish_to_dlq(channel: pika.channel.Channel, body: bytes, properties: pika.spec.BasicProperties = None) -> None:
-    """Publica el mensaje original en la DLQ (intercambio durable)."""
+def publish_to_dlq(channel: pika.channel.Channel, body: bytes, properties: pika.spec.BasicProperties = None,
+                   motivo: str = DESCONOCIDO, detalle: str = "") -> None:
+    """Publica el mensaje original en la DLQ (intercambio durable).
+
+    El motivo (utils.dlq) y el detalle del error se registran en las cabeceras x-dlq-* para
+    que dlq_tool.py pueda clasificar y reprocesar la DLQ.
+    """
+    properties = properties or pika.BasicProperties(delivery_mode=2)
     try:
         # Declaración y binding explícito de DLQ para asegurar que exista
         channel.exchange_declare(exchange=RABBITMQ_DLQ_EXCHANGE, exchange_type='direct', durable=True)
         channel.queue_declare(queue=RABBITMQ_DLQ_QUEUE, durable=True)
         channel.queue_bind(exchange=RABBITMQ_DLQ_EXCHANGE, queue=RABBITMQ_DLQ_QUEUE, routing_key=ROUTING_KEY)
 
-        channel.basic_publish(
-            exchange=RABBITMQ_DLQ_EXCHANGE,
-            routing_key=ROUTING_KEY,
-            body=body,
-            # Asegura que el mensaje sea persistente en la DLQ
-            properties=properties or pika.BasicProperties(delivery_mode=2) 
-        )
-        logger.info("Mensaje publicado en DLQ: %s", RABBITMQ_DLQ_QUEUE)
+        with etapa(ETAPA_DLQ):
+            channel.basic_publish(
+                exchange=RABBITMQ_DLQ_EXCHANGE,
+                routing_key=ROUTING_KEY,
+                body=body,
+                # Asegura que el mensaje sea persistente en la DLQ
+                properties=pika.BasicProperties(
+                    content_type=properties.content_type, content_encoding=properties.content_encoding,
+                    delivery_mode=2, message_id=properties.message_id, timestamp=properties.timestamp,
+                    headers=cabeceras_dlq(properties.headers, motivo, detalle),
+                )
+            )
+        log_mensajes.info("Mensaje publicado en DLQ: %s", RABBITMQ_DLQ_QUEUE)
     except Exception:
         logger.exception("Fallo al publicar en DLQ.")
 
 
+# ==============================
+# RABBITMQ - REINTENTOS DIFERIDOS
+# ==============================
+
+# Exchange/cola de cada nivel de espera, del más corto al más largo (utils.retry)
+NIVELES_REINTENTO = [nombre_nivel(RETRY_EXCHANGE_PREFIX, r) for r in RETRY_DELAYS_S]
+
+
+def declarar_niveles_reintento(channel) -> None:
+    """Declara un exchange fanout y una cola con TTL por nivel; al vencer vuelven al exchange principal."""
+    for retraso, nivel in zip(RETRY_DELAYS_S, NIVELES_REINTENTO):
+        channel.exchange_declare(exchange=nivel, exchange_type='fanout', durable=True)
+        channel.queue_declare(queue=nivel, durable=True, arguments=argumentos_nivel(retraso, RABBITMQ_EXCHANGE))
+        channel.queue_bind(exchange=nivel, queue=nivel)
+
+
+def propiedades_reintento(properties, motivo: str) -> pika.BasicProperties:
+    """Propiedades del mensaje republicado: las originales con x-retry-count incrementado."""
+    return pika.BasicProperties(
+        content_type=properties.content_type, content_encoding=properties.content_encoding,
+        headers=cabeceras_reintento(properties.headers, motivo), delivery_mode=2,
+        message_id=properties.message_id, timestamp=properties.timestamp,
+    )
+
+
+def reintentar(channel, acks: AckAcumulado, tag: int, mensaje: tuple, motivo: str) -> None:
+    """Error transitorio de la DB: el mensaje espera en el siguiente nivel de reintento.
+
+    `mensaje` es (body, properties, routing_key) tal como se recibió. Se republica en el
+    nivel que corresponde a su x-retry-count (o en la DLQ si ya agotó RETRY_MAX_ATTEMPTS) y
+    se confirma el original. Sin niveles configurados, o si la publicación falla, NACK+requeue.
+    """
+    body, properties, routing_key = mensaje
+    if not NIVELES_REINTENTO:
+        acks.rechazar(tag, requeue=True)
+        return
+    nivel = nivel_siguiente(properties.headers, NIVELES_REINTENTO, RETRY_MAX_ATTEMPTS)
+    propiedades = propiedades_reintento(properties, motivo)
+    try:
+        if nivel is None:
+            logger.error("Mensaje sin éxito tras %d reintentos. Moviendo a DLQ. Delivery tag=%s",
+                         reintentos(properties.headers), tag)
+            publish_to_dlq(channel, body, propiedades, REINTENTOS_AGOTADOS, motivo)
+            RETRIES_EXHAUSTED.inc()
+        else:
+            channel.basic_publish(exchange=nivel, routing_key=routing_key, body=body, properties=propiedades)
+            MESSAGES_RETRIED.labels(tier=nivel).inc()
+    except Exception:
+        logger.exception("No se pudo republicar el mensaje para reintento, NACK+requeue.")
+        acks.rechazar(tag, requeue=True)
+        return
+    acks.completar(tag)
+
+
+# ==============================
+# LOTES (MICRO-TRANSACCIONES)
+# ==============================
+
+class Pendiente(NamedTuple):
+    """Mensaje válido a la espera de escribirse: una fila, o las filas válidas de un sobre.
+
+    `a_dlq(j)` devuelve (body, properties) con los que enviar la fila j a la DLQ si la DB la
+    rechaza: el mensaje original, o solo esa lectura si el mensaje era un sobre.
+    `mensaje` es (body, properties, routing_key) del mensaje recibido, para reintentarlo.
+    """
+    tag: int
+    filas: List[tuple]
+    a_dlq: Callable[[int], tuple]
+    mensaje: tuple
+
+
+def propiedades_lectura(properties) -> pika.BasicProperties:
+    """Propiedades de una lectura suelta extraída de un sobre (sin compresión ni x-readings)."""
+    cabeceras = {k: v for k, v in (properties.headers or {}).items() if k != HEADER_LECTURAS}
+    return pika.BasicProperties(
+        content_type=properties.content_type, delivery_mode=2, headers=cabeceras or None,
+        message_id=properties.message_id,
+    )
+
+
+class AcumuladorLote:
+    """Acumula mensajes válidos y los persiste juntos en una sola transacción.
+
+    El lote se escribe al llegar a `max_filas` filas o cuando pasan `linger_s` segundos desde
+    el primer mensaje pendiente (timer del propio BlockingConnection, mismo hilo).
+    Tras el commit los tags del lote se marcan como completados en el AckAcumulado, que
+    los confirma con un único basic_ack(multiple=True) junto con los ya resueltos.
+    Las filas de un sobre nunca se reparten entre dos lotes: el mensaje se confirma una vez.
+    """
+
+    def __init__(self, connection: pika.BlockingConnection, channel, acks: AckAcumulado,
+                 max_filas: int, linger_s: float):
+        self.connection = connection
+        self.channel = channel
+        self.acks = acks
+        self.max_filas = max_filas
+        self.linger_s = linger_s
+        self.pendientes: List[Pendiente] = []
+        self._filas = 0
+        self._timer = None
+
+    def agregar(self, pendiente: Pendiente) -> None:
+        self.pendientes.append(pendiente)
+        self._filas += len(pendiente.filas)
+        if self._filas >= self.max_filas:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self.connection.call_later(self.linger_s, self._on_linger)
+
+    @property
+    def filas_pendientes(self) -> int:
+        """Filas acumuladas que aún no se han escrito (gauge consumer_rows_pending)."""
+        return self._filas
+
+    def _on_linger(self) -> None:
+        self._timer = None
+        self.flush()
+
+    def flush(self) -> None:
+        """Escribe el lote pendiente y hace ACK/NACK acumulado según el resultado."""
+        if self._timer is not None:
+            self.connection.remove_timeout(self._timer)
+            self._timer = None
+        lote, self.pendientes, self._filas = self.pendientes, [], 0
+        if lote:
+            escribir_pendientes(self.channel, self.acks, lote)
+
+
+# message_id de los mensajes ya escritos (compartida por los workers): un duplicado reciente
+# se confirma sin ir a la DB.
+_escritos = IdsRecientes(DEDUP_CACHE_SIZE)
+
+# Estaciones de weather_stations (hilo "estaciones"): las lecturas de estaciones desconocidas se
+# rechazan en la validación en vez de fallar por la FK al insertar.
+_estaciones = CacheEstaciones()
+
+
+def _resueltos(acks: AckAcumulado, lote: List[Pendiente]) -> None:
+    """Los mensajes del lote ya son durables (DB, spool o DLQ): ACK y a la caché de ids."""
+    acks.completar(*(p.tag for p in lote))
+    _escritos.agregar(*(p.mensaje[1].message_id for p in lote))
+
+
+def _latencias(lote: List[Pendiente]) -> None:
+    """Lag de extremo a extremo de los mensajes de un lote recién confirmado en la DB."""
+    ahora = time.time()
+    for p in lote:
+        observar_latencia(p.mensaje[1].headers, ahora)
+
+
+def escribir_pendientes(channel, acks: AckAcumulado, lote: List[Pendiente]) -> None:
+    """Escribe las filas de `lote` en una transacción y resuelve cada mensaje una sola vez."""
+    if _spool is not None and _spool.derivando:
+        # La DB acaba de fallar: al spool sin esperar a otro timeout de conexión
+        _devolver(channel, acks, lote, "DB no disponible")
+        return
+    filas = [fila for p in lote for fila in p.filas]
+    BATCH_ROWS.observe(len(filas))
+    try:
+        escribir_lote(filas)
+    except OperationalError as e:
+        # Error transitorio: todo el lote pasa al spool o a reintento diferido.
+        logger.warning("OperationalError al insertar lote, se devuelven %d mensajes. Error: %s", len(lote), str(e))
+        contar_fallos(DB_TRANSITORIO, len(lote))
+        marcar_db_caida()
+        _devolver(channel, acks, lote, str(e))
+        return
+    except Exception:
+        # Error irreparable en alguna fila (FK, CHECK...): se aísla fila a fila.
+        logger.warning("Lote rechazado por la DB. Reintentando fila a fila para aislar las inválidas.")
+        _procesar_por_fila(channel, acks, lote)
+        return
+
+    _resueltos(acks, lote)
+    _latencias(lote)
+    log_mensajes.info("Lote procesado. Último delivery tag=%s", lote[-1].tag)
+
+
+def _devolver(channel, acks: AckAcumulado, lote: List[Pendiente], motivo: str) -> None:
+    # Con spool, las filas quedan guardadas en disco y los mensajes se confirman.
+    if guardar_en_spool([fila for p in lote for fila in p.filas]):
+        _resueltos(acks, lote)
+        return
+    # Uno a uno: cada mensaje lleva su propio x-retry-count, y un NACK múltiple (sin niveles
+    # de reintento) también devolvería mensajes ajenos al lote que esperan su ACK acumulado.
+    for p in lote:
+        reintentar(channel, acks, p.tag, p.mensaje, motivo)
+
+
+def _procesar_por_fila(channel, acks: AckAcumulado, lote: List[Pendiente]) -> None:
+    """Reintenta el lote aislando las filas inválidas; solo esas van a la DLQ."""
+    # Posición de cada fila del lote: (índice del mensaje, índice de la fila en el mensaje)
+    posiciones = [(i, j) for i, p in enumerate(lote) for j in range(len(p.filas))]
+    try:
+        rechazadas = insertar_filas_aislando_errores([fila for p in lote for fila in p.filas])
+    except OperationalError as e:
+        # La DB cayó durante el reintento: todo el lote pasa al spool o a reintento diferido.
+        logger.warning("OperationalError durante reintento fila a fila, se devuelve el lote. Error: %s", str(e))
+        contar_fallos(DB_TRANSITORIO, len(lote))
+        marcar_db_caida()
+        _devolver(channel, acks, lote, str(e))
+        return
+    except Exception:
+        # Fallo inesperado fuera de las filas (no se pudo aislar): todo el lote a la DLQ.
+        logger.exception("No se pudo aislar las filas inválidas. Moviendo lote a DLQ.")
+        rechazadas = {k: "no se pudo aislar la fila" for k in range(len(posiciones))}
+
+    contar_fallos(RECHAZO_DB, len(rechazadas))
+    for k, error in rechazadas.items():
+        i, j = posiciones[k]
+        logger.warning("Fila irreparable en lote. Moviendo a DLQ. Delivery tag=%s", lote[i].tag)
+        publish_to_dlq(channel, *lote[i].a_dlq(j), RECHAZO_DB, error)
+    # Filas válidas confirmadas y rechazadas ya en la DLQ: ACK acumulado del lote.
+    _resueltos(acks, lote)
+    _latencias(lote)
+
+
+# Estado por hilo: cada worker tiene su propio canal, y los delivery tags, el lote y
+# los ACK pendientes son por canal.
+#   _estado.acks: AckAcumulado del canal actual
+#   _estado.lote: AcumuladorLote del canal actual (None si DB_BATCH_SIZE == 1)
+_estado = threading.local()
+
+# Conexión y canal de cada worker activo, para poder detenerlos desde el hilo principal
+_workers: dict = {}
+_workers_lock = threading.Lock()
+
+# Shards asignados a cada worker (RABBITMQ_SHARDS > 0). Cada shard lo consume un único
+# worker, así las lecturas de una estación se procesan en un solo hilo y en orden.
+_shards_worker: Dict[int, Set[int]] = {}
+
+
 # ==============================
 # CALLBACK DE PROCESAMIENTO
 # ==============================
@@ -254,61 +928,421 @@ def procesar_mensaje(ch: pika.channel.Channel, method, properties, body: bytes):
     """Procesa mensaje: valida, inserta y ACK/NACK según corresponda.
 
     Reglas:
-    - Si válido: insertar en DB y ACK.
+    - Si válido: insertar en DB y ACK (o acumular en el lote si DB_BATCH_SIZE > 1).
     - Si inválido: publicar en DLQ y ACK (evitar requeue infinito).
-    - Si error DB transitorio: NACK con requeue=True para reintentar.
+    - Si error DB transitorio: reintento diferido (niveles con TTL, ver utils.retry) y, tras
+      RETRY_MAX_ATTEMPTS, a la DLQ. Sin niveles configurados: NACK con requeue=True.
     - Errores irreparables: NACK requeue=False para no bloquear la cola.
+    - Sobres (cabecera x-readings): solo las lecturas inválidas van a la DLQ, una a una, y el
+      mensaje se confirma cuando todas sus lecturas válidas son durables.
+
+    Los ACK se delegan en el AckAcumulado del canal, que los envía acumulados tras el commit.
     """
-    logger.info("Mensaje recibido. Delivery tag=%s", method.delivery_tag)
+    acks: AckAcumulado = _estado.acks
+    lote: Optional[AcumuladorLote] = _estado.lote
+    log_mensajes.info("Mensaje recibido. Delivery tag=%s", method.delivery_tag)
+    acks.registrar(method.delivery_tag)
+
+    # 0. Duplicado reciente (reentrega tras caer la conexión antes del ACK, o reenvío del
+    # productor): ya está escrito, se confirma sin ir a la DB.
+    if _escritos.contiene(properties.message_id):
+        MESSAGES_DUPLICATED.inc()
+        log_mensajes.info("Mensaje duplicado (message_id=%s), se descarta. Delivery tag=%s",
+                          properties.message_id, method.delivery_tag)
+        acks.completar(method.delivery_tag)
+        return
 
-    # 1. Intenta parsear JSON
+    # 1. Descomprime y decodifica según content_encoding/content_type (JSON, MessagePack o struct)
     try:
-        payload = json.loads(body)
-    except json.JSONDecodeError:
-        logger.error("JSON inválido. Enviando a DLQ.")
+        with etapa(ETAPA_DECODIFICACION):
+            sobre = desempaquetar(body, properties.content_type, properties.content_encoding, properties.headers)
+    except ErrorDecodificacion as e:
+        logger.error("Cuerpo inválido (%s). Enviando a DLQ.", e)
+        contar_fallos(DECODIFICACION)
         # Error de formato (irreparable): a DLQ y ACK para sacarlo de la cola principal.
         try:
-            publish_to_dlq(ch, body, properties)
+            publish_to_dlq(ch, body, properties, DECODIFICACION, str(e))
         finally:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            acks.completar(method.delivery_tag)
         return
 
-    # 2. Validación de datos
-    if not validar_datos(payload):
-        logger.warning("Datos inválidos -> DLQ. Delivery tag=%s", method.delivery_tag)
+    if sobre.es_lote:
+        procesar_sobre(ch, method, properties, sobre)
+        return
+
+    # 2. Validación y normalización en una sola pasada (fila lista para la DB)
+    try:
+        with etapa(ETAPA_VALIDACION):
+            fila = _estaciones.verificar(normalizar(sobre.lecturas[0]))
+    except ErrorValidacion as e:
+        VALIDATION_ERRORS.labels(code=e.codigo).inc()
+        contar_fallos(VALIDACION)
+        logger.warning("Datos inválidos (%s: %s) -> DLQ. Delivery tag=%s", e.codigo, e, method.delivery_tag)
         # Error de validación (irreparable): a DLQ y ACK.
         try:
-            publish_to_dlq(ch, body, properties)
+            publish_to_dlq(ch, body, properties, VALIDACION, f"{e.codigo}: {e}")
         finally:
             # ACK original para no reencolar en la cola principal
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            acks.completar(method.delivery_tag)
+        return
+
+    # 3a. Modo lote: el ACK se envía al escribir el lote completo
+    if lote is not None:
+        lote.agregar(Pendiente(method.delivery_tag, [fila], lambda j: (body, properties),
+                               (body, properties, method.routing_key)))
         return
 
-    # 3. Intentar insertar en DB
+    # 3b. Intentar insertar en DB (directo al spool si la DB acaba de fallar)
+    if _spool is not None and _spool.derivando and guardar_en_spool([fila]):
+        acks.completar(method.delivery_tag)
+        _escritos.agregar(properties.message_id)
+        return
+    BATCH_ROWS.observe(1)
     try:
-        insertar_weather(payload)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        logger.info("Mensaje procesado y ACK enviado. Delivery tag=%s", method.delivery_tag)
+        insertar_weather(fila)
+        acks.completar(method.delivery_tag)
+        _escritos.agregar(properties.message_id)
+        observar_latencia(properties.headers)
+        log_mensajes.info("Mensaje procesado. Delivery tag=%s", method.delivery_tag)
 
     except OperationalError as e:
-        # Problema de conexión a la BD (transitorio): NACK con requeue=True para reintentar después
-        logger.warning("OperationalError al insertar, NACK+requeue. Error: %s", str(e))
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        # Problema de conexión a la BD (transitorio): spool local o reintento diferido en lugar
+        # de requeue inmediato
+        logger.warning("OperationalError al insertar. Error: %s", str(e))
+        contar_fallos(DB_TRANSITORIO)
+        marcar_db_caida()
+        if guardar_en_spool([fila]):
+            acks.completar(method.delivery_tag)
+            _escritos.agregar(properties.message_id)
+            return
+        reintentar(ch, acks, method.delivery_tag, (body, properties, method.routing_key), str(e))
 
     except Exception as e:
         # Error irreparable (ej. violación de FK o dato incorrecto): enviar a DLQ y ACK
         logger.exception("Error irreparable al insertar. Moviendo a DLQ.")
+        contar_fallos(RECHAZO_DB)
         try:
-            publish_to_dlq(ch, body, properties)
+            publish_to_dlq(ch, body, properties, RECHAZO_DB, str(e))
         finally:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            acks.completar(method.delivery_tag)
+
+
+def procesar_sobre(ch: pika.channel.Channel, method, properties, sobre: Sobre) -> None:
+    """Valida las N lecturas de un sobre; las inválidas van a la DLQ y las válidas a la DB juntas."""
+    acks: AckAcumulado = _estado.acks
+    with etapa(ETAPA_VALIDACION):
+        validas, errores = _estaciones.filtrar(*validar_lote(sobre.lecturas))
+    # La validación es determinista: en un reintento las inválidas ya están en la DLQ.
+    reintento = reintentos(properties.headers) > 0
+    for i, e in errores:
+        if reintento:
+            continue
+        VALIDATION_ERRORS.labels(code=e.codigo).inc()
+        contar_fallos(VALIDACION)
+        logger.warning("Lectura %d/%d inválida (%s: %s) -> DLQ. Delivery tag=%s",
+                       i + 1, len(sobre), e.codigo, e, method.delivery_tag)
+        publish_to_dlq(ch, sobre.cuerpo(i), propiedades_lectura(properties), VALIDACION, f"{e.codigo}: {e}")
+    log_mensajes.info("Sobre con %d lecturas (%d válidas). Delivery tag=%s", len(sobre), len(validas), method.delivery_tag)
+    if not validas:
+        acks.completar(method.delivery_tag)
+        return
+
+    indices = [i for i, _ in validas]
+    pendiente = Pendiente(
+        method.delivery_tag,
+        [fila for _, fila in validas],
+        lambda j: (sobre.cuerpo(indices[j]), propiedades_lectura(properties)),
+        (sobre.body, properties, method.routing_key),
+    )
+    if _estado.lote is not None:
+        _estado.lote.agregar(pendiente)
+    else:
+        # Sin modo lote el sobre se escribe igualmente en una sola transacción.
+        escribir_pendientes(ch, acks, [pendiente])
 
 
 # ==============================
 # INICIALIZACIÓN Y LOOP
 # ==============================
 
-def main():
+def _cerrar_canal(channel) -> None:
+    """Persiste lo pendiente del canal del hilo actual y deja de consumir."""
+    try:
+        # Persiste lo acumulado antes de cerrar para no forzar redelivery.
+        if _estado.lote is not None:
+            _estado.lote.flush()
+        _estado.acks.flush()
+    finally:
+        channel.stop_consuming()
+
+
+# ==============================
+# SHARDS (COLAS POR ESTACIÓN)
+# ==============================
+
+def declarar_colas_shard(channel) -> None:
+    """Declara y enlaza las N colas de shard (el productor declara las mismas)."""
+    for shard in range(RABBITMQ_SHARDS):
+        cola = cola_shard(RABBITMQ_QUEUE, shard)
+        channel.queue_declare(queue=cola, durable=True, arguments=ARGUMENTOS_COLA_SHARD)
+        channel.queue_bind(exchange=RABBITMQ_EXCHANGE, queue=cola, routing_key=routing_key_shard(ROUTING_KEY, shard))
+
+
+def _suscribir_shard(channel, shard: int) -> None:
+    """Empieza a consumir la cola del shard en el canal del hilo actual (idempotente)."""
+    if shard in _estado.consumos:
+        return
+    cola = cola_shard(RABBITMQ_QUEUE, shard)
+    _estado.consumos[shard] = channel.basic_consume(queue=cola, on_message_callback=procesar_mensaje, auto_ack=False)
+    logger.info("Consumiendo la cola '%s'.", cola)
+
+
+def _cancelar_shard(channel, shard: int, hecho: threading.Event) -> None:
+    """Persiste lo pendiente y deja de consumir el shard.
+
+    pika devuelve a la cola (NACK con requeue) lo recibido y aún no procesado, así que la
+    instancia que tome el shard continúa en el mismo orden.
+    """
+    try:
+        if _estado.lote is not None:
+            _estado.lote.flush()
+        _estado.acks.flush()
+        tag = _estado.consumos.pop(shard, None)
+        if tag is not None:
+            channel.basic_cancel(tag)
+            logger.info("Cola '%s' liberada.", cola_shard(RABBITMQ_QUEUE, shard))
+    finally:
+        hecho.set()
+
+
+def tomar_shard(shard: int) -> None:
+    """Asigna el shard al worker con menos shards; si está conectado, empieza a consumirlo."""
+    with _workers_lock:
+        worker_id = min(_shards_worker, key=lambda i: (len(_shards_worker[i]), i))
+        _shards_worker[worker_id].add(shard)
+        activo = _workers.get(worker_id)
+        if activo is None:
+            return  # Lo suscribe consumir() al conectar
+        connection, channel = activo
+        try:
+            # pika no es thread-safe: la suscripción se ejecuta en el hilo del worker.
+            connection.add_callback_threadsafe(functools.partial(_suscribir_shard, channel, shard))
+        except Exception:
+            pass  # Conexión cerrándose: consumir() lo suscribe al reconectar
+
+
+def soltar_shard(shard: int, timeout_s: float = 30.0) -> None:
+    """Deja de consumir el shard y espera a que su worker haya persistido lo pendiente."""
+    hecho = threading.Event()
+    with _workers_lock:
+        worker_id = next((i for i, shards in _shards_worker.items() if shard in shards), None)
+        if worker_id is None:
+            return
+        _shards_worker[worker_id].discard(shard)
+        activo = _workers.get(worker_id)
+        if activo is None:
+            return
+        connection, channel = activo
+        try:
+            connection.add_callback_threadsafe(functools.partial(_cancelar_shard, channel, shard, hecho))
+        except Exception:
+            return  # Sin conexión no hay consumo que cancelar: lo no confirmado vuelve a la cola
+    if not hecho.wait(timeout_s):
+        logger.warning("El worker %d no liberó el shard %d en %.0f s.", worker_id, shard, timeout_s)
+
+
+def conectar_reclamador() -> psycopg2.extensions.connection:
+    """Conexión dedicada del ReclamadorShards: sus advisory locks duran lo que la sesión."""
+    return psycopg2.connect(make_db_dsn(), application_name=APLICACION_RECLAMADOR, **opciones_conexion())
+
+
+def iniciar_shards(detener: threading.Event) -> None:
+    """Reparte entre los workers los shards de esta instancia: fijos o reclamados dinámicamente."""
+    for i in range(CONSUMER_WORKERS):
+        _shards_worker[i] = set()
+    fijos = parsear_shards(CONSUMER_SHARDS, RABBITMQ_SHARDS)
+    if fijos is not None:
+        for shard in fijos:
+            tomar_shard(shard)
+        logger.info("Shards de esta instancia: %s (de %d).", fijos, RABBITMQ_SHARDS)
+        return
+    reclamador = ReclamadorShards(RABBITMQ_SHARDS, conectar_reclamador, tomar_shard, soltar_shard)
+    threading.Thread(
+        target=reclamador.ejecutar, args=(SHARD_REBALANCE_INTERVAL_S, detener), name="shards", daemon=True
+    ).start()
+    logger.info("Reparto dinámico de %d shards cada %.0f s.", RABBITMQ_SHARDS, SHARD_REBALANCE_INTERVAL_S)
+
+
+# ==============================
+# AUTOESCALADO Y CONTROL DE FLUJO
+# ==============================
+
+# Prefetch de los canales; el autoescalado lo cambia en caliente (y lo usan las reconexiones)
+_prefetch = CONSUMER_PREFETCH
+
+# Hilo y evento de parada de cada worker del modo multi-worker (el autoescalado añade y quita)
+_hilos: Dict[int, Tuple[threading.Thread, threading.Event]] = {}
+_hilos_lock = threading.Lock()
+# Ids nunca reutilizados: un worker que se está cerrando no pisa la entrada de _workers de otro
+_ids_worker = itertools.count()
+
+
+def iniciar_worker() -> None:
+    worker_id = next(_ids_worker)
+    detener = threading.Event()
+    hilo = threading.Thread(target=consumir, args=(worker_id, detener), name=f"consumer-worker-{worker_id}", daemon=True)
+    _hilos[worker_id] = (hilo, detener)
+    hilo.start()
+
+
+def parar_worker(worker_id: int) -> threading.Thread:
+    """Detiene un worker: persiste lo pendiente de su canal, deja de consumir y cierra su conexión.
+
+    Lo recibido y aún no procesado vuelve a la cola al cerrarse el canal.
+    """
+    hilo, detener = _hilos.pop(worker_id)
+    detener.set()
+    with _workers_lock:
+        activo = _workers.get(worker_id)
+    if activo is not None:
+        connection, channel = activo
+        try:
+            # pika no es thread-safe: el cierre se ejecuta en el hilo del worker.
+            connection.add_callback_threadsafe(functools.partial(_cerrar_canal, channel))
+        except Exception:
+            pass
+    return hilo
+
+
+def ajustar_workers(n: int) -> None:
+    """Arranca o detiene workers hasta tener `n` (se detienen primero los de id más alto)."""
+    with _hilos_lock:
+        while len(_hilos) < n:
+            iniciar_worker()
+        while len(_hilos) > n:
+            parar_worker(max(_hilos))
+        CONSUMER_WORKERS_ACTIVE.set(len(_hilos))
+
+
+def aplicar_prefetch(prefetch: int) -> None:
+    """Cambia el prefetch de los canales de todos los workers (basic_qos en el hilo de cada uno)."""
+    global _prefetch
+    CONSUMER_PREFETCH_CURRENT.set(prefetch)
+    if prefetch == _prefetch:
+        return
+    _prefetch = prefetch
+    with _workers_lock:
+        activos = list(_workers.values())
+    for connection, channel in activos:
+        try:
+            connection.add_callback_threadsafe(functools.partial(channel.basic_qos, prefetch_count=prefetch))
+        except Exception:
+            pass  # Conexión cerrándose: consumir() aplica _prefetch al reconectar
+
+
+def _colas_consumidas() -> List[str]:
+    if RABBITMQ_SHARDS:
+        return [cola_shard(RABBITMQ_QUEUE, shard) for shard in range(RABBITMQ_SHARDS)]
+    return [RABBITMQ_QUEUE]
+
+
+def _publicar_flujo(abierta: Optional[Tuple[pika.BlockingConnection, object]], decision: Decision,
+                    profundidad: int) -> Optional[Tuple[pika.BlockingConnection, object]]:
+    """Publica el factor de flujo en FLOW_CONTROL_EXCHANGE con una conexión propia del hilo.
+
+    Devuelve (conexión, canal) para reutilizarlos, o None si falló (se reconecta en la siguiente).
+    """
+    try:
+        if abierta is None or abierta[0].is_closed:
+            conexion = pika.BlockingConnection(pika.ConnectionParameters(
+                host=RABBITMQ_HOST, port=RABBITMQ_PORT, credentials=pika.PlainCredentials(RABBIT_USER, RABBIT_PASS),
+                heartbeat=60,
+            ))
+            canal = conexion.channel()
+            canal.exchange_declare(exchange=FLOW_CONTROL_EXCHANGE, exchange_type='fanout', durable=True)
+            abierta = (conexion, canal)
+        conexion, canal = abierta
+        # Transitorio y con caducidad: un productor que arranca no recibe señales viejas
+        canal.basic_publish(
+            exchange=FLOW_CONTROL_EXCHANGE, routing_key="", body=mensaje_flujo(decision.factor, profundidad),
+            properties=pika.BasicProperties(
+                content_type="application/json", delivery_mode=1,
+                expiration=str(int(AUTOSCALE_INTERVAL_S * 2000)),
+            ),
+        )
+        # Atiende heartbeats: el hilo no vuelve a usar la conexión hasta el siguiente intervalo
+        conexion.process_data_events(0)
+        return abierta
+    except pika.exceptions.AMQPError as e:
+        AUTOSCALER_ERRORS.inc()
+        logger.warning("No se pudo publicar la señal de flujo: %s", e)
+        return None
+
+
+def aplicar_decision(decision: Decision, escalar_workers: bool) -> None:
+    """Aplica al motor síncrono el prefetch y, en modo pool con una sola cola, los workers."""
+    aplicar_prefetch(decision.prefetch)
+    if escalar_workers:
+        ajustar_workers(decision.workers)
+
+
+def autoescalar(aplicar: Callable[[Decision], None], workers_actuales: Callable[[], int]) -> None:
+    """Hilo del autoescalado: lee las colas en la API de management cada AUTOSCALE_INTERVAL_S,
+    decide workers, prefetch y factor de flujo (utils.autoscaling), aplica la decisión con
+    `aplicar` y publica el factor para los productores."""
+    controlador = Controlador(
+        AUTOSCALE_MIN_WORKERS, AUTOSCALE_MAX_WORKERS, CONSUMER_PREFETCH, AUTOSCALE_MAX_PREFETCH,
+        AUTOSCALE_TARGET_LAG_S, AUTOSCALE_SCALE_DOWN_DELAY_S,
+        FLOW_THROTTLE_DEPTH, FLOW_PAUSE_DEPTH, FLOW_RESUME_DEPTH, FLOW_MIN_FACTOR,
+    )
+    colas = _colas_consumidas()
+    anterior: Optional[Decision] = None
+    flujo = None
+    while True:
+        time.sleep(AUTOSCALE_INTERVAL_S)
+        try:
+            estado = leer_colas(RABBITMQ_MANAGEMENT_URL, RABBIT_USER, RABBIT_PASS, RABBITMQ_VHOST, colas)
+        except (OSError, ValueError) as e:
+            AUTOSCALER_ERRORS.inc()
+            logger.warning("API de management no disponible (%s): %s", RABBITMQ_MANAGEMENT_URL, e)
+            continue
+
+        decision = controlador.decidir(estado, workers_actuales())
+        AUTOSCALER_QUEUE_DEPTH.set(estado.mensajes)
+        if estado.utilizacion is not None:
+            AUTOSCALER_CONSUMER_UTILISATION.set(estado.utilizacion)
+        AUTOSCALER_DESIRED_WORKERS.set(decision.workers_totales)
+        FLOW_FACTOR.set(decision.factor)
+        if decision != anterior:
+            logger.info("Autoescalado: cola=%d (entrada %.0f/s, ACK %.0f/s) -> workers=%d, prefetch=%d, flujo=%.2f.",
+                        estado.mensajes, estado.tasa_entrada, estado.tasa_ack,
+                        decision.workers, decision.prefetch, decision.factor)
+            anterior = decision
+        try:
+            aplicar(decision)
+        except Exception:
+            logger.exception("No se pudo aplicar la decisión del autoescalado.")
+        if FLOW_CONTROL_ENABLED:
+            flujo = _publicar_flujo(flujo, decision, estado.mensajes)
+
+
+def iniciar_autoescalado(aplicar: Callable[[Decision], None], workers_actuales: Callable[[], int]) -> None:
+    threading.Thread(target=autoescalar, args=(aplicar, workers_actuales), name="autoescalado", daemon=True).start()
+    logger.info("Autoescalado activo: %d-%d workers, prefetch %d-%d, lag objetivo %.0f s, control de flujo %s.",
+                AUTOSCALE_MIN_WORKERS, AUTOSCALE_MAX_WORKERS, CONSUMER_PREFETCH, AUTOSCALE_MAX_PREFETCH,
+                AUTOSCALE_TARGET_LAG_S, "activo" if FLOW_CONTROL_ENABLED else "desactivado")
+
+
+def _programar_keepalive(connection: pika.BlockingConnection) -> None:
+    """Keepalive periódico de la DB en el bucle de pika (solo hace ping si está ociosa)."""
+    def tick():
+        keepalive_db()
+        _programar_keepalive(connection)
+    connection.call_later(DB_KEEPALIVE_INTERVAL_S, tick)
+
+
+def consumir(worker_id: int, detener: threading.Event) -> None:
+    """Bucle de consumo de un worker: conexión propia a RabbitMQ, canal, QoS y ACKs."""
     credentials = pika.PlainCredentials(RABBIT_USER, RABBIT_PASS)
 
     params = pika.ConnectionParameters(
@@ -319,40 +1353,70 @@ def main():
         blocked_connection_timeout=300
     )
 
-    while True:
+    while not detener.is_set():
         try:
             connection = pika.BlockingConnection(params)
             channel = connection.channel()
 
-            # QoS: prefetch_count=1 es obligatorio para procesamiento ordenado.
-            # Solo se entrega un mensaje al consumidor a la vez.
-            channel.basic_qos(prefetch_count=1)
+            # QoS: con prefetch_count=1 solo se entrega un mensaje al consumidor a la vez y el
+            # throughput queda limitado a 1/latencia. Una ventana mayor deja que el broker
+            # entregue mientras se escribe en la DB. El orden por estación se mantiene: un
+            # único hilo procesa los mensajes en orden de entrega y los lotes conservan ese orden.
+            channel.basic_qos(prefetch_count=_prefetch)
+            logger.info("Worker %d: prefetch=%d, ACK acumulado cada %d mensajes.", worker_id, _prefetch, CONSUMER_ACK_BATCH)
+
+            # Los delivery tags son por canal: cada reconexión empieza con un lote vacío.
+            _estado.acks = AckAcumulado(channel, connection, CONSUMER_ACK_BATCH, CONSUMER_ACK_LINGER_MS / 1000.0,
+                                        medir=lambda segundos: observar_etapa(ETAPA_ACK, segundos))
+            _estado.lote = None
+            if DB_BATCH_SIZE > 1:
+                _estado.lote = AcumuladorLote(connection, channel, _estado.acks, DB_BATCH_SIZE, DB_BATCH_LINGER_MS / 1000.0)
+                logger.info("Modo lote activo: hasta %d filas o %.0f ms por transacción.", DB_BATCH_SIZE, DB_BATCH_LINGER_MS)
+            # Mensajes sin ACK y filas sin escribir de este canal (consumer_messages_in_flight, consumer_rows_pending)
+            seguir_en_vuelo(_estado.acks, _estado.lote)
 
             # Declarar exchanges y colas (durable)
             channel.exchange_declare(exchange=RABBITMQ_EXCHANGE, exchange_type='direct', durable=True)
-            channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
-            channel.queue_bind(exchange=RABBITMQ_EXCHANGE, queue=RABBITMQ_QUEUE, routing_key=ROUTING_KEY)
+            if RABBITMQ_SHARDS:
+                declarar_colas_shard(channel)
+            else:
+                channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
+                channel.queue_bind(exchange=RABBITMQ_EXCHANGE, queue=RABBITMQ_QUEUE, routing_key=ROUTING_KEY)
 
             # Preparar DLQ (se declara dos veces, aquí y en publish_to_dlq, para seguridad)
             channel.exchange_declare(exchange=RABBITMQ_DLQ_EXCHANGE, exchange_type='direct', durable=True)
             channel.queue_declare(queue=RABBITMQ_DLQ_QUEUE, durable=True)
             channel.queue_bind(exchange=RABBITMQ_DLQ_EXCHANGE, queue=RABBITMQ_DLQ_QUEUE, routing_key=ROUTING_KEY)
-
-            logger.info("Esperando mensajes en la cola '%s'...", RABBITMQ_QUEUE)
+            # Niveles de reintento diferido (TTL + dead-letter de vuelta al exchange principal)
+            declarar_niveles_reintento(channel)
 
             # Empieza a consumir, deshabilitando el auto_ack para control manual.
-            channel.basic_consume(queue=RABBITMQ_QUEUE, on_message_callback=procesar_mensaje, auto_ack=False)
-
+            _estado.consumos = {}
+            if not RABBITMQ_SHARDS:
+                logger.info("Worker %d esperando mensajes en la cola '%s'...", worker_id, RABBITMQ_QUEUE)
+                channel.basic_consume(queue=RABBITMQ_QUEUE, on_message_callback=procesar_mensaje, auto_ack=False)
+
+            if DB_KEEPALIVE_INTERVAL_S > 0:
+                _programar_keepalive(connection)
+
+            with _workers_lock:
+                _workers[worker_id] = (connection, channel)
+                shards = sorted(_shards_worker.get(worker_id, ()))
+            # Los shards que lleguen después los suscribe tomar_shard() en este mismo hilo.
+            for shard in shards:
+                _suscribir_shard(channel, shard)
             try:
                 channel.start_consuming()
             except KeyboardInterrupt:
                 logger.info("Consumidor detenido por teclado.")
                 try:
-                    channel.stop_consuming()
+                    _cerrar_canal(channel)
                 except Exception:
                     pass
                 break
             finally:
+                with _workers_lock:
+                    _workers.pop(worker_id, None)
                 # Cierra la conexión si sale del start_consuming
                 try:
                     connection.close()
@@ -362,12 +1426,86 @@ def main():
         except pika.exceptions.AMQPConnectionError as e:
             # Manejo de errores de conexión a RabbitMQ con reintento
             logger.warning("No se puede conectar a RabbitMQ: %s. Reintentando en %.1f s...", e, RABBIT_RECONNECT_DELAY)
-            time.sleep(RABBIT_RECONNECT_DELAY)
+            detener.wait(RABBIT_RECONNECT_DELAY)
         except Exception:
             # Manejo de errores inesperados en el loop principal
             logger.exception("Error inesperado en el loop principal. Reintentando en %.1f s...", RABBIT_RECONNECT_DELAY)
-            time.sleep(RABBIT_RECONNECT_DELAY)
+            detener.wait(RABBIT_RECONNECT_DELAY)
+
+
+def main():
+    global _spool
+    # Arrancar el servidor Prometheus en puerto 8000 para exponer métricas
+    start_http_server(8000)
+    logger.info("Servidor de métricas Prometheus iniciado en puerto 8000")
+    if DB_PARTITION_MAINTENANCE_INTERVAL_S > 0:
+        threading.Thread(target=mantener_particiones, name="particiones", daemon=True).start()
+    if ROLLING_ENABLED and ROLLING_FLUSH_INTERVAL_S > 0:
+        threading.Thread(target=volcar_agregados, name="agregados", daemon=True).start()
+    if INGEST_WATERMARK_INTERVAL_S > 0:
+        threading.Thread(target=publicar_marca_escritura, name="marca-escritura", daemon=True).start()
+    if STATION_CACHE_ENABLED:
+        threading.Thread(
+            target=_estaciones.ejecutar, args=(lambda: psycopg2.connect(make_db_dsn(), **opciones_conexion()), STATION_CACHE_TTL_S),
+            name="estaciones", daemon=True,
+        ).start()
+    if SPOOL_ENABLED:
+        _spool = Spool(SPOOL_DIR, SPOOL_MAX_BYTES, SPOOL_SEGMENT_MAX_BYTES)
+        threading.Thread(target=reproducir_spool, name="spool", daemon=True).start()
+        logger.info("Spool local activo en %s (máx. %d bytes).", SPOOL_DIR, SPOOL_MAX_BYTES)
+
+    if CONSUMER_ENGINE == "async":
+        # Import diferido: aio-pika y asyncpg solo son necesarios con el motor asyncio.
+        import async_consumer
+        logger.info("Usando motor de consumo asyncio (CONSUMER_ENGINE=async).")
+        if AUTOSCALE_ENABLED:
+            iniciar_autoescalado(async_consumer.aplicar_decision, lambda: 1)
+        async_consumer.run(_spool, _estaciones)
+        return
+
+    detener = threading.Event()
+    if RABBITMQ_SHARDS:
+        iniciar_shards(detener)
+
+    # Con autoescalado y una sola cola se arranca en modo pool aunque CONSUMER_WORKERS sea 1,
+    # para poder añadir workers en caliente. Con shards el reparto fija los workers y solo se
+    # ajusta el prefetch.
+    escalar_workers = AUTOSCALE_ENABLED and not RABBITMQ_SHARDS and AUTOSCALE_MAX_WORKERS > 1
+    CONSUMER_WORKERS_ACTIVE.set(CONSUMER_WORKERS)
+    CONSUMER_PREFETCH_CURRENT.set(_prefetch)
+
+    if CONSUMER_WORKERS == 1 and not escalar_workers:
+        # Modo clásico: un solo hilo con la conexión global de get_db_conn().
+        if AUTOSCALE_ENABLED:
+            iniciar_autoescalado(functools.partial(aplicar_decision, escalar_workers=False), lambda: 1)
+        consumir(0, detener)
+        return
+
+    # Modo multi-worker: N hilos (cada uno con su conexión y canal de RabbitMQ) que
+    # comparten un pool acotado de conexiones a PostgreSQL. psycopg2 y pika liberan el
+    # GIL mientras esperan red, así que las esperas de varios workers se solapan.
+    inicializar_pool()
+    ajustar_workers(CONSUMER_WORKERS)
+    logger.info("Modo multi-worker: %d workers con pool de PostgreSQL.", CONSUMER_WORKERS)
+    if AUTOSCALE_ENABLED:
+        iniciar_autoescalado(functools.partial(aplicar_decision, escalar_workers=escalar_workers), lambda: len(_hilos))
+
+    try:
+        while True:
+            with _hilos_lock:
+                if not any(hilo.is_alive() for hilo, _ in _hilos.values()):
+                    break
+            time.sleep(1)
+    except KeyboardInterrupt:
+        detener.set()
+        with _hilos_lock:
+            logger.info("Consumidor detenido por teclado. Deteniendo %d workers...", len(_hilos))
+            hilos = [parar_worker(worker_id) for worker_id in list(_hilos)]
+        for hilo in hilos:
+            hilo.join(timeout=10)
+    finally:
+        _db_pool.cerrar()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,330 @@
+# Retención y agregación (downsampling) de weather_logs.
+# Proceso independiente del consumidor (servicio 'retention' en docker-compose):
+#
+#   python retention.py            # bucle cada RETENTION_INTERVAL_S
+#   python retention.py --once     # una sola pasada
+#
+# En cada pasada:
+# 1. Agrega por estación y hora (weather_logs_hourly) y por estación y día (weather_logs_daily)
+#    las lecturas crudas de los periodos ya cerrados, desde la marca de agua (watermark) de
+#    cada nivel: solo se lee lo nuevo y, gracias al particionado por `dates`, solo las
+#    particiones afectadas. Cada tramo se escribe junto con su watermark en una transacción,
+#    así que una pasada interrumpida se retoma sin duplicar ni perder agregados.
+#    Antes se reagregan los buckets ya cerrados que recibieron lecturas tardías (reintentos
+#    diferidos, reproducción del spool, dlq_tool.py): las filas con `ingested_at` posterior a
+#    la última reagregación y `dates` anterior a la watermark. Cada bucket afectado se
+#    recalcula entero desde weather_logs (ON CONFLICT DO UPDATE), así que repetirlo no altera
+#    el resultado.
+# 2. Elimina (DROP) o separa (DETACH) las particiones mensuales cuyo mes completo es más
+#    antiguo que RETENTION_RAW_DAYS y ya está agregado en ambos niveles. Borrar una partición
+#    entera no deja filas muertas que VACUUM tenga que limpiar.
+
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import psycopg2
+from psycopg2 import sql
+
+from utils.logger import setup_logger
+from utils.config import (
+    LOG_DIR,
+    POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_SSLMODE,
+    DB_MAX_RETRIES, DB_RETRY_BASE_SLEEP,
+    RETENTION_INTERVAL_S, RETENTION_ROLLUP_LAG_S, RETENTION_RAW_DAYS, RETENTION_MODE,
+)
+
+logger = setup_logger("RETENTION_LOG", f"{LOG_DIR}/retention.log")
+
+# nivel -> (unidad de date_trunc, tabla de agregados, tramo máximo por transacción)
+# El tramo es múltiplo de la unidad para que los límites queden siempre alineados.
+NIVELES = {
+    "hourly": ("hour", "weather_logs_hourly", timedelta(days=1)),
+    "daily": ("day", "weather_logs_daily", timedelta(days=7)),
+}
+DURACION = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+# `ingested_at` toma now() del inicio de la transacción que escribe la fila, no de su commit:
+# cada reagregación vuelve a mirar este margen antes de la anterior para no perder las filas
+# de transacciones que seguían abiertas al tomarla.
+MARGEN_INGESTA = timedelta(minutes=5)
+
+_INSERTAR_AGREGADOS = """
+INSERT INTO {tabla} (
+    id_station, bucket, readings,
+    temperature_min, temperature_max, temperature_avg,
+    humidity_min, humidity_max, humidity_avg,
+    wind_speed_min, wind_speed_max, wind_speed_avg,
+    pressure_min, pressure_max, pressure_avg,
+    wind_dominant
+)"""
+
+_ESTADISTICAS = """COUNT(*),
+    MIN(temperature_celsius), MAX(temperature_celsius), AVG(temperature_celsius),
+    MIN(humidity), MAX(humidity), AVG(humidity),
+    MIN(wind_speed), MAX(wind_speed), AVG(wind_speed),
+    MIN(pressure), MAX(pressure), AVG(pressure),
+    mode() WITHIN GROUP (ORDER BY wind)"""
+
+_SOBRESCRIBIR = """
+ON CONFLICT (id_station, bucket) DO UPDATE SET
+    readings = EXCLUDED.readings,
+    temperature_min = EXCLUDED.temperature_min, temperature_max = EXCLUDED.temperature_max, temperature_avg = EXCLUDED.temperature_avg,
+    humidity_min = EXCLUDED.humidity_min, humidity_max = EXCLUDED.humidity_max, humidity_avg = EXCLUDED.humidity_avg,
+    wind_speed_min = EXCLUDED.wind_speed_min, wind_speed_max = EXCLUDED.wind_speed_max, wind_speed_avg = EXCLUDED.wind_speed_avg,
+    pressure_min = EXCLUDED.pressure_min, pressure_max = EXCLUDED.pressure_max, pressure_avg = EXCLUDED.pressure_avg,
+    wind_dominant = EXCLUDED.wind_dominant;
+"""
+
+ROLLUP_SQL = _INSERTAR_AGREGADOS + """
+SELECT
+    id_station, date_trunc(%(unidad)s, dates), """ + _ESTADISTICAS + """
+FROM weather_logs
+WHERE dates >= %(desde)s AND dates < %(hasta)s
+GROUP BY 1, 2""" + _SOBRESCRIBIR
+
+# Buckets ya agregados (anteriores a la watermark) con filas ingeridas desde %(ingesta_desde)s,
+# recalculados enteros. Solo los que conservan todas sus lecturas crudas (bucket posterior a
+# %(conservado)s): recalcular uno cuya partición ya se borró lo dejaría solo con las tardías.
+REAGREGAR_SQL = _INSERTAR_AGREGADOS + """
+SELECT
+    s.id_station, s.bucket, """ + _ESTADISTICAS + """
+FROM (
+    SELECT DISTINCT id_station, date_trunc(%(unidad)s, dates) AS bucket
+    FROM weather_logs
+    WHERE ingested_at >= %(ingesta_desde)s AND dates < %(hasta)s
+      AND date_trunc(%(unidad)s, dates) >= %(conservado)s
+) s
+JOIN weather_logs w ON w.id_station = s.id_station AND w.dates >= s.bucket AND w.dates < s.bucket + %(intervalo)s
+GROUP BY 1, 2""" + _SOBRESCRIBIR
+
+WATERMARK_SQL = """
+INSERT INTO weather_rollup_watermarks (rollup, hasta, actualizado) VALUES (%s, %s, now())
+ON CONFLICT (rollup) DO UPDATE SET hasta = EXCLUDED.hasta, actualizado = EXCLUDED.actualizado;
+"""
+
+# Watermark, última reagregación (la primera vez, el último avance de la watermark) y now()
+MARCAS_REAGREGACION_SQL = """
+SELECT hasta, COALESCE(reagregado, actualizado), now() FROM weather_rollup_watermarks WHERE rollup = %s;
+"""
+
+# `actualizado` también cambia si se reescribieron buckets: el servicio de consultas invalida su caché
+REAGREGADO_SQL = """
+UPDATE weather_rollup_watermarks
+SET reagregado = %(ahora)s, actualizado = CASE WHEN %(buckets)s > 0 THEN now() ELSE actualizado END
+WHERE rollup = %(nivel)s;
+"""
+
+# Nombre de las particiones mensuales creadas por crear_particiones_weather_logs()
+PARTICION_RE = re.compile(r"^weather_logs_(\d{4})_(\d{2})$")
+
+# Evita que dos procesos de retención trabajen a la vez sobre las mismas tablas.
+LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext('weather_retention'));"
+UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext('weather_retention'));"
+
+
+def conectar(max_retries: int = DB_MAX_RETRIES) -> psycopg2.extensions.connection:
+    """Conexión dedicada con reintentos; los buckets se calculan en UTC."""
+    attempt = 0
+    while True:
+        try:
+            conn = psycopg2.connect(
+                dbname=POSTGRES_DB, user=POSTGRES_USER, password=POSTGRES_PASSWORD,
+                host=POSTGRES_HOST, port=POSTGRES_PORT, sslmode=POSTGRES_SSLMODE,
+                options="-c timezone=UTC",
+            )
+            conn.autocommit = False
+            return conn
+        except psycopg2.OperationalError as e:
+            attempt += 1
+            if attempt >= max_retries:
+                raise
+            espera = DB_RETRY_BASE_SLEEP * (2 ** (attempt - 1))
+            logger.error("No se pudo conectar a PostgreSQL (intento %d): %s. Reintentando en %.1f s...", attempt, e, espera)
+            time.sleep(espera)
+
+
+def fin_de_mes(anio: int, mes: int) -> datetime:
+    """Límite superior (exclusivo) de la partición mensual, en UTC."""
+    return datetime(anio + mes // 12, mes % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+# ==============================
+# AGREGADOS
+# ==============================
+def leer_watermark(cur, nivel: str) -> Optional[datetime]:
+    cur.execute("SELECT hasta FROM weather_rollup_watermarks WHERE rollup = %s;", (nivel,))
+    fila = cur.fetchone()
+    return fila[0] if fila else None
+
+
+def acumular(conn, nivel: str) -> int:
+    """Agrega los periodos cerrados posteriores a la watermark del nivel. Devuelve los buckets escritos."""
+    unidad, tabla, tramo = NIVELES[nivel]
+    with conn.cursor() as cur:
+        cur.execute("SELECT date_trunc(%s, now() - make_interval(secs => %s));", (unidad, RETENTION_ROLLUP_LAG_S))
+        limite = cur.fetchone()[0]
+        desde = leer_watermark(cur, nivel)
+        if desde is None:
+            # Primera pasada: desde la lectura más antigua conservada
+            cur.execute("SELECT date_trunc(%s, MIN(dates)) FROM weather_logs;", (unidad,))
+            desde = cur.fetchone()[0] or limite
+    conn.commit()
+
+    escritos = 0
+    consulta = sql.SQL(ROLLUP_SQL).format(tabla=sql.Identifier(tabla))
+    while desde < limite:
+        hasta = min(desde + tramo, limite)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(consulta, {"unidad": unidad, "desde": desde, "hasta": hasta})
+                escritos += max(cur.rowcount, 0)
+                cur.execute(WATERMARK_SQL, (nivel, hasta))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        desde = hasta
+    if escritos:
+        logger.info("Agregados '%s': %d buckets hasta %s.", nivel, escritos, limite.isoformat())
+    return escritos
+
+
+def reagregar_tardias(conn, nivel: str, dias: int = RETENTION_RAW_DAYS) -> int:
+    """Recalcula los buckets ya agregados del nivel que recibieron lecturas tardías.
+
+    Devuelve los buckets reescritos. Debe ejecutarse antes de acumular(): con la watermark
+    anterior, las filas que acumular() agrega por primera vez no cuentan como tardías.
+    """
+    unidad, tabla, _ = NIVELES[nivel]
+    try:
+        with conn.cursor() as cur:
+            cur.execute(MARCAS_REAGREGACION_SQL, (nivel,))
+            marcas = cur.fetchone()
+            if marcas is None:
+                # Nivel aún sin agregar: acumular() empezará por la lectura más antigua
+                conn.commit()
+                return 0
+            hasta, reagregado, ahora = marcas
+            conservado = ahora - timedelta(days=dias) if dias > 0 else datetime.min.replace(tzinfo=timezone.utc)
+            cur.execute(sql.SQL(REAGREGAR_SQL).format(tabla=sql.Identifier(tabla)), {
+                "unidad": unidad, "intervalo": DURACION[unidad], "hasta": hasta,
+                "ingesta_desde": reagregado - MARGEN_INGESTA, "conservado": conservado,
+            })
+            buckets = max(cur.rowcount, 0)
+            cur.execute(REAGREGADO_SQL, {"ahora": ahora, "buckets": buckets, "nivel": nivel})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if buckets:
+        logger.info("Agregados '%s': %d buckets recalculados por lecturas tardías.", nivel, buckets)
+    return buckets
+
+
+# ==============================
+# RETENCIÓN DE DATOS CRUDOS
+# ==============================
+def aplicar_retencion(conn, dias: int = RETENTION_RAW_DAYS, modo: str = RETENTION_MODE) -> int:
+    """Elimina o separa las particiones completamente agregadas y más antiguas que `dias`."""
+    if dias <= 0:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("SELECT now() - make_interval(days => %s);", (dias,))
+        corte = cur.fetchone()[0]
+        # Nunca se borra lo que todavía no está agregado en ambos niveles
+        for nivel in NIVELES:
+            watermark = leer_watermark(cur, nivel)
+            corte = min(corte, watermark) if watermark is not None else None
+            if corte is None:
+                conn.commit()
+                return 0
+        cur.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'weather_logs'::regclass ORDER BY c.relname;"
+        )
+        particiones = [fila[0] for fila in cur.fetchall()]
+    conn.commit()
+
+    eliminadas = 0
+    for nombre in particiones:
+        m = PARTICION_RE.match(nombre)
+        if m is None or fin_de_mes(int(m.group(1)), int(m.group(2))) > corte:
+            continue
+        if modo == "detach":
+            sentencia = sql.SQL("ALTER TABLE weather_logs DETACH PARTITION {}").format(sql.Identifier(nombre))
+        else:
+            sentencia = sql.SQL("DROP TABLE {}").format(sql.Identifier(nombre))
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sentencia)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        eliminadas += 1
+        logger.info("Partición %s %s (retención de %d días).", nombre, "separada" if modo == "detach" else "eliminada", dias)
+
+    # Filas antiguas que cayeron en la partición DEFAULT (meses sin partición)
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM weather_logs_default WHERE dates < %s;", (corte,))
+        if cur.rowcount:
+            logger.info("Eliminadas %d filas antiguas de weather_logs_default.", cur.rowcount)
+    conn.commit()
+    return eliminadas
+
+
+def pasada(conn) -> None:
+    """Una pasada completa (agregados y retención) si ningún otro proceso la está ejecutando."""
+    with conn.cursor() as cur:
+        cur.execute(LOCK_SQL)
+        obtenido = cur.fetchone()[0]
+    conn.commit()
+    if not obtenido:
+        logger.info("Otra instancia de retención está en curso; se omite la pasada.")
+        return
+    try:
+        for nivel in NIVELES:
+            reagregar_tardias(conn, nivel)
+            acumular(conn, nivel)
+        aplicar_retencion(conn)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(UNLOCK_SQL)
+        conn.commit()
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if RETENTION_MODE not in ("drop", "detach"):
+        logger.error("RETENTION_MODE inválido: %s (use 'drop' o 'detach').", RETENTION_MODE)
+        return 2
+    conn = None
+    try:
+        while True:
+            try:
+                if conn is None or conn.closed:
+                    conn = conectar()
+                pasada(conn)
+            except psycopg2.OperationalError as e:
+                logger.warning("Conexión perdida durante la retención: %s. Se reintentará.", e)
+                conn = None
+            except Exception:
+                logger.exception("Error en la pasada de retención.")
+                if conn is not None and not conn.closed:
+                    conn.rollback()
+            if "--once" in argv:
+                return 0
+            time.sleep(RETENTION_INTERVAL_S)
+    except KeyboardInterrupt:
+        logger.info("Retención detenida por teclado.")
+        return 0
+    finally:
+        if conn is not None and not conn.closed:
+            conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# Seguimiento de delivery tags pendientes para confirmar (ACK) mensajes de forma acumulada.
+# RabbitMQ permite confirmar todos los tags <= N con un único basic_ack(multiple=True);
+# este módulo lleva la cuenta de qué tags ya están resueltos (commit durable o enviados a
+# la DLQ) y solo confirma el prefijo contiguo, de modo que nunca se confirma un mensaje
+# que todavía espera su escritura en la base de datos.
+
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class AckAcumulado:
+    """Confirma delivery tags de un canal de forma acumulada y en orden.
+
+    - registrar(tag): el mensaje fue entregado y queda pendiente.
+    - completar(*tags): los mensajes ya son durables (o están en la DLQ).
+    - rechazar(tag, requeue): NACK inmediato e individual del mensaje.
+
+    Se envía un basic_ack(multiple=True) cuando hay al menos `ack_cada` mensajes
+    completados sin confirmar, o cuando vence el temporizador de `linger_s` segundos.
+    Los delivery tags son por canal: se debe crear una instancia por canal.
+    Si se indica `medir`, recibe la duración en segundos de cada basic_ack/basic_nack.
+    """
+
+    def __init__(self, channel, connection=None, ack_cada: int = 1, linger_s: float = 0.0,
+                 medir: Optional[Callable[[float], None]] = None):
+        self.channel = channel
+        self.connection = connection
+        self.ack_cada = max(1, ack_cada)
+        self.linger_s = linger_s
+        self.medir = medir
+        # tag -> True si está completado (pendiente de ACK), False si espera resultado
+        self._pendientes: "OrderedDict[int, bool]" = OrderedDict()
+        self._completados = 0
+        self._timer = None
+
+    @property
+    def en_vuelo(self) -> int:
+        """Número de mensajes entregados que aún no se han confirmado al broker."""
+        return len(self._pendientes)
+
+    def registrar(self, tag: int) -> None:
+        self._pendientes[tag] = False
+
+    def completar(self, *tags: int) -> None:
+        for tag in tags:
+            if self._pendientes.get(tag) is False:
+                self._pendientes[tag] = True
+                self._completados += 1
+        self._revisar()
+
+    def rechazar(self, tag: int, requeue: bool) -> None:
+        if self._pendientes.pop(tag, None):
+            self._completados -= 1
+        inicio = time.perf_counter()
+        self.channel.basic_nack(delivery_tag=tag, requeue=requeue)
+        self._medir(inicio)
+        # Puede haber quedado libre un prefijo de tags completados.
+        self._revisar()
+
+    def _revisar(self) -> None:
+        if self._completados >= self.ack_cada:
+            self.flush()
+        elif self._completados and self._timer is None and self.connection is not None and self.linger_s > 0:
+            self._timer = self.connection.call_later(self.linger_s, self._on_linger)
+
+    def _on_linger(self) -> None:
+        self._timer = None
+        self.flush()
+
+    def flush(self) -> None:
+        """Confirma el mayor prefijo contiguo de tags completados con un único ACK."""
+        if self._timer is not None:
+            self.connection.remove_timeout(self._timer)
+            self._timer = None
+
+        ultimo = None
+        while self._pendientes:
+            tag, completado = next(iter(self._pendientes.items()))
+            if not completado:
+                break
+            self._pendientes.popitem(last=False)
+            self._completados -= 1
+            ultimo = tag
+
+        # Los completados que queden detrás de un tag pendiente se confirmarán
+        # cuando ese tag se resuelva (completar/rechazar vuelven a revisar).
+        if ultimo is not None:
+            inicio = time.perf_counter()
+            self.channel.basic_ack(delivery_tag=ultimo, multiple=True)
+            self._medir(inicio)
+
+    def _medir(self, inicio: float) -> None:
+        if self.medir is not None:
+            self.medir(time.perf_counter() - inicio)
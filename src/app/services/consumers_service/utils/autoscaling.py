@@ -0,0 +1,191 @@
+# Autoescalado y control de flujo a partir de la profundidad de las colas. Cada
+# AUTOSCALE_INTERVAL_S el consumidor lee de la API de management de RabbitMQ los mensajes
+# listos y sin ACK, los consumidores, su utilización y las tasas de entrada y de ACK de sus
+# colas (la única o las de shard), y el Controlador decide:
+# - Workers: con cola acumulada los consumidores están saturados y la tasa de ACK por
+#   consumidor mide su capacidad. Los workers necesarios son los que atienden la tasa de
+#   entrada y además drenan lo acumulado en AUTOSCALE_TARGET_LAG_S. Se sube en el momento y
+#   se baja de uno en uno, solo si la recomendación se mantiene AUTOSCALE_SCALE_DOWN_DELAY_S.
+# - Prefetch: si hay cola pero la utilización de los consumidores es baja (el broker espera a
+#   que lleguen ACK para entregar más) se duplica hasta AUTOSCALE_MAX_PREFETCH; con la cola
+#   vacía vuelve poco a poco a CONSUMER_PREFETCH.
+# - Flujo: por encima de FLOW_THROTTLE_DEPTH mensajes se pide a los productores que publiquen
+#   más despacio (factor entre FLOW_MIN_FACTOR y 1), y por encima de FLOW_PAUSE_DEPTH que se
+#   detengan (factor 0). El freno se mantiene hasta bajar de FLOW_RESUME_DEPTH (histéresis).
+#   El factor se publica en el exchange fanout FLOW_CONTROL_EXCHANGE (ver
+#   producers_service/flow_control.py).
+
+import json
+import math
+import time
+import base64
+import logging
+import urllib.parse
+import urllib.request
+from typing import Callable, Iterable, NamedTuple, Optional
+
+logger = logging.getLogger("CONSUMER_LOG")
+
+# Columnas pedidas a /api/queues (evita recibir el detalle completo de cada cola)
+_COLUMNAS = ",".join((
+    "name", "messages", "messages_ready", "messages_unacknowledged", "consumers", "consumer_utilisation",
+    "message_stats.publish_details.rate", "message_stats.ack_details.rate",
+))
+
+# Utilización por debajo de la cual, con mensajes esperando, se amplía el prefetch
+UTILIZACION_MINIMA = 0.9
+
+
+class EstadoColas(NamedTuple):
+    """Suma de las colas del consumidor según la API de management."""
+    mensajes: int                  # listos + sin ACK
+    listos: int
+    sin_ack: int
+    consumidores: int
+    utilizacion: Optional[float]   # consumer_utilisation medio (None si no hay consumidores)
+    tasa_entrada: float            # mensajes/s publicados en las colas
+    tasa_ack: float                # mensajes/s confirmados por los consumidores
+
+
+class Decision(NamedTuple):
+    workers: int          # workers de esta instancia
+    workers_totales: int  # workers estimados para toda la cola (todas las instancias)
+    prefetch: int
+    factor: float         # factor de publicación para los productores (1 = sin freno, 0 = pausa)
+
+
+def _tasa(cola: dict, campo: str) -> float:
+    return float(((cola.get("message_stats") or {}).get(campo) or {}).get("rate") or 0.0)
+
+
+def sumar_colas(colas: Iterable[dict], nombres: Iterable[str]) -> EstadoColas:
+    """Agrega las entradas de /api/queues cuyo nombre está en `nombres`."""
+    nombres = set(nombres)
+    elegidas = [c for c in colas if c.get("name") in nombres]
+    utilizaciones = [float(c["consumer_utilisation"]) for c in elegidas
+                     if c.get("consumers") and c.get("consumer_utilisation") is not None]
+    return EstadoColas(
+        mensajes=sum(int(c.get("messages") or 0) for c in elegidas),
+        listos=sum(int(c.get("messages_ready") or 0) for c in elegidas),
+        sin_ack=sum(int(c.get("messages_unacknowledged") or 0) for c in elegidas),
+        consumidores=sum(int(c.get("consumers") or 0) for c in elegidas),
+        utilizacion=sum(utilizaciones) / len(utilizaciones) if utilizaciones else None,
+        tasa_entrada=sum(_tasa(c, "publish_details") for c in elegidas),
+        tasa_ack=sum(_tasa(c, "ack_details") for c in elegidas),
+    )
+
+
+def leer_colas(url: str, usuario: str, clave: str, vhost: str, nombres: Iterable[str],
+               timeout_s: float = 5.0) -> EstadoColas:
+    """Consulta GET /api/queues/<vhost> de la API de management (urllib, sin dependencias).
+
+    Lanza OSError (URLError, timeout) o ValueError si la API no responde o la respuesta no es válida.
+    """
+    peticion = urllib.request.Request(
+        f"{url.rstrip('/')}/api/queues/{urllib.parse.quote(vhost, safe='')}?columns={_COLUMNAS}",
+        headers={
+            "Authorization": "Basic " + base64.b64encode(f"{usuario}:{clave}".encode()).decode(),
+            "Accept": "application/json",
+        },
+    )
+    with urllib.request.urlopen(peticion, timeout=timeout_s) as respuesta:
+        colas = json.load(respuesta)
+    if not isinstance(colas, list):
+        raise ValueError("Respuesta inesperada de /api/queues")
+    return sumar_colas(colas, nombres)
+
+
+class Controlador:
+    """Decide workers, prefetch y factor de flujo a partir de un EstadoColas.
+
+    Guarda la capacidad por consumidor medida la última vez que la cola estaba saturada
+    (media móvil exponencial) y el estado de la histéresis de bajada y del freno.
+    """
+
+    def __init__(self, min_workers: int, max_workers: int, prefetch_base: int, prefetch_max: int,
+                 lag_objetivo_s: float, espera_bajada_s: float,
+                 profundidad_frenar: int, profundidad_pausar: int, profundidad_reanudar: int,
+                 factor_minimo: float, reloj: Callable[[], float] = time.monotonic):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.prefetch_base = max(1, prefetch_base)
+        self.prefetch_max = max(self.prefetch_base, prefetch_max)
+        self.lag_objetivo_s = max(0.1, lag_objetivo_s)
+        self.espera_bajada_s = espera_bajada_s
+        self.profundidad_frenar = profundidad_frenar
+        self.profundidad_pausar = max(profundidad_frenar + 1, profundidad_pausar)
+        self.profundidad_reanudar = min(profundidad_reanudar, profundidad_frenar)
+        self.factor_minimo = min(1.0, max(0.0, factor_minimo))
+        self._reloj = reloj
+
+        self.prefetch = self.prefetch_base
+        self.factor = 1.0
+        self.capacidad: Optional[float] = None  # mensajes/s por consumidor
+        self._bajar_desde: Optional[float] = None
+
+    def decidir(self, estado: EstadoColas, workers_actuales: int) -> Decision:
+        workers_actuales = max(1, workers_actuales)
+        consumidores = max(estado.consumidores, workers_actuales)
+        # Instancias del consumidor suscritas a las mismas colas (cada una con sus workers)
+        instancias = max(1, round(consumidores / workers_actuales))
+        # Saturada: hay mensajes esperando además de los que ya están en los prefetch
+        saturada = estado.listos > 0 and estado.sin_ack >= consumidores * self.prefetch * 0.5
+
+        if saturada and estado.tasa_ack > 0:
+            medida = estado.tasa_ack / consumidores
+            self.capacidad = medida if self.capacidad is None else 0.5 * self.capacidad + 0.5 * medida
+
+        if self.capacidad:
+            necesaria = estado.tasa_entrada + estado.listos / self.lag_objetivo_s
+            totales = math.ceil(necesaria / self.capacidad)
+        elif saturada:
+            totales = consumidores + instancias  # Sin medida aún: un worker más por instancia
+        else:
+            totales = consumidores
+        totales = min(max(totales, self.min_workers * instancias), self.max_workers * instancias)
+        workers = self._con_histeresis(math.ceil(totales / instancias), workers_actuales)
+
+        self._ajustar_prefetch(estado)
+        self._ajustar_factor(estado.mensajes)
+        return Decision(workers, totales, self.prefetch, self.factor)
+
+    def _con_histeresis(self, deseados: int, actuales: int) -> int:
+        """Sube en el momento; baja de uno en uno tras espera_bajada_s de recomendación sostenida."""
+        if deseados >= actuales:
+            self._bajar_desde = None
+            return deseados
+        ahora = self._reloj()
+        if self._bajar_desde is None:
+            self._bajar_desde = ahora
+        if ahora - self._bajar_desde < self.espera_bajada_s:
+            return actuales
+        self._bajar_desde = ahora
+        return actuales - 1
+
+    def _ajustar_prefetch(self, estado: EstadoColas) -> None:
+        if estado.listos > 0 and estado.utilizacion is not None and estado.utilizacion < UTILIZACION_MINIMA:
+            self.prefetch = min(self.prefetch * 2, self.prefetch_max)
+        elif estado.listos == 0:
+            self.prefetch = max(self.prefetch // 2, self.prefetch_base)
+
+    def _ajustar_factor(self, profundidad: int) -> None:
+        if profundidad >= self.profundidad_pausar:
+            self.factor = 0.0
+        elif profundidad >= self.profundidad_frenar:
+            # Lineal de 1 (en el umbral de freno) a factor_minimo (cerca del de pausa)
+            proporcion = (self.profundidad_pausar - profundidad) / (self.profundidad_pausar - self.profundidad_frenar)
+            self.factor = max(self.factor_minimo, min(1.0, proporcion))
+        elif self.factor < 1.0 and profundidad > self.profundidad_reanudar:
+            # Entre reanudar y frenar se mantiene el freno, sin volver a pausar
+            self.factor = max(self.factor, self.factor_minimo)
+        else:
+            self.factor = 1.0
+
+
+def mensaje_flujo(factor: float, profundidad: int, ahora: Optional[float] = None) -> bytes:
+    """Cuerpo JSON de la señal de flujo que leen los productores."""
+    return json.dumps({
+        "factor": round(factor, 3),
+        "depth": profundidad,
+        "ts": time.time() if ahora is None else ahora,
+    }).encode("utf-8")
@@ -0,0 +1,183 @@
+# Configuración del servicio consumidor leída de variables de entorno (.env / docker-compose).
+# Se centraliza aquí para que todos los motores (síncrono con pika y asyncio) y las
+# herramientas del servicio compartan exactamente los mismos valores por defecto.
+
+import os
+
+from utils.retry import parsear_retrasos
+
+LOG_DIR = os.getenv("LOG_DIR", "logs") # Directorio de logs dentro del contenedor
+
+# Logging (utils.logger): los registros pasan por una cola de LOG_QUEUE_SIZE entradas y un hilo
+# los escribe en archivo y consola; con la cola llena se descartan en vez de bloquear.
+# LOG_ROTATION: 'size' (archivos de LOG_MAX_BYTES), 'time' (cada LOG_ROTATE_WHEN, p. ej.
+# 'midnight' o 'H') o 'none'; se conservan LOG_BACKUP_COUNT archivos rotados. LOG_FORMAT:
+# 'text' o 'json' (una línea JSON por registro). Los registros por mensaje (INFO/DEBUG) se
+# muestrean con LOG_SAMPLE_RATE (fracción 0-1) y se limitan a LOG_RATE_LIMIT por segundo
+# (0 = sin límite).
+LOG_QUEUE_SIZE = max(1, int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size").lower()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 50 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = max(0, int(os.getenv("LOG_BACKUP_COUNT", 5)))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+LOG_RATE_LIMIT = max(0, int(os.getenv("LOG_RATE_LIMIT", 0)))
+
+# Motor del consumidor: 'sync' (pika.BlockingConnection, por defecto) o 'async' (aio-pika/asyncpg)
+CONSUMER_ENGINE = os.getenv("CONSUMER_ENGINE", "sync").lower()
+
+RABBIT_USER = os.getenv("RABBIT_USER", "guest")
+RABBIT_PASS = os.getenv("RABBIT_PASS", "guest")
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", 5672))
+RABBITMQ_EXCHANGE = os.getenv("RABBITMQ_EXCHANGE", "weather_exchange")
+RABBITMQ_QUEUE = os.getenv("RABBITMQ_QUEUE", "weather_queue")
+ROUTING_KEY = os.getenv("ROUTING_KEY", "weather.data")
+
+# Dead Letter Queue (DLQ)
+RABBITMQ_DLQ_EXCHANGE = os.getenv("RABBITMQ_DLQ_EXCHANGE", "weather_dlq_exchange")
+RABBITMQ_DLQ_QUEUE = os.getenv("RABBITMQ_DLQ_QUEUE", "weather_dlq_queue")
+
+# Colas particionadas por estación (utils.sharding). RABBITMQ_SHARDS=0 mantiene la cola única
+# RABBITMQ_QUEUE; con N > 0 hay N colas RABBITMQ_QUEUE.<k> (debe coincidir con el productor).
+# CONSUMER_SHARDS: 'auto' reparte los shards entre las instancias vivas cada
+# SHARD_REBALANCE_INTERVAL_S segundos, 'all' los consume todos (en espera si ya tienen
+# consumidor activo) y una lista como '0-3,7' fija los de esta instancia.
+RABBITMQ_SHARDS = max(0, int(os.getenv("RABBITMQ_SHARDS", 0)))
+CONSUMER_SHARDS = os.getenv("CONSUMER_SHARDS", "auto")
+SHARD_REBALANCE_INTERVAL_S = float(os.getenv("SHARD_REBALANCE_INTERVAL_S", 15))
+
+# Reintentos diferidos (utils.retry): ante un error transitorio de la DB el mensaje espera
+# RETRY_DELAYS_S[k] segundos en la cola weather_retry.<n>s antes de volver a su cola, en vez
+# de NACK+requeue inmediato. Tras RETRY_MAX_ATTEMPTS reintentos va a la DLQ. Con
+# RETRY_DELAYS_S vacío se mantiene el NACK con requeue.
+RETRY_DELAYS_S = parsear_retrasos(os.getenv("RETRY_DELAYS_S", "1,5,30,120"))
+RETRY_MAX_ATTEMPTS = max(0, int(os.getenv("RETRY_MAX_ATTEMPTS", 10)))
+RETRY_EXCHANGE_PREFIX = os.getenv("RETRY_EXCHANGE_PREFIX", "weather_retry")
+
+# Spool local durable (utils.spool): si la DB no responde, las filas validadas se guardan en
+# segmentos append-only en SPOOL_DIR (con fsync) y los mensajes se confirman; cada
+# SPOOL_REPLAY_INTERVAL_S se intenta cargarlas en weather_logs. Tras un fallo, durante
+# SPOOL_BYPASS_S se escribe directamente en el spool sin esperar a la DB.
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "false").lower() in ("1", "true", "yes")
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(LOG_DIR, "spool"))
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", 1024 * 1024 * 1024))
+SPOOL_SEGMENT_MAX_BYTES = int(os.getenv("SPOOL_SEGMENT_MAX_BYTES", 16 * 1024 * 1024))
+SPOOL_REPLAY_INTERVAL_S = float(os.getenv("SPOOL_REPLAY_INTERVAL_S", 10))
+SPOOL_BYPASS_S = float(os.getenv("SPOOL_BYPASS_S", 5))
+
+# Deduplicación (utils.dedup): message_id de los últimos DEDUP_CACHE_SIZE mensajes escritos
+# (0 = desactivada). Un duplicado reciente se confirma sin ir a la DB; el resto lo descarta
+# la clave única (id_station, dates) de weather_logs.
+DEDUP_CACHE_SIZE = max(0, int(os.getenv("DEDUP_CACHE_SIZE", 100000)))
+
+# Caché de weather_stations (utils.stations): las lecturas de estaciones desconocidas se
+# rechazan en la validación, sin ir a la DB. Se recarga al recibir un NOTIFY del trigger de
+# weather_stations o, como muy tarde, cada STATION_CACHE_TTL_S.
+STATION_CACHE_ENABLED = os.getenv("STATION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+STATION_CACHE_TTL_S = float(os.getenv("STATION_CACHE_TTL_S", 300))
+
+POSTGRES_DB = os.getenv("POSTGRES_DB", "postgres_db")
+POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "pass")
+POSTGRES_HOST = os.getenv("POSTGRES_HOST", "db")
+POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", 5432))
+POSTGRES_SSLMODE = os.getenv("POSTGRES_SSLMODE", "disable") # use 'require' if using SSL/TLS
+
+# Pool/retry settings
+DB_MAX_RETRIES = int(os.getenv("DB_MAX_RETRIES", 5))
+DB_RETRY_BASE_SLEEP = float(os.getenv("DB_RETRY_BASE_SLEEP", 1.0))
+RABBIT_RECONNECT_DELAY = float(os.getenv("RABBIT_RECONNECT_DELAY", 5.0))
+
+# Liveness de la conexión a PostgreSQL: sin ping por mensaje; reconexión cuando una
+# operación falla. Keepalive opcional de la app (0 = desactivado) y keepalives TCP de libpq.
+DB_KEEPALIVE_INTERVAL_S = float(os.getenv("DB_KEEPALIVE_INTERVAL_S", 0))
+DB_TCP_KEEPALIVE_IDLE_S = int(os.getenv("DB_TCP_KEEPALIVE_IDLE_S", 30))
+
+# Batching de inserciones: se acumulan hasta DB_BATCH_SIZE filas o DB_BATCH_LINGER_MS
+# milisegundos y se escriben en una sola transacción. DB_BATCH_SIZE=1 mantiene el
+# comportamiento original (un commit por mensaje).
+DB_BATCH_SIZE = max(1, int(os.getenv("DB_BATCH_SIZE", 1)))
+DB_BATCH_LINGER_MS = float(os.getenv("DB_BATCH_LINGER_MS", 200))
+
+# Ventana de prefetch (mensajes sin ACK que el broker entrega por adelantado). Por defecto
+# cubre un lote completo; nunca es menor que DB_BATCH_SIZE para que el lote pueda llenarse.
+CONSUMER_PREFETCH = max(DB_BATCH_SIZE, int(os.getenv("CONSUMER_PREFETCH", DB_BATCH_SIZE)))
+# ACK acumulado: se confirma al broker cada CONSUMER_ACK_BATCH mensajes resueltos o cada
+# CONSUMER_ACK_LINGER_MS, siempre después del commit. CONSUMER_ACK_BATCH=1 confirma al momento.
+CONSUMER_ACK_BATCH = max(1, int(os.getenv("CONSUMER_ACK_BATCH", 1)))
+CONSUMER_ACK_LINGER_MS = float(os.getenv("CONSUMER_ACK_LINGER_MS", 100))
+
+# Motor de escritura de lotes: 'insert' (INSERT multi-fila) o 'copy' (COPY ... FROM STDIN)
+DB_WRITE_ENGINE = os.getenv("DB_WRITE_ENGINE", "insert").lower()
+
+# Modo multi-worker (motor síncrono): N hilos, cada uno con su propia conexión y canal
+# de RabbitMQ, que toman conexiones de un pool acotado de PostgreSQL.
+CONSUMER_WORKERS = max(1, int(os.getenv("CONSUMER_WORKERS", 1)))
+
+# Autoescalado y control de flujo (utils.autoscaling): cada AUTOSCALE_INTERVAL_S se consulta la
+# API de management de RabbitMQ y se ajustan los workers (entre AUTOSCALE_MIN_WORKERS y
+# AUTOSCALE_MAX_WORKERS, solo con cola única) y el prefetch (hasta AUTOSCALE_MAX_PREFETCH) para
+# drenar la cola en AUTOSCALE_TARGET_LAG_S. Con FLOW_CONTROL_ENABLED se publica además en
+# FLOW_CONTROL_EXCHANGE el factor de publicación para los productores: freno desde
+# FLOW_THROTTLE_DEPTH mensajes, pausa desde FLOW_PAUSE_DEPTH, normal bajo FLOW_RESUME_DEPTH.
+AUTOSCALE_ENABLED = os.getenv("AUTOSCALE_ENABLED", "false").lower() in ("1", "true", "yes")
+AUTOSCALE_INTERVAL_S = float(os.getenv("AUTOSCALE_INTERVAL_S", 5))
+AUTOSCALE_MIN_WORKERS = max(1, int(os.getenv("AUTOSCALE_MIN_WORKERS", 1)))
+AUTOSCALE_MAX_WORKERS = max(AUTOSCALE_MIN_WORKERS, int(os.getenv("AUTOSCALE_MAX_WORKERS", CONSUMER_WORKERS)))
+AUTOSCALE_MAX_PREFETCH = max(CONSUMER_PREFETCH, int(os.getenv("AUTOSCALE_MAX_PREFETCH", CONSUMER_PREFETCH * 4)))
+AUTOSCALE_TARGET_LAG_S = float(os.getenv("AUTOSCALE_TARGET_LAG_S", 30))
+AUTOSCALE_SCALE_DOWN_DELAY_S = float(os.getenv("AUTOSCALE_SCALE_DOWN_DELAY_S", 60))
+RABBITMQ_MANAGEMENT_URL = os.getenv("RABBITMQ_MANAGEMENT_URL", f"http://{RABBITMQ_HOST}:15672")
+RABBITMQ_VHOST = os.getenv("RABBITMQ_VHOST", "/")
+FLOW_CONTROL_ENABLED = os.getenv("FLOW_CONTROL_ENABLED", "true").lower() in ("1", "true", "yes")
+FLOW_CONTROL_EXCHANGE = os.getenv("FLOW_CONTROL_EXCHANGE", "weather_flow_control")
+FLOW_THROTTLE_DEPTH = int(os.getenv("FLOW_THROTTLE_DEPTH", 10000))
+FLOW_PAUSE_DEPTH = int(os.getenv("FLOW_PAUSE_DEPTH", 50000))
+FLOW_RESUME_DEPTH = int(os.getenv("FLOW_RESUME_DEPTH", 5000))
+FLOW_MIN_FACTOR = float(os.getenv("FLOW_MIN_FACTOR", 0.1))
+
+# El pool debe poder dar una conexión a cada worker, también a los que añada el autoescalado
+DB_POOL_MIN_SIZE = max(1, int(os.getenv("DB_POOL_MIN_SIZE", CONSUMER_WORKERS)))
+DB_POOL_MAX_SIZE = max(DB_POOL_MIN_SIZE, int(os.getenv(
+    "DB_POOL_MAX_SIZE", max(CONSUMER_WORKERS, AUTOSCALE_MAX_WORKERS if AUTOSCALE_ENABLED else 1)
+)))
+DB_POOL_MAX_LIFETIME_S = float(os.getenv("DB_POOL_MAX_LIFETIME_S", 1800))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", 30))
+
+# Motor asyncio: conexiones máximas del pool asyncpg y lotes escribiéndose a la vez
+ASYNC_DB_POOL_SIZE = max(1, int(os.getenv("ASYNC_DB_POOL_SIZE", 4)))
+ASYNC_DB_CONCURRENCY = max(1, int(os.getenv("ASYNC_DB_CONCURRENCY", 2)))
+
+# weather_logs está particionada por mes (init/init.sql). El consumidor crea por adelantado
+# las particiones de los próximos DB_PARTITION_MONTHS_AHEAD meses cada
+# DB_PARTITION_MAINTENANCE_INTERVAL_S segundos (0 = desactivado).
+DB_PARTITION_MONTHS_AHEAD = max(0, int(os.getenv("DB_PARTITION_MONTHS_AHEAD", 3)))
+DB_PARTITION_MAINTENANCE_INTERVAL_S = float(os.getenv("DB_PARTITION_MAINTENANCE_INTERVAL_S", 21600))
+
+# Retención y agregados (retention.py): cada RETENTION_INTERVAL_S se agregan por hora y por
+# día las lecturas de los periodos cerrados hace más de RETENTION_ROLLUP_LAG_S (margen para
+# mensajes atrasados) y se eliminan ('drop') o separan ('detach') las particiones crudas más
+# antiguas que RETENTION_RAW_DAYS días (0 = conservar las lecturas crudas para siempre).
+RETENTION_INTERVAL_S = float(os.getenv("RETENTION_INTERVAL_S", 300))
+RETENTION_ROLLUP_LAG_S = float(os.getenv("RETENTION_ROLLUP_LAG_S", 600))
+RETENTION_RAW_DAYS = max(0, int(os.getenv("RETENTION_RAW_DAYS", 30)))
+RETENTION_MODE = os.getenv("RETENTION_MODE", "drop").lower()
+
+# Agregados móviles por estación (utils.rolling): último valor y media/mín/máx en 1 min,
+# 5 min y 1 h, expuestos en /metrics. ROLLING_SLOTS casillas por ventana (resolución) y como
+# mucho ROLLING_MAX_STATIONS estaciones (~4 KB cada una). Si ROLLING_FLUSH_INTERVAL_S > 0 se
+# vuelcan además a la tabla weather_station_rolling con esa periodicidad.
+ROLLING_ENABLED = os.getenv("ROLLING_ENABLED", "true").lower() in ("1", "true", "yes")
+ROLLING_SLOTS = int(os.getenv("ROLLING_SLOTS", 12))
+ROLLING_MAX_STATIONS = int(os.getenv("ROLLING_MAX_STATIONS", 1000))
+ROLLING_FLUSH_INTERVAL_S = float(os.getenv("ROLLING_FLUSH_INTERVAL_S", 0))
+
+# Marca de escritura: cada INGEST_WATERMARK_INTERVAL_S, si se escribieron filas nuevas, se
+# actualiza la fila de esta instancia en weather_ingest_watermarks. El servicio de consultas
+# (query_service) la usa para invalidar su caché de respuestas. 0 = desactivada.
+INGEST_WATERMARK_INTERVAL_S = float(os.getenv("INGEST_WATERMARK_INTERVAL_S", 1.0))
+
+# Intervalo (s) con el que se recalcula y registra el throughput del motor activo
+THROUGHPUT_REPORT_INTERVAL = float(os.getenv("THROUGHPUT_REPORT_INTERVAL", 10.0))
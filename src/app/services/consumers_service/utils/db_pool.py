@@ -0,0 +1,105 @@
+# Pool acotado de conexiones psycopg2 para el modo multi-worker del consumidor.
+# Envuelve psycopg2.pool.ThreadedConnectionPool añadiendo lo que le falta para
+# usarlo en producción:
+# - Espera acotada: si todas las conexiones están en uso, el worker espera (con timeout)
+#   en lugar de recibir un PoolError inmediato. El tiempo de espera se mide en Prometheus.
+# - Tiempo de vida máximo: las conexiones más antiguas que DB_POOL_MAX_LIFETIME se cierran
+#   y se reemplazan al devolverse al pool.
+# - Salud: las conexiones cerradas o con una transacción abierta/abortada no vuelven al pool.
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from utils.metrics import DB_POOL_WAIT_SECONDS, DB_POOL_IN_USE, DB_POOL_DISCARDED
+
+logger = logging.getLogger("CONSUMER_LOG")
+
+
+class PoolAgotadoError(Exception):
+    """No se obtuvo una conexión del pool dentro del timeout configurado."""
+
+
+class PoolConexiones:
+    """Pool de conexiones thread-safe con espera acotada, tiempo de vida máximo y métricas.
+
+    Uso:
+        with pool.conexion() as conn:
+            ...  # conn.autocommit es False; el llamador hace commit/rollback
+    """
+
+    def __init__(self, min_conn: int, max_conn: int, max_lifetime_s: float, timeout_s: float,
+                 dsn: str, **connect_kwargs):
+        self.max_conn = max_conn
+        self.max_lifetime_s = max_lifetime_s
+        self.timeout_s = timeout_s
+        self._pool = pg_pool.ThreadedConnectionPool(min_conn, max_conn, dsn, **connect_kwargs)
+        # Limita las conexiones prestadas a max_conn (el pool de psycopg2 lanza PoolError si no)
+        self._disponibles = threading.BoundedSemaphore(max_conn)
+        self._creadas: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def _obtener(self) -> psycopg2.extensions.connection:
+        inicio = time.monotonic()
+        if not self._disponibles.acquire(timeout=self.timeout_s):
+            DB_POOL_WAIT_SECONDS.observe(time.monotonic() - inicio)
+            raise PoolAgotadoError(f"Sin conexiones libres tras {self.timeout_s:.1f}s (max={self.max_conn}).")
+        DB_POOL_WAIT_SECONDS.observe(time.monotonic() - inicio)
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._disponibles.release()
+            raise
+        with self._lock:
+            self._creadas.setdefault(id(conn), time.monotonic())
+        # Desactivar autocommit para gestionar transacciones manualmente (INSERT/ROLLBACK)
+        if conn.autocommit:
+            conn.autocommit = False
+        DB_POOL_IN_USE.inc()
+        return conn
+
+    def _devolver(self, conn: psycopg2.extensions.connection) -> None:
+        descartar = False
+        motivo = ""
+        if conn.closed != 0:
+            descartar, motivo = True, "cerrada"
+        elif conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            # Quedó una transacción abierta o abortada: no se reutiliza en ese estado.
+            descartar, motivo = True, "transacción pendiente"
+        else:
+            with self._lock:
+                creada = self._creadas.get(id(conn), time.monotonic())
+            if time.monotonic() - creada > self.max_lifetime_s:
+                descartar, motivo = True, "tiempo de vida máximo"
+
+        if descartar:
+            with self._lock:
+                self._creadas.pop(id(conn), None)
+            DB_POOL_DISCARDED.labels(reason=motivo).inc()
+            logger.info("Conexión del pool descartada (%s).", motivo)
+        try:
+            self._pool.putconn(conn, close=descartar)
+            # El pool de psycopg2 cierra las conexiones ociosas que exceden min_conn.
+            if conn.closed != 0:
+                with self._lock:
+                    self._creadas.pop(id(conn), None)
+        finally:
+            DB_POOL_IN_USE.dec()
+            self._disponibles.release()
+
+    @contextmanager
+    def conexion(self) -> Iterator[psycopg2.extensions.connection]:
+        conn = self._obtener()
+        try:
+            yield conn
+        finally:
+            self._devolver(conn)
+
+    def cerrar(self) -> None:
+        self._pool.closeall()
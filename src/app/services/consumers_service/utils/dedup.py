@@ -0,0 +1,48 @@
+# Deduplicación en memoria por message_id. Un mensaje se vuelve a entregar si la conexión con
+# RabbitMQ cae entre el commit y el basic_ack, o si el productor lo reenvía al no recibir su
+# confirmación (PublicadorConfirmado conserva el message_id). Los ids de los mensajes ya
+# escritos se guardan en una caché LRU acotada: un duplicado reciente se confirma sin ir a la
+# DB. La garantía la da la clave única (id_station, dates) de weather_logs con
+# ON CONFLICT DO NOTHING; la caché solo ahorra la ida y vuelta en los casos obvios.
+
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class IdsRecientes:
+    """Conjunto LRU de como mucho `capacidad` message_id (thread-safe).
+
+    - contiene(id): True si el id se escribió hace poco (y lo marca como usado).
+    - agregar(*ids): registra ids ya escritos; los None (mensajes sin message_id) se ignoran.
+    Con capacidad 0 la caché está desactivada.
+    """
+
+    def __init__(self, capacidad: int):
+        self.capacidad = max(0, capacidad)
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def contiene(self, message_id: Optional[str]) -> bool:
+        if message_id is None or not self.capacidad:
+            return False
+        with self._lock:
+            if message_id not in self._ids:
+                return False
+            self._ids.move_to_end(message_id)
+            return True
+
+    def agregar(self, *message_ids: Optional[str]) -> None:
+        if not self.capacidad:
+            return
+        with self._lock:
+            for message_id in message_ids:
+                if message_id is None:
+                    continue
+                self._ids[message_id] = None
+                self._ids.move_to_end(message_id)
+            while len(self._ids) > self.capacidad:
+                self._ids.popitem(last=False)
@@ -0,0 +1,53 @@
+# Motivo por el que un mensaje acaba en la DLQ, registrado en sus cabeceras al publicarlo para
+# que dlq_tool.py pueda clasificar la cola y reprocesar solo lo recuperable:
+#
+#   x-dlq-reason  categoría (decodificacion, validacion, rechazo_db, reintentos_agotados)
+#   x-dlq-detail  texto del error (código de validación y mensaje, error de PostgreSQL...)
+#   x-dlq-at      instante de la publicación en la DLQ (segundos Unix)
+#   x-dlq-replays veces que dlq_tool.py lo ha devuelto a la DLQ tras reprocesarlo
+#
+# Compartido por los motores síncrono y asyncio y por la herramienta.
+
+import time
+from typing import Optional
+
+HEADER_MOTIVO_DLQ = "x-dlq-reason"
+HEADER_DETALLE_DLQ = "x-dlq-detail"
+HEADER_FECHA_DLQ = "x-dlq-at"
+HEADER_REPROCESOS_DLQ = "x-dlq-replays"
+
+DECODIFICACION = "decodificacion"            # Cuerpo o content_type/encoding ilegible
+VALIDACION = "validacion"                    # Rechazado por utils.validation
+RECHAZO_DB = "rechazo_db"                    # Fila rechazada por PostgreSQL (FK, CHECK, tipos)
+REINTENTOS_AGOTADOS = "reintentos_agotados"  # Error transitorio tras RETRY_MAX_ATTEMPTS reintentos
+DESCONOCIDO = "desconocido"                  # Publicado antes de registrar el motivo
+
+MOTIVOS = (DECODIFICACION, VALIDACION, RECHAZO_DB, REINTENTOS_AGOTADOS, DESCONOCIDO)
+
+# Longitud máxima del detalle guardado en la cabecera
+_MAX_DETALLE = 500
+
+
+def cabeceras_dlq(headers: Optional[dict], motivo: str, detalle: str = "") -> dict:
+    """Cabeceras del mensaje publicado en la DLQ: las originales con el motivo y el detalle."""
+    nuevas = dict(headers or {})
+    nuevas[HEADER_MOTIVO_DLQ] = motivo
+    nuevas[HEADER_DETALLE_DLQ] = str(detalle).strip()[:_MAX_DETALLE]
+    nuevas[HEADER_FECHA_DLQ] = int(time.time())
+    return nuevas
+
+
+def motivo_dlq(headers: Optional[dict]) -> str:
+    """Motivo registrado (DESCONOCIDO en mensajes antiguos o con una cabecera no válida)."""
+    motivo = (headers or {}).get(HEADER_MOTIVO_DLQ)
+    if isinstance(motivo, bytes):
+        motivo = motivo.decode("utf-8", "replace")
+    return motivo if motivo in MOTIVOS else DESCONOCIDO
+
+
+def reprocesos(headers: Optional[dict]) -> int:
+    """Veces que el mensaje ya volvió a la DLQ desde dlq_tool.py."""
+    try:
+        return max(0, int((headers or {}).get(HEADER_REPROCESOS_DLQ, 0)))
+    except (TypeError, ValueError):
+        return 0
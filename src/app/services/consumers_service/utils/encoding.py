@@ -0,0 +1,205 @@
+# Decodificación del cuerpo de los mensajes según su propiedad AMQP `content_type`.
+# Compartido por los motores síncrono y asyncio del consumidor. Formatos aceptados
+# (mantener sincronizado con producers_service/encoding.py):
+# - application/json o sin content_type: objeto JSON (publicadores anteriores).
+# - application/msgpack: array MessagePack con los campos en el orden de CAMPOS y la fecha
+#   como Timestamp (también se acepta un mapa con las mismas claves que el JSON).
+# - application/x-weather-struct: registro binario fijo FORMATO_STRUCT con la fecha en
+#   segundos epoch.
+# Los formatos binarios producen un dict con la fecha ya convertida a datetime, de modo que
+# utils.validation aplica exactamente las mismas reglas a los tres formatos.
+#
+# Sobres (lotes): un mensaje con la cabecera `x-readings: N` transporta N lecturas en el
+# mismo formato (array JSON de objetos, array MessagePack de arrays o N registros struct
+# concatenados). Cualquier mensaje puede ir comprimido, indicado en `content_encoding`
+# (zlib/deflate o gzip).
+
+import json
+import zlib
+import struct
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import msgpack
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+CONTENT_TYPE_STRUCT = "application/x-weather-struct"
+
+CAMPOS = ("id_station", "dates", "temperature_celsius", "humidity", "wind", "wind_speed", "pressure")
+
+# versión, id_station, epoch, temperatura, humedad, código de viento, velocidad, presión
+VERSION_STRUCT = 1
+FORMATO_STRUCT = struct.Struct("<BHdffBff")
+VIENTOS = ("N", "S", "E", "W", "NE", "NW", "SE", "SW")
+
+# Cabecera AMQP que marca un sobre y declara cuántas lecturas contiene
+HEADER_LECTURAS = "x-readings"
+
+# Cabecera con el instante de publicación (milisegundos Unix) puesto por el productor; el
+# consumidor la usa para medir el lag de extremo a extremo hasta el commit
+HEADER_PUBLICADO = "x-published-at-ms"
+
+# content_encoding -> parámetro wbits de zlib.decompress
+COMPRESIONES = {"zlib": zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS, "gzip": 16 + zlib.MAX_WBITS}
+# Tamaño máximo descomprimido: un cuerpo que se expande más se rechaza
+MAX_DESCOMPRIMIDO = 16 * 1024 * 1024
+
+
+class ErrorDecodificacion(ValueError):
+    """El cuerpo no se puede decodificar con el formato indicado (o el formato no se soporta)."""
+
+
+def decodificar_json(body: bytes) -> Any:
+    return json.loads(body)
+
+
+def decodificar_msgpack(body: bytes) -> Any:
+    datos = msgpack.unpackb(body, timestamp=3)
+    if type(datos) is list and len(datos) == len(CAMPOS):
+        return dict(zip(CAMPOS, datos))
+    return datos
+
+
+def decodificar_struct(body: bytes) -> dict:
+    if len(body) != FORMATO_STRUCT.size or body[0] != VERSION_STRUCT:
+        raise ErrorDecodificacion(f"Registro {CONTENT_TYPE_STRUCT} inválido ({len(body)} bytes).")
+    _, id_station, epoch, temperatura, humedad, viento, velocidad, presion = FORMATO_STRUCT.unpack(body)
+    try:
+        fecha = datetime.fromtimestamp(epoch, timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        fecha = epoch  # La validación lo rechaza como fecha_invalida
+    return {
+        "id_station": id_station,
+        "dates": fecha,
+        "temperature_celsius": temperatura,
+        "humidity": humedad,
+        # Un código desconocido se conserva para que la validación lo rechace
+        "wind": VIENTOS[viento] if viento < len(VIENTOS) else str(viento),
+        "wind_speed": velocidad,
+        "pressure": presion,
+    }
+
+
+DECODIFICADORES: Dict[str, Callable[[bytes], Any]] = {
+    CONTENT_TYPE_JSON: decodificar_json,
+    CONTENT_TYPE_MSGPACK: decodificar_msgpack,
+    "application/x-msgpack": decodificar_msgpack,
+    CONTENT_TYPE_STRUCT: decodificar_struct,
+}
+
+
+def decodificar(body: bytes, content_type: Optional[str] = None) -> Any:
+    """Payload del mensaje. Lanza ErrorDecodificacion si el cuerpo o el formato no son válidos."""
+    tipo = content_type.split(";", 1)[0].strip().lower() if content_type else CONTENT_TYPE_JSON
+    decodificador = DECODIFICADORES.get(tipo)
+    if decodificador is None:
+        raise ErrorDecodificacion(f"content_type no soportado: {content_type!r}")
+    try:
+        return decodificador(body)
+    except ErrorDecodificacion:
+        raise
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise ErrorDecodificacion(f"Cuerpo {tipo} inválido: {e}") from None
+
+
+# ==============================
+# SOBRES (VARIAS LECTURAS POR MENSAJE)
+# ==============================
+class Sobre:
+    """Lecturas de un mensaje: una sola, o las N de un sobre.
+
+    `cuerpo(i)` devuelve la lectura i como cuerpo independiente (sin comprimir y en el mismo
+    content_type) para enviar a la DLQ solo esa lectura. En un mensaje simple es el cuerpo
+    original tal cual se recibió.
+    """
+
+    __slots__ = ("body", "content_type", "lecturas", "es_lote", "_cuerpo")
+
+    def __init__(self, body: bytes, content_type: str, lecturas: List[Any], es_lote: bool,
+                 cuerpo: Optional[Callable[[int], bytes]] = None):
+        self.body = body
+        self.content_type = content_type
+        self.lecturas = lecturas
+        self.es_lote = es_lote
+        self._cuerpo = cuerpo
+
+    def __len__(self) -> int:
+        return len(self.lecturas)
+
+    def cuerpo(self, i: int) -> bytes:
+        return self._cuerpo(i) if self._cuerpo is not None else self.body
+
+
+def descomprimir(body: bytes, content_encoding: Optional[str]) -> bytes:
+    codificacion = content_encoding.strip().lower() if content_encoding else "identity"
+    if codificacion == "identity":
+        return body
+    if codificacion not in COMPRESIONES:
+        raise ErrorDecodificacion(f"content_encoding no soportado: {content_encoding!r}")
+    descompresor = zlib.decompressobj(COMPRESIONES[codificacion])
+    try:
+        datos = descompresor.decompress(body, MAX_DESCOMPRIMIDO)
+    except zlib.error as e:
+        raise ErrorDecodificacion(f"Cuerpo {codificacion} inválido: {e}") from None
+    if descompresor.unconsumed_tail:
+        raise ErrorDecodificacion(f"Cuerpo {codificacion} de más de {MAX_DESCOMPRIMIDO} bytes descomprimido.")
+    return datos
+
+
+def _sobre_json(datos: bytes):
+    crudas = json.loads(datos)
+    if type(crudas) is not list:
+        raise ErrorDecodificacion("Un sobre JSON debe ser un array de lecturas.")
+    return crudas, lambda i: json.dumps(crudas[i]).encode()
+
+
+def _sobre_msgpack(datos: bytes):
+    crudas = msgpack.unpackb(datos, timestamp=3)
+    if type(crudas) is not list:
+        raise ErrorDecodificacion("Un sobre MessagePack debe ser un array de lecturas.")
+    lecturas = [dict(zip(CAMPOS, c)) if type(c) is list and len(c) == len(CAMPOS) else c for c in crudas]
+    return lecturas, lambda i: msgpack.packb(crudas[i], datetime=True)
+
+
+def _sobre_struct(datos: bytes):
+    tamano = FORMATO_STRUCT.size
+    if len(datos) % tamano:
+        raise ErrorDecodificacion(f"Sobre {CONTENT_TYPE_STRUCT} de {len(datos)} bytes: no es múltiplo de {tamano}.")
+    lecturas = []
+    for inicio in range(0, len(datos), tamano):
+        try:
+            lecturas.append(decodificar_struct(datos[inicio:inicio + tamano]))
+        except ErrorDecodificacion:
+            lecturas.append(None)  # Solo esa lectura se rechaza (payload_invalido)
+    return lecturas, lambda i: datos[i * tamano:(i + 1) * tamano]
+
+
+SOBRES = {
+    CONTENT_TYPE_JSON: _sobre_json,
+    CONTENT_TYPE_MSGPACK: _sobre_msgpack,
+    "application/x-msgpack": _sobre_msgpack,
+    CONTENT_TYPE_STRUCT: _sobre_struct,
+}
+
+
+def desempaquetar(body: bytes, content_type: Optional[str] = None, content_encoding: Optional[str] = None,
+                  headers: Optional[dict] = None) -> Sobre:
+    """Descomprime y decodifica un mensaje simple o un sobre. Lanza ErrorDecodificacion."""
+    tipo = content_type.split(";", 1)[0].strip().lower() if content_type else CONTENT_TYPE_JSON
+    datos = descomprimir(body, content_encoding)
+    declaradas = (headers or {}).get(HEADER_LECTURAS)
+    if declaradas is None:
+        return Sobre(body, tipo, [decodificar(datos, content_type)], False)
+
+    if tipo not in SOBRES:
+        raise ErrorDecodificacion(f"content_type no soportado: {content_type!r}")
+    try:
+        lecturas, cuerpo = SOBRES[tipo](datos)
+    except ErrorDecodificacion:
+        raise
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise ErrorDecodificacion(f"Sobre {tipo} inválido: {e}") from None
+    if str(declaradas) != str(len(lecturas)):
+        raise ErrorDecodificacion(f"El sobre declara {declaradas} lecturas y contiene {len(lecturas)}.")
+    return Sobre(body, tipo, lecturas, True, cuerpo)
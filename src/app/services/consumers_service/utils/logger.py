@@ -1,34 +1,191 @@
+import atexit
+import copy
+import json
 import logging
 import os
-# Nota: Se ha eliminado la importación de RotatingFileHandler
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from prometheus_client import Counter
+
+from utils.config import (
+    LOG_QUEUE_SIZE, LOG_ROTATION, LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT, LOG_FORMAT,
+    LOG_SAMPLE_RATE, LOG_RATE_LIMIT,
+)
+
+# Los registros no se escriben en el hilo que los emite: el logger solo los deja en una cola
+# acotada (sin bloquear) y un QueueListener los escribe en archivo y consola desde su propio
+# hilo. Si la cola está llena el registro se descarta, así el I/O de logging nunca retrasa un
+# ACK. Los registros por mensaje se emiten en el logger hijo "<nombre>.mensajes", que aplica
+# muestreo y límite por segundo a INFO/DEBUG (WARNING y superiores pasan siempre).
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Registros de log descartados (queue_full: cola llena, sampled: muestreo, rate_limited: límite por segundo)",
+    ["reason"],
+)
+
+# Listener activo por logger, para detenerlo (y vaciar su cola) al reconfigurar o al salir
+_listeners = {}
+
+# Atributos estándar de LogRecord; el resto (extra=...) se añade a la salida JSON
+_ATRIBUTOS_ESTANDAR = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+# Solo para formatear tracebacks antes de encolar el registro
+_FORMATO_EXCEPCION = logging.Formatter()
+
+
+class ColaNoBloqueante(QueueHandler):
+    """QueueHandler que descarta el registro (y lo cuenta) en vez de fallar con la cola llena.
+
+    A diferencia de QueueHandler.prepare(), el traceback no se funde en `msg`: viaja ya
+    formateado en `exc_text`, así los formatters del listener lo siguen viendo (FormatoJSON lo
+    emite en "exc") y la cola no retiene los frames de la excepción.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _FORMATO_EXCEPCION.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels("queue_full").inc()
+
+
+class EscritorEnCola(QueueListener):
+    """QueueListener cuyo stop() espera hueco en la cola para el centinela en vez de fallar."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro: ts, level, logger, thread, msg y los campos de extra=."""
+
+    def format(self, record):
+        datos = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_ESTANDAR:
+                datos[clave] = valor
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            datos["exc"] = record.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class Muestreo(logging.Filter):
+    """Deja pasar una fracción `tasa` de los registros INFO/DEBUG y como mucho
+    `max_por_segundo` por segundo (0 = sin límite). WARNING y superiores pasan siempre."""
+
+    def __init__(self, tasa: float = 1.0, max_por_segundo: int = 0,
+                 reloj=time.monotonic, azar=random.random):
+        super().__init__()
+        self.tasa = min(1.0, max(0.0, tasa))
+        self.max_por_segundo = max(0, max_por_segundo)
+        self._reloj = reloj
+        self._azar = azar
+        self._segundo = None
+        self._cuenta = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.tasa < 1.0 and self._azar() >= self.tasa:
+            LOG_RECORDS_DROPPED.labels("sampled").inc()
+            return False
+        if self.max_por_segundo:
+            with self._lock:
+                segundo = int(self._reloj())
+                if segundo != self._segundo:
+                    self._segundo, self._cuenta = segundo, 0
+                self._cuenta += 1
+                if self._cuenta > self.max_por_segundo:
+                    LOG_RECORDS_DROPPED.labels("rate_limited").inc()
+                    return False
+        return True
+
+
+def _handler_archivo(log_file: str) -> logging.Handler:
+    """Handler de archivo según LOG_ROTATION: 'size', 'time' o 'none' (sin rotación)."""
+    if LOG_ROTATION == "size":
+        return RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    if LOG_ROTATION == "time":
+        return TimedRotatingFileHandler(log_file, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    return logging.FileHandler(log_file, encoding="utf-8")
+
+
+def _detener(name: str) -> None:
+    listener = _listeners.pop(name, None)
+    if listener is not None:
+        listener.stop()
+
+
+def _detener_todos() -> None:
+    for name in list(_listeners):
+        _detener(name)
+
+
+atexit.register(_detener_todos)
+
 
 def setup_logger(name: str, log_file: str, level=logging.INFO):
-    """Crea y configura un logger con salida a archivo y consola."""
-    
+    """Crea y configura un logger con salida a archivo (con rotación) y consola, escrita
+    desde un hilo aparte. Configura también el logger de registros por mensaje
+    "<name>.mensajes" con el muestreo de LOG_SAMPLE_RATE y LOG_RATE_LIMIT."""
+
     # Asegura que la carpeta de logs exista.
     os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
-    # Formato de logging (simplificado)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    
-    # 1. Handler para Archivo (sin rotación)
-    handler = logging.FileHandler(log_file)
-    handler.setFormatter(formatter)
+    if LOG_FORMAT == "json":
+        formatter = FormatoJSON()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-    # 2. Handler para Consola (StreamHandler)
+    # 1. Handler para Archivo y 2. Handler para Consola, atendidos por el listener
+    handler = _handler_archivo(log_file)
+    handler.setFormatter(formatter)
     console = logging.StreamHandler()
     console.setFormatter(formatter)
 
-    # 3. Configuración del Logger
+    # 3. Cola entre el logger y el hilo escritor
+    _detener(name)
+    cola = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    listener = EscritorEnCola(cola, handler, console)
+    listener.start()
+    _listeners[name] = listener
+
+    # 4. Configuración del Logger
     logger = logging.getLogger(name)
-    
+
     # Esto previene la adición múltiple de handlers
-    if logger.handlers:
-        for existing_handler in logger.handlers:
-            logger.removeHandler(existing_handler)
-            
+    for existing_handler in list(logger.handlers):
+        logger.removeHandler(existing_handler)
+        existing_handler.close()
+
     logger.setLevel(level)
-    logger.addHandler(handler)
-    logger.addHandler(console)
+    logger.addHandler(ColaNoBloqueante(cola))
+
+    por_mensaje = logging.getLogger(f"{name}.mensajes")
+    for existing_filter in list(por_mensaje.filters):
+        por_mensaje.removeFilter(existing_filter)
+    por_mensaje.addFilter(Muestreo(LOG_SAMPLE_RATE, LOG_RATE_LIMIT))
 
-    return logger
\ No newline at end of file
+    return logger
@@ -0,0 +1,223 @@
+# Métricas Prometheus del consumidor. Se definen en un único módulo para que los dos
+# motores (síncrono y asyncio) actualicen las mismas series en el registro por defecto.
+# El servidor HTTP de métricas se arranca desde main.py (puerto 8000).
+
+import time
+import weakref
+import logging
+import threading
+
+from typing import Iterable, Optional
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+
+from utils.config import (
+    CONSUMER_ENGINE, THROUGHPUT_REPORT_INTERVAL, ROLLING_ENABLED, ROLLING_SLOTS, ROLLING_MAX_STATIONS,
+)
+from utils.rolling import AgregadosEstaciones, ColectorAgregados
+from utils.encoding import HEADER_PUBLICADO
+
+logger = logging.getLogger("CONSUMER_LOG")
+
+# Contador de mensajes procesados
+MESSAGES_PROCESSED = Counter('messages_processed_total', 'Mensajes procesados correctamente')
+
+# Agregados móviles por estación (station_last_value, station_window_value, station_window_readings),
+# calculados en cada scrape a partir de los buffers circulares de utils.rolling
+AGREGADOS_ESTACION = AgregadosEstaciones(slots=ROLLING_SLOTS, max_estaciones=ROLLING_MAX_STATIONS)
+if ROLLING_ENABLED:
+    REGISTRY.register(ColectorAgregados(AGREGADOS_ESTACION))
+
+# Throughput del motor activo, para comparar el motor síncrono con el asyncio
+CONSUMER_THROUGHPUT = Gauge(
+    'consumer_throughput_messages_per_second',
+    'Filas guardadas por segundo en la última ventana de medición',
+    ['engine']
+)
+
+# Payloads rechazados por la validación, por código de error (utils.validation)
+VALIDATION_ERRORS = Counter('validation_errors_total', 'Payloads rechazados por la validación', ['code'])
+
+# Reintentos diferidos por error transitorio de la DB (utils.retry), por nivel de espera
+MESSAGES_RETRIED = Counter('messages_retried_total', 'Mensajes enviados a un nivel de reintento diferido', ['tier'])
+RETRIES_EXHAUSTED = Counter('messages_retry_exhausted_total', 'Mensajes enviados a la DLQ tras agotar los reintentos')
+
+# Duplicados: mensajes descartados por la caché de message_id (utils.dedup) y filas que ya
+# existían en weather_logs (ON CONFLICT DO NOTHING)
+MESSAGES_DUPLICATED = Counter('messages_duplicate_total', 'Mensajes descartados por un message_id ya escrito')
+ROWS_DUPLICATED = Counter('rows_duplicate_total', 'Filas ignoradas por existir ya en weather_logs')
+
+# Spool local durable (utils.spool)
+SPOOL_BYTES = Gauge('spool_bytes', 'Bytes pendientes de reproducir en el spool local')
+SPOOL_SEGMENTS = Gauge('spool_segments', 'Segmentos del spool local en disco')
+SPOOL_ROWS_WRITTEN = Counter('spool_rows_written_total', 'Filas guardadas en el spool porque la DB no respondía')
+SPOOL_ROWS_REPLAYED = Counter('spool_rows_replayed_total', 'Filas del spool cargadas en weather_logs')
+SPOOL_ROWS_DISCARDED = Counter('spool_rows_discarded_total', 'Filas del spool rechazadas por la DB al reproducirlas')
+SPOOL_REJECTED = Counter('spool_rejected_total', 'Escrituras no aceptadas por estar el spool lleno')
+
+# Reconexiones a PostgreSQL provocadas por fallos reales (sin ping previo)
+DB_RECONNECTS = Counter('db_reconnects_total', 'Conexiones a PostgreSQL descartadas por error y reabiertas')
+
+# Pool de conexiones (modo multi-worker)
+DB_POOL_WAIT_SECONDS = Histogram(
+    'db_pool_wait_seconds',
+    'Tiempo esperando una conexión libre del pool',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+DB_POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Conexiones del pool prestadas a workers')
+DB_POOL_DISCARDED = Counter(
+    'db_pool_connections_discarded_total',
+    'Conexiones del pool cerradas en lugar de reutilizarse',
+    ['reason']
+)
+
+# ==============================
+# INSTRUMENTACIÓN POR ETAPAS
+# ==============================
+
+# Etapas del procesamiento de un mensaje (label `stage` de consumer_stage_seconds)
+ETAPA_DECODIFICACION = "decode"    # desempaquetar(): descompresión y decodificación
+ETAPA_VALIDACION = "validate"      # normalizar() / validar_lote()
+ETAPA_INSERCION = "db_insert"      # INSERT / COPY del lote (sin el commit)
+ETAPA_COMMIT = "db_commit"         # commit de la transacción
+ETAPA_ACK = "ack"                  # basic_ack / basic_nack
+ETAPA_DLQ = "dlq_publish"          # publicación en la DLQ
+ETAPAS = (ETAPA_DECODIFICACION, ETAPA_VALIDACION, ETAPA_INSERCION, ETAPA_COMMIT, ETAPA_ACK, ETAPA_DLQ)
+
+STAGE_SECONDS = Histogram(
+    'consumer_stage_seconds',
+    'Duración de cada etapa del procesamiento de un mensaje',
+    ['stage'],
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+             0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+# Hijos ya resueltos: labels() no se llama en cada mensaje
+_ETAPAS = {nombre: STAGE_SECONDS.labels(stage=nombre) for nombre in ETAPAS}
+
+# Desde que el productor publica el mensaje (cabecera x-published-at-ms) hasta el commit
+END_TO_END_LAG = Histogram(
+    'consumer_end_to_end_lag_seconds',
+    'Tiempo desde la publicación del mensaje hasta el commit de sus filas',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+)
+
+# Fallos por motivo: los de utils.dlq (decodificacion, validacion, rechazo_db) y DB_TRANSITORIO.
+# Las lecturas inválidas de un sobre y las filas rechazadas de un lote cuentan una a una.
+DB_TRANSITORIO = "db_transitorio"
+MESSAGES_FAILED = Counter('messages_failed_total', 'Mensajes o lecturas fallidos, por motivo', ['reason'])
+
+# Filas por transacción de escritura (lote intentado; 1 sin modo lote)
+BATCH_ROWS = Histogram(
+    'consumer_batch_rows',
+    'Filas escritas por transacción',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+
+# Mensajes entregados sin ACK/NACK y filas validadas a la espera de escribirse. Se calculan en
+# cada scrape sumando `en_vuelo` y `filas_pendientes` de los objetos registrados con
+# seguir_en_vuelo() (AckAcumulado, AcumuladorLote, ConsumidorAsync).
+IN_FLIGHT_MESSAGES = Gauge('consumer_messages_in_flight', 'Mensajes entregados aún sin ACK/NACK')
+PENDING_ROWS = Gauge('consumer_rows_pending', 'Filas validadas a la espera de escribirse en la DB')
+_seguidos = weakref.WeakSet()
+_seguidos_lock = threading.Lock()
+
+
+def etapa(nombre: str):
+    """Context manager que mide la duración de una etapa en consumer_stage_seconds."""
+    return _ETAPAS[nombre].time()
+
+
+def observar_etapa(nombre: str, segundos: float) -> None:
+    _ETAPAS[nombre].observe(segundos)
+
+
+def contar_fallos(motivo: str, n: int = 1) -> None:
+    MESSAGES_FAILED.labels(reason=motivo).inc(n)
+
+
+def observar_latencia(headers: Optional[dict], ahora: Optional[float] = None) -> None:
+    """Observa el lag de extremo a extremo de un mensaje recién confirmado en la DB.
+
+    Los mensajes sin la cabecera (productores antiguos, send_test_message.py) se ignoran.
+    """
+    publicado = (headers or {}).get(HEADER_PUBLICADO)
+    if not isinstance(publicado, (int, float)):
+        return
+    ahora = time.time() if ahora is None else ahora
+    END_TO_END_LAG.observe(max(0.0, ahora - publicado / 1000.0))
+
+
+def seguir_en_vuelo(*objetos) -> None:
+    """Registra objetos con `en_vuelo` y/o `filas_pendientes` para los gauges de en vuelo."""
+    with _seguidos_lock:
+        for objeto in objetos:
+            if objeto is not None:
+                _seguidos.add(objeto)
+
+
+def _sumar(atributo: str) -> int:
+    with _seguidos_lock:
+        return sum(getattr(objeto, atributo, 0) for objeto in list(_seguidos))
+
+
+IN_FLIGHT_MESSAGES.set_function(lambda: _sumar("en_vuelo"))
+PENDING_ROWS.set_function(lambda: _sumar("filas_pendientes"))
+
+
+# Autoescalado y control de flujo (utils.autoscaling)
+AUTOSCALER_QUEUE_DEPTH = Gauge('autoscaler_queue_depth', 'Mensajes (listos + sin ACK) en las colas del consumidor')
+AUTOSCALER_CONSUMER_UTILISATION = Gauge('autoscaler_consumer_utilisation', 'consumer_utilisation medio de las colas (API de management)')
+AUTOSCALER_DESIRED_WORKERS = Gauge('autoscaler_desired_workers', 'Workers estimados para la cola, sumando todas las instancias')
+CONSUMER_WORKERS_ACTIVE = Gauge('consumer_workers_active', 'Workers de consumo activos en esta instancia')
+CONSUMER_PREFETCH_CURRENT = Gauge('consumer_prefetch', 'Prefetch actual de los canales de esta instancia')
+FLOW_FACTOR = Gauge('autoscaler_flow_factor', 'Factor de publicación indicado a los productores (1 = sin freno, 0 = pausa)')
+AUTOSCALER_ERRORS = Counter('autoscaler_errors_total', 'Consultas a la API de management o señales de flujo fallidas')
+
+# Caché de weather_stations (utils.stations)
+STATION_CACHE_SIZE = Gauge('station_cache_stations', 'Estaciones en la caché de weather_stations')
+STATION_CACHE_REFRESHES = Counter(
+    'station_cache_refreshes_total', 'Recargas de la caché de estaciones (inicio, reconexion, ttl o notify)', ['trigger']
+)
+STATION_CACHE_ERRORS = Counter('station_cache_errors_total', 'Recargas de la caché de estaciones fallidas')
+
+
+_lock = threading.Lock()
+_ventana_inicio = time.monotonic()
+_ventana_filas = 0
+_filas_escritas = 0  # Total desde el arranque, para la marca de escritura
+
+
+def contar_procesados(n: int = 1) -> None:
+    """Incrementa messages_processed_total y actualiza el throughput del motor activo."""
+    global _ventana_inicio, _ventana_filas, _filas_escritas
+    MESSAGES_PROCESSED.inc(n)
+    with _lock:
+        _ventana_filas += n
+        _filas_escritas += n
+        ahora = time.monotonic()
+        transcurrido = ahora - _ventana_inicio
+        if transcurrido < THROUGHPUT_REPORT_INTERVAL:
+            return
+        tasa = _ventana_filas / transcurrido
+        _ventana_inicio, _ventana_filas = ahora, 0
+    CONSUMER_THROUGHPUT.labels(engine=CONSUMER_ENGINE).set(tasa)
+    logger.info("Throughput motor '%s': %.1f msg/s", CONSUMER_ENGINE, tasa)
+
+
+def filas_escritas() -> int:
+    """Filas nuevas escritas (tras el commit) desde el arranque, por ambos motores y el spool."""
+    with _lock:
+        return _filas_escritas
+
+
+def contar_insertadas(filas: int, insertadas: int) -> None:
+    """contar_procesados() de las filas nuevas; las demás ya existían (ON CONFLICT DO NOTHING)."""
+    contar_procesados(insertadas)
+    if insertadas < filas:
+        ROWS_DUPLICATED.inc(filas - insertadas)
+
+
+def registrar_lecturas(filas: Iterable[tuple]) -> None:
+    """Añade filas ya persistidas a los agregados móviles por estación."""
+    if ROLLING_ENABLED:
+        AGREGADOS_ESTACION.registrar(filas)
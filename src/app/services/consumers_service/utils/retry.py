@@ -0,0 +1,67 @@
+# Reintentos diferidos ante errores transitorios de la DB (OperationalError, conexión caída).
+# En lugar de NACK con requeue, que devuelve el mensaje al instante y lo repite en bucle contra
+# una DB caída, el consumidor lo republica en un nivel de espera y confirma el original:
+#
+#   weather_exchange -> cola principal -> (fallo) -> weather_retry.<n>s (fanout) -> cola con
+#   x-message-ttl = n s -> al vencer, dead-letter a weather_exchange con la routing key
+#   original -> de vuelta a su cola (la única o la de su shard).
+#
+# Los niveles (RETRY_DELAYS_S, p. ej. 1, 5, 30, 120 s) crecen exponencialmente. El número de
+# reintentos viaja en la cabecera x-retry-count; el intento k usa el nivel k (o el último si
+# hay más intentos que niveles) y, superado RETRY_MAX_ATTEMPTS, el mensaje va a la DLQ.
+# Cada nivel tiene un TTL fijo, así que sus mensajes vencen en el orden en que entraron.
+# Compartido por los motores síncrono y asyncio.
+
+from typing import Dict, List, Optional, Sequence
+
+HEADER_REINTENTOS = "x-retry-count"
+HEADER_MOTIVO = "x-retry-reason"
+
+# Longitud máxima del motivo guardado en la cabecera
+_MAX_MOTIVO = 200
+
+
+def parsear_retrasos(texto: str) -> List[float]:
+    """Retrasos de RETRY_DELAYS_S ('1,5,30,120'); vacío o '0' desactiva los reintentos diferidos."""
+    retrasos = [float(parte) for parte in texto.replace(" ", "").split(",") if parte]
+    if any(r < 0 for r in retrasos):
+        raise ValueError(f"RETRY_DELAYS_S inválido: {texto!r} (los retrasos no pueden ser negativos)")
+    return [r for r in retrasos if r > 0]
+
+
+def nombre_nivel(prefijo: str, retraso_s: float) -> str:
+    """Nombre del exchange (fanout) y de la cola de un nivel: 'weather_retry.5s'."""
+    return f"{prefijo}.{retraso_s:g}s"
+
+
+def argumentos_nivel(retraso_s: float, exchange_principal: str) -> Dict[str, object]:
+    """Argumentos de la cola de un nivel: TTL y dead-letter al exchange principal.
+
+    Sin x-dead-letter-routing-key, RabbitMQ conserva la routing key con la que se publicó el
+    reintento, que es la original del mensaje.
+    """
+    return {"x-message-ttl": int(retraso_s * 1000), "x-dead-letter-exchange": exchange_principal}
+
+
+def reintentos(headers: Optional[dict]) -> int:
+    """Reintentos ya hechos según x-retry-count (0 si no hay cabecera o no es válida)."""
+    try:
+        return max(0, int((headers or {}).get(HEADER_REINTENTOS, 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def nivel_siguiente(headers: Optional[dict], niveles: Sequence[str], max_intentos: int) -> Optional[str]:
+    """Nivel en el que esperar el próximo reintento; None si ya se agotaron (-> DLQ)."""
+    hechos = reintentos(headers)
+    if not niveles or hechos >= max_intentos:
+        return None
+    return niveles[min(hechos, len(niveles) - 1)]
+
+
+def cabeceras_reintento(headers: Optional[dict], motivo: str) -> dict:
+    """Cabeceras del mensaje republicado: las originales con x-retry-count + 1 y el motivo."""
+    nuevas = dict(headers or {})
+    nuevas[HEADER_REINTENTOS] = reintentos(headers) + 1
+    nuevas[HEADER_MOTIVO] = motivo[:_MAX_MOTIVO]
+    return nuevas
@@ -0,0 +1,197 @@
+# Agregados móviles por estación calculados en memoria por el consumidor.
+# Para cada id_station se guarda el último valor de cada magnitud y, por ventana (1 min,
+# 5 min, 1 h), la media, el mínimo y el máximo. Así los dashboards muestran el estado actual
+# de cada estación sin consultar weather_logs.
+#
+# Cada ventana es un buffer circular de tamaño fijo (`slots` casillas de duración/slots
+# segundos) sobre arrays de tipos primitivos: la memoria por estación es constante
+# (~4 KB con 12 casillas) sin importar cuántas lecturas lleguen, y el número de estaciones
+# seguidas está acotado por `max_estaciones`. Una ventana cubre entre (slots-1)/slots y la
+# totalidad de su duración: la casilla más antigua se descarta entera al avanzar.
+
+import time
+import logging
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger("CONSUMER_LOG")
+
+# (etiqueta/prefijo de columna, posición en la fila normalizada de weather_logs)
+CAMPOS_AGREGADOS: Tuple[Tuple[str, int], ...] = (
+    ("temperature", 2),
+    ("humidity", 3),
+    ("wind_speed", 5),
+    ("pressure", 6),
+)
+
+# (nombre, duración en segundos)
+VENTANAS: Tuple[Tuple[str, float], ...] = (("1m", 60.0), ("5m", 300.0), ("1h", 3600.0))
+
+# Resumen de un campo en una ventana: (media, mínimo, máximo); None si no hay lecturas
+Resumen = Optional[Tuple[float, float, float]]
+
+
+class VentanaCircular:
+    """Suma, mínimo y máximo de varios campos sobre una ventana deslizante de duración fija."""
+
+    __slots__ = ("ancho", "n", "n_campos", "casilla", "conteo", "suma", "minimo", "maximo")
+
+    def __init__(self, duracion: float, slots: int, n_campos: int):
+        self.ancho = duracion / slots
+        self.n = slots
+        self.n_campos = n_campos
+        # Índice absoluto (t // ancho) de la casilla que ocupa cada posición; -1 = vacía
+        self.casilla = array("q", [-1]) * slots
+        self.conteo = array("L", [0]) * slots
+        self.suma = array("d", [0.0]) * (slots * n_campos)
+        self.minimo = array("d", [0.0]) * (slots * n_campos)
+        self.maximo = array("d", [0.0]) * (slots * n_campos)
+
+    def agregar(self, t: float, valores: Sequence[float]) -> None:
+        absoluta = int(t // self.ancho)
+        i = absoluta % self.n
+        base = i * self.n_campos
+        if self.casilla[i] != absoluta:
+            # La posición guardaba una casilla vencida: se reutiliza
+            self.casilla[i] = absoluta
+            self.conteo[i] = 1
+            for j, v in enumerate(valores):
+                self.suma[base + j] = self.minimo[base + j] = self.maximo[base + j] = v
+            return
+        self.conteo[i] += 1
+        for j, v in enumerate(valores):
+            k = base + j
+            self.suma[k] += v
+            if v < self.minimo[k]:
+                self.minimo[k] = v
+            elif v > self.maximo[k]:
+                self.maximo[k] = v
+
+    def resumir(self, t: float) -> Tuple[int, List[Resumen]]:
+        """Número de lecturas y (media, mín, máx) de cada campo en la ventana que termina en `t`."""
+        actual = int(t // self.ancho)
+        lecturas = 0
+        suma = [0.0] * self.n_campos
+        minimo = [float("inf")] * self.n_campos
+        maximo = [float("-inf")] * self.n_campos
+        for i in range(self.n):
+            if not actual - self.n < self.casilla[i] <= actual:
+                continue
+            lecturas += self.conteo[i]
+            base = i * self.n_campos
+            for j in range(self.n_campos):
+                suma[j] += self.suma[base + j]
+                minimo[j] = min(minimo[j], self.minimo[base + j])
+                maximo[j] = max(maximo[j], self.maximo[base + j])
+        if not lecturas:
+            return 0, [None] * self.n_campos
+        return lecturas, [(suma[j] / lecturas, minimo[j], maximo[j]) for j in range(self.n_campos)]
+
+
+class AgregadoEstacion:
+    """Último valor y ventanas de una estación."""
+
+    __slots__ = ("ultimo", "ultimo_t", "ventanas")
+
+    def __init__(self, ventanas: Iterable[Tuple[str, float]], slots: int, n_campos: int):
+        self.ultimo = array("d", [0.0]) * n_campos
+        self.ultimo_t = 0.0
+        self.ventanas = tuple(VentanaCircular(duracion, slots, n_campos) for _, duracion in ventanas)
+
+
+class AgregadosEstaciones:
+    """Agregados móviles de todas las estaciones, compartidos por los workers (thread-safe).
+
+    - registrar(filas): añade filas normalizadas de weather_logs ya persistidas.
+    - instantanea(): [(id_station, último valor por campo, [(ventana, lecturas, resúmenes)])].
+    """
+
+    def __init__(self, campos: Sequence[Tuple[str, int]] = CAMPOS_AGREGADOS,
+                 ventanas: Sequence[Tuple[str, float]] = VENTANAS, slots: int = 12,
+                 max_estaciones: int = 1000, reloj: Callable[[], float] = time.time):
+        self.campos = tuple(campos)
+        self.ventanas = tuple(ventanas)
+        self.slots = max(2, slots)
+        self.max_estaciones = max_estaciones
+        self.reloj = reloj
+        self._posiciones = tuple(pos for _, pos in self.campos)
+        self._estaciones: Dict[int, AgregadoEstacion] = {}
+        self._ignoradas = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._estaciones)
+
+    def registrar(self, filas: Iterable[tuple]) -> None:
+        t = self.reloj()
+        posiciones = self._posiciones
+        with self._lock:
+            for fila in filas:
+                estacion = self._estaciones.get(fila[0])
+                if estacion is None:
+                    if len(self._estaciones) >= self.max_estaciones:
+                        self._ignoradas += 1
+                        if self._ignoradas == 1:
+                            logger.warning("Límite de %d estaciones con agregados alcanzado; se ignoran las nuevas.",
+                                           self.max_estaciones)
+                        continue
+                    estacion = AgregadoEstacion(self.ventanas, self.slots, len(posiciones))
+                    self._estaciones[fila[0]] = estacion
+                valores = [float(fila[p]) for p in posiciones]
+                estacion.ultimo[:] = array("d", valores)
+                estacion.ultimo_t = t
+                for ventana in estacion.ventanas:
+                    ventana.agregar(t, valores)
+
+    def instantanea(self) -> Iterator[Tuple[int, List[float], List[Tuple[str, int, List[Resumen]]]]]:
+        t = self.reloj()
+        with self._lock:
+            estaciones = list(self._estaciones.items())
+        for id_station, estacion in estaciones:
+            # Lectura sin lock por estación: como mucho mezcla una lectura en curso, aceptable
+            # para un indicador en vivo y sin bloquear a los workers durante el scrape.
+            ventanas = [
+                (nombre, *ventana.resumir(t))
+                for (nombre, _), ventana in zip(self.ventanas, estacion.ventanas)
+            ]
+            yield id_station, list(estacion.ultimo), ventanas
+
+
+class ColectorAgregados:
+    """Expone los agregados en Prometheus calculándolos en cada scrape (no por mensaje).
+
+    - station_last_value{station, field}
+    - station_window_value{station, field, window, stat=mean|min|max}
+    - station_window_readings{station, window}
+    """
+
+    def __init__(self, agregados: AgregadosEstaciones):
+        self.agregados = agregados
+
+    def collect(self):
+        ultimo = GaugeMetricFamily("station_last_value", "Última lectura de la estación", labels=["station", "field"])
+        valor = GaugeMetricFamily(
+            "station_window_value", "Media, mínimo y máximo de la estación en la ventana",
+            labels=["station", "field", "window", "stat"]
+        )
+        lecturas = GaugeMetricFamily(
+            "station_window_readings", "Lecturas de la estación en la ventana", labels=["station", "window"]
+        )
+        nombres = [nombre for nombre, _ in self.agregados.campos]
+        for id_station, ultimos, ventanas in self.agregados.instantanea():
+            station = str(id_station)
+            for campo, v in zip(nombres, ultimos):
+                ultimo.add_metric([station, campo], v)
+            for ventana, n, resumenes in ventanas:
+                lecturas.add_metric([station, ventana], n)
+                for campo, resumen in zip(nombres, resumenes):
+                    if resumen is None:
+                        continue
+                    for stat, v in zip(("mean", "min", "max"), resumen):
+                        valor.add_metric([station, campo, ventana, stat], v)
+        yield ultimo
+        yield valor
+        yield lecturas
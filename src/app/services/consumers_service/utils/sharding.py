@@ -0,0 +1,157 @@
+# Colas particionadas por estación (shards). Con RABBITMQ_SHARDS = N > 0 el productor publica
+# cada lectura con la routing key `ROUTING_KEY.<k>`, donde k = shard_de(id_station, N), y cada
+# routing key va a su propia cola `RABBITMQ_QUEUE.<k>` en el mismo exchange direct. Así:
+# - Todas las lecturas de una estación pasan por la misma cola, en orden.
+# - Cada cola se declara con x-single-active-consumer: aunque varios consumidores se
+#   suscriban a la misma cola, solo uno recibe mensajes (los demás quedan en espera y toman
+#   el relevo si el activo cae). El orden por estación no depende del reparto.
+# - Los consumidores reparten los shards entre sí (ReclamadorShards) y el throughput crece
+#   con el número de instancias hasta llegar a N.
+#
+# shard_de usa jump consistent hash (Lamping y Veach, 2014): al pasar de N a N+1 shards solo
+# cambia de cola ~1/(N+1) de las estaciones, frente a casi todas con `id_station % N`.
+# Mantener sincronizado con producers_service/sharding.py.
+
+import math
+import random
+import logging
+import threading
+from typing import Callable, List, Optional, Set
+
+logger = logging.getLogger("CONSUMER_LOG")
+
+# Argumentos de las colas de shard (deben coincidir en productor y consumidor)
+ARGUMENTOS_COLA_SHARD = {"x-single-active-consumer": True}
+
+# application_name de las conexiones que reclaman shards: cuenta las instancias vivas
+APLICACION_RECLAMADOR = "weather-consumer-shards"
+
+INSTANCIAS_SQL = """
+SELECT count(*) FROM pg_stat_activity
+WHERE application_name = %s AND datname = current_database();
+"""
+TOMAR_SQL = "SELECT pg_try_advisory_lock(hashtext('weather_shards'), %s);"
+SOLTAR_SQL = "SELECT pg_advisory_unlock(hashtext('weather_shards'), %s);"
+
+_MASCARA_64 = (1 << 64) - 1
+
+
+def shard_de(id_station: int, n_shards: int) -> int:
+    """Shard (0..n_shards-1) de una estación con jump consistent hash."""
+    if n_shards <= 1:
+        return 0
+    clave = int(id_station) & _MASCARA_64
+    b, j = -1, 0
+    while j < n_shards:
+        b = j
+        clave = (clave * 2862933555777941757 + 1) & _MASCARA_64
+        j = int((b + 1) * ((1 << 31) / ((clave >> 33) + 1)))
+    return b
+
+
+def cola_shard(cola: str, shard: int) -> str:
+    return f"{cola}.{shard}"
+
+
+def routing_key_shard(routing_key: str, shard: int) -> str:
+    return f"{routing_key}.{shard}"
+
+
+def parsear_shards(texto: str, n_shards: int) -> Optional[List[int]]:
+    """Shards de CONSUMER_SHARDS: 'auto' (None, reparto dinámico), 'all' o lista '0-3,7'."""
+    texto = texto.strip().lower()
+    if texto in ("", "auto"):
+        return None
+    if texto == "all":
+        return list(range(n_shards))
+    shards = set()
+    for parte in texto.split(","):
+        inicio, _, fin = parte.strip().partition("-")
+        try:
+            desde, hasta = int(inicio), int(fin or inicio)
+        except ValueError:
+            raise ValueError(f"CONSUMER_SHARDS inválido: {texto!r} (use auto, all o p. ej. 0-3,7)") from None
+        if not 0 <= desde <= hasta < n_shards:
+            raise ValueError(f"CONSUMER_SHARDS fuera de rango: {parte.strip()!r} (hay {n_shards} shards)")
+        shards.update(range(desde, hasta + 1))
+    return sorted(shards)
+
+
+class ReclamadorShards:
+    """Reparte los shards entre las instancias del consumidor con advisory locks de PostgreSQL.
+
+    Cada instancia mantiene una conexión propia (application_name=APLICACION_RECLAMADOR) y en
+    cada pasada:
+    - Cuenta las instancias vivas en pg_stat_activity y calcula su cuota, ceil(N / instancias).
+    - Si tiene más shards que la cuota, suelta los sobrantes: primero deja de consumirlos
+      (`soltar`, que persiste lo pendiente) y después libera el lock.
+    - Si tiene menos, intenta tomar el lock de shards libres y empieza a consumirlos (`tomar`).
+    Si la instancia muere, PostgreSQL libera sus locks al cerrarse la conexión y las demás
+    toman sus shards en la siguiente pasada. Si se pierde solo la conexión del reclamador,
+    la instancia sigue consumiendo (x-single-active-consumer mantiene el orden) y al
+    reconectar recupera sus locks o suelta los shards que ya tomó otra instancia.
+    """
+
+    def __init__(self, n_shards: int, conectar: Callable[[], object],
+                 tomar: Callable[[int], None], soltar: Callable[[int], None]):
+        self.n_shards = n_shards
+        self.conectar = conectar
+        self.tomar = tomar
+        self.soltar = soltar
+        self.propios: Set[int] = set()
+        self._conn = None
+        self._con_locks = False  # False tras reconectar: los locks de propios se perdieron
+
+    def cuota(self, instancias: int) -> int:
+        return math.ceil(self.n_shards / max(1, instancias))
+
+    def pasada(self) -> None:
+        if self._conn is None or self._conn.closed:
+            self._conn = self.conectar()
+            self._conn.autocommit = True
+            self._con_locks = False
+        with self._conn.cursor() as cur:
+            if not self._con_locks:
+                for shard in sorted(self.propios):
+                    cur.execute(TOMAR_SQL, (shard,))
+                    if not cur.fetchone()[0]:
+                        logger.warning("El shard %d ya lo tomó otra instancia; se deja de consumir.", shard)
+                        self.soltar(shard)
+                        self.propios.discard(shard)
+                self._con_locks = True
+
+            cur.execute(INSTANCIAS_SQL, (APLICACION_RECLAMADOR,))
+            cuota = self.cuota(cur.fetchone()[0])
+
+            for shard in sorted(self.propios, reverse=True)[:max(0, len(self.propios) - cuota)]:
+                logger.info("Soltando el shard %d (cuota %d de %d).", shard, cuota, self.n_shards)
+                self.soltar(shard)
+                self.propios.discard(shard)
+                cur.execute(SOLTAR_SQL, (shard,))
+
+            # Empezar en un shard al azar reparte mejor cuando varias instancias arrancan juntas
+            inicio = random.randrange(self.n_shards)
+            for k in range(self.n_shards):
+                if len(self.propios) >= cuota:
+                    break
+                shard = (inicio + k) % self.n_shards
+                if shard in self.propios:
+                    continue
+                cur.execute(TOMAR_SQL, (shard,))
+                if cur.fetchone()[0]:
+                    logger.info("Shard %d tomado (cuota %d de %d).", shard, cuota, self.n_shards)
+                    self.propios.add(shard)
+                    self.tomar(shard)
+
+    def ejecutar(self, intervalo_s: float, detener: threading.Event) -> None:
+        """Pasadas cada `intervalo_s` hasta `detener`; los fallos de la DB se reintentan."""
+        while not detener.is_set():
+            try:
+                self.pasada()
+            except Exception:
+                logger.exception("Fallo al repartir shards; se reintenta en %.1f s.", intervalo_s)
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+            detener.wait(intervalo_s)
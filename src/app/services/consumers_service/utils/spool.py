@@ -0,0 +1,167 @@
+# Spool local durable (write-ahead) para seguir vaciando RabbitMQ mientras PostgreSQL no
+# responde. Si una escritura falla por un error transitorio, las filas ya validadas se añaden
+# al spool (fsync incluido) y los mensajes se confirman; un hilo de reproducción las carga
+# después en weather_logs.
+#
+# Formato: segmentos append-only `<seq>-<id>.seg` en SPOOL_DIR. Cada registro es un lote de
+# filas: cabecera `<II` (longitud, CRC32) + array MessagePack de filas con la fecha en ISO
+# 8601. Se hace un fsync por registro (un lote completo, no por fila). Un registro
+# incompleto o con CRC inválido al final de un segmento (caída a mitad de escritura) se
+# descarta al leer: sus mensajes nunca se confirmaron y RabbitMQ los vuelve a entregar.
+#
+# La reproducción es idempotente: el nombre del segmento se registra en
+# weather_spool_replayed en la misma transacción que sus filas, y un segmento ya registrado
+# solo se borra del disco.
+
+import os
+import time
+import uuid
+import zlib
+import struct
+import logging
+import threading
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence
+
+import msgpack
+
+from utils.metrics import SPOOL_BYTES, SPOOL_SEGMENTS, SPOOL_ROWS_WRITTEN, SPOOL_REJECTED
+
+logger = logging.getLogger("CONSUMER_LOG")
+
+CABECERA = struct.Struct("<II")
+EXTENSION = ".seg"
+
+
+class SpoolLleno(Exception):
+    """El spool alcanzó SPOOL_MAX_BYTES: las filas no se aceptan (el llamador reintenta)."""
+
+
+def codificar_registro(filas: Sequence[tuple]) -> bytes:
+    datos = msgpack.packb([list(f) for f in filas], default=lambda o: o.isoformat() if isinstance(o, datetime) else o)
+    return CABECERA.pack(len(datos), zlib.crc32(datos)) + datos
+
+
+def leer_segmento(ruta: str) -> Iterator[List[tuple]]:
+    """Lotes de filas de un segmento; se detiene en el primer registro incompleto o corrupto."""
+    with open(ruta, "rb") as f:
+        while True:
+            cabecera = f.read(CABECERA.size)
+            if not cabecera:
+                return
+            if len(cabecera) == CABECERA.size:
+                longitud, crc = CABECERA.unpack(cabecera)
+                datos = f.read(longitud)
+                if len(datos) == longitud and zlib.crc32(datos) == crc:
+                    yield [(c[0], datetime.fromisoformat(c[1]), *c[2:]) for c in msgpack.unpackb(datos)]
+                    continue
+            logger.warning("Registro incompleto o corrupto al final de %s: se descarta.", ruta)
+            return
+
+
+class Spool:
+    """Segmentos append-only con límite de tamaño, compartidos por los workers (thread-safe).
+
+    - agregar(filas): escribe un registro y hace fsync antes de volver; SpoolLleno si no cabe.
+    - sellar(): cierra el segmento activo para que se pueda reproducir.
+    - segmentos(): segmentos sellados, del más antiguo al más reciente.
+    - eliminar(ruta): borra un segmento ya reproducido.
+    - derivando: tras marcar_caida(s), durante s segundos se escribe directo en el spool sin
+      esperar a que la DB falle en cada lote; restablecer() lo anula cuando la DB vuelve.
+    """
+
+    def __init__(self, directorio: str, max_bytes: int, segmento_max_bytes: int):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.segmento_max_bytes = segmento_max_bytes
+        os.makedirs(directorio, exist_ok=True)
+        self._lock = threading.Lock()
+        self._activo = None
+        self._ruta_activo: Optional[str] = None
+        self._bytes_activo = 0
+        self._derivar_hasta = 0.0
+        existentes = self._listar()
+        self._seq = max((int(os.path.basename(r).split("-", 1)[0]) for r in existentes), default=0)
+        # Bytes y segmentos en disco: se mantienen al escribir, rotar y eliminar, sin volver a
+        # listar el directorio en cada lote
+        self._bytes = sum(os.path.getsize(r) for r in existentes)
+        self._segmentos = len(existentes)
+        if existentes:
+            logger.warning("Spool con %d segmentos pendientes (%d bytes) de una ejecución anterior.",
+                           len(existentes), self._bytes)
+        self._actualizar_metricas()
+
+    def _listar(self) -> List[str]:
+        return sorted(
+            os.path.join(self.directorio, nombre) for nombre in os.listdir(self.directorio)
+            if nombre.endswith(EXTENSION)
+        )
+
+    def _actualizar_metricas(self) -> None:
+        SPOOL_BYTES.set(self._bytes)
+        SPOOL_SEGMENTS.set(self._segmentos)
+
+    @property
+    def vacio(self) -> bool:
+        return self._bytes == 0
+
+    @property
+    def derivando(self) -> bool:
+        return time.monotonic() < self._derivar_hasta
+
+    def marcar_caida(self, segundos: float) -> None:
+        self._derivar_hasta = time.monotonic() + segundos
+
+    def restablecer(self) -> None:
+        self._derivar_hasta = 0.0
+
+    def agregar(self, filas: Sequence[tuple]) -> None:
+        registro = codificar_registro(filas)
+        with self._lock:
+            if self._bytes + len(registro) > self.max_bytes:
+                SPOOL_REJECTED.inc()
+                raise SpoolLleno(f"Spool lleno ({self._bytes} de {self.max_bytes} bytes).")
+            if self._activo is None or self._bytes_activo + len(registro) > self.segmento_max_bytes:
+                self._sellar()
+                self._seq += 1
+                self._ruta_activo = os.path.join(self.directorio, f"{self._seq:010d}-{uuid.uuid4().hex[:12]}{EXTENSION}")
+                self._activo = open(self._ruta_activo, "ab")
+                self._bytes_activo = 0
+                self._segmentos += 1
+            try:
+                self._activo.write(registro)
+                self._activo.flush()
+                os.fsync(self._activo.fileno())
+            except OSError:
+                # Un registro a medias cierra el segmento: lo siguiente va a uno nuevo
+                self._sellar()
+                existentes = self._listar()
+                self._bytes = sum(os.path.getsize(r) for r in existentes)
+                self._segmentos = len(existentes)
+                raise
+            self._bytes_activo += len(registro)
+            self._bytes += len(registro)
+        SPOOL_ROWS_WRITTEN.inc(len(filas))
+        self._actualizar_metricas()
+
+    def _sellar(self) -> None:
+        if self._activo is not None:
+            self._activo.close()
+            self._activo = None
+            self._ruta_activo = None
+
+    def sellar(self) -> None:
+        with self._lock:
+            self._sellar()
+
+    def segmentos(self) -> List[str]:
+        with self._lock:
+            return [r for r in self._listar() if r != self._ruta_activo]
+
+    def eliminar(self, ruta: str) -> None:
+        with self._lock:
+            tamano = os.path.getsize(ruta)
+            os.remove(ruta)
+            self._bytes -= tamano
+            self._segmentos -= 1
+        self._actualizar_metricas()
@@ -0,0 +1,147 @@
+# Caché en memoria de weather_stations (id -> metadatos). Sin ella una lectura de una estación
+# inexistente pasa la validación, falla en el INSERT por la FK de weather_logs y solo entonces
+# va a la DLQ, después de una transacción y un rollback (en modo lote, además, el lote entero
+# se reintenta fila a fila). Con la caché se rechaza en la validación como cualquier otro
+# payload inválido (código estacion_desconocida, motivo de DLQ 'validacion').
+#
+# - Se carga al arrancar con una conexión propia que además hace LISTEN en CANAL_ESTACIONES:
+#   el trigger de weather_stations (init.sql) envía un NOTIFY en cada cambio y la caché se
+#   recarga al momento. Como respaldo (NOTIFY perdido al reconectar) se recarga cada ttl_s.
+# - Cada recarga sustituye el diccionario completo: los workers leen sin lock y nunca ven
+#   una carga a medias.
+# - Mientras no se ha podido cargar (DB caída al arrancar) todas las estaciones se aceptan y
+#   la FK sigue siendo la garantía.
+#
+# Los metadatos (ciudad, país, coordenadas) quedan disponibles con get() para enriquecer
+# filas o agregados sin joins.
+
+import select
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from utils.metrics import STATION_CACHE_ERRORS, STATION_CACHE_REFRESHES, STATION_CACHE_SIZE
+from utils.validation import ESTACION_DESCONOCIDA, ErrorValidacion
+
+logger = logging.getLogger("CONSUMER_LOG")
+
+# Canal de NOTIFY del trigger trg_weather_stations_cambio (init.sql)
+CANAL_ESTACIONES = "weather_stations_changed"
+
+ESTACIONES_SQL = "SELECT id, name, city, country, latitude, longitude, altitude FROM weather_stations"
+
+
+class Estacion(NamedTuple):
+    id: int
+    nombre: str
+    ciudad: Optional[str]
+    pais: Optional[str]
+    latitud: Optional[float]
+    longitud: Optional[float]
+    altitud: Optional[float]
+
+
+class CacheEstaciones:
+    """Estaciones de weather_stations por id.
+
+    - conocida(id) / verificar(fila): comprobación antes de escribir (sin lock).
+    - filtrar(validas, errores): aplica verificar() al resultado de validar_lote().
+    - ejecutar(conectar, ttl_s, detener): hilo de carga y recarga (LISTEN/NOTIFY + TTL).
+    """
+
+    def __init__(self, reloj: Callable[[], float] = time.monotonic):
+        self._estaciones: Optional[Dict[int, Estacion]] = None
+        self._cargada_en: Optional[float] = None
+        self._reloj = reloj
+
+    def __len__(self) -> int:
+        return len(self._estaciones or ())
+
+    @property
+    def cargada(self) -> bool:
+        return self._estaciones is not None
+
+    def edad_s(self) -> Optional[float]:
+        """Segundos desde la última recarga (None si aún no se ha cargado)."""
+        return None if self._cargada_en is None else self._reloj() - self._cargada_en
+
+    def reemplazar(self, filas: Iterable[tuple]) -> None:
+        """Sustituye el contenido por las filas de ESTACIONES_SQL."""
+        estaciones = {int(fila[0]): Estacion(*fila) for fila in filas}
+        self._estaciones = estaciones
+        self._cargada_en = self._reloj()
+        STATION_CACHE_SIZE.set(len(estaciones))
+
+    def get(self, id_station: int) -> Optional[Estacion]:
+        return (self._estaciones or {}).get(id_station)
+
+    def conocida(self, id_station: int) -> bool:
+        estaciones = self._estaciones
+        return estaciones is None or id_station in estaciones
+
+    def verificar(self, fila: tuple) -> tuple:
+        """Devuelve la fila (de normalizar()) o lanza ErrorValidacion si su estación no existe."""
+        if not self.conocida(fila[0]):
+            raise ErrorValidacion(ESTACION_DESCONOCIDA, "id_station", f"id_station {fila[0]} no existe en weather_stations.")
+        return fila
+
+    def filtrar(self, validas: List[Tuple[int, tuple]], errores: List[Tuple[int, ErrorValidacion]]
+                ) -> Tuple[List[Tuple[int, tuple]], List[Tuple[int, ErrorValidacion]]]:
+        """Pasa a `errores` las lecturas válidas de estaciones desconocidas (salida de validar_lote)."""
+        estaciones = self._estaciones
+        if estaciones is None or all(fila[0] in estaciones for _, fila in validas):
+            return validas, errores
+        conocidas, errores = [], list(errores)
+        for i, fila in validas:
+            try:
+                conocidas.append((i, self.verificar(fila)))
+            except ErrorValidacion as e:
+                errores.append((i, e))
+        errores.sort(key=lambda error: error[0])
+        return conocidas, errores
+
+    def cargar(self, conn, motivo: str) -> None:
+        with conn.cursor() as cur:
+            cur.execute(ESTACIONES_SQL)
+            self.reemplazar(cur.fetchall())
+        STATION_CACHE_REFRESHES.labels(trigger=motivo).inc()
+        logger.info("Caché de estaciones recargada (%s): %d estaciones.", motivo, len(self))
+
+    def ejecutar(self, conectar: Callable[[], Any], ttl_s: float, detener: Optional[threading.Event] = None) -> None:
+        """Carga la caché y la recarga con cada NOTIFY o cada `ttl_s`, hasta `detener`.
+
+        `conectar()` devuelve una conexión psycopg2 nueva; si falla se reintenta tras `ttl_s`
+        (como mucho 30 s) y la caché conserva la última carga.
+        """
+        detener = detener or threading.Event()
+        while not detener.is_set():
+            conn = None
+            try:
+                conn = conectar()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CANAL_ESTACIONES};")
+                # Tras LISTEN: un cambio entre la carga y la escucha no se pierde
+                self.cargar(conn, "inicio" if not self.cargada else "reconexion")
+                while not detener.is_set():
+                    listos, _, _ = select.select([conn], [], [], ttl_s)
+                    motivo = "ttl"
+                    if listos:
+                        conn.poll()
+                        if not conn.notifies:
+                            continue
+                        # Varios cambios seguidos se resuelven con una sola recarga
+                        conn.notifies.clear()
+                        motivo = "notify"
+                    self.cargar(conn, motivo)
+            except Exception as e:
+                STATION_CACHE_ERRORS.inc()
+                logger.warning("No se pudo cargar la caché de estaciones: %s", e)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            detener.wait(min(ttl_s, 30.0))
@@ -0,0 +1,212 @@
+# Validación y normalización de los payloads de estaciones meteorológicas.
+# Compartido por los motores síncrono y asyncio del consumidor.
+#
+# Las reglas se declaran una sola vez (ESQUEMA_WEATHER) y se compilan al importar el
+# módulo. Acepta el payload de cualquier formato de utils.encoding (las fechas pueden
+# llegar como cadena ISO 8601 o ya como datetime). Cada payload se recorre una única vez: se convierte, se valida y se devuelve la
+# tupla en el orden de columnas de weather_logs, lista para el INSERT/COPY, sin volver a
+# parsear fechas ni números.
+# - Ruta rápida: una función generada a partir del esquema con todas las conversiones y
+#   comparaciones en línea (sin llamadas por campo ni excepciones propias).
+# - Diagnóstico: si la ruta rápida rechaza el payload, se recorre campo a campo con las
+#   funciones compiladas de cada campo para devolver el código de error exacto.
+
+import logging
+from datetime import datetime
+from typing import Any, Callable, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("CONSUMER_LOG")
+
+
+# ==============================
+# CÓDIGOS DE ERROR
+# ==============================
+PAYLOAD_INVALIDO = "payload_invalido"      # El payload no es un objeto JSON
+CAMPO_FALTANTE = "campo_faltante"
+TIPO_INVALIDO = "tipo_invalido"            # No convertible al tipo del campo
+FECHA_INVALIDA = "fecha_invalida"          # No es una fecha ISO 8601
+FUERA_DE_RANGO = "fuera_de_rango"
+VALOR_NO_PERMITIDO = "valor_no_permitido"  # Fuera del conjunto de valores permitidos
+ESTACION_DESCONOCIDA = "estacion_desconocida"  # id_station no está en weather_stations (utils.stations)
+
+
+class ErrorValidacion(ValueError):
+    """Payload rechazado. `codigo` es uno de los códigos de error del módulo."""
+
+    def __init__(self, codigo: str, campo: Optional[str], mensaje: str):
+        super().__init__(mensaje)
+        self.codigo = codigo
+        self.campo = campo
+
+
+# ==============================
+# ESQUEMA DECLARATIVO
+# ==============================
+class Campo(NamedTuple):
+    nombre: str
+    tipo: type                                  # int, float, str o datetime
+    minimo: Optional[float] = None
+    maximo: Optional[float] = None
+    permitidos: Optional[FrozenSet[str]] = None  # Solo str: se comparan en mayúsculas
+
+
+# En el orden de las columnas de INSERT_SQL / COPY_SQL
+ESQUEMA_WEATHER: Tuple[Campo, ...] = (
+    Campo("id_station", int, 1, 9999),  # adaptar rango si se conoce
+    Campo("dates", datetime),
+    Campo("temperature_celsius", float, -50.0, 70.0),
+    Campo("humidity", float, 0.0, 100.0),
+    Campo("wind", str, permitidos=frozenset({"N", "S", "E", "W", "NE", "NW", "SE", "SW"})),
+    Campo("wind_speed", float, 0.0, 300.0),
+    Campo("pressure", float, 300.0, 1200.0),  # rango ampliado para seguridad
+)
+
+
+def _compilar_campo(campo: Campo) -> Callable[[Any], Any]:
+    """Devuelve la función que convierte y valida el valor de un campo."""
+    nombre, minimo, maximo = campo.nombre, campo.minimo, campo.maximo
+
+    if campo.tipo is datetime:
+        def convertir(valor):
+            if type(valor) is datetime:  # Formatos binarios (utils.encoding)
+                return valor
+            try:
+                return datetime.fromisoformat(valor)
+            except (TypeError, ValueError):
+                raise ErrorValidacion(FECHA_INVALIDA, nombre, f"{nombre}: formato de fecha inválido. Use ISO 8601.") from None
+        return convertir
+
+    if campo.permitidos is not None:
+        permitidos = campo.permitidos
+
+        def convertir(valor):
+            texto = str(valor).upper()
+            if texto not in permitidos:
+                raise ErrorValidacion(VALOR_NO_PERMITIDO, nombre, f"{nombre}: valor no permitido ({valor!r}).")
+            return texto
+        return convertir
+
+    tipo = campo.tipo
+    if minimo is None and maximo is None:
+        def convertir(valor):
+            try:
+                return tipo(valor)
+            except (TypeError, ValueError, OverflowError):
+                raise ErrorValidacion(TIPO_INVALIDO, nombre, f"{nombre}: se esperaba {tipo.__name__}.") from None
+        return convertir
+
+    minimo = float("-inf") if minimo is None else minimo
+    maximo = float("inf") if maximo is None else maximo
+
+    def convertir(valor):
+        try:
+            numero = tipo(valor)
+        except (TypeError, ValueError, OverflowError):
+            raise ErrorValidacion(TIPO_INVALIDO, nombre, f"{nombre}: se esperaba {tipo.__name__}.") from None
+        # `not (a <= x <= b)` también rechaza NaN
+        if not (minimo <= numero <= maximo):
+            raise ErrorValidacion(FUERA_DE_RANGO, nombre, f"{nombre} fuera de rango ({minimo:g} a {maximo:g}).")
+        return numero
+    return convertir
+
+
+class ValidadorCompilado:
+    """Validador construido una vez a partir de un esquema.
+
+    - normalizar(data): tupla lista para la DB o ErrorValidacion (función generada).
+    - validar(data): (fila, None) o (None, error), sin excepciones.
+    - validar_lote(payloads): ([(índice, fila)], [(índice, error)]) en una sola llamada.
+    """
+
+    def __init__(self, esquema: Iterable[Campo]):
+        self.esquema = tuple(esquema)
+        self._campos = tuple((c.nombre, _compilar_campo(c)) for c in self.esquema)
+        self.normalizar = self._generar_ruta_rapida()
+
+    def _generar_ruta_rapida(self) -> Callable[[Any], tuple]:
+        """Genera `normalizar(data)` con las conversiones y los rangos del esquema en línea."""
+        entorno = {"_diagnosticar": self._diagnosticar, "_fecha": datetime.fromisoformat, "_datetime": datetime}
+        conversiones, condiciones = [], []
+        for i, campo in enumerate(self.esquema):
+            valor = f"data[{campo.nombre!r}]"
+            if campo.tipo is datetime:
+                # Cadena ISO 8601 (JSON) o datetime ya decodificado (msgpack/struct)
+                conversiones.append(f"v{i} = {valor}")
+                conversiones.append(f"if type(v{i}) is not _datetime: v{i} = _fecha(v{i})")
+            elif campo.permitidos is not None:
+                entorno[f"_permitidos{i}"] = campo.permitidos
+                conversiones.append(f"v{i} = str({valor}).upper()")
+                condiciones.append(f"v{i} in _permitidos{i}")
+            else:
+                entorno[f"_tipo{i}"] = campo.tipo
+                conversiones.append(f"v{i} = _tipo{i}({valor})")
+                if campo.minimo is not None:
+                    entorno[f"_min{i}"] = campo.minimo
+                    condiciones.append(f"_min{i} <= v{i}")
+                if campo.maximo is not None:
+                    entorno[f"_max{i}"] = campo.maximo
+                    condiciones.append(f"v{i} <= _max{i}")
+        fila = ", ".join(f"v{i}" for i in range(len(self.esquema)))
+        codigo = "\n".join([
+            "def normalizar(data):",
+            "    if type(data) is dict:",
+            "        try:",
+            *(f"            {c}" for c in conversiones),
+            f"            if {' and '.join(condiciones) or 'True'}:",
+            f"                return ({fila},)",
+            "        except (KeyError, TypeError, ValueError, OverflowError):",
+            "            pass",
+            "    return _diagnosticar(data)",
+        ])
+        exec(compile(codigo, "<validador-compilado>", "exec"), entorno)
+        return entorno["normalizar"]
+
+    def _diagnosticar(self, data: Any) -> tuple:
+        """Ruta lenta campo a campo: lanza ErrorValidacion con el código del primer fallo."""
+        if type(data) is not dict:
+            raise ErrorValidacion(PAYLOAD_INVALIDO, None, "El payload debe ser un objeto JSON.")
+        try:
+            return tuple([convertir(data[nombre]) for nombre, convertir in self._campos])
+        except KeyError as e:
+            raise ErrorValidacion(CAMPO_FALTANTE, e.args[0], f"Falta campo requerido: {e.args[0]}") from None
+
+    def validar(self, data: Any) -> Tuple[Optional[tuple], Optional[ErrorValidacion]]:
+        try:
+            return self.normalizar(data), None
+        except ErrorValidacion as e:
+            return None, e
+
+    def validar_lote(self, payloads: Iterable[Any]) -> Tuple[List[Tuple[int, tuple]], List[Tuple[int, ErrorValidacion]]]:
+        validos, errores = [], []
+        normalizar = self.normalizar
+        for i, data in enumerate(payloads):
+            try:
+                validos.append((i, normalizar(data)))
+            except ErrorValidacion as e:
+                errores.append((i, e))
+        return validos, errores
+
+
+VALIDADOR_WEATHER = ValidadorCompilado(ESQUEMA_WEATHER)
+normalizar = VALIDADOR_WEATHER.normalizar
+validar_lote = VALIDADOR_WEATHER.validar_lote
+
+
+# ==============================
+# API ANTERIOR (compatibilidad)
+# ==============================
+def validar_datos(data: dict) -> bool:
+    """Valida rangos y tipos mínimos. Regresa True si válido, False si no.
+
+    Los motores del consumidor usan normalizar() directamente para no convertir dos veces.
+    """
+    _, error = VALIDADOR_WEATHER.validar(data)
+    if error is not None:
+        logger.error("Validación fallida: %s. Datos: %s", error, data)
+        return False
+    return True
+
+
+def normalizar_fila(data: dict) -> tuple:
+    """Convierte un payload validado en la tupla de columnas de weather_logs."""
+    return normalizar(data)
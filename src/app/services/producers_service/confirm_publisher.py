@@ -0,0 +1,220 @@
+# Publicador con confirmaciones del broker (publisher confirms) y ventana de mensajes en vuelo.
+# Usa pika.SelectConnection (asíncrono) para no bloquear esperando cada confirmación:
+# - Se mantienen hasta `ventana` mensajes publicados y aún sin confirmar.
+# - Cada `flush_interval_s` se publican en bloque los mensajes pendientes que quepan en la ventana.
+# - Basic.Ack (simple o múltiple) libera la ventana; Basic.Nack y los mensajes devueltos
+#   (mandatory=True sin cola enlazada) se reenvían hasta `max_reintentos` veces.
+# - Si la conexión cae, todo lo que estaba sin confirmar se vuelve a publicar (al menos una vez).
+
+import time
+import uuid
+import logging
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional
+
+import pika
+from pika.spec import Basic
+from prometheus_client import Counter, Gauge
+
+MESSAGES_CONFIRMED = Counter('messages_confirmed_total', 'Mensajes confirmados (Basic.Ack) por RabbitMQ')
+MESSAGES_REPUBLISHED = Counter('messages_republished_total', 'Mensajes reenviados tras Nack, devolución o reconexión', ['reason'])
+MESSAGES_FAILED = Counter('messages_publish_failed_total', 'Mensajes descartados tras agotar los reintentos')
+MESSAGES_IN_FLIGHT = Gauge('messages_in_flight', 'Mensajes publicados pendientes de confirmación')
+
+
+class MensajeSaliente:
+    """Mensaje a publicar. El message_id se mantiene entre reenvíos."""
+
+    __slots__ = ("body", "properties", "routing_key", "intentos", "devuelto", "no_antes_de", "enviado")
+
+    def __init__(self, body: bytes, properties: pika.BasicProperties, routing_key: str):
+        if properties.message_id is None:
+            properties.message_id = uuid.uuid4().hex
+        if properties.delivery_mode is None:
+            properties.delivery_mode = 2  # Persistente
+        self.body = body
+        self.properties = properties
+        self.routing_key = routing_key
+        self.intentos = 0
+        self.devuelto = False
+        self.no_antes_de = 0.0
+        self.enviado = 0.0
+
+
+class PublicadorConfirmado:
+    """Publica los mensajes entregados por `fuente` con confirmaciones y ventana acotada.
+
+    `fuente(n)` se llama en cada flush y devuelve como máximo `n` MensajeSaliente nuevos
+    (lista vacía si no hay nada que publicar todavía). `al_confirmar(msg, latencia_s)` se
+    llama por cada mensaje confirmado por el broker.
+    """
+
+    def __init__(self, params: pika.ConnectionParameters, exchange: str,
+                 fuente: Callable[[int], List[MensajeSaliente]],
+                 ventana: int = 100, flush_interval_s: float = 0.05,
+                 max_reintentos: int = 10, espera_reintento_s: float = 1.0,
+                 reconnect_delay_s: float = 5.0,
+                 al_confirmar: Optional[Callable[[MensajeSaliente, float], None]] = None):
+        self.params = params
+        self.exchange = exchange
+        self.fuente = fuente
+        self.ventana = max(1, ventana)
+        self.flush_interval_s = flush_interval_s
+        self.max_reintentos = max_reintentos
+        self.espera_reintento_s = espera_reintento_s
+        self.reconnect_delay_s = reconnect_delay_s
+        self.al_confirmar = al_confirmar
+
+        self._connection: Optional[pika.SelectConnection] = None
+        self._channel = None
+        self._deteniendo = False
+        # delivery tag de confirmación -> mensaje (en orden de publicación)
+        self._sin_confirmar: "OrderedDict[int, MensajeSaliente]" = OrderedDict()
+        self._por_id: Dict[str, MensajeSaliente] = {}
+        self._reenvios: Deque[MensajeSaliente] = deque()
+        self._seq = 0
+
+    @property
+    def en_vuelo(self) -> int:
+        """Mensajes sin confirmar o a la espera de reenvío."""
+        return len(self._sin_confirmar) + len(self._reenvios)
+
+    # ---- Ciclo de vida ----
+
+    def run(self) -> None:
+        """Bloquea publicando hasta detener(); reconecta si la conexión se pierde."""
+        while not self._deteniendo:
+            self._connection = pika.SelectConnection(
+                self.params,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_open_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            try:
+                self._connection.ioloop.start()
+            except KeyboardInterrupt:
+                self.detener()
+                # Procesa el cierre ordenado de la conexión
+                self._connection.ioloop.start()
+                break
+            if not self._deteniendo:
+                logging.warning("Conexión perdida. Reintentando en %.1f s...", self.reconnect_delay_s)
+                time.sleep(self.reconnect_delay_s)
+
+    def detener(self) -> None:
+        self._deteniendo = True
+        if self._connection is not None and not (self._connection.is_closing or self._connection.is_closed):
+            self._connection.close()
+
+    # ---- Conexión y canal ----
+
+    def _on_connection_open(self, connection) -> None:
+        logging.info("Conectado a RabbitMQ (modo confirmaciones). Abriendo canal...")
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error) -> None:
+        logging.error("No se pudo abrir la conexión: %s", error)
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason) -> None:
+        self._channel = None
+        # Lo que no se confirmó puede no haber llegado: se reenvía en la próxima conexión.
+        pendientes = list(self._sin_confirmar.values())
+        self._sin_confirmar.clear()
+        self._por_id.clear()
+        MESSAGES_IN_FLIGHT.set(0)
+        MESSAGES_REPUBLISHED.labels(reason="reconnect").inc(len(pendientes))
+        self._reenvios.extendleft(reversed(pendientes))
+        if pendientes:
+            logging.warning("Conexión cerrada (%s) con %d mensajes sin confirmar; se reenviarán.", reason, len(pendientes))
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel) -> None:
+        self._channel = channel
+        self._seq = 0  # Los delivery tags de confirmación empiezan en 1 en cada canal
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.add_on_return_callback(self._on_return)
+        channel.exchange_declare(
+            exchange=self.exchange, exchange_type='direct', durable=True,
+            callback=lambda _frame: channel.confirm_delivery(
+                ack_nack_callback=self._on_confirm, callback=self._on_confirm_ok
+            ),
+        )
+
+    def _on_channel_closed(self, channel, reason) -> None:
+        logging.warning("Canal cerrado: %s", reason)
+        if self._connection is not None and not (self._connection.is_closing or self._connection.is_closed):
+            self._connection.close()
+
+    def _on_confirm_ok(self, _frame) -> None:
+        logging.info("Confirmaciones activas. Ventana=%d, flush cada %.0f ms.", self.ventana, self.flush_interval_s * 1000)
+        self._flush()
+
+    # ---- Publicación ----
+
+    def _flush(self) -> None:
+        if self._channel is None or not self._channel.is_open:
+            return
+        libres = self.ventana - len(self._sin_confirmar)
+        ahora = time.monotonic()
+        # Primero los reenvíos cuyo tiempo de espera ya venció
+        while libres > 0 and self._reenvios and self._reenvios[0].no_antes_de <= ahora:
+            self._publicar(self._reenvios.popleft())
+            libres -= 1
+        if libres > 0:
+            for msg in self.fuente(libres):
+                self._publicar(msg)
+        self._connection.ioloop.call_later(self.flush_interval_s, self._flush)
+
+    def _publicar(self, msg: MensajeSaliente) -> None:
+        msg.intentos += 1
+        msg.devuelto = False
+        msg.enviado = time.monotonic()
+        self._channel.basic_publish(
+            exchange=self.exchange,
+            routing_key=msg.routing_key,
+            body=msg.body,
+            properties=msg.properties,
+            mandatory=True,  # Si ninguna cola lo recibe, el broker lo devuelve (Basic.Return)
+        )
+        self._seq += 1
+        self._sin_confirmar[self._seq] = msg
+        self._por_id[msg.properties.message_id] = msg
+        MESSAGES_IN_FLIGHT.set(len(self._sin_confirmar))
+
+    def _on_return(self, channel, method, properties, body) -> None:
+        # Llega antes que el Basic.Ack del mismo mensaje: se marca para reenviarlo entonces.
+        msg = self._por_id.get(properties.message_id)
+        if msg is not None:
+            msg.devuelto = True
+        logging.warning("Mensaje devuelto por el broker (%s): %s", method.reply_text, properties.message_id)
+
+    def _on_confirm(self, frame) -> None:
+        confirmacion = frame.method
+        tag = confirmacion.delivery_tag
+        if confirmacion.multiple:
+            tags = [t for t in self._sin_confirmar if t <= tag]
+        else:
+            tags = [tag] if tag in self._sin_confirmar else []
+
+        es_ack = isinstance(confirmacion, Basic.Ack)
+        ahora = time.monotonic()
+        for t in tags:
+            msg = self._sin_confirmar.pop(t)
+            self._por_id.pop(msg.properties.message_id, None)
+            if es_ack and not msg.devuelto:
+                MESSAGES_CONFIRMED.inc()
+                if self.al_confirmar is not None:
+                    self.al_confirmar(msg, ahora - msg.enviado)
+            else:
+                self._reintentar(msg, "return" if es_ack else "nack", ahora)
+        MESSAGES_IN_FLIGHT.set(len(self._sin_confirmar))
+
+    def _reintentar(self, msg: MensajeSaliente, motivo: str, ahora: float) -> None:
+        if msg.intentos >= self.max_reintentos:
+            MESSAGES_FAILED.inc()
+            logging.error("Mensaje %s descartado tras %d intentos (%s).", msg.properties.message_id, msg.intentos, motivo)
+            return
+        MESSAGES_REPUBLISHED.labels(reason=motivo).inc()
+        msg.no_antes_de = ahora + self.espera_reintento_s
+        self._reenvios.append(msg)
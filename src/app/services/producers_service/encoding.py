@@ -0,0 +1,154 @@
+# Codificación de las lecturas publicadas. El formato se indica en la propiedad AMQP
+# `content_type` y el consumidor decodifica cualquiera de los tres:
+# - application/json (por defecto): el objeto JSON de siempre (~190 bytes).
+# - application/msgpack: array MessagePack con los campos en orden fijo y la fecha como
+#   Timestamp nativo (~50 bytes).
+# - application/x-weather-struct: registro binario de tamaño fijo (28 bytes) con la fecha en
+#   segundos epoch. Temperatura, humedad, viento y presión van como float32, la misma
+#   precisión que las columnas REAL de weather_logs.
+#
+# Sobres: con PUBLISH_BATCH_SIZE > 1 cada mensaje lleva N lecturas en el mismo formato (array
+# JSON, array MessagePack o N registros struct concatenados) y la cabecera `x-readings: N`.
+# PUBLISH_COMPRESSION (zlib o gzip) comprime el cuerpo y lo indica en `content_encoding`.
+# Mantener sincronizado con consumers_service/utils/encoding.py.
+
+import gzip
+import json
+import time
+import zlib
+import struct
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import msgpack
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+CONTENT_TYPE_STRUCT = "application/x-weather-struct"
+
+# Orden de los campos en los formatos binarios (el de las columnas de weather_logs)
+CAMPOS = ("id_station", "dates", "temperature_celsius", "humidity", "wind", "wind_speed", "pressure")
+
+# versión, id_station, epoch, temperatura, humedad, código de viento, velocidad, presión
+VERSION_STRUCT = 1
+FORMATO_STRUCT = struct.Struct("<BHdffBff")
+VIENTOS = ("N", "S", "E", "W", "NE", "NW", "SE", "SW")
+_CODIGO_VIENTO = {v: i for i, v in enumerate(VIENTOS)}
+
+# Cabecera AMQP que marca un sobre y declara cuántas lecturas contiene
+HEADER_LECTURAS = "x-readings"
+
+# Cabecera con el instante de publicación (milisegundos Unix) puesto por el productor; el
+# consumidor la usa para medir el lag de extremo a extremo hasta el commit
+HEADER_PUBLICADO = "x-published-at-ms"
+
+COMPRESORES: Dict[str, Callable[[bytes], bytes]] = {
+    "zlib": zlib.compress,
+    "gzip": gzip.compress,
+}
+
+Codificador = Callable[[dict], Tuple[bytes, str]]
+# Lecturas -> (body, propiedades AMQP: content_type, content_encoding, headers)
+Empaquetador = Callable[[List[dict]], Tuple[bytes, dict]]
+
+
+def _a_datetime(valor) -> datetime:
+    """Fecha de la lectura con zona horaria (las ISO sin zona se interpretan como hora local)."""
+    fecha = valor if isinstance(valor, datetime) else datetime.fromisoformat(valor)
+    return fecha if fecha.tzinfo is not None else fecha.astimezone()
+
+
+def codificar_json(datos: dict) -> Tuple[bytes, str]:
+    return json.dumps(datos).encode(), CONTENT_TYPE_JSON
+
+
+def _valores(datos: dict) -> list:
+    valores = [datos[c] for c in CAMPOS]
+    valores[1] = _a_datetime(valores[1])
+    return valores
+
+
+def codificar_msgpack(datos: dict) -> Tuple[bytes, str]:
+    return msgpack.packb(_valores(datos), datetime=True), CONTENT_TYPE_MSGPACK
+
+
+def codificar_struct(datos: dict) -> Tuple[bytes, str]:
+    body = FORMATO_STRUCT.pack(
+        VERSION_STRUCT,
+        datos["id_station"],
+        _a_datetime(datos["dates"]).timestamp(),
+        datos["temperature_celsius"],
+        datos["humidity"],
+        _CODIGO_VIENTO[datos["wind"].upper()],
+        datos["wind_speed"],
+        datos["pressure"],
+    )
+    return body, CONTENT_TYPE_STRUCT
+
+
+CODIFICADORES: Dict[str, Codificador] = {
+    "json": codificar_json,
+    "msgpack": codificar_msgpack,
+    "struct": codificar_struct,
+}
+
+
+def obtener_codificador(nombre: str) -> Codificador:
+    """Codificador de PUBLISH_ENCODING ('json', 'msgpack' o 'struct')."""
+    try:
+        return CODIFICADORES[nombre.lower()]
+    except KeyError:
+        raise ValueError(f"PUBLISH_ENCODING no soportado: {nombre!r} (use json, msgpack o struct)") from None
+
+
+# ==============================
+# SOBRES (VARIAS LECTURAS POR MENSAJE)
+# ==============================
+def _sobre_json(lecturas: List[dict]) -> Tuple[bytes, str]:
+    return json.dumps(lecturas).encode(), CONTENT_TYPE_JSON
+
+
+def _sobre_msgpack(lecturas: List[dict]) -> Tuple[bytes, str]:
+    return msgpack.packb([_valores(d) for d in lecturas], datetime=True), CONTENT_TYPE_MSGPACK
+
+
+def _sobre_struct(lecturas: List[dict]) -> Tuple[bytes, str]:
+    return b"".join(codificar_struct(d)[0] for d in lecturas), CONTENT_TYPE_STRUCT
+
+
+SOBRES = {"json": _sobre_json, "msgpack": _sobre_msgpack, "struct": _sobre_struct}
+
+
+def obtener_empaquetador(formato: str, lecturas_por_mensaje: int = 1, compresion: Optional[str] = None) -> Empaquetador:
+    """Empaquetador de PUBLISH_ENCODING / PUBLISH_BATCH_SIZE / PUBLISH_COMPRESSION.
+
+    Con lecturas_por_mensaje == 1 cada lectura va sola (sin cabecera x-readings), igual que
+    con obtener_codificador(); si no, el empaquetador recibe la lista de lecturas del sobre.
+    """
+    codificar = obtener_codificador(formato)
+    sobre = SOBRES[formato.lower()]
+    compresion = (compresion or "none").lower()
+    if compresion not in ("none", *COMPRESORES):
+        raise ValueError(f"PUBLISH_COMPRESSION no soportado: {compresion!r} (use none, zlib o gzip)")
+    comprimir = COMPRESORES.get(compresion)
+
+    def empaquetar(lecturas: List[dict]) -> Tuple[bytes, dict]:
+        if lecturas_por_mensaje <= 1 and len(lecturas) == 1:
+            body, content_type = codificar(lecturas[0])
+            propiedades = {"content_type": content_type}
+        else:
+            body, content_type = sobre(lecturas)
+            propiedades = {"content_type": content_type, "headers": {HEADER_LECTURAS: len(lecturas)}}
+        if comprimir is not None:
+            body = comprimir(body)
+            propiedades["content_encoding"] = compresion
+        return body, propiedades
+
+    return empaquetar
+
+
+def sellar_publicacion(propiedades: dict) -> dict:
+    """Añade a las propiedades de empaquetar() la cabecera x-published-at-ms con el instante actual."""
+    headers = dict(propiedades.get("headers") or {})
+    headers[HEADER_PUBLICADO] = int(time.time() * 1000)
+    return {**propiedades, "headers": headers}
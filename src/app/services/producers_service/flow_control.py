@@ -0,0 +1,86 @@
+# Control de flujo pedido por el consumidor. Su autoescalado (consumers_service/utils/autoscaling.py)
+# publica cada AUTOSCALE_INTERVAL_S en el exchange fanout FLOW_CONTROL_EXCHANGE un JSON
+# {"factor": f, "depth": n, "ts": t} según la profundidad de la cola: 1 = publicar normal,
+# entre 0 y 1 = publicar más despacio (intervalo / f), 0 = pausar. ControlFlujo lo escucha en
+# un hilo propio con una cola exclusiva y temporal. Si deja de recibir señales durante
+# FLOW_SIGNAL_TTL_S (consumidor caído o sin autoescalado) vuelve a 1: un consumidor que
+# desaparece no deja a los productores pausados para siempre.
+
+import json
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+import pika
+from prometheus_client import Gauge
+
+FLOW_FACTOR = Gauge("producer_flow_factor", "Factor de publicación pedido por el consumidor (1 = normal, 0 = pausa)")
+FLOW_FACTOR.set(1.0)
+
+
+class ControlFlujo:
+    """Último factor de flujo recibido, con caducidad de `ttl_s` segundos."""
+
+    def __init__(self, params: pika.ConnectionParameters, exchange: str, ttl_s: float = 30.0,
+                 reconnect_delay_s: float = 5.0, reloj: Callable[[], float] = time.monotonic):
+        self.params = params
+        self.exchange = exchange
+        self.ttl_s = ttl_s
+        self.reconnect_delay_s = reconnect_delay_s
+        self._reloj = reloj
+        self._factor = 1.0
+        self._recibido: Optional[float] = None
+
+    @property
+    def factor(self) -> float:
+        if self._recibido is None or self._reloj() - self._recibido > self.ttl_s:
+            return 1.0
+        return self._factor
+
+    def actualizar(self, body: bytes) -> None:
+        """Registra una señal; las que no se pueden leer se ignoran."""
+        try:
+            factor = float(json.loads(body)["factor"])
+        except (ValueError, TypeError, KeyError):
+            logging.warning("Señal de flujo no válida: %r", body[:100])
+            return
+        factor = min(1.0, max(0.0, factor))
+        if factor != self.factor:
+            logging.info("Control de flujo: factor %.2f -> %.2f.", self.factor, factor)
+        self._factor = factor
+        self._recibido = self._reloj()
+        FLOW_FACTOR.set(factor)
+
+    def esperar(self, intervalo_s: float, dormir: Callable[[float], None] = time.sleep) -> None:
+        """Espera el intervalo entre publicaciones ajustado al factor; en pausa, hasta que se reanude.
+
+        `dormir` permite usar BlockingConnection.sleep para seguir atendiendo los heartbeats.
+        """
+        factor = self.factor
+        while factor <= 0:
+            dormir(min(1.0, self.ttl_s))
+            factor = self.factor
+        dormir(intervalo_s / factor)
+
+    def iniciar(self) -> "ControlFlujo":
+        threading.Thread(target=self.run, name="control-flujo", daemon=True).start()
+        return self
+
+    def run(self) -> None:
+        while True:
+            try:
+                connection = pika.BlockingConnection(self.params)
+                channel = connection.channel()
+                channel.exchange_declare(exchange=self.exchange, exchange_type='fanout', durable=True)
+                cola = channel.queue_declare(queue="", exclusive=True, auto_delete=True).method.queue
+                channel.queue_bind(queue=cola, exchange=self.exchange)
+                channel.basic_consume(
+                    queue=cola, auto_ack=True, on_message_callback=lambda ch, method, props, body: self.actualizar(body)
+                )
+                logging.info("Escuchando señales de control de flujo en '%s'.", self.exchange)
+                channel.start_consuming()
+            except pika.exceptions.AMQPError as e:
+                logging.warning("Control de flujo sin conexión: %s. Reintentando en %.1f s...", e, self.reconnect_delay_s)
+            FLOW_FACTOR.set(self.factor)
+            time.sleep(self.reconnect_delay_s)
@@ -0,0 +1,298 @@
+# Generador de carga sintética para dimensionar los consumidores antes de cada despliegue.
+# Publica a una tasa objetivo (mensajes/s) simulando miles de estaciones, con perfiles de
+# ráfaga y jitter, durante un tiempo fijo y opcionalmente repartido en varios procesos.
+# - Cada worker publica con PublicadorConfirmado: la latencia de publicación es el tiempo
+#   entre basic_publish y el Basic.Ack del broker.
+# - Los workers envían sus estadísticas por una cola al proceso principal, que las agrega
+#   y las expone en el servidor de Prometheus del producer (puerto 8001).
+
+import math
+import time
+import queue
+import random
+import logging
+import threading
+import multiprocessing as mp
+from typing import Callable, List, Optional
+
+import pika
+from prometheus_client import Gauge, Histogram
+
+from confirm_publisher import MensajeSaliente, PublicadorConfirmado
+from encoding import Empaquetador, obtener_empaquetador, sellar_publicacion
+from sharding import Enrutador
+
+LOAD_TARGET_RATE = Gauge('load_target_rate_messages_per_second', 'Tasa base objetivo del generador de carga')
+LOAD_ACHIEVED_RATE = Gauge('load_achieved_rate_messages_per_second', 'Mensajes confirmados por segundo en el último intervalo')
+LOAD_PUBLISH_LATENCY = Histogram(
+    'load_publish_latency_seconds', 'Latencia desde la publicación hasta el Basic.Ack del broker',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+LOAD_LATENCY_QUANTILE = Gauge(
+    'load_publish_latency_quantile_seconds', 'Percentiles de latencia de publicación en el último intervalo', ['quantile']
+)
+
+CUANTILES = (0.5, 0.95, 0.99)
+PERFILES = ("constant", "burst")
+GRACIA_FINAL_S = 10.0   # Espera máxima de confirmaciones pendientes al terminar la prueba
+REPORTE_WORKER_S = 1.0  # Cada cuánto envía un worker sus estadísticas al proceso principal
+MUESTRA_MAX = 100_000   # Latencias guardadas (muestreo de reservorio) para el resumen final
+
+# IDs reservados para las estaciones del generador de carga: solo existen en weather_stations
+# tras cargar init/load_test/seed_stations.sql (init.sql crea únicamente las estaciones reales)
+PRIMERA_ESTACION_CARGA = 9000
+MAX_ESTACIONES_CARGA = 1000
+
+
+def estaciones_carga(n: int) -> range:
+    """IDs de las `n` primeras estaciones de carga (como mucho MAX_ESTACIONES_CARGA)."""
+    return range(PRIMERA_ESTACION_CARGA, PRIMERA_ESTACION_CARGA + max(1, min(n, MAX_ESTACIONES_CARGA)))
+
+
+def percentil(ordenados: List[float], q: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, max(0, math.ceil(q * len(ordenados)) - 1))]
+
+
+class PerfilCarga:
+    """Tasa objetivo (mensajes/s) en función del tiempo transcurrido desde el inicio.
+
+    - constant: tasa base fija.
+    - burst: cada `periodo_rafaga_s` segundos la tasa se multiplica por `factor_rafaga`
+      durante `duracion_rafaga_s` segundos.
+    El jitter (0..1) varía aleatoriamente la tasa en ±jitter en cada cálculo.
+    """
+
+    def __init__(self, tasa: float, perfil: str = "constant", factor_rafaga: float = 5.0,
+                 duracion_rafaga_s: float = 2.0, periodo_rafaga_s: float = 10.0, jitter: float = 0.0):
+        if perfil not in PERFILES:
+            raise ValueError(f"Perfil de carga desconocido: {perfil} (use {', '.join(PERFILES)}).")
+        self.tasa_base = tasa
+        self.perfil = perfil
+        self.factor_rafaga = factor_rafaga
+        self.duracion_rafaga_s = duracion_rafaga_s
+        self.periodo_rafaga_s = max(periodo_rafaga_s, 1e-3)
+        self.jitter = min(max(jitter, 0.0), 1.0)
+
+    def tasa(self, t: float) -> float:
+        tasa = self.tasa_base
+        if self.perfil == "burst" and (t % self.periodo_rafaga_s) < self.duracion_rafaga_s:
+            tasa *= self.factor_rafaga
+        if self.jitter > 0:
+            tasa *= random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+        return max(tasa, 0.0)
+
+
+class CuboTokens:
+    """Convierte la tasa del perfil en mensajes a emitir en cada llamada (token bucket).
+
+    Los mensajes que no caben (ventana de confirmaciones llena) se acumulan hasta
+    `max_acumulado_s` segundos de tasa; lo que exceda se pierde y se refleja en la tasa lograda.
+    """
+
+    def __init__(self, perfil: PerfilCarga, max_acumulado_s: float = 1.0, inicio: Optional[float] = None):
+        self.perfil = perfil
+        self.max_acumulado_s = max_acumulado_s
+        self.inicio = self.ultimo = time.monotonic() if inicio is None else inicio
+        self.tokens = 0.0
+
+    def tomar(self, maximo: int, ahora: Optional[float] = None) -> int:
+        ahora = time.monotonic() if ahora is None else ahora
+        tasa = self.perfil.tasa(ahora - self.inicio)
+        tope = max(1.0, tasa * self.max_acumulado_s)
+        self.tokens = min(self.tokens + tasa * (ahora - self.ultimo), tope)
+        self.ultimo = ahora
+        n = min(maximo, int(self.tokens))
+        self.tokens -= n
+        return n
+
+
+def ejecutar_worker(indice: int, params: pika.ConnectionParameters, exchange: str, routing_key: str,
+                    generar: Callable[[int], dict], perfil: PerfilCarga, estaciones: int,
+                    duracion_s: float, opciones: dict, cola, detener,
+                    empaquetar: Optional[Empaquetador] = None, lecturas_por_mensaje: int = 1,
+                    enrutador: Optional[Enrutador] = None) -> None:
+    """Publica según `perfil` hasta agotar `duracion_s` (0 = sin límite) o hasta `detener`."""
+    cubo = CuboTokens(perfil)
+    empaquetar = empaquetar or obtener_empaquetador("json")
+    enrutador = enrutador or Enrutador(routing_key, 0, estaciones_carga(estaciones))
+    fin = cubo.inicio + duracion_s if duracion_s > 0 else math.inf
+    stats = {"generados": 0, "confirmados": 0, "latencias": []}
+    ultimo_reporte = cubo.inicio
+    fin_generacion: Optional[float] = None
+
+    def reportar(final: bool = False) -> None:
+        cola.put((indice, stats["generados"], stats["confirmados"], stats["latencias"], final))
+        stats.update(generados=0, confirmados=0, latencias=[])
+
+    def al_confirmar(msg: MensajeSaliente, latencia_s: float) -> None:
+        stats["confirmados"] += 1
+        stats["latencias"].append(latencia_s)
+
+    def fuente(maximo: int) -> List[MensajeSaliente]:
+        nonlocal ultimo_reporte, fin_generacion
+        ahora = time.monotonic()
+        if ahora - ultimo_reporte >= REPORTE_WORKER_S:
+            reportar()
+            ultimo_reporte = ahora
+        if fin_generacion is None and (ahora >= fin or detener.is_set()):
+            fin_generacion = ahora
+        if fin_generacion is not None:
+            # No genera más; espera las confirmaciones pendientes durante un período de gracia.
+            if publicador.en_vuelo == 0 or ahora - fin_generacion >= GRACIA_FINAL_S:
+                publicador.detener()
+            return []
+        mensajes = []
+        for _ in range(cubo.tomar(maximo, ahora)):
+            ids = enrutador.estaciones_sobre(lecturas_por_mensaje)
+            body, propiedades = empaquetar([generar(i) for i in ids])
+            mensajes.append(MensajeSaliente(
+                body, pika.BasicProperties(delivery_mode=2, **sellar_publicacion(propiedades)),
+                enrutador.routing_key(ids[0])
+            ))
+        stats["generados"] += len(mensajes)
+        return mensajes
+
+    publicador = PublicadorConfirmado(params, exchange, fuente, al_confirmar=al_confirmar, **opciones)
+    try:
+        publicador.run()
+    finally:
+        reportar(final=True)
+
+
+class GeneradorCarga:
+    """Reparte la tasa objetivo entre `procesos` workers y agrega sus estadísticas.
+
+    Con un único proceso el worker corre en un hilo; con más de uno, en procesos
+    hijos creados con fork. `al_confirmar(n)` se llama con cada lote de mensajes confirmados.
+    """
+
+    def __init__(self, params: pika.ConnectionParameters, exchange: str, routing_key: str,
+                 generar: Callable[[int], dict], tasa: float, estaciones: int = 1000,
+                 duracion_s: float = 60.0, procesos: int = 1, perfil: str = "constant",
+                 factor_rafaga: float = 5.0, duracion_rafaga_s: float = 2.0, periodo_rafaga_s: float = 10.0,
+                 jitter: float = 0.0, intervalo_reporte_s: float = 5.0, opciones_publicador: Optional[dict] = None,
+                 al_confirmar: Optional[Callable[[int], None]] = None,
+                 empaquetar: Optional[Empaquetador] = None, lecturas_por_mensaje: int = 1,
+                 enrutador: Optional[Enrutador] = None):
+        self.params = params
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.generar = generar
+        self.tasa = tasa
+        if estaciones > MAX_ESTACIONES_CARGA:
+            logging.warning("LOAD_STATIONS=%d supera las %d estaciones reservadas para carga; se usan %d.",
+                            estaciones, MAX_ESTACIONES_CARGA, MAX_ESTACIONES_CARGA)
+        self.estaciones = max(1, min(estaciones, MAX_ESTACIONES_CARGA))
+        self.duracion_s = duracion_s
+        self.procesos = max(1, procesos)
+        # Cada worker recibe una fracción de la tasa; las ráfagas coinciden en todos.
+        self.perfil = PerfilCarga(tasa / self.procesos, perfil, factor_rafaga, duracion_rafaga_s,
+                                  periodo_rafaga_s, jitter)
+        self.intervalo_reporte_s = intervalo_reporte_s
+        self.opciones_publicador = opciones_publicador or {}
+        self.al_confirmar = al_confirmar
+        # Sobres: cada mensaje lleva `lecturas_por_mensaje` lecturas; la tasa es de mensajes.
+        self.empaquetar = empaquetar
+        self.lecturas_por_mensaje = max(1, lecturas_por_mensaje)
+        # Colas por estación: routing key del shard y sobres con estaciones del mismo shard
+        self.enrutador = enrutador
+
+    def run(self) -> None:
+        if self.procesos == 1:
+            cola, detener = queue.Queue(), threading.Event()
+            crear = threading.Thread
+        else:
+            # fork: los hijos heredan `generar` sin volver a importar main.py (que abre el puerto 8001)
+            ctx = mp.get_context("fork")
+            cola, detener = ctx.Queue(), ctx.Event()
+            crear = ctx.Process
+
+        workers = [
+            crear(target=ejecutar_worker, name=f"carga-{i}", daemon=True, args=(
+                i, self.params, self.exchange, self.routing_key, self.generar, self.perfil,
+                self.estaciones, self.duracion_s, self.opciones_publicador, cola, detener,
+                self.empaquetar, self.lecturas_por_mensaje, self.enrutador))
+            for i in range(self.procesos)
+        ]
+        LOAD_TARGET_RATE.set(self.tasa)
+        logging.info("Generador de carga: %.0f msg/s (%s, %d lecturas/msg), %d estaciones, %s, %d worker(s).",
+                     self.tasa, self.perfil.perfil, self.lecturas_por_mensaje, self.estaciones,
+                     f"{self.duracion_s:g} s" if self.duracion_s > 0 else "sin límite", self.procesos)
+        for w in workers:
+            w.start()
+
+        inicio = time.monotonic()
+        activos = set(range(self.procesos))
+        total_generados = total_confirmados = 0
+        muestra: List[float] = []
+        vistas = 0
+        intervalo_confirmados, intervalo_latencias = 0, []
+        inicio_intervalo = inicio
+
+        def acumular(item) -> None:
+            nonlocal total_generados, total_confirmados, vistas, intervalo_confirmados
+            indice, generados, confirmados, latencias, final = item
+            total_generados += generados
+            total_confirmados += confirmados
+            intervalo_confirmados += confirmados
+            intervalo_latencias.extend(latencias)
+            for lat in latencias:
+                LOAD_PUBLISH_LATENCY.observe(lat)
+                # Muestreo de reservorio para los percentiles de toda la prueba
+                vistas += 1
+                if len(muestra) < MUESTRA_MAX:
+                    muestra.append(lat)
+                else:
+                    j = random.randrange(vistas)
+                    if j < MUESTRA_MAX:
+                        muestra[j] = lat
+            if confirmados and self.al_confirmar is not None:
+                self.al_confirmar(confirmados)
+            if final:
+                activos.discard(indice)
+
+        while activos:
+            try:
+                espera = max(0.1, inicio_intervalo + self.intervalo_reporte_s - time.monotonic())
+                acumular(cola.get(timeout=espera))
+            except queue.Empty:
+                # Un worker que murió sin su reporte final no debe bloquear el resumen.
+                activos = {i for i in activos if workers[i].is_alive()}
+            except KeyboardInterrupt:
+                logging.info("Deteniendo el generador de carga...")
+                detener.set()
+
+            ahora = time.monotonic()
+            if ahora - inicio_intervalo >= self.intervalo_reporte_s:
+                self._reportar(intervalo_confirmados / (ahora - inicio_intervalo), intervalo_latencias)
+                intervalo_confirmados, intervalo_latencias = 0, []
+                inicio_intervalo = ahora
+
+        for w in workers:
+            w.join(timeout=GRACIA_FINAL_S)
+        while True:
+            try:
+                acumular(cola.get_nowait())
+            except queue.Empty:
+                break
+
+        duracion = time.monotonic() - inicio
+        muestra.sort()
+        logging.info(
+            "Carga finalizada: %d generados, %d confirmados en %.1f s (%.1f msg/s). "
+            "Latencia p50=%.1f ms p95=%.1f ms p99=%.1f ms.",
+            total_generados, total_confirmados, duracion, total_confirmados / max(duracion, 1e-9),
+            *(percentil(muestra, q) * 1000 for q in CUANTILES)
+        )
+
+    def _reportar(self, tasa_lograda: float, latencias: List[float]) -> None:
+        latencias.sort()
+        LOAD_ACHIEVED_RATE.set(tasa_lograda)
+        valores = [percentil(latencias, q) for q in CUANTILES]
+        for q, v in zip(CUANTILES, valores):
+            LOAD_LATENCY_QUANTILE.labels(quantile=str(q)).set(v)
+        logging.info("Carga: objetivo %.0f msg/s, logrado %.1f msg/s, p50=%.1f ms p95=%.1f ms p99=%.1f ms.",
+                     self.tasa, tasa_lograda, *(v * 1000 for v in valores))
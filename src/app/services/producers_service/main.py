@@ -3,14 +3,20 @@
 # Incluye un mecanismo de reintento para la conexión inicial y métricas de Prometheus.
 
 import pika
-import json
 import random
 import time
 import logging
 import os
+import uuid
 from datetime import datetime
 from prometheus_client import Counter, start_http_server
 
+from confirm_publisher import MensajeSaliente, PublicadorConfirmado
+from encoding import obtener_empaquetador, sellar_publicacion
+from flow_control import ControlFlujo
+from load_generator import GeneradorCarga, estaciones_carga
+from sharding import Enrutador, declarar_colas_shard
+
 # ==========================
 # Configuración de logging
 # ==========================
@@ -38,15 +44,60 @@ RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")  # Debería ser 'rabbitmq' en docker-
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", 5672))
 RABBITMQ_EXCHANGE = os.getenv("RABBITMQ_EXCHANGE", "weather_exchange")
 ROUTING_KEY = os.getenv("ROUTING_KEY", "weather.data")
+# Colas particionadas por estación: 0 = cola única (routing key ROUTING_KEY); con N > 0 cada
+# lectura va a RABBITMQ_QUEUE.<k> según su id_station (mismo valor en el consumidor).
+RABBITMQ_QUEUE = os.getenv("RABBITMQ_QUEUE", "weather_queue")
+RABBITMQ_SHARDS = max(0, int(os.getenv("RABBITMQ_SHARDS", 0)))
+RABBIT_RECONNECT_DELAY = float(os.getenv("RABBIT_RECONNECT_DELAY", 5.0))
+
+# Intervalo entre lecturas generadas (segundos)
+PUBLISH_INTERVAL_S = float(os.getenv("PUBLISH_INTERVAL_S", 5))
+
+# Control de flujo: el autoescalado del consumidor pide publicar más despacio o pausar cuando
+# la cola crece (ver flow_control.py). La señal caduca a los FLOW_SIGNAL_TTL_S segundos.
+# No se aplica al generador de carga (PUBLISH_MODE=load), que mide la tasa que se le pide.
+FLOW_CONTROL_ENABLED = os.getenv("FLOW_CONTROL_ENABLED", "true").lower() == "true"
+FLOW_CONTROL_EXCHANGE = os.getenv("FLOW_CONTROL_EXCHANGE", "weather_flow_control")
+FLOW_SIGNAL_TTL_S = float(os.getenv("FLOW_SIGNAL_TTL_S", 30))
+
+# Codificación de los mensajes: 'json' (por defecto), 'msgpack' o 'struct' (registro binario
+# de tamaño fijo). Se indica en la propiedad content_type; el consumidor acepta las tres.
+PUBLISH_ENCODING = os.getenv("PUBLISH_ENCODING", "json").lower()
+# Sobres: lecturas por mensaje (1 = una lectura por mensaje, como siempre) y compresión
+# opcional del cuerpo ('none', 'zlib' o 'gzip'), para gateways que reenvían muchas estaciones.
+PUBLISH_BATCH_SIZE = max(1, int(os.getenv("PUBLISH_BATCH_SIZE", 1)))
+PUBLISH_COMPRESSION = os.getenv("PUBLISH_COMPRESSION", "none").lower()
+empaquetar = obtener_empaquetador(PUBLISH_ENCODING, PUBLISH_BATCH_SIZE, PUBLISH_COMPRESSION)
+
+# Modo de publicación: 'simple' (basic_publish sin confirmación), 'confirm'
+# (publisher confirms con ventana de mensajes en vuelo y reenvío de Nack/devueltos)
+# o 'load' (generador de carga sintética, también con confirmaciones)
+PUBLISH_MODE = os.getenv("PUBLISH_MODE", "simple").lower()
+PUBLISH_CONFIRM_WINDOW = int(os.getenv("PUBLISH_CONFIRM_WINDOW", 100))
+PUBLISH_FLUSH_INTERVAL_MS = float(os.getenv("PUBLISH_FLUSH_INTERVAL_MS", 50))
+PUBLISH_MAX_RETRIES = int(os.getenv("PUBLISH_MAX_RETRIES", 10))
+PUBLISH_RETRY_DELAY_S = float(os.getenv("PUBLISH_RETRY_DELAY_S", 1.0))
+
+# Generador de carga (PUBLISH_MODE=load)
+LOAD_RATE = float(os.getenv("LOAD_RATE", 1000))               # Tasa base objetivo (mensajes/s)
+LOAD_STATIONS = int(os.getenv("LOAD_STATIONS", 1000))         # Estaciones simuladas (IDs 9000.., máximo 1000)
+LOAD_DURATION_S = float(os.getenv("LOAD_DURATION_S", 60))     # 0 = sin límite
+LOAD_PROCESSES = int(os.getenv("LOAD_PROCESSES", 1))
+LOAD_PROFILE = os.getenv("LOAD_PROFILE", "constant").lower()  # constant | burst
+LOAD_BURST_FACTOR = float(os.getenv("LOAD_BURST_FACTOR", 5))
+LOAD_BURST_DURATION_S = float(os.getenv("LOAD_BURST_DURATION_S", 2))
+LOAD_BURST_PERIOD_S = float(os.getenv("LOAD_BURST_PERIOD_S", 10))
+LOAD_JITTER = float(os.getenv("LOAD_JITTER", 0))              # Variación aleatoria de la tasa (0..1)
+LOAD_REPORT_INTERVAL_S = float(os.getenv("LOAD_REPORT_INTERVAL_S", 5))
 
 # ==========================
 # Función generadora de datos
 # ==========================
-def generar_datos():
+def generar_datos(id_station=None):
     """Genera datos meteorológicos aleatorios simulando una estación."""
     return {
-        # Simula 5 estaciones diferentes (IDs del 1 al 5)
-        "id_station": random.randint(1, 5),
+        # Simula 5 estaciones diferentes (IDs del 1 al 5) salvo que se indique otra
+        "id_station": id_station if id_station is not None else random.randint(1, 5),
         # Marca de tiempo en formato ISO 8601 (requerido por la validación del consumidor)
         "dates": datetime.now().isoformat(),
         # Datos meteorológicos simulados dentro de rangos razonables
@@ -57,6 +108,28 @@ def generar_datos():
         "pressure": round(random.uniform(950, 1050), 2)
     }
 
+# Estaciones simuladas por generar_datos() (IDs del 1 al 5)
+enrutador = Enrutador(ROUTING_KEY, RABBITMQ_SHARDS, range(1, 6))
+
+
+def generar_mensaje():
+    """Genera PUBLISH_BATCH_SIZE lecturas de estaciones del mismo shard y las empaqueta en un
+    mensaje: (lecturas, body, propiedades, routing_key)."""
+    estaciones = enrutador.estaciones_sobre(PUBLISH_BATCH_SIZE)
+    lecturas = [generar_datos(estacion) for estacion in estaciones]
+    body, propiedades = empaquetar(lecturas)
+    # delivery_mode=2: el mensaje es persistente en la cola. El message_id permite al consumidor
+    # descartar reentregas y reenvíos del mismo mensaje (se conserva en los reenvíos).
+    # x-published-at-ms permite al consumidor medir el lag hasta el commit.
+    propiedades = sellar_publicacion(propiedades)
+    return lecturas, body, pika.BasicProperties(delivery_mode=2, message_id=uuid.uuid4().hex, **propiedades), \
+        enrutador.routing_key(estaciones[0])
+
+
+def describir(lecturas, body) -> str:
+    detalle = lecturas[0] if len(lecturas) == 1 else f"sobre con {len(lecturas)} lecturas"
+    return f"({PUBLISH_ENCODING}, {len(body)} bytes): {detalle}"
+
 # ==========================
 # Función de conexión con reintentos
 # ==========================
@@ -78,6 +151,106 @@ def connect_with_retry(params, max_attempts=None):
             # Duplica el tiempo de espera (hasta un máximo de 10 segundos)
             backoff = min(backoff * 2, 10)
 
+# ==========================
+# Publicación con confirmaciones
+# ==========================
+def fuente_periodica(intervalo_s: float, control=None):
+    """Devuelve una fuente para PublicadorConfirmado que genera una lectura cada intervalo_s
+    (dividido por el factor de `control`, si hay control de flujo; en pausa no genera nada)."""
+    proxima = time.monotonic()
+
+    def fuente(maximo: int):
+        nonlocal proxima
+        mensajes = []
+        ahora = time.monotonic()
+        factor = control.factor if control is not None else 1.0
+        if factor <= 0:
+            proxima = ahora  # Al reanudar no se recupera lo no generado durante la pausa
+            return mensajes
+        while len(mensajes) < maximo and ahora >= proxima:
+            lecturas, body, propiedades, routing_key = generar_mensaje()
+            mensajes.append(MensajeSaliente(body, propiedades, routing_key))
+            logging.info(f"Mensaje generado {describir(lecturas, body)}")
+            proxima += intervalo_s / factor
+        return mensajes
+
+    return fuente
+
+
+def iniciar_control_flujo(params):
+    """Arranca el hilo que escucha las señales de flujo (None si FLOW_CONTROL_ENABLED=false)."""
+    if not FLOW_CONTROL_ENABLED:
+        return None
+    return ControlFlujo(params, FLOW_CONTROL_EXCHANGE, FLOW_SIGNAL_TTL_S, RABBIT_RECONNECT_DELAY).iniciar()
+
+
+def main_confirmado(params):
+    """Publica con confirmaciones del broker: un mensaje solo cuenta como publicado cuando
+    RabbitMQ lo confirma (Basic.Ack) como persistido."""
+    def al_confirmar(msg, latencia_s):
+        MESSAGES_PUBLISHED.inc() # Solo cuenta lo que el broker confirmó
+
+    publicador = PublicadorConfirmado(
+        params,
+        RABBITMQ_EXCHANGE,
+        fuente_periodica(PUBLISH_INTERVAL_S, iniciar_control_flujo(params)),
+        ventana=PUBLISH_CONFIRM_WINDOW,
+        flush_interval_s=PUBLISH_FLUSH_INTERVAL_MS / 1000.0,
+        max_reintentos=PUBLISH_MAX_RETRIES,
+        espera_reintento_s=PUBLISH_RETRY_DELAY_S,
+        reconnect_delay_s=RABBIT_RECONNECT_DELAY,
+        al_confirmar=al_confirmar,
+    )
+    logging.info("Publicando con confirmaciones (ventana=%d, flush=%.0f ms)...", PUBLISH_CONFIRM_WINDOW, PUBLISH_FLUSH_INTERVAL_MS)
+    publicador.run()
+    logging.info("Servicio detenido.")
+
+
+def main_carga(params):
+    """Genera carga sintética a LOAD_RATE mensajes/s y reporta la tasa lograda y la latencia."""
+    generador = GeneradorCarga(
+        params,
+        RABBITMQ_EXCHANGE,
+        ROUTING_KEY,
+        generar_datos,
+        empaquetar=empaquetar,
+        enrutador=Enrutador(ROUTING_KEY, RABBITMQ_SHARDS, estaciones_carga(LOAD_STATIONS)),
+        lecturas_por_mensaje=PUBLISH_BATCH_SIZE,
+        tasa=LOAD_RATE,
+        estaciones=LOAD_STATIONS,
+        duracion_s=LOAD_DURATION_S,
+        procesos=LOAD_PROCESSES,
+        perfil=LOAD_PROFILE,
+        factor_rafaga=LOAD_BURST_FACTOR,
+        duracion_rafaga_s=LOAD_BURST_DURATION_S,
+        periodo_rafaga_s=LOAD_BURST_PERIOD_S,
+        jitter=LOAD_JITTER,
+        intervalo_reporte_s=LOAD_REPORT_INTERVAL_S,
+        opciones_publicador=dict(
+            ventana=PUBLISH_CONFIRM_WINDOW,
+            flush_interval_s=PUBLISH_FLUSH_INTERVAL_MS / 1000.0,
+            max_reintentos=PUBLISH_MAX_RETRIES,
+            espera_reintento_s=PUBLISH_RETRY_DELAY_S,
+            reconnect_delay_s=RABBIT_RECONNECT_DELAY,
+        ),
+        al_confirmar=MESSAGES_PUBLISHED.inc,
+    )
+    generador.run()
+
+
+def declarar_shards(params):
+    """Declara las colas de shard al arrancar (en todos los modos de publicación), para que lo
+    publicado antes de que arranquen los consumidores no se descarte por no tener cola."""
+    connection = connect_with_retry(params)
+    try:
+        channel = connection.channel()
+        channel.exchange_declare(exchange=RABBITMQ_EXCHANGE, exchange_type='direct', durable=True)
+        declarar_colas_shard(channel, RABBITMQ_EXCHANGE, RABBITMQ_QUEUE, ROUTING_KEY, RABBITMQ_SHARDS)
+        logging.info("Colas de shard declaradas: %s.0..%d.", RABBITMQ_QUEUE, RABBITMQ_SHARDS - 1)
+    finally:
+        connection.close()
+
+
 # ==========================
 # Función principal
 # ==========================
@@ -91,7 +264,19 @@ def main():
     )
     logging.info("Conectando a RabbitMQ en %s:%s con usuario '%s'...", 
                  RABBITMQ_HOST or "rabbitmq", RABBITMQ_PORT, RABBIT_USER or "guest")
+
+    if RABBITMQ_SHARDS:
+        declarar_shards(params)
+
+    if PUBLISH_MODE == "confirm":
+        main_confirmado(params)
+        return
+    if PUBLISH_MODE == "load":
+        main_carga(params)
+        return
     
+    control = iniciar_control_flujo(params)
+
     # Intenta la conexión hasta que tenga éxito
     connection = connect_with_retry(params)
     channel = connection.channel()
@@ -103,26 +288,28 @@ def main():
         durable=True # El exchange persistirá incluso si el broker cae
     )
 
-    logging.info(f"Conectado. Publicando mensajes en exchange '{RABBITMQ_EXCHANGE}' cada 5 segundos...")
+    logging.info(f"Conectado. Publicando mensajes en exchange '{RABBITMQ_EXCHANGE}' cada {PUBLISH_INTERVAL_S:g} segundos...")
 
     try:
         while True:
-            data = generar_datos()
-            message = json.dumps(data)
+            # Lectura (o sobre de lecturas) con su content_type/content_encoding
+            lecturas, body, propiedades, routing_key = generar_mensaje()
 
-            # Publicación del mensaje
+            # Publicación del mensaje (routing key del shard de sus estaciones)
             channel.basic_publish(
                 exchange=RABBITMQ_EXCHANGE,
-                routing_key=ROUTING_KEY,
-                body=message,
-                properties=pika.BasicProperties(
-                    delivery_mode=2  # Hace que el mensaje sea persistente en la cola
-                )
+                routing_key=routing_key,
+                body=body,
+                properties=propiedades
             )
 
             MESSAGES_PUBLISHED.inc() # Incrementa el contador de Prometheus
-            logging.info(f"Mensaje publicado: {message}")
-            time.sleep(5) # Espera 5 segundos antes de generar el siguiente dato
+            logging.info(f"Mensaje publicado {describir(lecturas, body)}")
+            # Espera antes de generar el siguiente dato (más, o hasta reanudar, si el consumidor lo pide)
+            if control is not None:
+                control.esperar(PUBLISH_INTERVAL_S, connection.sleep)
+            else:
+                time.sleep(PUBLISH_INTERVAL_S)
 
     except KeyboardInterrupt:
         logging.info("Servicio detenido manualmente.")
@@ -0,0 +1,73 @@
+# Enrutado a colas particionadas por estación (RABBITMQ_SHARDS = N > 0): cada lectura se
+# publica con la routing key `ROUTING_KEY.<k>`, k = shard_de(id_station, N), y va a la cola
+# `RABBITMQ_QUEUE.<k>`. Todas las lecturas de una estación comparten cola y llegan en orden;
+# los consumidores se reparten las colas. Un sobre solo lleva estaciones del mismo shard.
+# shard_de es jump consistent hash: cambiar N mueve ~1/N de las estaciones.
+# Mantener sincronizado con consumers_service/utils/sharding.py.
+
+import random
+from typing import Dict, List, Sequence
+
+# Argumentos de las colas de shard (deben coincidir en productor y consumidor)
+ARGUMENTOS_COLA_SHARD = {"x-single-active-consumer": True}
+
+_MASCARA_64 = (1 << 64) - 1
+
+
+def shard_de(id_station: int, n_shards: int) -> int:
+    """Shard (0..n_shards-1) de una estación con jump consistent hash."""
+    if n_shards <= 1:
+        return 0
+    clave = int(id_station) & _MASCARA_64
+    b, j = -1, 0
+    while j < n_shards:
+        b = j
+        clave = (clave * 2862933555777941757 + 1) & _MASCARA_64
+        j = int((b + 1) * ((1 << 31) / ((clave >> 33) + 1)))
+    return b
+
+
+def cola_shard(cola: str, shard: int) -> str:
+    return f"{cola}.{shard}"
+
+
+def routing_key_shard(routing_key: str, shard: int) -> str:
+    return f"{routing_key}.{shard}"
+
+
+def declarar_colas_shard(channel, exchange: str, cola: str, routing_key: str, n_shards: int) -> None:
+    """Declara y enlaza las colas de shard (pika BlockingChannel) para no perder lo publicado
+    antes de que arranque el consumidor."""
+    for shard in range(n_shards):
+        nombre = cola_shard(cola, shard)
+        channel.queue_declare(queue=nombre, durable=True, arguments=ARGUMENTOS_COLA_SHARD)
+        channel.queue_bind(exchange=exchange, queue=nombre, routing_key=routing_key_shard(routing_key, shard))
+
+
+class Enrutador:
+    """Routing key de cada lectura y estaciones del mismo shard para armar sobres.
+
+    Con n_shards == 0 todo va a la routing key única, como antes de particionar.
+    """
+
+    def __init__(self, routing_key: str, n_shards: int, estaciones: Sequence[int]):
+        self.routing_key_base = routing_key
+        self.n_shards = n_shards
+        self.estaciones = list(estaciones)
+        self._grupos: Dict[int, List[int]] = {}
+        for estacion in self.estaciones:
+            self._grupos.setdefault(self.shard(estacion), []).append(estacion)
+
+    def shard(self, id_station: int) -> int:
+        return shard_de(id_station, self.n_shards)
+
+    def routing_key(self, id_station: int) -> str:
+        if not self.n_shards:
+            return self.routing_key_base
+        return routing_key_shard(self.routing_key_base, self.shard(id_station))
+
+    def estaciones_sobre(self, n: int) -> List[int]:
+        """`n` estaciones al azar que comparten shard (la primera, uniforme entre todas)."""
+        primera = random.choice(self.estaciones)
+        grupo = self._grupos[self.shard(primera)]
+        return [primera] + [random.choice(grupo) for _ in range(n - 1)]
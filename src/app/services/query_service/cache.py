@@ -0,0 +1,64 @@
+# Caché de respuestas del servicio de consultas. Cada respuesta se guarda con la marca de
+# escritura del consumidor vigente al calcularla (weather_ingest_watermarks): en cuanto el
+# consumidor escribe filas nuevas la marca cambia y las entradas anteriores dejan de servirse.
+# El TTL acota además lo que puede durar una respuesta que depende del momento actual (p. ej.
+# "últimas 24 h" sin `to`), y la capacidad acota la memoria (LRU).
+#
+# Con el consumidor escribiendo sin pausa la marca avanza cada INGEST_WATERMARK_INTERVAL_S:
+# los paneles que piden lo mismo dentro de ese intervalo comparten una sola consulta.
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, NamedTuple, Optional
+
+
+class Entrada(NamedTuple):
+    valor: bytes
+    marca: Hashable
+    caduca: float
+
+
+class CacheRespuestas:
+    """LRU de como mucho `capacidad` respuestas con caducidad `ttl_s` (thread-safe).
+
+    - obtener(clave, marca): la respuesta si no ha caducado y se calculó con `marca`.
+    - guardar(clave, marca, valor): la registra (y descarta las menos usadas si no cabe).
+    Con capacidad 0 la caché está desactivada.
+    """
+
+    def __init__(self, capacidad: int, ttl_s: float, reloj: Callable[[], float] = time.monotonic):
+        self.capacidad = max(0, capacidad)
+        self.ttl_s = ttl_s
+        self._reloj = reloj
+        self._entradas: "OrderedDict[Hashable, Entrada]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def obtener(self, clave: Hashable, marca: Hashable) -> Optional[bytes]:
+        if not self.capacidad:
+            return None
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada.marca != marca or entrada.caduca <= self._reloj():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return entrada.valor
+
+    def guardar(self, clave: Hashable, marca: Hashable, valor: bytes) -> None:
+        if not self.capacidad:
+            return
+        with self._lock:
+            self._entradas[clave] = Entrada(valor, marca, self._reloj() + self.ttl_s)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+
+    def vaciar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
@@ -0,0 +1,390 @@
+# Servicio de consultas: API HTTP de solo lectura sobre los datos meteorológicos, para que los
+# paneles y los clientes no lancen SQL contra la base de ingesta. Endpoints (GET, JSON):
+#
+#   /stations                          estaciones y sus metadatos
+#   /stations/latest                   última lectura de cada estación (?station=1,2&max_age_s=)
+#   /stations/<id>/series              serie con downsampling (?from=&to=&step=5m | &points=500)
+#   /stations/<id>/aggregates          lecturas, media, mínimo y máximo del rango (?from=&to=)
+#   /export                            lecturas crudas en streaming (chunked), CSV o NDJSON
+#                                      (?station=&from=&to=&format=csv|ndjson)
+#   /health                            estado y marca de escritura
+#
+# Las fechas son ISO 8601 (sin zona = UTC); sin `to` se usa el momento actual y sin `from`
+# QUERY_DEFAULT_RANGE_S antes de `to`. Las respuestas (salvo /export y /health) se guardan en
+# una caché LRU con TTL invalidada por la marca de escritura del consumidor (cache.py).
+# QUERY_POSTGRES_HOST permite apuntar a una réplica de lectura.
+
+import io
+import os
+import re
+import csv
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Hashable, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import psycopg2
+from psycopg2.errors import QueryCanceled
+from psycopg2.pool import ThreadedConnectionPool
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from cache import CacheRespuestas
+from queries import (
+    COLUMNAS_ESTACION, COLUMNAS_LECTURA, COLUMNAS_SERIE, ESTACIONES_SQL, EXPORTAR_ESTACION_SQL, EXPORTAR_TODAS_SQL,
+    MARCA_SQL, SERIE_HORARIA_SQL, ULTIMAS_SQL, ErrorConsulta, alinear, consulta_agregados, consulta_serie,
+    filas_a_dicts, paso_serie, parsear_entero, parsear_estaciones, parsear_fecha, parsear_paso, rango,
+)
+
+# ==========================
+# Configuración de logging
+# ==========================
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# ==========================
+# Variables de entorno (.env)
+# ==========================
+POSTGRES_DB = os.getenv("POSTGRES_DB", "postgres_db")
+POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
+POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", 5432))
+POSTGRES_SSLMODE = os.getenv("POSTGRES_SSLMODE", "prefer")
+# Réplica de lectura si la hay; por defecto la misma base que el consumidor
+QUERY_POSTGRES_HOST = os.getenv("QUERY_POSTGRES_HOST") or os.getenv("POSTGRES_HOST", "localhost")
+
+QUERY_PORT = int(os.getenv("QUERY_PORT", 8090))
+QUERY_METRICS_PORT = int(os.getenv("QUERY_METRICS_PORT", 8002))
+QUERY_DB_POOL_SIZE = max(1, int(os.getenv("QUERY_DB_POOL_SIZE", 8)))
+QUERY_STATEMENT_TIMEOUT_MS = int(os.getenv("QUERY_STATEMENT_TIMEOUT_MS", 10000))
+
+# Caché de respuestas (0 = desactivada) y periodo de lectura de la marca de escritura
+QUERY_CACHE_SIZE = max(0, int(os.getenv("QUERY_CACHE_SIZE", 1000)))
+QUERY_CACHE_TTL_S = float(os.getenv("QUERY_CACHE_TTL_S", 30))
+QUERY_WATERMARK_POLL_S = float(os.getenv("QUERY_WATERMARK_POLL_S", 1.0))
+
+# Límites de las consultas
+QUERY_DEFAULT_RANGE_S = float(os.getenv("QUERY_DEFAULT_RANGE_S", 86400))
+QUERY_DEFAULT_POINTS = int(os.getenv("QUERY_DEFAULT_POINTS", 500))
+QUERY_MAX_POINTS = int(os.getenv("QUERY_MAX_POINTS", 5000))
+QUERY_LATEST_MAX_AGE_S = int(os.getenv("QUERY_LATEST_MAX_AGE_S", 86400))
+QUERY_EXPORT_MAX_RANGE_S = float(os.getenv("QUERY_EXPORT_MAX_RANGE_S", 31 * 86400))
+QUERY_EXPORT_FETCH_ROWS = int(os.getenv("QUERY_EXPORT_FETCH_ROWS", 5000))
+
+# Lecturas crudas conservadas por retention.py (0 = todas): dentro de ese periodo las series
+# se calculan sobre weather_logs aunque la hora ya esté agregada
+RETENTION_RAW_DAYS = max(0, int(os.getenv("RETENTION_RAW_DAYS", 30)))
+RETENCION_CRUDA = timedelta(days=RETENTION_RAW_DAYS) if RETENTION_RAW_DAYS else None
+
+# ==========================
+# Métricas Prometheus
+# ==========================
+QUERY_REQUESTS = Counter('query_requests_total', 'Peticiones atendidas por endpoint y código HTTP', ['endpoint', 'status'])
+QUERY_SECONDS = Histogram(
+    'query_request_seconds', 'Duración de las peticiones por endpoint', ['endpoint'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+QUERY_CACHE = Counter('query_cache_total', 'Consultas resueltas por la caché (hit), calculadas (miss) o sin caché (bypass)', ['result'])
+QUERY_CACHE_ENTRIES = Gauge('query_cache_entries', 'Respuestas en la caché')
+QUERY_EXPORT_ROWS = Counter('query_export_rows_total', 'Filas enviadas por /export')
+
+cache = CacheRespuestas(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_S)
+QUERY_CACHE_ENTRIES.set_function(lambda: len(cache))
+
+# ==========================
+# Pool de conexiones (solo lectura)
+# ==========================
+_pool: Optional[ThreadedConnectionPool] = None
+# ThreadedConnectionPool falla en vez de esperar si no quedan conexiones: el semáforo hace esperar
+_huecos = threading.BoundedSemaphore(QUERY_DB_POOL_SIZE)
+
+
+def crear_pool() -> ThreadedConnectionPool:
+    """Pool de conexiones de solo lectura en UTC, con statement_timeout (reintenta al arrancar)."""
+    espera = 0.5
+    while True:
+        try:
+            return ThreadedConnectionPool(
+                1, QUERY_DB_POOL_SIZE,
+                dbname=POSTGRES_DB, user=POSTGRES_USER, password=POSTGRES_PASSWORD,
+                host=QUERY_POSTGRES_HOST, port=POSTGRES_PORT, sslmode=POSTGRES_SSLMODE,
+                application_name="weather_query",
+                options=f"-c default_transaction_read_only=on -c statement_timeout={QUERY_STATEMENT_TIMEOUT_MS} -c timezone=UTC",
+            )
+        except psycopg2.OperationalError as e:
+            logging.warning("No se puede conectar a PostgreSQL (%s): %s. Reintentando...", QUERY_POSTGRES_HOST, e)
+            time.sleep(espera)
+            espera = min(espera * 2, 10)
+
+
+@contextmanager
+def conexion():
+    """Presta una conexión del pool; se descarta si se perdió la conexión."""
+    with _huecos:
+        conn = _pool.getconn()
+        try:
+            yield conn
+        finally:
+            if not conn.closed:
+                try:
+                    conn.rollback()  # Cierra la transacción de lectura
+                except psycopg2.Error:
+                    pass
+            _pool.putconn(conn, close=bool(conn.closed))
+
+
+def consultar(sql: str, parametros=None) -> list:
+    with conexion() as conn, conn.cursor() as cur:
+        cur.execute(sql, parametros)
+        return cur.fetchall()
+
+
+# ==========================
+# Marca de escritura
+# ==========================
+# Cambia cuando el consumidor escribe filas nuevas o retention.py agrega; None = desconocida
+# (sin ella no se usa la caché).
+_marca: Optional[Hashable] = None
+
+
+def vigilar_marca() -> None:
+    """Lee la marca de escritura cada QUERY_WATERMARK_POLL_S (hilo en segundo plano)."""
+    global _marca
+    while True:
+        try:
+            _marca = tuple(consultar(MARCA_SQL)[0])
+        except psycopg2.Error as e:
+            if _marca is not None:
+                logging.warning("No se pudo leer la marca de escritura (caché en pausa): %s", e)
+            _marca = None
+        time.sleep(QUERY_WATERMARK_POLL_S)
+
+
+def cacheado(clave: Hashable, calcular: Callable[[], bytes]) -> tuple:
+    """(cuerpo, resultado de la caché): la respuesta guardada con la marca vigente o calcular()."""
+    marca = _marca
+    if marca is None or not QUERY_CACHE_SIZE:
+        return calcular(), "bypass"
+    cuerpo = cache.obtener(clave, marca)
+    if cuerpo is not None:
+        return cuerpo, "hit"
+    cuerpo = calcular()
+    cache.guardar(clave, marca, cuerpo)
+    return cuerpo, "miss"
+
+
+# ==========================
+# Endpoints
+# ==========================
+def _json(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    raise TypeError(f"No serializable: {type(valor).__name__}")
+
+
+def a_json(datos) -> bytes:
+    return json.dumps(datos, default=_json, ensure_ascii=False).encode("utf-8")
+
+
+def _uno(params: Dict[str, List[str]], nombre: str) -> Optional[str]:
+    valores = params.get(nombre)
+    return valores[-1] if valores else None
+
+
+def _rango(params: Dict[str, List[str]], por_defecto_s: float) -> tuple:
+    return rango(parsear_fecha(_uno(params, "from")), parsear_fecha(_uno(params, "to")),
+                 datetime.now(timezone.utc), timedelta(seconds=por_defecto_s))
+
+
+def estaciones(params, estacion=None) -> bytes:
+    return a_json({"stations": filas_a_dicts(COLUMNAS_ESTACION, consultar(ESTACIONES_SQL))})
+
+
+def ultimas(params, estacion=None) -> bytes:
+    max_edad = parsear_entero(_uno(params, "max_age_s"), "max_age_s", QUERY_LATEST_MAX_AGE_S)
+    filas = consultar(ULTIMAS_SQL, {
+        "max_edad": timedelta(seconds=max_edad), "estaciones": parsear_estaciones(params.get("station", [])),
+    })
+    return a_json({"max_age_s": max_edad, "readings": filas_a_dicts(COLUMNAS_LECTURA, filas)})
+
+
+def serie(params, estacion: int) -> bytes:
+    desde, hasta = _rango(params, QUERY_DEFAULT_RANGE_S)
+    puntos = parsear_entero(_uno(params, "points"), "points", QUERY_DEFAULT_POINTS, maximo=QUERY_MAX_POINTS)
+    paso = paso_serie(desde, hasta, parsear_paso(_uno(params, "step")), puntos, QUERY_MAX_POINTS)
+    desde, hasta = alinear(desde, hasta, paso)
+    sql, parametros = consulta_serie(estacion, desde, hasta, paso, retencion=RETENCION_CRUDA)
+    return a_json({
+        "station": estacion, "from": desde, "to": hasta, "step_s": int(paso.total_seconds()),
+        "source": "hourly" if sql is SERIE_HORARIA_SQL else "raw",
+        "points": filas_a_dicts(COLUMNAS_SERIE, consultar(sql, parametros)),
+    })
+
+
+def agregados(params, estacion: int) -> bytes:
+    desde, hasta = _rango(params, QUERY_DEFAULT_RANGE_S)
+    sql, parametros = consulta_agregados(estacion, desde, hasta, retencion=RETENCION_CRUDA)
+    filas = filas_a_dicts(COLUMNAS_SERIE, consultar(sql, parametros))
+    resumen = filas[0] if filas else {"readings": 0}
+    resumen.pop("bucket", None)
+    return a_json({
+        "station": estacion, "from": desde, "to": hasta,
+        "source": "hourly" if sql is SERIE_HORARIA_SQL else "raw", **resumen,
+    })
+
+
+# patrón, nombre del endpoint (métricas), función(params, estación)
+RUTAS = (
+    (re.compile(r"^/stations/?$"), "stations", estaciones),
+    (re.compile(r"^/stations/latest/?$"), "latest", ultimas),
+    (re.compile(r"^/stations/(\d+)/series/?$"), "series", serie),
+    (re.compile(r"^/stations/(\d+)/aggregates/?$"), "aggregates", agregados),
+)
+
+
+class Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Necesario para Transfer-Encoding: chunked y keep-alive
+    server_version = "weather-query/1.0"
+
+    def log_message(self, formato, *args):
+        logging.debug("%s - %s", self.address_string(), formato % args)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        endpoint = "desconocido"
+        inicio = time.perf_counter()
+        estado = 200
+        self._enviando = False  # True una vez enviadas las cabeceras de una exportación
+        try:
+            if url.path == "/health":
+                endpoint = "health"
+                self._responder(200, a_json({"status": "ok", "watermark": _marca}))
+            elif url.path.rstrip("/") == "/export":
+                endpoint = "export"
+                self._exportar(params)
+            else:
+                for patron, nombre, funcion in RUTAS:
+                    coincidencia = patron.match(url.path)
+                    if coincidencia:
+                        endpoint = nombre
+                        estacion = int(coincidencia.group(1)) if coincidencia.groups() else None
+                        clave = (url.path.rstrip("/"), tuple(sorted((k, tuple(v)) for k, v in params.items())))
+                        cuerpo, resultado = cacheado(clave, lambda: funcion(params, estacion))
+                        QUERY_CACHE.labels(result=resultado).inc()
+                        self._responder(200, cuerpo, {"X-Cache": resultado.upper()})
+                        break
+                else:
+                    estado = 404
+                    self._responder(404, a_json({"error": f"Ruta no encontrada: {url.path}"}))
+        except ErrorConsulta as e:
+            estado = self._fallar(400, str(e))
+        except QueryCanceled:
+            estado = self._fallar(504, "La consulta superó QUERY_STATEMENT_TIMEOUT_MS.")
+        except psycopg2.Error as e:
+            logging.warning("Error de PostgreSQL en %s: %s", url.path, e)
+            estado = self._fallar(503, "Base de datos no disponible.")
+        except (BrokenPipeError, ConnectionResetError):
+            estado = 499  # El cliente cerró la conexión (p. ej. a mitad de una exportación)
+            self.close_connection = True
+        finally:
+            QUERY_REQUESTS.labels(endpoint=endpoint, status=str(estado)).inc()
+            QUERY_SECONDS.labels(endpoint=endpoint).observe(time.perf_counter() - inicio)
+
+    def _fallar(self, estado: int, mensaje: str) -> int:
+        """Responde con el error; a mitad de una exportación solo se puede cortar la conexión
+        (el cliente lo detecta por la falta del trozo final)."""
+        if self._enviando:
+            self.close_connection = True
+        else:
+            self._responder(estado, a_json({"error": mensaje}))
+        return estado
+
+    def _responder(self, estado: int, cuerpo: bytes, cabeceras: Optional[dict] = None) -> None:
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        if estado == 200:
+            self.send_header("Cache-Control", f"max-age={int(QUERY_CACHE_TTL_S)}")
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _exportar(self, params) -> None:
+        """Lecturas crudas en trozos (Transfer-Encoding: chunked) leídas con un cursor del
+        servidor: la memoria no depende del tamaño de la exportación."""
+        formato = (_uno(params, "format") or "csv").lower()
+        if formato not in ("csv", "ndjson"):
+            raise ErrorConsulta("format debe ser csv o ndjson.")
+        desde, hasta = _rango(params, QUERY_DEFAULT_RANGE_S)
+        if (hasta - desde).total_seconds() > QUERY_EXPORT_MAX_RANGE_S:
+            raise ErrorConsulta(f"Rango demasiado grande (máximo {QUERY_EXPORT_MAX_RANGE_S:.0f} s).")
+        estacion = parsear_entero(_uno(params, "station"), "station", maximo=2 ** 31 - 1)
+        sql = EXPORTAR_TODAS_SQL if estacion is None else EXPORTAR_ESTACION_SQL
+
+        with conexion() as conn, conn.cursor(name="exportar") as cur:
+            cur.itersize = QUERY_EXPORT_FETCH_ROWS
+            cur.execute(sql, {"estacion": estacion, "desde": desde, "hasta": hasta})
+            filas = cur.fetchmany(QUERY_EXPORT_FETCH_ROWS)  # Los errores llegan antes de las cabeceras
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self._enviando = True
+            if formato == "csv":
+                self._trozo((",".join(COLUMNAS_LECTURA) + "\r\n").encode("utf-8"))
+            while filas:
+                self._trozo(_serializar(filas, formato))
+                QUERY_EXPORT_ROWS.inc(len(filas))
+                filas = cur.fetchmany(QUERY_EXPORT_FETCH_ROWS)
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _trozo(self, datos: bytes) -> None:
+        self.wfile.write(f"{len(datos):X}\r\n".encode("ascii") + datos + b"\r\n")
+
+
+def _serializar(filas: list, formato: str) -> bytes:
+    if formato == "ndjson":
+        return b"".join(a_json(dict(zip(COLUMNAS_LECTURA, fila))) + b"\n" for fila in filas)
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    for fila in filas:
+        escritor.writerow([valor.isoformat() if isinstance(valor, datetime) else valor for valor in fila])
+    return salida.getvalue().encode("utf-8")
+
+
+# ==========================
+# Función principal
+# ==========================
+def main():
+    global _pool
+    start_http_server(QUERY_METRICS_PORT)
+    logging.info("Servidor de métricas Prometheus iniciado en puerto %d", QUERY_METRICS_PORT)
+    _pool = crear_pool()
+    threading.Thread(target=vigilar_marca, name="marca", daemon=True).start()
+
+    servidor = ThreadingHTTPServer(("0.0.0.0", QUERY_PORT), Manejador)
+    servidor.daemon_threads = True
+    logging.info("API de consultas en el puerto %d (PostgreSQL en %s, caché de %d respuestas, TTL %.0f s).",
+                 QUERY_PORT, QUERY_POSTGRES_HOST, QUERY_CACHE_SIZE, QUERY_CACHE_TTL_S)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Servicio detenido manualmente.")
+    finally:
+        servidor.server_close()
+        _pool.closeall()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# Consultas del servicio de lectura sobre las tablas que escriben el consumidor y retention.py.
+# Todas usan índices existentes (init/init.sql):
+# - Última lectura por estación: un recorrido inverso del índice único (id_station, dates) por
+#   estación (LATERAL ... LIMIT 1), acotado a las particiones de los últimos `max_age_s`.
+# - Series y agregados de una estación: el mismo índice sobre weather_logs y la clave primaria
+#   (id_station, bucket) de weather_logs_hourly. Con pasos de horas enteras lo que ya no
+#   conserva lecturas crudas (anterior a RETENTION_RAW_DAYS y a la marca de agua 'hourly' de
+#   weather_rollup_watermarks) se lee de weather_logs_hourly y el resto de weather_logs, así
+#   que las series largas funcionan aunque retention.py ya haya borrado las lecturas crudas y
+#   las lecturas tardías cuentan aunque su hora aún no se haya reagregado.
+# - Exportación: rango de fechas (poda de particiones) con cursor del servidor.
+# El downsampling se hace en PostgreSQL con date_bin (media, mínimo y máximo por intervalo).
+
+import math
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+ORIGEN = datetime(1970, 1, 1, tzinfo=timezone.utc)
+HORA = timedelta(hours=1)
+
+# Prefijo de columna en la salida (como weather_logs_hourly) -> columna de weather_logs
+MAGNITUDES = (
+    ("temperature", "temperature_celsius"),
+    ("humidity", "humidity"),
+    ("wind_speed", "wind_speed"),
+    ("pressure", "pressure"),
+)
+COLUMNAS_SERIE = ("bucket", "readings") + tuple(
+    f"{nombre}_{estadistica}" for nombre, _ in MAGNITUDES for estadistica in ("avg", "min", "max")
+)
+COLUMNAS_LECTURA = ("id_station", "dates", "temperature_celsius", "humidity", "wind", "wind_speed", "pressure")
+COLUMNAS_ESTACION = ("id", "name", "city", "country", "latitude", "longitude", "altitude")
+
+# Pasos "redondos" (s) entre los que se elige cuando solo se indica el número de puntos
+PASOS = (1, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400, 604800)
+
+_UNIDADES = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_PASO = re.compile(r"^\s*(\d+)\s*([smhd]?)\s*$")
+
+
+class ErrorConsulta(ValueError):
+    """Parámetros no válidos: el servidor responde 400 con el mensaje."""
+
+
+# ==============================
+# PARÁMETROS
+# ==============================
+
+def parsear_fecha(texto: Optional[str], por_defecto: Optional[datetime] = None) -> Optional[datetime]:
+    """Fecha ISO 8601 (sin zona = UTC)."""
+    if texto is None or texto == "":
+        return por_defecto
+    try:
+        fecha = datetime.fromisoformat(texto.replace("Z", "+00:00"))
+    except ValueError:
+        raise ErrorConsulta(f"Fecha no válida: {texto!r}. Use ISO 8601.") from None
+    return fecha if fecha.tzinfo is not None else fecha.replace(tzinfo=timezone.utc)
+
+
+def parsear_entero(texto: Optional[str], nombre: str, por_defecto: Optional[int] = None,
+                   minimo: int = 1, maximo: Optional[int] = None) -> Optional[int]:
+    if texto is None or texto == "":
+        return por_defecto
+    try:
+        valor = int(texto)
+    except ValueError:
+        raise ErrorConsulta(f"{nombre}: se esperaba un entero.") from None
+    if valor < minimo or (maximo is not None and valor > maximo):
+        raise ErrorConsulta(f"{nombre} fuera de rango ({minimo} a {maximo if maximo is not None else '∞'}).")
+    return valor
+
+
+def parsear_estaciones(valores: List[str]) -> Optional[List[int]]:
+    """?station=1&station=2 o ?station=1,2 -> [1, 2]; sin el parámetro, None (todas)."""
+    ids = [parte for valor in valores for parte in valor.split(",") if parte.strip()]
+    if not ids:
+        return None
+    return sorted({parsear_entero(i.strip(), "station", maximo=2 ** 31 - 1) for i in ids})
+
+
+def parsear_paso(texto: Optional[str]) -> Optional[timedelta]:
+    """'90', '90s', '5m', '1h' o '1d' -> timedelta (None si no se indica)."""
+    if texto is None or texto == "":
+        return None
+    coincidencia = _PASO.match(texto)
+    if not coincidencia or int(coincidencia.group(1)) == 0:
+        raise ErrorConsulta(f"step no válido: {texto!r}. Ejemplos: 60, 30s, 5m, 1h, 1d.")
+    return timedelta(seconds=int(coincidencia.group(1)) * _UNIDADES[coincidencia.group(2) or "s"])
+
+
+def rango(desde: Optional[datetime], hasta: Optional[datetime], ahora: datetime,
+          por_defecto: timedelta) -> tuple:
+    """(desde, hasta) con `hasta` = ahora y `desde` = hasta - por_defecto si faltan."""
+    hasta = hasta or ahora
+    desde = desde or hasta - por_defecto
+    if desde >= hasta:
+        raise ErrorConsulta("from debe ser anterior a to.")
+    return desde, hasta
+
+
+def paso_serie(desde: datetime, hasta: datetime, paso: Optional[timedelta], puntos: int,
+               max_puntos: int) -> timedelta:
+    """Paso del downsampling: el indicado o el menor paso redondo que deja como mucho `puntos`."""
+    segundos = (hasta - desde).total_seconds()
+    if paso is None:
+        minimo = segundos / max(1, puntos)
+        paso = timedelta(seconds=next((p for p in PASOS if p >= minimo), math.ceil(minimo / 86400) * 86400))
+    if segundos / paso.total_seconds() > max_puntos:
+        raise ErrorConsulta(f"Demasiados puntos ({math.ceil(segundos / paso.total_seconds())}); "
+                            f"como máximo {max_puntos}. Aumente step o reduzca el rango.")
+    return paso
+
+
+def alinear(desde: datetime, hasta: datetime, paso: timedelta) -> tuple:
+    """Amplía el rango a intervalos completos de `paso` (contados desde ORIGEN)."""
+    desde = desde - (desde - ORIGEN) % paso
+    resto = (hasta - ORIGEN) % paso
+    return desde, hasta + (paso - resto if resto else timedelta(0))
+
+
+def usa_horarios(desde: datetime, hasta: datetime, paso: timedelta, origen: datetime = ORIGEN) -> bool:
+    """Se puede leer de weather_logs_hourly si rango e intervalos son horas enteras alineadas."""
+    return paso % HORA == timedelta(0) and all((x - ORIGEN) % HORA == timedelta(0) for x in (desde, hasta, origen))
+
+
+# ==============================
+# SQL
+# ==============================
+
+def _estadisticas_crudas() -> str:
+    return ",\n       ".join(
+        f"avg({columna}) AS {nombre}_avg, min({columna}) AS {nombre}_min, max({columna}) AS {nombre}_max"
+        for nombre, columna in MAGNITUDES
+    )
+
+
+def _estadisticas_combinadas() -> str:
+    # Media ponderada por lecturas de las horas (las horas sin valor no cuentan)
+    return ",\n       ".join(
+        f"sum({nombre}_avg * readings) / NULLIF(sum(readings) FILTER (WHERE {nombre}_avg IS NOT NULL), 0) AS {nombre}_avg, "
+        f"min({nombre}_min) AS {nombre}_min, max({nombre}_max) AS {nombre}_max"
+        for nombre, _ in MAGNITUDES
+    )
+
+
+def _columnas_horarias() -> str:
+    return ", ".join(f"{nombre}_avg, {nombre}_min, {nombre}_max" for nombre, _ in MAGNITUDES)
+
+
+# Intervalos de `paso` desde `origen` con lecturas crudas
+SERIE_CRUDA_SQL = f"""
+SELECT date_bin(%(paso)s, dates, %(origen)s) AS bucket, count(*) AS readings,
+       {_estadisticas_crudas()}
+FROM weather_logs
+WHERE id_station = %(estacion)s AND dates >= %(desde)s AND dates < %(hasta)s
+GROUP BY 1
+ORDER BY 1
+"""
+
+# Igual, combinando weather_logs_hourly con las lecturas crudas. El corte es la marca de agua o,
+# si es anterior, la hora desde la que se conservan las lecturas crudas (%(retencion)s antes de
+# now(); NULL = siempre): un bucket agregado puede no incluir aún las lecturas tardías.
+SERIE_HORARIA_SQL = f"""
+WITH marca AS (
+    SELECT LEAST(
+        COALESCE((SELECT hasta FROM weather_rollup_watermarks WHERE rollup = 'hourly'), '-infinity'::timestamptz),
+        COALESCE(date_trunc('hour', now() - %(retencion)s::interval), '-infinity'::timestamptz)
+    ) AS hasta
+), horas AS (
+    SELECT h.bucket, h.readings, {_columnas_horarias()}
+    FROM weather_logs_hourly h, marca
+    WHERE h.id_station = %(estacion)s AND h.bucket >= %(desde)s AND h.bucket < LEAST(%(hasta)s, marca.hasta)
+    UNION ALL
+    SELECT date_trunc('hour', dates), count(*),
+           {_estadisticas_crudas()}
+    FROM weather_logs, marca
+    WHERE id_station = %(estacion)s AND dates >= GREATEST(%(desde)s, marca.hasta) AND dates < %(hasta)s
+    GROUP BY 1
+)
+SELECT date_bin(%(paso)s, bucket, %(origen)s) AS bucket, sum(readings)::bigint AS readings,
+       {_estadisticas_combinadas()}
+FROM horas
+GROUP BY 1
+ORDER BY 1
+"""
+
+# Última lectura de cada estación (o de las indicadas) en los últimos %(max_edad)s
+ULTIMAS_SQL = f"""
+SELECT {", ".join(f"l.{columna}" for columna in COLUMNAS_LECTURA)}
+FROM weather_stations s
+CROSS JOIN LATERAL (
+    SELECT * FROM weather_logs w
+    WHERE w.id_station = s.id AND w.dates >= now() - %(max_edad)s
+    ORDER BY w.dates DESC
+    LIMIT 1
+) l
+WHERE %(estaciones)s::int[] IS NULL OR s.id = ANY(%(estaciones)s::int[])
+ORDER BY s.id
+"""
+
+ESTACIONES_SQL = f"SELECT {', '.join(COLUMNAS_ESTACION)} FROM weather_stations ORDER BY id"
+
+# Exportación: de una estación en orden de fecha (índice único) o de todas en orden de partición
+EXPORTAR_ESTACION_SQL = f"""
+SELECT {", ".join(COLUMNAS_LECTURA)} FROM weather_logs
+WHERE id_station = %(estacion)s AND dates >= %(desde)s AND dates < %(hasta)s
+ORDER BY dates
+"""
+EXPORTAR_TODAS_SQL = f"""
+SELECT {", ".join(COLUMNAS_LECTURA)} FROM weather_logs
+WHERE dates >= %(desde)s AND dates < %(hasta)s
+"""
+
+# Marca de escritura: filas escritas por las instancias del consumidor (publicar_marca_escritura
+# en consumers_service/main.py) y última pasada de agregación de retention.py
+MARCA_SQL = """
+SELECT (SELECT COALESCE(sum(filas), 0) FROM weather_ingest_watermarks),
+       (SELECT max(escrito) FROM weather_ingest_watermarks),
+       (SELECT max(actualizado) FROM weather_rollup_watermarks)
+"""
+
+
+def consulta_serie(estacion: int, desde: datetime, hasta: datetime, paso: timedelta,
+                   origen: datetime = ORIGEN, retencion: Optional[timedelta] = None) -> tuple:
+    """(sql, parámetros) de la serie de una estación con intervalos de `paso` desde `origen`.
+
+    `retencion`: antigüedad de las lecturas crudas conservadas (None = todas)."""
+    sql = SERIE_HORARIA_SQL if usa_horarios(desde, hasta, paso, origen) else SERIE_CRUDA_SQL
+    return sql, {"estacion": estacion, "desde": desde, "hasta": hasta, "paso": paso, "origen": origen,
+                 "retencion": retencion}
+
+
+def consulta_agregados(estacion: int, desde: datetime, hasta: datetime,
+                       retencion: Optional[timedelta] = None) -> tuple:
+    """(sql, parámetros) de los agregados de todo el rango: una serie con un único intervalo.
+
+    Si `desde` y `hasta` son horas enteras se usan los agregados horarios."""
+    return consulta_serie(estacion, desde, hasta, hasta - desde, origen=desde, retencion=retencion)
+
+
+def filas_a_dicts(columnas, filas) -> List[Dict]:
+    return [dict(zip(columnas, fila)) for fila in filas]
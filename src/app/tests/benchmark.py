@@ -0,0 +1,415 @@
+# Suite de benchmarks de extremo a extremo: producer -> RabbitMQ -> consumer -> PostgreSQL.
+# Se ejecuta dentro del contenedor 'tests' (código en /app y socket de Docker montado):
+#
+#   pytest -m benchmark tests/          # escenarios como tests de pytest
+#   python -m tests.benchmark           # runner independiente
+#
+# Por cada escenario (configuración del consumidor) y tasa:
+# - Detiene los contenedores producer/consumer del stack para que no compitan por la cola.
+# - Lanza el consumidor (services/consumers_service/main.py) como subproceso con la
+#   configuración del escenario: camino de escritura, tamaño de lote, prefetch, ACK, workers.
+# - Lanza el producer en modo carga (PUBLISH_MODE=load) a una tasa fija durante BENCHMARK_DURATION_S,
+#   tras crear sus estaciones con init/load_test/seed_stations.sql (idempotente).
+# - Sondea weather_logs: cada fila nueva se fecha en el momento en que se ve confirmada; la
+#   latencia extremo a extremo es ese momento menos `dates` (la marca de generación del producer).
+#   La resolución es el intervalo de sondeo. Se asume el mismo reloj y zona horaria (UTC)
+#   en el contenedor de tests y en la base de datos.
+# - Muestrea CPU y memoria de los subprocesos (/proc) y de rabbitmq/db (docker stats).
+# Los resultados se escriben en JSON (BENCHMARK_OUTPUT_DIR) para comparar entre commits.
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import signal
+import threading
+import subprocess
+import urllib.request
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import psycopg2
+
+try:
+    import docker
+except ImportError:  # Fuera del contenedor de tests puede no estar instalado
+    docker = None
+
+from tests.conftest import DB_CONFIG
+
+# ==========================
+# Configuración (variables de entorno)
+# ==========================
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONSUMER_DIR = os.path.join(APP_DIR, "services", "consumers_service")
+PRODUCER_DIR = os.path.join(APP_DIR, "services", "producers_service")
+# En el contenedor de tests init/ se monta en /init (APP_DIR es /app)
+SEMILLA_CARGA_SQL = os.getenv(
+    "BENCHMARK_SEED_SQL", os.path.join(APP_DIR, "..", "..", "init", "load_test", "seed_stations.sql")
+)
+
+TASAS = [float(t) for t in os.getenv("BENCHMARK_RATES", "200,1000").split(",") if t.strip()]
+DURACION_S = float(os.getenv("BENCHMARK_DURATION_S", 30))
+DRENADO_TIMEOUT_S = float(os.getenv("BENCHMARK_DRAIN_TIMEOUT_S", 120))
+SONDEO_S = float(os.getenv("BENCHMARK_POLL_INTERVAL_S", 0.1))
+MUESTREO_S = float(os.getenv("BENCHMARK_SAMPLE_INTERVAL_S", 1.0))
+SALIDA_DIR = os.getenv("BENCHMARK_OUTPUT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results"))
+COMMIT = os.getenv("BENCHMARK_COMMIT") or os.getenv("GIT_COMMIT") or "desconocido"
+
+# Configuraciones del consumidor a comparar: caminos de escritura y ventanas de prefetch.
+ESCENARIOS: Dict[str, Dict[str, str]] = {
+    "por_mensaje": {"DB_BATCH_SIZE": "1", "CONSUMER_PREFETCH": "1"},
+    "lote_insert": {"DB_BATCH_SIZE": "100", "DB_WRITE_ENGINE": "insert", "CONSUMER_PREFETCH": "200", "CONSUMER_ACK_BATCH": "50"},
+    "lote_copy": {"DB_BATCH_SIZE": "100", "DB_WRITE_ENGINE": "copy", "CONSUMER_PREFETCH": "200", "CONSUMER_ACK_BATCH": "50"},
+    "lote_insert_prefetch_100": {"DB_BATCH_SIZE": "100", "DB_WRITE_ENGINE": "insert", "CONSUMER_PREFETCH": "100"},
+    "lote_insert_prefetch_1000": {"DB_BATCH_SIZE": "100", "DB_WRITE_ENGINE": "insert", "CONSUMER_PREFETCH": "1000", "CONSUMER_ACK_BATCH": "50"},
+    "multi_worker_4": {"CONSUMER_WORKERS": "4", "DB_BATCH_SIZE": "100", "CONSUMER_PREFETCH": "200", "CONSUMER_ACK_BATCH": "50"},
+    "async_copy": {"CONSUMER_ENGINE": "async", "DB_BATCH_SIZE": "100", "DB_WRITE_ENGINE": "copy", "CONSUMER_PREFETCH": "200"},
+}
+_seleccion = [e.strip() for e in os.getenv("BENCHMARK_SCENARIOS", "").split(",") if e.strip()]
+if _seleccion:
+    ESCENARIOS = {nombre: ESCENARIOS[nombre] for nombre in _seleccion}
+
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGINA = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# ==========================
+# Estadísticas
+# ==========================
+def resumen_latencias(valores: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/máx/media en milisegundos (percentil por rango más cercano)."""
+    if not valores:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0, "media_ms": 0.0}
+    ordenados = sorted(valores)
+    n = len(ordenados)
+
+    def p(q: float) -> float:
+        return round(ordenados[min(n - 1, max(0, math.ceil(q * n) - 1))] * 1000, 2)
+
+    return {
+        "p50_ms": p(0.50), "p95_ms": p(0.95), "p99_ms": p(0.99),
+        "max_ms": round(ordenados[-1] * 1000, 2), "media_ms": round(sum(ordenados) / n * 1000, 2),
+    }
+
+
+def cpu_docker(stats: dict) -> float:
+    """% de CPU (100 = un núcleo) a partir de una lectura de `docker stats` (stream=False)."""
+    cpu, pre = stats.get("cpu_stats", {}), stats.get("precpu_stats", {})
+    delta_cpu = cpu.get("cpu_usage", {}).get("total_usage", 0) - pre.get("cpu_usage", {}).get("total_usage", 0)
+    delta_sistema = cpu.get("system_cpu_usage", 0) - pre.get("system_cpu_usage", 0)
+    nucleos = cpu.get("online_cpus") or len(cpu.get("cpu_usage", {}).get("percpu_usage") or [1])
+    if delta_cpu <= 0 or delta_sistema <= 0:
+        return 0.0
+    return delta_cpu / delta_sistema * nucleos * 100.0
+
+
+def _leer_stat(pid: int):
+    """(ppid, ticks de CPU, RSS en bytes) de /proc/<pid>/stat o None si el proceso terminó."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            campos = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    # Tras el nombre: estado(0) ppid(1) ... utime(11) stime(12) ... rss(21)
+    return int(campos[1]), int(campos[11]) + int(campos[12]), int(campos[21]) * PAGINA
+
+
+def uso_arbol_procesos(pid: int):
+    """Ticks de CPU acumulados y RSS del proceso y todos sus descendientes."""
+    procesos = {}
+    for entrada in os.listdir("/proc"):
+        if entrada.isdigit():
+            stat = _leer_stat(int(entrada))
+            if stat is not None:
+                procesos[int(entrada)] = stat
+    arbol, pendientes = set(), [pid]
+    while pendientes:
+        actual = pendientes.pop()
+        arbol.add(actual)
+        pendientes.extend(p for p, (ppid, _, _) in procesos.items() if ppid == actual and p not in arbol)
+    ticks = sum(procesos[p][1] for p in arbol if p in procesos)
+    rss = sum(procesos[p][2] for p in arbol if p in procesos)
+    return ticks, rss
+
+
+# ==========================
+# Muestreo de recursos
+# ==========================
+class MuestreadorRecursos(threading.Thread):
+    """Muestrea CPU (%) y memoria (MB) de subprocesos locales y de contenedores Docker."""
+
+    def __init__(self, procesos: Dict[str, subprocess.Popen], contenedores: Dict[str, object], intervalo_s: float = MUESTREO_S):
+        super().__init__(daemon=True)
+        self.procesos = procesos
+        self.contenedores = contenedores
+        self.intervalo_s = intervalo_s
+        self.muestras: Dict[str, Dict[str, List[float]]] = {
+            nombre: {"cpu": [], "mem": []} for nombre in list(procesos) + list(contenedores)
+        }
+        self._detener = threading.Event()
+        self._previo: Dict[str, tuple] = {}
+
+    def run(self) -> None:
+        while not self._detener.wait(self.intervalo_s):
+            ahora = time.monotonic()
+            for nombre, proc in self.procesos.items():
+                if proc.poll() is not None:
+                    continue
+                ticks, rss = uso_arbol_procesos(proc.pid)
+                if nombre in self._previo:
+                    ticks_previos, t_previo = self._previo[nombre]
+                    self.muestras[nombre]["cpu"].append((ticks - ticks_previos) / CLK_TCK / (ahora - t_previo) * 100.0)
+                self._previo[nombre] = (ticks, ahora)
+                self.muestras[nombre]["mem"].append(rss / 1e6)
+            for nombre, contenedor in self.contenedores.items():
+                try:
+                    stats = contenedor.stats(stream=False)
+                except Exception:
+                    continue
+                self.muestras[nombre]["cpu"].append(cpu_docker(stats))
+                self.muestras[nombre]["mem"].append(stats.get("memory_stats", {}).get("usage", 0) / 1e6)
+
+    def detener(self) -> Dict[str, Dict[str, float]]:
+        self._detener.set()
+        self.join(timeout=10)
+        return {
+            nombre: {
+                "cpu_pct_media": round(sum(m["cpu"]) / len(m["cpu"]), 1) if m["cpu"] else 0.0,
+                "cpu_pct_max": round(max(m["cpu"]), 1) if m["cpu"] else 0.0,
+                "mem_mb_max": round(max(m["mem"]), 1) if m["mem"] else 0.0,
+            }
+            for nombre, m in self.muestras.items()
+        }
+
+
+# ==========================
+# Sondeo de filas confirmadas
+# ==========================
+class SondeoFilas(threading.Thread):
+    """Registra cuándo se hace visible (commit) cada fila nueva de weather_logs."""
+
+    # Los commits concurrentes (lotes, varios workers) pueden hacerse visibles fuera del
+    # orden de los id SERIAL: se vuelve a mirar una ventana de ids por detrás del máximo visto.
+    VENTANA_IDS = 5000
+
+    def __init__(self, desde: datetime, intervalo_s: float = SONDEO_S):
+        super().__init__(daemon=True)
+        self.desde = desde
+        self.intervalo_s = intervalo_s
+        self.latencias: List[float] = []
+        self.vistas: List[float] = []  # Instante (monotónico) en que se vio cada fila
+        self._ids = set()
+        self._max_id = 0
+        self._detener = threading.Event()
+        self._conn = psycopg2.connect(**DB_CONFIG)
+        self._conn.autocommit = True
+        with self._conn.cursor() as cur:
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM weather_logs;")
+            self._max_id = cur.fetchone()[0]
+
+    def run(self) -> None:
+        try:
+            while not self._detener.wait(self.intervalo_s):
+                self.sondear()
+            self.sondear()
+        finally:
+            self._conn.close()
+
+    def sondear(self) -> None:
+        with self._conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, EXTRACT(EPOCH FROM clock_timestamp() - dates) FROM weather_logs "
+                "WHERE id > %s AND dates >= %s;",
+                (self._max_id - self.VENTANA_IDS, self.desde),
+            )
+            filas = cur.fetchall()
+        ahora = time.monotonic()
+        for id_fila, latencia in filas:
+            if id_fila in self._ids:
+                continue
+            self._ids.add(id_fila)
+            self._max_id = max(self._max_id, id_fila)
+            self.latencias.append(float(latencia))
+            self.vistas.append(ahora)
+
+    @property
+    def total(self) -> int:
+        return len(self.latencias)
+
+    def detener(self) -> None:
+        self._detener.set()
+        self.join(timeout=30)
+
+
+# ==========================
+# Servicios bajo prueba
+# ==========================
+def _buscar_contenedor(client, servicio: str):
+    conts = client.containers.list(all=True, filters={"label": f"com.docker.compose.service={servicio}"})
+    return conts[0] if conts else None
+
+
+def _entorno_base() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "TZ": "UTC",
+        "POSTGRES_HOST": DB_CONFIG["host"],
+        "POSTGRES_PORT": str(DB_CONFIG["port"]),
+        "POSTGRES_DB": DB_CONFIG["dbname"],
+        "POSTGRES_USER": DB_CONFIG["user"],
+        "POSTGRES_PASSWORD": DB_CONFIG["password"],
+        "PYTHONUNBUFFERED": "1",
+    })
+    return env
+
+
+def _esperar_http(url: str, timeout_s: float) -> None:
+    limite = time.monotonic() + timeout_s
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            if time.monotonic() >= limite:
+                raise TimeoutError(f"{url} no respondió en {timeout_s:.0f}s")
+            time.sleep(0.5)
+
+
+def _terminar(proc: subprocess.Popen, timeout_s: float = 15) -> None:
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGINT)  # Ambos servicios cierran ordenadamente con KeyboardInterrupt
+        try:
+            proc.wait(timeout=timeout_s)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def ejecutar_escenario(nombre: str, tasa: float, duracion_s: float = DURACION_S) -> dict:
+    """Ejecuta un escenario a una tasa fija y devuelve sus métricas."""
+    config_consumer = ESCENARIOS[nombre]
+    logs_dir = os.path.join(SALIDA_DIR, "logs")
+    os.makedirs(logs_dir, exist_ok=True)
+    etiqueta = f"{nombre}_{tasa:g}"
+
+    client = docker.from_env() if docker is not None else None
+    detenidos = []
+    contenedores = {}
+    if client is not None:
+        for servicio in ("producer", "consumer"):
+            c = _buscar_contenedor(client, servicio)
+            if c is not None and c.status == "running":
+                c.stop()
+                detenidos.append(c)
+        for servicio in ("rabbitmq", "db"):
+            c = _buscar_contenedor(client, servicio)
+            if c is not None:
+                contenedores[servicio] = c
+
+    env_consumer = _entorno_base()
+    env_consumer.update({"LOG_DIR": logs_dir, **config_consumer})
+    env_producer = _entorno_base()
+    env_producer.update({
+        "PUBLISH_MODE": "load", "LOAD_RATE": str(tasa), "LOAD_DURATION_S": str(duracion_s),
+        "LOAD_PROCESSES": "1", "LOAD_STATIONS": os.getenv("LOAD_STATIONS", "1000"),
+    })
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cur:
+            with open(SEMILLA_CARGA_SQL, encoding="utf-8") as f:
+                cur.execute(f.read())
+            conn.commit()
+            cur.execute("SELECT clock_timestamp();")
+            desde = cur.fetchone()[0]
+    finally:
+        conn.close()
+
+    log_consumer = open(os.path.join(logs_dir, f"{etiqueta}_consumer.log"), "w")
+    log_producer = open(os.path.join(logs_dir, f"{etiqueta}_producer.log"), "w")
+    consumer = producer = sondeo = muestreador = None
+    recursos = {}
+    try:
+        consumer = subprocess.Popen([sys.executable, "-u", "main.py"], cwd=CONSUMER_DIR, env=env_consumer,
+                                    stdout=log_consumer, stderr=subprocess.STDOUT)
+        _esperar_http("http://localhost:8000/metrics", 60)
+        time.sleep(3)  # Margen para que el consumidor declare y enlace la cola
+
+        sondeo = SondeoFilas(desde)
+        sondeo.start()
+        producer = subprocess.Popen([sys.executable, "-u", "main.py"], cwd=PRODUCER_DIR, env=env_producer,
+                                    stdout=log_producer, stderr=subprocess.STDOUT)
+        muestreador = MuestreadorRecursos({"producer": producer, "consumer": consumer}, contenedores)
+        muestreador.start()
+        inicio = time.monotonic()
+
+        producer.wait(timeout=duracion_s + 120)
+        fin_publicacion = time.monotonic()
+        log_producer.flush()
+        with open(log_producer.name) as f:
+            m = re.search(r"(\d+) generados, (\d+) confirmados", f.read())
+        confirmados = int(m.group(2)) if m else None
+
+        # Drenado: espera a que todas las filas confirmadas por el broker lleguen a la DB.
+        limite = time.monotonic() + DRENADO_TIMEOUT_S
+        objetivo = confirmados if confirmados is not None else int(tasa * duracion_s)
+        while sondeo.total < objetivo and time.monotonic() < limite:
+            time.sleep(0.5)
+    finally:
+        if muestreador is not None:
+            recursos = muestreador.detener()
+        if sondeo is not None:
+            sondeo.detener()
+        for proc in (producer, consumer):
+            if proc is not None:
+                _terminar(proc)
+        log_consumer.close()
+        log_producer.close()
+        for c in detenidos:
+            c.start()
+
+    vistas = sondeo.vistas
+    en_ventana = sum(1 for t in vistas if t <= fin_publicacion)
+    duracion_total = (vistas[-1] - inicio) if vistas else 0.0
+    return {
+        "escenario": nombre,
+        "config_consumer": config_consumer,
+        "tasa_objetivo": tasa,
+        "duracion_s": duracion_s,
+        "mensajes_confirmados": confirmados,
+        "filas_guardadas": sondeo.total,
+        "throughput_sostenido": round(en_ventana / max(fin_publicacion - inicio, 1e-9), 1),
+        "throughput_total": round(sondeo.total / duracion_total, 1) if duracion_total > 0 else 0.0,
+        "drenado_s": round(max(0.0, (vistas[-1] if vistas else fin_publicacion) - fin_publicacion), 2),
+        "latencia_extremo_a_extremo": resumen_latencias(sondeo.latencias),
+        "recursos": recursos,
+    }
+
+
+def guardar_resultados(resultados: List[dict], directorio: str = SALIDA_DIR) -> str:
+    """Escribe los resultados de una corrida en JSON y devuelve la ruta."""
+    os.makedirs(directorio, exist_ok=True)
+    ahora = datetime.now(timezone.utc)
+    ruta = os.path.join(directorio, f"benchmark_{ahora:%Y%m%dT%H%M%SZ}_{COMMIT[:12]}.json")
+    with open(ruta, "w") as f:
+        json.dump({"commit": COMMIT, "fecha": ahora.isoformat(), "resultados": resultados}, f, indent=2)
+    return ruta
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    resultados = []
+    for nombre in ESCENARIOS:
+        for tasa in TASAS:
+            print(f"== {nombre} @ {tasa:g} msg/s ==", flush=True)
+            resultado = ejecutar_escenario(nombre, tasa)
+            print(json.dumps(resultado, indent=2), flush=True)
+            resultados.append(resultado)
+    print(f"Resultados guardados en {guardar_resultados(resultados)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
 import os
 import time
+import shutil
 import socket
+import tempfile
 import pytest
 import psycopg2
 
@@ -18,6 +20,20 @@ DB_CONFIG = {
     "port": int(os.getenv("POSTGRES_PORT", 5432)),
 }
 
+# --- Directorio de logs ---
+
+def pytest_configure(config):
+    # Los módulos de los servicios (main.py, dlq_tool.py, retention.py) llaman a setup_logger al
+    # importarse, antes de cualquier fixture: LOG_DIR (y el spool por defecto, bajo LOG_DIR) se
+    # apunta a un directorio temporal antes de recoger los tests para no escribir en el cwd.
+    config._log_dir = tempfile.mkdtemp(prefix="weather_tests_logs_")
+    os.environ["LOG_DIR"] = config._log_dir
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(getattr(config, "_log_dir", ""), ignore_errors=True)
+
+
 # --- Pytest Fixtures ---
 
 @pytest.fixture(scope="session")
@@ -0,0 +1,72 @@
+import os
+import sys
+
+# Los módulos del consumidor se importan igual que dentro de su contenedor (desde la
+# carpeta del servicio), sin importar main.py para no arrancar el servidor de métricas.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from utils.acks import AckAcumulado
+
+
+# --- Clases Fake para Pruebas Unitarias (Mocking) ---
+
+class FakeChannel:
+    def __init__(self):
+        self.llamadas = []
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.llamadas.append(("ack", delivery_tag, multiple))
+    def basic_nack(self, delivery_tag, requeue=True, multiple=False):
+        self.llamadas.append(("nack", delivery_tag, requeue))
+
+class FakeConnection:
+    def __init__(self):
+        self.timers = []
+    def call_later(self, delay, callback):
+        self.timers.append(callback)
+        return len(self.timers)
+    def remove_timeout(self, timer_id):
+        self.timers[timer_id - 1] = None
+
+
+def test_ack_inmediato_por_defecto():
+    # Con ack_cada=1 cada mensaje completado se confirma al momento.
+    ch = FakeChannel()
+    acks = AckAcumulado(ch)
+    acks.registrar(1)
+    acks.completar(1)
+    assert ch.llamadas == [("ack", 1, True)]
+    assert acks.en_vuelo == 0
+
+def test_ack_acumulado_solo_prefijo_contiguo():
+    # El tag 2 sigue pendiente (p. ej. en un lote): solo se puede confirmar el 1.
+    ch = FakeChannel()
+    acks = AckAcumulado(ch, ack_cada=2)
+    for tag in (1, 2, 3):
+        acks.registrar(tag)
+    acks.completar(1, 3)
+    assert ch.llamadas == [("ack", 1, True)]
+    # Al resolverse el 2 se confirman 2 y 3 con un único ACK múltiple.
+    acks.completar(2)
+    assert ch.llamadas[-1] == ("ack", 3, True)
+    assert acks.en_vuelo == 0
+
+def test_rechazo_libera_prefijo():
+    ch = FakeChannel()
+    acks = AckAcumulado(ch, ack_cada=1)
+    acks.registrar(1)
+    acks.registrar(2)
+    acks.completar(2)
+    assert ch.llamadas == []
+    acks.rechazar(1, requeue=True)
+    assert ch.llamadas == [("nack", 1, True), ("ack", 2, True)]
+
+def test_linger_confirma_lo_pendiente():
+    ch = FakeChannel()
+    conn = FakeConnection()
+    acks = AckAcumulado(ch, conn, ack_cada=10, linger_s=0.1)
+    acks.registrar(1)
+    acks.completar(1)
+    assert ch.llamadas == []
+    # Simula el vencimiento del temporizador del BlockingConnection.
+    conn.timers[0]()
+    assert ch.llamadas == [("ack", 1, True)]
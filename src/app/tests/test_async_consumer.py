@@ -0,0 +1,159 @@
+import os
+import sys
+import asyncio
+from datetime import datetime, timezone
+
+import asyncpg
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from async_consumer import ConsumidorAsync
+from utils.metrics import filas_escritas
+from utils.retry import HEADER_REINTENTOS
+from utils.spool import Spool, leer_segmento
+
+
+def fila(estacion, minuto=0):
+    return (estacion, datetime(2024, 1, 1, 0, minuto, tzinfo=timezone.utc), 20.0, 50.0, "N", 10.0, 1000.0)
+
+
+# --- Fakes de aio-pika y asyncpg ---
+
+class FakeMessage:
+    def __init__(self, tag):
+        self.delivery_tag = tag
+        self.body = f"mensaje {tag}".encode()
+        self.headers = {}
+        self.message_id = f"m{tag}"
+        self.content_type = "application/json"
+        self.content_encoding = None
+        self.timestamp = None
+        self.routing_key = "weather"
+        self.resultado = None
+
+    async def ack(self):
+        self.resultado = "ack"
+
+    async def nack(self, requeue=True):
+        self.resultado = "nack"
+
+
+class FakeExchange:
+    def __init__(self, name):
+        self.name = name
+        self.publicados = []
+
+    async def publish(self, message, routing_key):
+        self.publicados.append(message)
+
+
+class Adquirir:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        if isinstance(self.conn, Exception):
+            raise self.conn
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePool:
+    """acquire() devuelve, por orden, las conexiones (o lanza los errores) indicados."""
+
+    def __init__(self, *conexiones):
+        self.conexiones = list(conexiones)
+
+    def acquire(self):
+        return Adquirir(self.conexiones.pop(0))
+
+
+class FakeTransaccion:
+    async def start(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self, error=None, existentes=()):
+        self.error = error
+        self.existentes = set(existentes)
+
+    def transaction(self):
+        return FakeTransaccion()
+
+    async def execute(self, sql, *columnas):
+        if self.error is not None:
+            raise self.error
+        # INSERT ... SELECT FROM unnest(...) ON CONFLICT DO NOTHING: un array por columna
+        nuevas = [(e, d) for e, d in zip(columnas[0], columnas[1]) if (e, d) not in self.existentes]
+        return f"INSERT 0 {len(nuevas)}"
+
+
+def consumidor(pool, spool=None):
+    return ConsumidorAsync(pool, FakeExchange("weather_dlq"), [FakeExchange("weather_retry.1s")], spool)
+
+
+def test_reinicio_de_postgres_reintenta_en_vez_de_dlq():
+    # 57P01 al pedir la conexión (p. ej. reinicio o failover del servidor): error transitorio
+    async def escenario():
+        c = consumidor(FakePool(asyncpg.exceptions.AdminShutdownError("terminating connection due to administrator command")))
+        lote = [(FakeMessage(1), [fila(1)], None), (FakeMessage(2), [fila(2), fila(3)], lambda j: b"")]
+        await c._escribir(lote)
+        return c, lote
+
+    c, lote = asyncio.run(escenario())
+    assert c.dlq_exchange.publicados == []
+    [nivel] = c.niveles
+    assert [m.message_id for m in nivel.publicados] == ["m1", "m2"]
+    assert [m.headers[HEADER_REINTENTOS] for m in nivel.publicados] == [1, 1]
+    assert [m.resultado for m, _, _ in lote] == ["ack", "ack"]
+
+
+def test_caida_durante_el_aislamiento_no_envia_el_lote_a_la_dlq(tmp_path):
+    # El lote falla por una fila y, al reintentarlo fila a fila, el servidor aún no acepta
+    # conexiones (57P03): las filas válidas van al spool, no a la DLQ.
+    spool = Spool(str(tmp_path), max_bytes=10 ** 6, segmento_max_bytes=10 ** 6)
+    pool = FakePool(
+        FakeConn(asyncpg.exceptions.ForeignKeyViolationError("weather_logs_id_station_fkey")),
+        asyncpg.exceptions.CannotConnectNowError("the database system is starting up"),
+    )
+
+    async def escenario():
+        c = consumidor(pool, spool)
+        lote = [(FakeMessage(1), [fila(1)], None), (FakeMessage(2), [fila(9)], None)]
+        await c._escribir(lote)
+        return c, lote
+
+    c, lote = asyncio.run(escenario())
+    assert c.dlq_exchange.publicados == [] and c.niveles[0].publicados == []
+    assert [m.resultado for m, _, _ in lote] == ["ack", "ack"]
+    assert spool.derivando
+    spool.sellar()
+    assert [f[0] for ruta in spool.segmentos() for lote_spool in leer_segmento(ruta) for f in lote_spool] == [1, 9]
+
+
+def test_insert_cuenta_solo_las_filas_nuevas():
+    # La lectura (1, 00:00) ya estaba en weather_logs: ON CONFLICT DO NOTHING la ignora
+    conn = FakeConn(existentes={fila(1)[:2]})
+
+    async def escenario():
+        c = consumidor(FakePool(conn))
+        lote = [(FakeMessage(1), [fila(1)], None), (FakeMessage(2), [fila(2), fila(3)], lambda j: b"")]
+        await c._escribir(lote)
+        return lote
+
+    procesadas = filas_escritas()
+    duplicadas = REGISTRY.get_sample_value("rows_duplicate_total") or 0.0
+    lote = asyncio.run(escenario())
+    assert filas_escritas() == procesadas + 2
+    assert REGISTRY.get_sample_value("rows_duplicate_total") == duplicadas + 1
+    assert [m.resultado for m, _, _ in lote] == ["ack", "ack"]
@@ -0,0 +1,106 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "producers_service"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from flow_control import ControlFlujo
+from utils.autoscaling import Controlador, Decision, EstadoColas, mensaje_flujo, sumar_colas
+
+
+class Reloj:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def controlador(reloj=None):
+    # 1-8 workers, prefetch 100-400, lag 30 s, bajada tras 60 s; freno 1000, pausa 5000, reanudar 500
+    return Controlador(1, 8, 100, 400, 30, 60, 1000, 5000, 500, 0.1, reloj=reloj or Reloj())
+
+
+def estado(mensajes=0, listos=0, sin_ack=0, consumidores=1, utilizacion=None, entrada=0.0, ack=0.0):
+    return EstadoColas(mensajes, listos, sin_ack, consumidores, utilizacion, entrada, ack)
+
+
+def test_sumar_colas():
+    colas = [
+        {"name": "weather_queue.0", "messages": 10, "messages_ready": 7, "messages_unacknowledged": 3,
+         "consumers": 1, "consumer_utilisation": 0.5,
+         "message_stats": {"publish_details": {"rate": 20.0}, "ack_details": {"rate": 15.0}}},
+        {"name": "weather_queue.1", "messages": 5, "messages_ready": 5, "messages_unacknowledged": 0,
+         "consumers": 1, "consumer_utilisation": 1.0},
+        {"name": "weather_dlq_queue", "messages": 1000, "consumers": 0},
+    ]
+    total = sumar_colas(colas, ["weather_queue.0", "weather_queue.1"])
+    assert total == EstadoColas(15, 12, 3, 2, 0.75, 20.0, 15.0)
+    assert sumar_colas([], ["weather_queue"]).utilizacion is None
+
+
+def test_sube_workers_segun_capacidad_medida():
+    c = controlador()
+    # Saturada: 2 consumidores confirman 200/s (100/s cada uno); hay que atender 300/s y drenar 3000 en 30 s
+    decision = c.decidir(estado(3200, 3000, 200, 2, 0.95, entrada=300, ack=200), workers_actuales=2)
+    assert decision == Decision(4, 4, 100, 0.45)
+    assert c.capacidad == 100
+
+
+def test_baja_de_uno_en_uno_tras_la_espera():
+    reloj = Reloj()
+    c = controlador(reloj)
+    c.decidir(estado(3200, 3000, 200, 2, 0.95, entrada=300, ack=200), workers_actuales=2)
+    vacia = estado(0, 0, 0, 4, None, entrada=100, ack=100)
+    assert c.decidir(vacia, 4).workers == 4
+    reloj.t = 30
+    assert c.decidir(vacia, 4).workers == 4
+    reloj.t = 61
+    assert c.decidir(vacia, 4).workers == 3
+    reloj.t = 62
+    assert c.decidir(vacia, 3).workers == 3
+    reloj.t = 122
+    assert c.decidir(vacia, 3).workers == 2
+    # Una subida cancela la espera
+    assert c.decidir(estado(3200, 3000, 200, 2, 0.95, entrada=300, ack=200), 2).workers == 4
+
+
+def test_prefetch_sube_con_baja_utilizacion_y_vuelve_con_la_cola_vacia():
+    c = controlador()
+    poco_usados = estado(550, 500, 50, 1, 0.5)
+    # Sin medida de capacidad pero saturada: un worker más
+    assert c.decidir(poco_usados, 1) == Decision(2, 2, 200, 1.0)
+    assert [c.decidir(poco_usados, 1).prefetch for _ in range(2)] == [400, 400]
+    assert [c.decidir(estado(), 1).prefetch for _ in range(3)] == [200, 100, 100]
+
+
+def test_factor_de_flujo_con_histeresis():
+    c = controlador()
+
+    def factor(profundidad):
+        return c.decidir(estado(profundidad), 1).factor
+
+    assert factor(100) == 1.0
+    assert factor(3000) == 0.5
+    assert factor(6000) == 0.0
+    # Bajo el umbral de freno se mantiene frenado (sin pausa) hasta bajar de 500
+    assert factor(800) == 0.1
+    assert factor(400) == 1.0
+    assert factor(800) == 1.0
+    assert json.loads(mensaje_flujo(0.123456, 800, ahora=5.0)) == {"factor": 0.123, "depth": 800, "ts": 5.0}
+
+
+def test_control_flujo_del_productor_caduca():
+    reloj = Reloj()
+    control = ControlFlujo(params=None, exchange="weather_flow_control", ttl_s=30, reloj=reloj)
+    assert control.factor == 1.0
+    control.actualizar(mensaje_flujo(0.25, 20000))
+    assert control.factor == 0.25
+    control.actualizar(b"no es json")
+    assert control.factor == 0.25
+    dormido = []
+    control.esperar(2.0, dormido.append)
+    assert dormido == [8.0]
+    reloj.t = 31
+    assert control.factor == 1.0
@@ -0,0 +1,48 @@
+import pytest
+
+from tests.benchmark import (
+    DURACION_S, ESCENARIOS, TASAS, cpu_docker, ejecutar_escenario, guardar_resultados, resumen_latencias
+)
+
+# Los escenarios solo se ejecutan con `pytest -m benchmark` (ver pytest.ini); los resultados
+# de la sesión se guardan en un único JSON al terminar.
+_resultados = []
+
+@pytest.fixture(scope="module")
+def resultados():
+    yield _resultados
+    if _resultados:
+        print(f"\nResultados del benchmark: {guardar_resultados(_resultados)}")
+
+
+# --- Pruebas Unitarias de las utilidades del benchmark ---
+
+def test_resumen_latencias():
+    resumen = resumen_latencias([i / 1000 for i in range(1, 101)])
+    assert resumen["p50_ms"] == 50.0
+    assert resumen["p99_ms"] == 99.0
+    assert resumen["max_ms"] == 100.0
+    assert resumen_latencias([])["p95_ms"] == 0.0
+
+def test_cpu_docker():
+    stats = {
+        "cpu_stats": {"cpu_usage": {"total_usage": 300}, "system_cpu_usage": 2000, "online_cpus": 2},
+        "precpu_stats": {"cpu_usage": {"total_usage": 100}, "system_cpu_usage": 1000},
+    }
+    # 200 de 1000 ticks de sistema en 2 núcleos = 40% de un núcleo
+    assert cpu_docker(stats) == pytest.approx(40.0)
+    assert cpu_docker({}) == 0.0
+
+
+# --- Benchmark de extremo a extremo ---
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("tasa", TASAS)
+@pytest.mark.parametrize("escenario", list(ESCENARIOS))
+def test_benchmark_ingesta(escenario, tasa, db_conn, resultados):
+    # db_conn garantiza que PostgreSQL está disponible antes de empezar.
+    resultado = ejecutar_escenario(escenario, tasa, DURACION_S)
+    resultados.append(resultado)
+    assert resultado["mensajes_confirmados"], "El producer no reportó mensajes confirmados"
+    # Todo lo que el broker confirmó debe terminar en la base de datos.
+    assert resultado["filas_guardadas"] >= resultado["mensajes_confirmados"]
@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "producers_service"))
+
+import pika
+from pika.spec import Basic
+
+from confirm_publisher import MensajeSaliente, PublicadorConfirmado
+
+
+# --- Clases Fake para Pruebas Unitarias (Mocking) ---
+
+class FakeChannel:
+    is_open = True
+    def __init__(self):
+        self.publicados = []
+    def basic_publish(self, exchange, routing_key, body, properties, mandatory=False):
+        self.publicados.append(properties.message_id)
+
+class FakeFrame:
+    def __init__(self, method):
+        self.method = method
+
+
+def crear_publicador(confirmados, ventana=3):
+    pub = PublicadorConfirmado(pika.ConnectionParameters(), "weather_exchange", lambda n: [],
+                               ventana=ventana, espera_reintento_s=0.0,
+                               al_confirmar=lambda msg, lat: confirmados.append(msg.properties.message_id))
+    pub._channel = FakeChannel()
+    return pub
+
+def mensaje():
+    return MensajeSaliente(b"{}", pika.BasicProperties(), "weather.data")
+
+
+def test_ack_multiple_libera_la_ventana():
+    confirmados = []
+    pub = crear_publicador(confirmados)
+    msgs = [mensaje() for _ in range(3)]
+    for m in msgs:
+        pub._publicar(m)
+    pub._on_confirm(FakeFrame(Basic.Ack(delivery_tag=2, multiple=True)))
+    assert confirmados == [m.properties.message_id for m in msgs[:2]]
+    assert list(pub._sin_confirmar) == [3]
+
+def test_nack_y_devuelto_se_reenvian():
+    confirmados = []
+    pub = crear_publicador(confirmados)
+    nack, devuelto = mensaje(), mensaje()
+    pub._publicar(nack)
+    pub._publicar(devuelto)
+    pub._on_confirm(FakeFrame(Basic.Nack(delivery_tag=1)))
+    # Un mensaje devuelto (mandatory) recibe igualmente Basic.Ack: no cuenta como confirmado.
+    pub._on_return(pub._channel, Basic.Return(reply_text="NO_ROUTE"), devuelto.properties, devuelto.body)
+    pub._on_confirm(FakeFrame(Basic.Ack(delivery_tag=2)))
+    assert confirmados == []
+    assert list(pub._reenvios) == [nack, devuelto]
+
+def test_descarta_tras_agotar_reintentos():
+    pub = crear_publicador([])
+    pub.max_reintentos = 1
+    pub._publicar(mensaje())
+    pub._on_confirm(FakeFrame(Basic.Nack(delivery_tag=1)))
+    assert not pub._reenvios and not pub._sin_confirmar
@@ -0,0 +1,133 @@
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+from prometheus_client import REGISTRY
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR, TRANSACTION_STATUS_INTRANS
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from utils.db_pool import PoolAgotadoError, PoolConexiones
+
+
+# --- Conexiones falsas: psycopg2.connect se sustituye para que el pool no abra sockets ---
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = True
+        self.info = SimpleNamespace(transaction_status=TRANSACTION_STATUS_IDLE)
+
+    def close(self):
+        self.closed = 1
+
+    def rollback(self):
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+
+@pytest.fixture
+def conexiones(monkeypatch):
+    """Lista de las conexiones creadas por el pool, en orden."""
+    creadas = []
+
+    def conectar(*args, **kwargs):
+        creadas.append(FakeConnection())
+        return creadas[-1]
+
+    monkeypatch.setattr(psycopg2, "connect", conectar)
+    return creadas
+
+
+def muestra(nombre, **labels):
+    return REGISTRY.get_sample_value(nombre, labels) or 0.0
+
+
+def descartadas(motivo):
+    return muestra("db_pool_connections_discarded_total", reason=motivo)
+
+
+def test_reutiliza_la_conexion_y_desactiva_autocommit(conexiones):
+    pool = PoolConexiones(1, 2, max_lifetime_s=600, timeout_s=1, dsn="dbname=test")
+    with pool.conexion() as conn:
+        assert conn is conexiones[0] and conn.autocommit is False
+        assert muestra("db_pool_connections_in_use") == 1
+    with pool.conexion() as otra:
+        assert otra is conn
+    assert len(conexiones) == 1 and muestra("db_pool_connections_in_use") == 0
+
+
+def test_espera_acotada_cuando_no_quedan_conexiones(conexiones):
+    pool = PoolConexiones(1, 1, max_lifetime_s=600, timeout_s=0.05, dsn="dbname=test")
+    esperas = muestra("db_pool_wait_seconds_count")
+    with pool.conexion():
+        with pytest.raises(PoolAgotadoError):
+            with pool.conexion():
+                pass
+    assert muestra("db_pool_wait_seconds_count") == esperas + 2
+
+    # Un worker que espera recibe la conexión en cuanto otro la devuelve
+    pool.timeout_s = 5
+    prestada = threading.Event()
+    devolver = threading.Event()
+
+    def ocupar():
+        with pool.conexion():
+            prestada.set()
+            devolver.wait(5)
+
+    hilo = threading.Thread(target=ocupar)
+    hilo.start()
+    prestada.wait(5)
+    threading.Timer(0.05, devolver.set).start()
+    with pool.conexion() as conn:
+        assert conn is conexiones[0]
+    hilo.join(5)
+
+
+def test_recicla_por_tiempo_de_vida_maximo(conexiones):
+    pool = PoolConexiones(1, 2, max_lifetime_s=600, timeout_s=1, dsn="dbname=test")
+    antes = descartadas("tiempo de vida máximo")
+    with pool.conexion() as conn:
+        # Creada hace más de max_lifetime_s
+        pool._creadas[id(conn)] -= 601
+    assert conn.closed and descartadas("tiempo de vida máximo") == antes + 1
+    with pool.conexion() as nueva:
+        assert nueva is conexiones[1] and not nueva.closed
+
+
+@pytest.mark.parametrize("estropear, motivo", [
+    (lambda conn: conn.close(), "cerrada"),
+    (lambda conn: setattr(conn.info, "transaction_status", TRANSACTION_STATUS_INTRANS), "transacción pendiente"),
+    (lambda conn: setattr(conn.info, "transaction_status", TRANSACTION_STATUS_INERROR), "transacción pendiente"),
+])
+def test_descarta_conexiones_cerradas_o_con_transaccion(conexiones, estropear, motivo):
+    pool = PoolConexiones(1, 1, max_lifetime_s=600, timeout_s=0.05, dsn="dbname=test")
+    antes = descartadas(motivo)
+    with pytest.raises(RuntimeError):
+        with pool.conexion() as conn:
+            estropear(conn)
+            raise RuntimeError("fallo del worker")
+    assert conn.closed and descartadas(motivo) == antes + 1
+    # El hueco del semáforo se liberó: la siguiente petición obtiene una conexión nueva
+    with pool.conexion() as nueva:
+        assert nueva is not conn and nueva is conexiones[-1]
+    assert muestra("db_pool_connections_in_use") == 0
+
+
+def test_fallo_al_conectar_libera_el_hueco(conexiones, monkeypatch):
+    pool = PoolConexiones(0, 1, max_lifetime_s=600, timeout_s=0.05, dsn="dbname=test")
+
+    def caida(*args, **kwargs):
+        raise psycopg2.OperationalError("could not connect to server")
+
+    with monkeypatch.context() as m:
+        m.setattr(psycopg2, "connect", caida)
+        with pytest.raises(psycopg2.OperationalError):
+            with pool.conexion():
+                pass
+    # Sin liberar el semáforo esta petición agotaría el timeout
+    with pool.conexion() as conn:
+        assert conn is conexiones[0]
@@ -0,0 +1,34 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from utils.dedup import IdsRecientes
+
+
+def test_lru_acotada():
+    escritos = IdsRecientes(3)
+    escritos.agregar("a", "b", None, "c")
+    assert len(escritos) == 3 and not escritos.contiene(None)
+    assert escritos.contiene("a")  # 'a' pasa a ser el más reciente
+    escritos.agregar("d")
+    assert not escritos.contiene("b")
+    assert all(escritos.contiene(i) for i in ("a", "c", "d"))
+
+
+def test_desactivada_y_concurrente():
+    desactivada = IdsRecientes(0)
+    desactivada.agregar("a")
+    assert not desactivada.contiene("a") and len(desactivada) == 0
+
+    escritos = IdsRecientes(1000)
+    hilos = [
+        threading.Thread(target=lambda k=k: [escritos.agregar(f"{k}-{i}") for i in range(500)])
+        for k in range(4)
+    ]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert len(escritos) == 1000
@@ -0,0 +1,142 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pika
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "producers_service"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+import dlq_tool
+import encoding as productor
+from utils.dlq import (
+    DESCONOCIDO, HEADER_MOTIVO_DLQ, HEADER_REPROCESOS_DLQ, RECHAZO_DB, VALIDACION, cabeceras_dlq, motivo_dlq
+)
+from utils.retry import HEADER_REINTENTOS
+
+
+def lectura(id_station, temperatura=20.5):
+    return {
+        "id_station": id_station, "dates": "2025-01-01T10:00:00+00:00", "temperature_celsius": temperatura,
+        "humidity": 50.0, "wind": "N", "wind_speed": 10.0, "pressure": 1013.5,
+    }
+
+
+def en_dlq(lecturas, motivo=VALIDACION, formato="msgpack"):
+    body, propiedades = productor.obtener_empaquetador(formato, len(lecturas), "gzip")(lecturas)
+    headers = cabeceras_dlq(dict(propiedades.get("headers") or {}, **{HEADER_REINTENTOS: 3}), motivo, "fuera_de_rango")
+    return body, pika.BasicProperties(
+        content_type=propiedades["content_type"], content_encoding=propiedades.get("content_encoding"),
+        headers=headers, message_id="original",
+    )
+
+
+class CanalFalso:
+    def __init__(self):
+        self.publicados = []
+        self.acks = []
+
+    def basic_publish(self, exchange, routing_key, body, properties, mandatory=False):
+        self.publicados.append((exchange, routing_key, body, properties))
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+
+
+class CanalConsumo(CanalFalso):
+    """Entrega como mucho `prefetch_count` mensajes sin confirmar, como el broker."""
+
+    def __init__(self, mensajes):
+        super().__init__()
+        self.mensajes = mensajes
+        self.prefetch = None
+
+    def basic_qos(self, prefetch_count):
+        self.prefetch = prefetch_count
+
+    def queue_declare(self, queue, durable, passive):
+        return SimpleNamespace(method=SimpleNamespace(message_count=len(self.mensajes)))
+
+    def consume(self, queue, inactivity_timeout):
+        limite = self.prefetch or len(self.mensajes)
+        for tag, (body, properties) in enumerate(self.mensajes[:limite], start=1):
+            yield entrega(tag, body, properties)
+        while True:
+            yield None, None, None
+
+    def cancel(self):
+        pass
+
+
+def entrega(tag, body, properties):
+    return SimpleNamespace(delivery_tag=tag), properties, body
+
+
+def test_cabeceras_y_motivo():
+    headers = cabeceras_dlq({"x-readings": 3}, RECHAZO_DB, "violates foreign key " * 100)
+    assert motivo_dlq(headers) == RECHAZO_DB and len(headers["x-dlq-detail"]) == 500 and headers["x-readings"] == 3
+    assert motivo_dlq(None) == motivo_dlq({HEADER_MOTIVO_DLQ: "otro"}) == DESCONOCIDO
+    assert motivo_dlq({HEADER_MOTIVO_DLQ: b"validacion"}) == VALIDACION
+
+
+def test_clasificacion():
+    assert dlq_tool.clasificar(*en_dlq([lectura(1), lectura(2)])).estado == "valido"
+    assert dlq_tool.clasificar(*en_dlq([lectura(1), lectura(2, 150)])).estado == "parcial"
+    assert dlq_tool.clasificar(*en_dlq([lectura(1, 150)], formato="json")).estado == "invalido:fuera_de_rango"
+    ilegible = dlq_tool.clasificar(b"{no es json", pika.BasicProperties(content_type="application/json"))
+    assert ilegible.estado == "ilegible" and ilegible.motivo == DESCONOCIDO
+
+
+def test_republicar_recupera_las_validas_y_devuelve_el_resto():
+    canal = CanalFalso()
+    reprocesador = dlq_tool.Reprocesador(canal, "republicar")
+    reprocesador.procesar([
+        entrega(1, *en_dlq([lectura(1), lectura(2)])),
+        entrega(2, *en_dlq([lectura(3), lectura(4, 150)])),
+        entrega(3, b"{no es json", pika.BasicProperties(content_type="application/json")),
+    ])
+    assert reprocesador.resultados == {"recuperado": 1, "parcial": 1, "devuelto": 1}
+    assert reprocesador.lecturas == 3 and canal.acks == [(3, True)]
+
+    principal = [p for p in canal.publicados if p[0] == dlq_tool.RABBITMQ_EXCHANGE]
+    devueltos = [p for p in canal.publicados if p[0] == dlq_tool.RABBITMQ_DLQ_EXCHANGE]
+    # Sobre completo tal cual (comprimido) y la lectura válida del sobre parcial suelta
+    assert [p[3].content_encoding for p in principal] == ["gzip", None]
+    for _, _, _, propiedades in principal:
+        assert propiedades.message_id != "original" and propiedades.headers[dlq_tool.HEADER_ID_ORIGINAL] == "original"
+        assert HEADER_MOTIVO_DLQ not in propiedades.headers and HEADER_REINTENTOS not in propiedades.headers
+    assert len(devueltos) == 2
+    assert all(p[3].headers[HEADER_REPROCESOS_DLQ] == 1 for p in devueltos)
+    assert "x-readings" not in devueltos[0][3].headers and devueltos[0][3].headers["x-dlq-detail"].startswith("fuera_de_rango")
+
+
+def test_filtro_por_motivo_y_limitador():
+    canal = CanalFalso()
+    reprocesador = dlq_tool.Reprocesador(canal, "republicar", motivos=[RECHAZO_DB])
+    body, propiedades = en_dlq([lectura(1)])
+    reprocesador.procesar([entrega(7, body, propiedades)])
+    assert reprocesador.resultados == {"omitido": 1}
+    assert canal.publicados == [(dlq_tool.RABBITMQ_DLQ_EXCHANGE, dlq_tool.ROUTING_KEY, body, propiedades)]
+
+    reloj, esperas = [0.0], []
+    limitador = dlq_tool.Limitador(100, reloj=lambda: reloj[0], dormir=esperas.append)
+    limitador.esperar(50)
+    limitador.esperar(50)
+    reloj[0] = 2.0
+    limitador.esperar(50)
+    assert esperas == [0.5]
+
+
+def test_resumen_acota_el_prefetch():
+    canal = CanalConsumo([en_dlq([lectura(i)]) for i in range(1, 31)])
+    conteo = dlq_tool.resumir(canal, 20)
+    assert canal.prefetch == 20 and conteo == {(VALIDACION, "valido"): 20}
+
+    # Sin --max no se pide el prefetch ilimitado (0): toda la DLQ acabaría en memoria
+    dlq_tool.resumir(canal, None)
+    assert canal.prefetch == dlq_tool.RESUMEN_MAX
+    dlq_tool.resumir(canal, 10 ** 6)
+    assert canal.prefetch == dlq_tool.PREFETCH_MAX
+    assert dlq_tool.parsear_argumentos(["resumen"]).max == dlq_tool.RESUMEN_MAX
+    assert canal.acks == []
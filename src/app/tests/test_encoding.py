@@ -0,0 +1,80 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "producers_service"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+import encoding as productor
+from utils.encoding import CONTENT_TYPE_STRUCT, HEADER_LECTURAS, ErrorDecodificacion, decodificar, desempaquetar
+from utils.validation import (
+    FECHA_INVALIDA, FUERA_DE_RANGO, VALOR_NO_PERMITIDO, ErrorValidacion, normalizar, validar_lote
+)
+
+DATOS = {
+    "id_station": 42, "dates": "2025-01-01T10:00:00+00:00", "temperature_celsius": 20.5,
+    "humidity": 50.25, "wind": "ne", "wind_speed": 10.0, "pressure": 1013.5,
+}
+
+
+@pytest.mark.parametrize("formato", ["json", "msgpack", "struct"])
+def test_los_tres_formatos_producen_la_misma_fila(formato):
+    body, content_type = productor.obtener_codificador(formato)(DATOS)
+    fila = normalizar(decodificar(body, content_type))
+    assert fila == (42, datetime(2025, 1, 1, 10, tzinfo=timezone.utc), 20.5, 50.25, "NE", 10.0, 1013.5)
+
+
+def test_formatos_binarios_son_mas_compactos():
+    tamanos = {f: len(productor.obtener_codificador(f)(DATOS)[0]) for f in productor.CODIFICADORES}
+    assert tamanos["struct"] == productor.FORMATO_STRUCT.size < tamanos["msgpack"] < tamanos["json"] / 2
+
+
+def test_sin_content_type_es_json_y_formatos_desconocidos_fallan():
+    assert decodificar(b'{"a": 1}', None) == {"a": 1}
+    assert decodificar(b'{"a": 1}', "application/json; charset=utf-8") == {"a": 1}
+    for body, content_type in [(b"{", None), (b"\xff\xfe", None), (b"\xc1", "application/msgpack"),
+                               (b"corto", CONTENT_TYPE_STRUCT), (b"{}", "text/xml")]:
+        with pytest.raises(ErrorDecodificacion):
+            decodificar(body, content_type)
+
+
+def test_struct_con_valores_invalidos_llega_a_la_validacion():
+    campos = (1, 42, 0.0, 20.0, 50.0, 8, 10.0, 1000.0)  # código de viento 8 no existe
+    with pytest.raises(ErrorValidacion) as error:
+        normalizar(decodificar(productor.FORMATO_STRUCT.pack(*campos), CONTENT_TYPE_STRUCT))
+    assert error.value.codigo == VALOR_NO_PERMITIDO
+
+    campos = (1, 42, float("nan"), 20.0, 50.0, 0, 10.0, 1000.0)
+    with pytest.raises(ErrorValidacion) as error:
+        normalizar(decodificar(productor.FORMATO_STRUCT.pack(*campos), CONTENT_TYPE_STRUCT))
+    assert error.value.codigo == FECHA_INVALIDA
+
+
+@pytest.mark.parametrize("formato", ["json", "msgpack", "struct"])
+@pytest.mark.parametrize("compresion", ["none", "zlib", "gzip"])
+def test_sobre_con_compresion(formato, compresion):
+    lecturas = [dict(DATOS, id_station=i) for i in range(1, 6)]
+    lecturas[2] = dict(DATOS, humidity=150)  # fuera de rango: solo esta va a la DLQ
+    body, propiedades = productor.obtener_empaquetador(formato, len(lecturas), compresion)(lecturas)
+    sobre = desempaquetar(body, propiedades["content_type"], propiedades.get("content_encoding"), propiedades["headers"])
+    assert sobre.es_lote and len(sobre) == 5
+
+    validas, errores = validar_lote(sobre.lecturas)
+    assert [i for i, _ in validas] == [0, 1, 3, 4]
+    assert [(i, e.codigo) for i, e in errores] == [(2, FUERA_DE_RANGO)]
+    # La lectura rechazada se reenvía sola, sin comprimir, en el mismo formato
+    assert decodificar(sobre.cuerpo(2), propiedades["content_type"])["humidity"] == 150
+
+
+def test_sobre_mal_declarado_o_comprimido():
+    body, propiedades = productor.obtener_empaquetador("json", 2)([DATOS, DATOS])
+    with pytest.raises(ErrorDecodificacion):
+        desempaquetar(body, propiedades["content_type"], headers={HEADER_LECTURAS: 3})
+    with pytest.raises(ErrorDecodificacion):
+        desempaquetar(body, propiedades["content_type"], "zlib", propiedades["headers"])
+    # Un mensaje simple comprimido se decodifica igual y su cuerpo en la DLQ es el original
+    comprimido, propiedades = productor.obtener_empaquetador("json", 1, "gzip")([DATOS])
+    sobre = desempaquetar(comprimido, propiedades["content_type"], propiedades["content_encoding"])
+    assert not sobre.es_lote and sobre.lecturas[0]["id_station"] == 42 and sobre.cuerpo(0) == comprimido
@@ -0,0 +1,309 @@
+import io
+import os
+import csv
+import sys
+from datetime import datetime, timezone
+
+import pika
+import pytest
+from prometheus_client import REGISTRY
+from psycopg2 import IntegrityError, OperationalError
+
+# main.py se puede importar sin efectos de red: el servidor de métricas arranca en main().
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+import main
+from utils.acks import AckAcumulado
+from utils.dedup import IdsRecientes
+from utils.dlq import HEADER_DETALLE_DLQ, HEADER_MOTIVO_DLQ, RECHAZO_DB
+from utils.metrics import filas_escritas
+from utils.retry import HEADER_REINTENTOS
+
+
+def fila(estacion, minuto=0):
+    return (estacion, datetime(2024, 1, 1, 0, minuto, tzinfo=timezone.utc), 20.0, 50.0, "N", 10.0, 1000.0)
+
+
+# --- Fakes de psycopg2 y pika; los eventos de la DB y del canal van a una lista común ---
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = self.connection = conn
+        self.rowcount = -1
+        self._valores = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def mogrify(self, template, args):
+        # execute_values compone el INSERT multi-fila con mogrify
+        self._valores.append(args)
+        return b"(...)"
+
+    def execute(self, sql, params=None):
+        filas, self._valores = ([params] if params is not None else self._valores), []
+        if isinstance(sql, str) and "FROM weather_logs_entrada" in sql:
+            filas, self.conn.temporal = self.conn.temporal, []  # COPY_MOVER_SQL
+        self.conn.eventos.append(("sql", sql.split()[0].upper() if isinstance(sql, str) else "INSERT"))
+        if self.conn.error is not None:
+            error, self.conn.error = self.conn.error, None
+            if self.conn.cerrar_al_fallar:
+                self.conn.closed = 1
+            raise error
+        if any(f[0] in self.conn.malas for f in filas):
+            raise IntegrityError("insert or update on table weather_logs violates foreign key constraint")
+        # ON CONFLICT DO NOTHING: las lecturas ya guardadas no cuentan en rowcount
+        nuevas = [f for f in filas if f[:2] not in self.conn.existentes]
+        self.rowcount = len(nuevas)
+        self.conn.filas.extend(nuevas)
+
+    def copy_expert(self, sql, buffer):
+        self.conn.eventos.append(("sql", "COPY"))
+        self.conn.temporal = [(int(f[0]),) + tuple(f[1:]) for f in csv.reader(io.StringIO(buffer.read()))]
+
+
+class FakeConn:
+    encoding = "UTF8"
+
+    def __init__(self, malas=(), error=None, cerrar_al_fallar=False, eventos=None):
+        self.malas = set(malas)
+        self.error = error
+        self.cerrar_al_fallar = cerrar_al_fallar
+        self.error_commit = None
+        self.closed = 0
+        self.filas = []  # filas de la transacción en curso
+        self.temporal = []  # weather_logs_entrada del motor copy
+        self.existentes = set()  # (id_station, dates) ya en weather_logs
+        self.confirmadas = []
+        self.eventos = eventos if eventos is not None else []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        if self.error_commit is not None:
+            self.closed = 1
+            raise self.error_commit
+        self.eventos.append(("commit",))
+        self.confirmadas.extend(self.filas)
+        self.filas = []
+
+    def rollback(self):
+        self.eventos.append(("rollback",))
+        self.filas = []
+
+
+class FakeChannel:
+    def __init__(self, eventos):
+        self.eventos = eventos
+        self.publicados = []
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def queue_declare(self, **kwargs):
+        pass
+
+    def queue_bind(self, **kwargs):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.eventos.append(("publish", exchange))
+        self.publicados.append((exchange, body, properties))
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.eventos.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue=True, multiple=False):
+        self.eventos.append(("nack", delivery_tag))
+
+
+class FakeConnection:
+    """Temporizadores de pika: se disparan a mano en los tests."""
+
+    def __init__(self):
+        self.timers = {}
+
+    def call_later(self, delay, callback):
+        self.timers[len(self.timers) + 1] = callback
+        return len(self.timers)
+
+    def remove_timeout(self, timer_id):
+        self.timers.pop(timer_id, None)
+
+
+def pendiente(tag, *filas):
+    propiedades = pika.BasicProperties(message_id=f"m{tag}", delivery_mode=2)
+    body = f"mensaje {tag}".encode()
+    return main.Pendiente(tag, list(filas), lambda j: (f"{tag}/{j}".encode(), propiedades),
+                          (body, propiedades, main.ROUTING_KEY))
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Conexión global falsa (modo de un worker, sin spool)."""
+    conn = FakeConn()
+    monkeypatch.setattr(main, "_db_conn", conn)
+    monkeypatch.setattr(main, "_db_pool", None)
+    monkeypatch.setattr(main, "_spool", None)
+    monkeypatch.setattr(main, "_escritos", IdsRecientes(100))
+    return conn
+
+
+def canal_y_acks(db, *tags):
+    ch = FakeChannel(db.eventos)
+    acks = AckAcumulado(ch, ack_cada=len(tags))
+    for tag in tags:
+        acks.registrar(tag)
+    return ch, acks
+
+
+# ==============================
+# AcumuladorLote / escribir_pendientes
+# ==============================
+
+def test_lote_se_escribe_al_llegar_a_max_filas(db):
+    ch, acks = canal_y_acks(db, 1, 2)
+    conexion = FakeConnection()
+    lote = main.AcumuladorLote(conexion, ch, acks, max_filas=3, linger_s=0.2)
+    lote.agregar(pendiente(1, fila(1)))
+    assert db.eventos == [] and lote.filas_pendientes == 1 and len(conexion.timers) == 1
+    # Un sobre de dos filas completa el lote: una transacción y un ACK múltiple tras el commit
+    lote.agregar(pendiente(2, fila(1, 1), fila(2, 1)))
+    assert db.eventos == [("sql", "INSERT"), ("commit",), ("ack", 2)]
+    assert db.confirmadas == [fila(1), fila(1, 1), fila(2, 1)]
+    assert lote.filas_pendientes == 0 and conexion.timers == {}
+    assert main._escritos.contiene("m1") and main._escritos.contiene("m2")
+
+
+def test_lote_se_escribe_al_vencer_linger(db):
+    ch, acks = canal_y_acks(db, 1)
+    conexion = FakeConnection()
+    lote = main.AcumuladorLote(conexion, ch, acks, max_filas=100, linger_s=0.2)
+    lote.agregar(pendiente(1, fila(1)))
+    assert db.eventos == []
+    conexion.timers.pop(1)()
+    assert db.eventos == [("sql", "INSERT"), ("commit",), ("ack", 1)]
+    # Sin pendientes el timer no vuelve a programarse ni se escribe nada
+    lote.flush()
+    assert conexion.timers == {} and len(db.eventos) == 3
+
+
+def test_operational_error_pasa_el_lote_a_reintento(db):
+    db.error = OperationalError("could not receive data from server")
+    ch, acks = canal_y_acks(db, 1, 2)
+    procesadas = filas_escritas()
+    main.escribir_pendientes(ch, acks, [pendiente(1, fila(1)), pendiente(2, fila(2))])
+    # Sin commit: cada mensaje se republica en el primer nivel de reintento y luego se confirma
+    assert ("commit",) not in db.eventos and filas_escritas() == procesadas
+    primer_nivel = main.NIVELES_REINTENTO[0]
+    assert [e for e in db.eventos if e[0] != "sql"] == [
+        ("rollback",), ("publish", primer_nivel), ("publish", primer_nivel), ("ack", 2),
+    ]
+    assert [p[2].headers[HEADER_REINTENTOS] for p in ch.publicados] == [1, 1]
+    assert not main._escritos.contiene("m1")
+
+
+def test_lote_rechazado_se_aisla_fila_a_fila(db):
+    db.malas = {9}
+    ch, acks = canal_y_acks(db, 1, 2, 3)
+    procesadas = filas_escritas()
+    main.escribir_pendientes(ch, acks, [pendiente(1, fila(1)), pendiente(2, fila(9), fila(2)), pendiente(3, fila(3))])
+    # Solo la fila de la estación 9 (primera del sobre 2) va a la DLQ; el resto se confirma
+    assert db.confirmadas == [fila(1), fila(2), fila(3)]
+    assert filas_escritas() == procesadas + 3
+    assert [(p[0], p[1], p[2].headers[HEADER_MOTIVO_DLQ]) for p in ch.publicados] == [
+        (main.RABBITMQ_DLQ_EXCHANGE, b"2/0", RECHAZO_DB),
+    ]
+    # Rollback del lote, commit del reintento fila a fila, DLQ y por último un único ACK
+    resto = [e for e in db.eventos if e[0] != "sql"]
+    assert resto == [("rollback",), ("commit",), ("publish", main.RABBITMQ_DLQ_EXCHANGE), ("ack", 3)]
+
+
+# ==============================
+# Motor copy y aislamiento fila a fila
+# ==============================
+
+def test_copy_escribe_el_lote_en_una_transaccion(db, monkeypatch):
+    monkeypatch.setattr(main, "escribir_lote", main.copiar_weather_lote)
+    ch, acks = canal_y_acks(db, 1, 2)
+    procesadas = filas_escritas()
+    main.escribir_pendientes(ch, acks, [pendiente(1, fila(1)), pendiente(2, fila(2), fila(3))])
+    assert db.eventos == [("sql", "CREATE"), ("sql", "COPY"), ("sql", "INSERT"), ("commit",), ("ack", 2)]
+    assert [f[0] for f in db.confirmadas] == [1, 2, 3]
+    assert filas_escritas() == procesadas + 3
+
+
+def test_copy_rechazado_envia_cada_fila_mala_con_su_mensaje(db, monkeypatch):
+    monkeypatch.setattr(main, "escribir_lote", main.copiar_weather_lote)
+    db.malas = {8, 9}
+    ch, acks = canal_y_acks(db, 1, 2, 3)
+    main.escribir_pendientes(ch, acks, [
+        pendiente(1, fila(1)), pendiente(2, fila(9), fila(2), fila(8)), pendiente(3, fila(8, 1)),
+    ])
+    # El COPY falla entero; el reintento con un SAVEPOINT por fila confirma las buenas...
+    assert db.confirmadas == [fila(1), fila(2)]
+    assert db.eventos.count(("sql", "SAVEPOINT")) == 5 and db.eventos.count(("sql", "ROLLBACK")) == 3
+    # ...y cada fila rechazada va a la DLQ con el cuerpo de su propia lectura
+    assert [(p[0], p[1]) for p in ch.publicados] == [
+        (main.RABBITMQ_DLQ_EXCHANGE, b"2/0"), (main.RABBITMQ_DLQ_EXCHANGE, b"2/2"), (main.RABBITMQ_DLQ_EXCHANGE, b"3/0"),
+    ]
+    assert all("foreign key" in p[2].headers[HEADER_DETALLE_DLQ] for p in ch.publicados)
+    resto = [e for e in db.eventos if e[0] != "sql"]
+    assert resto[:2] == [("rollback",), ("commit",)] and resto[-1] == ("ack", 3)
+
+
+def test_aislar_filas_devuelve_el_error_por_indice(db):
+    db.malas = {9}
+    rechazadas = main.insertar_filas_aislando_errores([fila(1), fila(9), fila(2), fila(9, 1)])
+    assert sorted(rechazadas) == [1, 3]
+    assert db.confirmadas == [fila(1), fila(2)] and db.eventos[-1] == ("commit",)
+
+
+# ==============================
+# Reconexión (con_reconexion) y commit incierto (confirmar)
+# ==============================
+
+def reconexiones():
+    return REGISTRY.get_sample_value("db_reconnects_total") or 0.0
+
+
+def test_conexion_perdida_antes_del_commit_repite_el_lote(db, monkeypatch):
+    db.error = OperationalError("server closed the connection unexpectedly")
+    db.cerrar_al_fallar = True
+    nueva = FakeConn(eventos=db.eventos)
+    monkeypatch.setattr(main, "connect_db_with_retry", lambda: nueva)
+    ch, acks = canal_y_acks(db, 1, 2)
+    procesadas, antes = filas_escritas(), reconexiones()
+    main.escribir_pendientes(ch, acks, [pendiente(1, fila(1)), pendiente(2, fila(2))])
+    # La transacción perdida nunca se confirmó: el lote completo se repite en la conexión nueva
+    assert db.confirmadas == [] and nueva.confirmadas == [fila(1), fila(2)]
+    assert main._db_conn is nueva and reconexiones() == antes + 1
+    assert filas_escritas() == procesadas + 2
+    assert db.eventos == [("sql", "INSERT"), ("sql", "INSERT"), ("commit",), ("ack", 2)]
+
+
+def test_commit_incierto_no_repite_ni_pierde_filas(db, monkeypatch):
+    db.error_commit = OperationalError("server closed the connection unexpectedly")
+    monkeypatch.setattr(main, "connect_db_with_retry", lambda: pytest.fail("no se debe repetir el lote"))
+    ch, acks = canal_y_acks(db, 1)
+    procesadas, antes = filas_escritas(), reconexiones()
+    main.escribir_pendientes(ch, acks, [pendiente(1, fila(1), fila(2))])
+    # No se sabe si el commit llegó: no se cuenta ni se repite aquí, el mensaje va a reintento
+    assert db.eventos.count(("sql", "INSERT")) == 1 and filas_escritas() == procesadas
+    assert main._db_conn is None and reconexiones() == antes + 1
+    assert [(e, p.headers[HEADER_REINTENTOS]) for e, _, p in ch.publicados] == [(main.NIVELES_REINTENTO[0], 1)]
+    assert db.eventos[-2:] == [("publish", main.NIVELES_REINTENTO[0]), ("ack", 1)]
+
+    # El commit sí se había aplicado: al reentregarse, las filas cuentan como duplicadas
+    nueva = FakeConn(eventos=db.eventos)
+    nueva.existentes = {fila(1)[:2], fila(2)[:2]}
+    monkeypatch.setattr(main, "connect_db_with_retry", lambda: nueva)
+    ch, acks = canal_y_acks(nueva, 2)
+    duplicadas = REGISTRY.get_sample_value("rows_duplicate_total") or 0.0
+    main.escribir_pendientes(ch, acks, [pendiente(2, fila(1), fila(2))])
+    assert filas_escritas() == procesadas and nueva.eventos[-1] == ("ack", 2)
+    assert REGISTRY.get_sample_value("rows_duplicate_total") == duplicadas + 2
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "producers_service"))
+
+from load_generator import (MAX_ESTACIONES_CARGA, PRIMERA_ESTACION_CARGA, CuboTokens, GeneradorCarga, PerfilCarga,
+                            estaciones_carga, percentil)
+
+
+def test_cubo_respeta_la_tasa_y_la_ventana():
+    cubo = CuboTokens(PerfilCarga(100), inicio=0.0)
+    assert cubo.tomar(1000, ahora=0.5) == 50
+    # Con la ventana llena (maximo=10) lo que no cabe queda acumulado...
+    assert cubo.tomar(10, ahora=1.0) == 10
+    assert cubo.tomar(1000, ahora=1.0) == 40
+    # ...pero nunca más de un segundo de tasa.
+    assert cubo.tomar(1000, ahora=10.0) == 100
+
+def test_perfil_rafaga():
+    perfil = PerfilCarga(10, "burst", factor_rafaga=5, duracion_rafaga_s=2, periodo_rafaga_s=10)
+    assert perfil.tasa(1.0) == 50
+    assert perfil.tasa(5.0) == 10
+    assert perfil.tasa(11.0) == 50
+
+def test_perfil_jitter_acotado():
+    perfil = PerfilCarga(100, jitter=0.2)
+    assert all(80 <= perfil.tasa(0) <= 120 for _ in range(100))
+
+def test_perfil_desconocido():
+    with pytest.raises(ValueError):
+        PerfilCarga(10, "sine")
+
+def test_percentiles():
+    valores = [i / 100 for i in range(1, 101)]
+    assert percentil(valores, 0.5) == 0.5
+    assert percentil(valores, 0.99) == 0.99
+    assert percentil([], 0.5) == 0.0
+
+
+def test_estaciones_en_el_rango_reservado_para_carga():
+    # init.sql solo crea las estaciones reales (1-5): la carga usa IDs propios (seed_stations.sql)
+    assert estaciones_carga(3) == range(9000, 9003)
+    assert estaciones_carga(10 ** 6) == range(PRIMERA_ESTACION_CARGA, 10000)
+    assert len(estaciones_carga(0)) == 1
+    generador = GeneradorCarga(None, "weather", "weather", lambda i: {}, tasa=10, estaciones=5000)
+    assert generador.estaciones == MAX_ESTACIONES_CARGA
@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import queue
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+import utils.logger as logger_mod
+from utils.logger import ColaNoBloqueante, Muestreo, LOG_RECORDS_DROPPED
+
+
+def registro(nivel=logging.INFO, msg="Mensaje recibido. Delivery tag=%s"):
+    return logging.LogRecord("CONSUMER_LOG.mensajes", nivel, __file__, 1, msg, (1,), None)
+
+
+def test_muestreo_y_limite_por_segundo():
+    azar = iter([0.05, 0.5, 0.09, 0.95])
+    muestreo = Muestreo(tasa=0.1, azar=lambda: next(azar))
+    assert [muestreo.filter(registro()) for _ in range(4)] == [True, False, True, False]
+    assert muestreo.filter(registro(logging.WARNING))  # WARNING no se muestrea
+
+    reloj = [100.2]
+    limite = Muestreo(max_por_segundo=2, reloj=lambda: reloj[0])
+    assert [limite.filter(registro()) for _ in range(3)] == [True, True, False]
+    assert limite.filter(registro(logging.ERROR))
+    reloj[0] = 101.0
+    assert limite.filter(registro())
+
+
+def test_cola_llena_descarta_sin_bloquear():
+    antes = LOG_RECORDS_DROPPED.labels("queue_full")._value.get()
+    handler = ColaNoBloqueante(queue.Queue(maxsize=1))
+    handler.handle(registro())
+    handler.handle(registro())
+    assert handler.queue.qsize() == 1
+    assert LOG_RECORDS_DROPPED.labels("queue_full")._value.get() == antes + 1
+
+
+def test_setup_logger_json_y_rotacion(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger_mod, "LOG_FORMAT", "json")
+    monkeypatch.setattr(logger_mod, "LOG_MAX_BYTES", 300)
+    monkeypatch.setattr(logger_mod, "LOG_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(logger_mod, "LOG_RATE_LIMIT", 0)
+    archivo = tmp_path / "consumer.log"
+    log = logger_mod.setup_logger("TEST_LOG", str(archivo))
+    for i in range(10):
+        logging.getLogger("TEST_LOG.mensajes").info("Mensaje %d", i, extra={"delivery_tag": i})
+    logger_mod._detener("TEST_LOG")  # vacía la cola
+    log.handlers.clear()
+
+    rotados = sorted(tmp_path.glob("consumer.log.*"))
+    assert rotados and len(rotados) <= 5
+    lineas = [json.loads(l) for l in archivo.read_text(encoding="utf-8").splitlines()]
+    assert lineas[-1]["msg"] == "Mensaje 9" and lineas[-1]["delivery_tag"] == 9
+    assert lineas[-1]["logger"] == "TEST_LOG.mensajes" and lineas[-1]["level"] == "INFO"
+
+
+def test_json_conserva_el_traceback(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger_mod, "LOG_FORMAT", "json")
+    archivo = tmp_path / "consumer.log"
+    log = logger_mod.setup_logger("TEST_EXC_LOG", str(archivo))
+    try:
+        raise ValueError("fila no válida")
+    except ValueError:
+        log.exception("Fallo al escribir el lote %s", 7)
+    logger_mod._detener("TEST_EXC_LOG")  # vacía la cola
+    log.handlers.clear()
+
+    [linea] = [json.loads(l) for l in archivo.read_text(encoding="utf-8").splitlines()]
+    assert linea["msg"] == "Fallo al escribir el lote 7" and linea["level"] == "ERROR"
+    assert linea["exc"].startswith("Traceback") and "ValueError: fila no válida" in linea["exc"]
@@ -0,0 +1,72 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "producers_service"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from prometheus_client import REGISTRY
+
+import encoding as productor
+from utils.acks import AckAcumulado
+from utils.encoding import HEADER_LECTURAS, HEADER_PUBLICADO
+from utils.metrics import (
+    DB_TRANSITORIO, ETAPA_VALIDACION, contar_fallos, etapa, observar_latencia, seguir_en_vuelo,
+)
+
+
+def valor(nombre, **labels):
+    return REGISTRY.get_sample_value(nombre, labels) or 0.0
+
+
+def test_etapas_fallos_y_lag():
+    antes = valor("consumer_stage_seconds_count", stage=ETAPA_VALIDACION)
+    with etapa(ETAPA_VALIDACION):
+        pass
+    assert valor("consumer_stage_seconds_count", stage=ETAPA_VALIDACION) == antes + 1
+
+    antes = valor("messages_failed_total", reason=DB_TRANSITORIO)
+    contar_fallos(DB_TRANSITORIO, 3)
+    assert valor("messages_failed_total", reason=DB_TRANSITORIO) == antes + 3
+
+    # Lag de 2.5 s; los mensajes sin cabecera (o con un valor no numérico) no cuentan
+    cuenta, suma = valor("consumer_end_to_end_lag_seconds_count"), valor("consumer_end_to_end_lag_seconds_sum")
+    observar_latencia({HEADER_PUBLICADO: 1_000_000}, ahora=1_002.5)
+    observar_latencia(None)
+    observar_latencia({HEADER_PUBLICADO: b"1000"})
+    assert valor("consumer_end_to_end_lag_seconds_count") == cuenta + 1
+    assert abs(valor("consumer_end_to_end_lag_seconds_sum") - suma - 2.5) < 1e-9
+
+
+def test_sello_del_productor():
+    _, propiedades = productor.obtener_empaquetador("json", 2)([{"id_station": 1}, {"id_station": 2}])
+    sellado = productor.sellar_publicacion(propiedades)
+    assert sellado["headers"][HEADER_LECTURAS] == 2 and isinstance(sellado["headers"][HEADER_PUBLICADO], int)
+    assert HEADER_PUBLICADO not in propiedades["headers"]  # no modifica el original
+    assert productor.HEADER_PUBLICADO == HEADER_PUBLICADO
+
+
+class Canal:
+    def basic_ack(self, delivery_tag, multiple=False):
+        pass
+
+
+class Lote:
+    filas_pendientes = 7
+
+
+def test_en_vuelo_y_medicion_del_ack():
+    duraciones = []
+    acks = AckAcumulado(Canal(), ack_cada=10, medir=duraciones.append)
+    lote = Lote()
+    base = valor("consumer_messages_in_flight"), valor("consumer_rows_pending")
+    seguir_en_vuelo(acks, lote, None)
+    for tag in (1, 2, 3):
+        acks.registrar(tag)
+    assert valor("consumer_messages_in_flight") == base[0] + 3
+    assert valor("consumer_rows_pending") == base[1] + 7
+
+    acks.completar(1, 2)
+    acks.flush()
+    assert len(duraciones) == 1 and valor("consumer_messages_in_flight") == base[0] + 1
+    del acks, lote  # WeakSet: dejan de contar al liberarse
+    assert valor("consumer_messages_in_flight") == base[0]
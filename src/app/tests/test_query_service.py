@@ -0,0 +1,91 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "query_service"))
+
+from cache import CacheRespuestas
+from queries import (SERIE_CRUDA_SQL, SERIE_HORARIA_SQL, ErrorConsulta, alinear, consulta_agregados,
+                     consulta_serie, paso_serie, parsear_estaciones, parsear_fecha, parsear_paso, usa_horarios)
+
+UTC = timezone.utc
+
+
+class Reloj:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def test_cache_lru_ttl_y_marca():
+    reloj = Reloj()
+    cache = CacheRespuestas(2, ttl_s=30, reloj=reloj)
+    cache.guardar("a", 1, b"A")
+    cache.guardar("b", 1, b"B")
+    assert cache.obtener("a", 1) == b"A"
+    # "b" es la menos usada: sale al guardar "c"
+    cache.guardar("c", 1, b"C")
+    assert cache.obtener("b", 1) is None and len(cache) == 2
+    # Con otra marca de escritura la respuesta ya no se sirve (y se descarta)
+    assert cache.obtener("a", 2) is None and cache.obtener("a", 1) is None
+    reloj.t = 30
+    assert cache.obtener("c", 1) is None and len(cache) == 0
+
+
+def test_cache_desactivada():
+    cache = CacheRespuestas(0, ttl_s=30)
+    cache.guardar("a", 1, b"A")
+    assert cache.obtener("a", 1) is None and len(cache) == 0
+
+
+def test_parametros():
+    assert parsear_paso("90") == timedelta(seconds=90)
+    assert parsear_paso("5m") == timedelta(minutes=5)
+    assert parsear_paso("1d") == timedelta(days=1)
+    assert parsear_paso(None) is None
+    for texto in ("0", "5x", "-1h"):
+        with pytest.raises(ErrorConsulta):
+            parsear_paso(texto)
+    assert parsear_estaciones(["3,1", "2", "1"]) == [1, 2, 3]
+    assert parsear_estaciones([]) is None
+    with pytest.raises(ErrorConsulta):
+        parsear_estaciones(["a"])
+    assert parsear_fecha("2024-01-01T10:00:00Z") == datetime(2024, 1, 1, 10, tzinfo=UTC)
+    assert parsear_fecha("2024-01-01") == datetime(2024, 1, 1, tzinfo=UTC)
+
+
+def test_paso_redondo_y_limite_de_puntos():
+    desde = datetime(2024, 1, 1, tzinfo=UTC)
+    # 24 h en como mucho 500 puntos -> 172.8 s -> 5 min
+    assert paso_serie(desde, desde + timedelta(days=1), None, 500, 5000) == timedelta(minutes=5)
+    assert paso_serie(desde, desde + timedelta(days=1), timedelta(hours=1), 500, 5000) == timedelta(hours=1)
+    with pytest.raises(ErrorConsulta):
+        paso_serie(desde, desde + timedelta(days=1), timedelta(seconds=1), 500, 5000)
+
+
+def test_alinear_y_fuente_de_la_serie():
+    desde, hasta = alinear(datetime(2024, 1, 1, 10, 20, tzinfo=UTC), datetime(2024, 1, 3, 7, 5, tzinfo=UTC),
+                           timedelta(hours=1))
+    assert (desde, hasta) == (datetime(2024, 1, 1, 10, tzinfo=UTC), datetime(2024, 1, 3, 8, tzinfo=UTC))
+    assert usa_horarios(desde, hasta, timedelta(hours=6))
+    assert not usa_horarios(desde, hasta, timedelta(minutes=5))
+
+    sql, parametros = consulta_serie(1, desde, hasta, timedelta(hours=1), retencion=timedelta(days=30))
+    assert sql is SERIE_HORARIA_SQL and parametros["estacion"] == 1 and parametros["retencion"] == timedelta(days=30)
+    # Los agregados horarios solo sustituyen a las lecturas crudas ya eliminadas: el corte es
+    # la marca de agua o, si es anterior, la hora desde la que se conservan las crudas
+    assert "LEAST(" in sql and "now() - %(retencion)s::interval" in sql
+    assert consulta_serie(1, desde, hasta, timedelta(hours=1))[1]["retencion"] is None
+    sql, _ = consulta_serie(1, desde, hasta, timedelta(minutes=15))
+    assert sql is SERIE_CRUDA_SQL
+
+    # Agregados: un único intervalo desde `from`; horarios solo con horas enteras
+    sql, parametros = consulta_agregados(1, desde, hasta, retencion=timedelta(days=30))
+    assert sql is SERIE_HORARIA_SQL and parametros["paso"] == hasta - desde and parametros["origen"] == desde
+    assert parametros["retencion"] == timedelta(days=30)
+    sql, _ = consulta_agregados(1, desde, hasta - timedelta(minutes=30))
+    assert sql is SERIE_CRUDA_SQL
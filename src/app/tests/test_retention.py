@@ -0,0 +1,160 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+import retention
+from psycopg2 import sql
+
+
+def como_texto(consulta):
+    """Texto de una sentencia compuesta con psycopg2.sql sin necesitar una conexión real."""
+    if isinstance(consulta, str):
+        return consulta
+    if isinstance(consulta, sql.Composed):
+        return "".join(como_texto(parte) for parte in consulta.seq)
+    if isinstance(consulta, sql.Identifier):
+        return ".".join(f'"{s}"' for s in consulta.strings)
+    return consulta.string
+
+
+class CursorFalso:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self._resultado = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, consulta, params=None):
+        texto = como_texto(consulta)
+        self.conn.sentencias.append(texto)
+        if texto.startswith("SELECT now()"):
+            self._resultado = [(self.conn.ahora,)]
+        elif "COALESCE(reagregado" in texto:
+            nivel = params[0]
+            self._resultado = [(self.conn.watermarks[nivel], self.conn.reagregados[nivel], self.conn.ahora)]
+        elif "SET reagregado" in texto:
+            self.conn.reagregados[params["nivel"]] = params["ahora"]
+        elif "JOIN weather_logs w" in texto:
+            # Buckets (de una hora) con filas ingeridas desde la última reagregación
+            self.conn.reagregacion = params
+            self.rowcount = len({
+                (estacion, fecha.replace(minute=0)) for estacion, fecha, ingesta in self.conn.filas
+                if ingesta >= params["ingesta_desde"] and fecha < params["hasta"]
+                and fecha.replace(minute=0) >= params["conservado"]
+            })
+        elif "weather_rollup_watermarks" in texto:
+            self._resultado = [(self.conn.watermarks[params[0]],)] if params[0] in self.conn.watermarks else []
+        elif "pg_try_advisory_lock" in texto:
+            self._resultado = [(True,)]
+        elif "pg_inherits" in texto:
+            self._resultado = [(n,) for n in self.conn.particiones]
+
+    def fetchone(self):
+        return self._resultado[0] if self._resultado else None
+
+    def fetchall(self):
+        return self._resultado
+
+
+class ConexionFalsa:
+    def __init__(self, ahora, watermarks, particiones, reagregados=None, filas=()):
+        self.ahora = ahora
+        self.watermarks = watermarks
+        self.particiones = particiones
+        self.reagregados = reagregados or {}
+        # Lecturas de weather_logs: (id_station, dates, ingested_at)
+        self.filas = list(filas)
+        self.sentencias = []
+
+    def cursor(self):
+        return CursorFalso(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def eliminadas(self):
+        return [s for s in self.sentencias if s.startswith(("DROP", "ALTER"))]
+
+
+PARTICIONES = ["weather_logs_2025_01", "weather_logs_2025_02", "weather_logs_2025_12", "weather_logs_default"]
+
+
+def test_fin_de_mes_cruza_el_anio():
+    assert retention.fin_de_mes(2025, 1) == datetime(2025, 2, 1, tzinfo=timezone.utc)
+    assert retention.fin_de_mes(2025, 12) == datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def test_solo_elimina_meses_completos_y_agregados():
+    # Corte por edad: 2025-03-15; el nivel diario solo está agregado hasta el 2025-02-10
+    conn = ConexionFalsa(
+        ahora=datetime(2025, 3, 15, tzinfo=timezone.utc),
+        watermarks={"hourly": datetime(2025, 3, 15, tzinfo=timezone.utc), "daily": datetime(2025, 2, 10, tzinfo=timezone.utc)},
+        particiones=PARTICIONES,
+    )
+    assert retention.aplicar_retencion(conn, dias=30, modo="drop") == 1
+    assert conn.eliminadas() == ['DROP TABLE "weather_logs_2025_01"']
+
+
+def test_detach_y_sin_watermark_no_borra():
+    ahora = datetime(2026, 6, 1, tzinfo=timezone.utc)
+    conn = ConexionFalsa(ahora=ahora, watermarks={"hourly": ahora}, particiones=PARTICIONES)
+    assert retention.aplicar_retencion(conn, dias=30, modo="detach") == 0
+    assert conn.eliminadas() == []
+
+    conn.watermarks["daily"] = ahora
+    assert retention.aplicar_retencion(conn, dias=30, modo="detach") == 3
+    assert all(s.startswith("ALTER TABLE weather_logs DETACH PARTITION") for s in conn.eliminadas())
+
+
+def test_reagrega_los_buckets_con_lecturas_tardias():
+    # Watermark horaria en las 12:00; la última reagregación fue a las 11:50
+    ahora = datetime(2025, 3, 15, 12, 30, tzinfo=timezone.utc)
+    watermark = datetime(2025, 3, 15, 12, tzinfo=timezone.utc)
+    reagregado = datetime(2025, 3, 15, 11, 50, tzinfo=timezone.utc)
+    conn = ConexionFalsa(ahora=ahora, watermarks={"hourly": watermark}, particiones=[],
+                         reagregados={"hourly": reagregado}, filas=[
+        # Ya agregada en su momento
+        (1, datetime(2025, 3, 15, 9, 10, tzinfo=timezone.utc), datetime(2025, 3, 15, 9, 11, tzinfo=timezone.utc)),
+        # Tardías: reintento diferido y reproducción del spool, por debajo de la watermark
+        (1, datetime(2025, 3, 15, 10, 5, tzinfo=timezone.utc), datetime(2025, 3, 15, 12, 20, tzinfo=timezone.utc)),
+        (1, datetime(2025, 3, 15, 10, 40, tzinfo=timezone.utc), datetime(2025, 3, 15, 12, 21, tzinfo=timezone.utc)),
+        (2, datetime(2025, 3, 15, 11, 55, tzinfo=timezone.utc), datetime(2025, 3, 15, 11, 47, tzinfo=timezone.utc)),
+        # Posterior a la watermark: la agrega acumular()
+        (3, datetime(2025, 3, 15, 12, 10, tzinfo=timezone.utc), datetime(2025, 3, 15, 12, 15, tzinfo=timezone.utc)),
+        # Tardía pero de un bucket fuera de la retención de datos crudos
+        (4, datetime(2025, 2, 1, 8, tzinfo=timezone.utc), datetime(2025, 3, 15, 12, 25, tzinfo=timezone.utc)),
+    ])
+
+    # (1, 10:00) y (2, 11:00): la de las 11:47 entra por el margen de transacciones abiertas
+    assert retention.reagregar_tardias(conn, "hourly", dias=30) == 2
+    parametros = conn.reagregacion
+    assert parametros["hasta"] == watermark and parametros["intervalo"] == timedelta(hours=1)
+    assert parametros["ingesta_desde"] == reagregado - retention.MARGEN_INGESTA
+    assert parametros["conservado"] == ahora - timedelta(days=30)
+    assert 'INSERT INTO "weather_logs_hourly"' in next(s for s in conn.sentencias if "JOIN weather_logs w" in s)
+    assert conn.reagregados["hourly"] == ahora
+
+    # La siguiente pasada ya no las vuelve a contar
+    conn.ahora = ahora + timedelta(hours=1)
+    assert retention.reagregar_tardias(conn, "hourly", dias=30) == 0
+
+
+def test_pasada_reagrega_antes_de_avanzar_la_watermark(monkeypatch):
+    llamadas = []
+    conn = ConexionFalsa(ahora=None, watermarks={}, particiones=[])
+    monkeypatch.setattr(retention, "reagregar_tardias", lambda c, nivel: llamadas.append(("reagregar", nivel)))
+    monkeypatch.setattr(retention, "acumular", lambda c, nivel: llamadas.append(("acumular", nivel)))
+    monkeypatch.setattr(retention, "aplicar_retencion", lambda c: llamadas.append(("retencion",)))
+    retention.pasada(conn)
+    assert llamadas == [("reagregar", "hourly"), ("acumular", "hourly"),
+                        ("reagregar", "daily"), ("acumular", "daily"), ("retencion",)]
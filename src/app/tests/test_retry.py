@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from utils.retry import (
+    HEADER_MOTIVO, HEADER_REINTENTOS, argumentos_nivel, cabeceras_reintento, nivel_siguiente, nombre_nivel,
+    parsear_retrasos, reintentos
+)
+
+NIVELES = [nombre_nivel("weather_retry", r) for r in parsear_retrasos("1, 5,30,120")]
+
+
+def test_niveles_y_argumentos():
+    assert NIVELES == ["weather_retry.1s", "weather_retry.5s", "weather_retry.30s", "weather_retry.120s"]
+    assert nombre_nivel("weather_retry", 0.5) == "weather_retry.0.5s"
+    # Sin routing key de dead-letter: vuelve con la original (la de su cola o su shard)
+    assert argumentos_nivel(30, "weather_exchange") == {
+        "x-message-ttl": 30000, "x-dead-letter-exchange": "weather_exchange"
+    }
+    assert parsear_retrasos("") == parsear_retrasos("0") == []
+    with pytest.raises(ValueError):
+        parsear_retrasos("5,-1")
+
+
+def test_backoff_por_niveles_hasta_la_dlq():
+    headers, recorrido = None, []
+    while True:
+        nivel = nivel_siguiente(headers, NIVELES, max_intentos=6)
+        recorrido.append(nivel)
+        if nivel is None:
+            break
+        headers = cabeceras_reintento(headers, "server closed the connection unexpectedly")
+    # El último nivel se repite hasta agotar los intentos; después, DLQ
+    assert recorrido == NIVELES + ["weather_retry.120s"] * 2 + [None]
+    assert headers[HEADER_REINTENTOS] == 6 and headers[HEADER_MOTIVO].startswith("server closed")
+
+
+def test_cabeceras_conservan_las_originales():
+    originales = {"x-readings": 10, HEADER_REINTENTOS: "2"}
+    nuevas = cabeceras_reintento(originales, "x" * 1000)
+    assert nuevas["x-readings"] == 10 and nuevas[HEADER_REINTENTOS] == 3 and len(nuevas[HEADER_MOTIVO]) == 200
+    assert originales[HEADER_REINTENTOS] == "2"
+    assert reintentos({HEADER_REINTENTOS: "basura"}) == 0
+    assert nivel_siguiente({}, [], 10) is None
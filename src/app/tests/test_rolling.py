@@ -0,0 +1,62 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from utils.rolling import AgregadosEstaciones, ColectorAgregados, VentanaCircular
+
+
+class Reloj:
+    def __init__(self, t=1_000_000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def fila(station, temperatura, humedad=50.0, viento=10.0, presion=1000.0):
+    return (station, datetime(2025, 1, 1), temperatura, humedad, "N", viento, presion)
+
+
+def test_ventana_descarta_casillas_vencidas():
+    ventana = VentanaCircular(60.0, 12, 1)  # casillas de 5 s
+    ventana.agregar(1000.0, [10.0])
+    ventana.agregar(1002.0, [20.0])
+    ventana.agregar(1030.0, [30.0])
+    assert ventana.resumir(1030.0) == (3, [(20.0, 10.0, 30.0)])
+    # 60 s después la primera casilla ya salió de la ventana
+    assert ventana.resumir(1061.0) == (1, [(30.0, 30.0, 30.0)])
+    assert ventana.resumir(2000.0) == (0, [None])
+
+
+def test_agregados_por_estacion_y_ventana():
+    reloj = Reloj()
+    agregados = AgregadosEstaciones(slots=12, reloj=reloj)
+    agregados.registrar([fila(1, 10.0), fila(2, -5.0)])
+    reloj.t += 120
+    agregados.registrar([fila(1, 20.0, humedad=70.0)])
+
+    instantanea = {station: (ultimos, ventanas) for station, ultimos, ventanas in agregados.instantanea()}
+    ultimos, ventanas = instantanea[1]
+    assert ultimos == [20.0, 70.0, 10.0, 1000.0]
+    por_ventana = {nombre: (n, resumenes) for nombre, n, resumenes in ventanas}
+    assert por_ventana["1m"][0] == 1
+    assert por_ventana["5m"][0] == 2
+    assert por_ventana["5m"][1][0] == (15.0, 10.0, 20.0)
+    assert por_ventana["1h"][1][1] == (60.0, 50.0, 70.0)
+    assert instantanea[2][1][0] == ("1m", 0, [None] * 4)
+
+
+def test_limite_de_estaciones_y_colector():
+    agregados = AgregadosEstaciones(max_estaciones=2, reloj=Reloj())
+    agregados.registrar([fila(1, 1.0), fila(2, 2.0), fila(3, 3.0)])
+    assert len(agregados) == 2
+
+    familias = {f.name: f for f in ColectorAgregados(agregados).collect()}
+    maximos = {
+        s.labels["station"]: s.value for s in familias["station_window_value"].samples
+        if s.labels["field"] == "temperature" and s.labels["window"] == "1h" and s.labels["stat"] == "max"
+    }
+    assert maximos == {"1": 1.0, "2": 2.0}
+    assert len(familias["station_last_value"].samples) == 8
@@ -0,0 +1,137 @@
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "producers_service"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+import sharding as productor
+from utils.sharding import INSTANCIAS_SQL, SOLTAR_SQL, TOMAR_SQL, ReclamadorShards, parsear_shards, shard_de
+
+
+def test_shard_estable_repartido_y_consistente():
+    assert all(shard_de(i, 8) == productor.shard_de(i, 8) for i in range(1, 2000))
+    conteo = Counter(shard_de(i, 8) for i in range(1, 8001))
+    assert set(conteo) == set(range(8)) and min(conteo.values()) > 900
+    # Al añadir un shard solo cambian de cola las estaciones que pasan al nuevo
+    movidas = [i for i in range(1, 8001) if shard_de(i, 8) != shard_de(i, 9)]
+    assert all(shard_de(i, 9) == 8 for i in movidas) and len(movidas) < 8000 / 9 * 1.2
+    assert shard_de(42, 1) == shard_de(42, 0) == 0
+
+
+def test_parsear_shards():
+    assert parsear_shards("auto", 8) is None
+    assert parsear_shards("all", 3) == [0, 1, 2]
+    assert parsear_shards("0-2, 6,1", 8) == [0, 1, 2, 6]
+    for texto in ("8", "3-1", "x"):
+        with pytest.raises(ValueError):
+            parsear_shards(texto, 8)
+
+
+def test_sobres_con_estaciones_del_mismo_shard():
+    enrutador = productor.Enrutador("weather.data", 4, range(1, 101))
+    for _ in range(50):
+        ids = enrutador.estaciones_sobre(10)
+        assert len({enrutador.routing_key(i) for i in ids}) == 1
+    assert enrutador.routing_key(7) == f"weather.data.{shard_de(7, 4)}"
+    assert productor.Enrutador("weather.data", 0, [1]).routing_key(7) == "weather.data"
+
+
+class LocksFalsos:
+    """Advisory locks y pg_stat_activity compartidos por varias conexiones falsas."""
+
+    def __init__(self):
+        self.duenos = {}
+        self.abiertas = set()
+
+
+class ConexionFalsa:
+    def __init__(self, db):
+        self.db = db
+        self.closed = 0
+        self.autocommit = False
+        db.abiertas.add(self)
+
+    def cursor(self):
+        return CursorFalso(self)
+
+    def close(self):
+        # Como en PostgreSQL, cerrar la sesión libera sus locks
+        self.closed = 1
+        self.db.abiertas.discard(self)
+        self.db.duenos = {s: c for s, c in self.db.duenos.items() if c is not self}
+
+
+class CursorFalso:
+    def __init__(self, conn):
+        self.conn = conn
+        self.resultado = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, consulta, params=()):
+        db = self.conn.db
+        if consulta == INSTANCIAS_SQL:
+            self.resultado = len(db.abiertas)
+        elif consulta == TOMAR_SQL:
+            self.resultado = db.duenos.setdefault(params[0], self.conn) is self.conn
+        elif consulta == SOLTAR_SQL:
+            self.resultado = db.duenos.pop(params[0], None) is self.conn
+
+    def fetchone(self):
+        return (self.resultado,)
+
+
+def instancia(db, consumiendo):
+    def tomar(shard):
+        assert shard not in consumiendo
+        consumiendo[shard] = nombre
+
+    def soltar(shard):
+        assert consumiendo.pop(shard) == nombre
+
+    nombre = object()
+    return ReclamadorShards(8, lambda: ConexionFalsa(db), tomar, soltar)
+
+
+def test_reparto_entre_instancias():
+    db, consumiendo = LocksFalsos(), {}
+    a = instancia(db, consumiendo)
+    a.pasada()
+    assert len(a.propios) == 8
+
+    b, c = instancia(db, consumiendo), instancia(db, consumiendo)
+    for _ in range(2):
+        for reclamador in (b, c, a):
+            reclamador.pasada()
+    # ceil(8/3) = 3: 3 + 3 + 2, sin shards repetidos ni sin dueño
+    assert sorted(len(r.propios) for r in (a, b, c)) == [2, 3, 3]
+    assert a.propios | b.propios | c.propios == set(range(8)) == set(consumiendo)
+
+    # Si una instancia cae, sus locks se liberan y las demás toman sus shards
+    b._conn.close()
+    for shard in b.propios:
+        consumiendo.pop(shard)
+    for reclamador in (a, c):
+        reclamador.pasada()
+    assert len(a.propios) == len(c.propios) == 4 and a.propios | c.propios == set(range(8))
+
+
+def test_reconexion_suelta_los_shards_que_tomo_otra_instancia():
+    db, de_a, de_b = LocksFalsos(), {}, {}
+    a, b = instancia(db, de_a), instancia(db, de_b)
+    a.pasada()
+    a._conn.close()  # Solo cae la conexión del reclamador: a sigue consumiendo sin locks
+    b.pasada()
+    assert len(de_a) == len(de_b) == 8  # x-single-active-consumer mantiene activo a a
+    a.pasada()
+    assert de_a == {} and a.propios == set()
+    b.pasada()
+    a.pasada()
+    assert len(de_a) == len(de_b) == 4
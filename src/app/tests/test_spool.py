@@ -0,0 +1,83 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from utils.spool import Spool, SpoolLleno, leer_segmento
+from utils.validation import normalizar
+
+FILA = normalizar({
+    "id_station": 3, "dates": "2024-05-01T10:00:00+00:00", "temperature_celsius": 21.5,
+    "humidity": 40.0, "wind": "N", "wind_speed": 3.2, "pressure": 1013.0,
+})
+
+
+def test_ida_y_vuelta_por_segmentos(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=10 ** 6, segmento_max_bytes=10 ** 6)
+    assert spool.vacio
+    spool.agregar([FILA, FILA])
+    spool.agregar([FILA])
+    assert spool.segmentos() == []  # El segmento activo no se reproduce hasta sellarlo
+    spool.sellar()
+    [ruta] = spool.segmentos()
+    lotes = list(leer_segmento(ruta))
+    assert lotes == [[FILA, FILA], [FILA]]
+    assert isinstance(lotes[1][0][1], datetime) and lotes[1][0][1].utcoffset() == timezone.utc.utcoffset(None)
+
+    spool.eliminar(ruta)
+    assert spool.vacio and spool.segmentos() == []
+
+
+def test_registro_cortado_se_descarta(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=10 ** 6, segmento_max_bytes=10 ** 6)
+    spool.agregar([FILA])
+    spool.agregar([FILA, FILA])
+    spool.sellar()
+    [ruta] = spool.segmentos()
+    # Caída a mitad del segundo registro: solo sobrevive el primero
+    with open(ruta, "r+b") as f:
+        f.truncate(os.path.getsize(ruta) - 5)
+    assert list(leer_segmento(ruta)) == [[FILA]]
+
+
+def test_limites_y_rotacion(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=600, segmento_max_bytes=200)
+    while True:
+        try:
+            spool.agregar([FILA])
+        except SpoolLleno:
+            break
+    spool.sellar()
+    segmentos = spool.segmentos()
+    assert len(segmentos) > 1 and all(os.path.getsize(r) <= 200 for r in segmentos)
+    assert sum(os.path.getsize(r) for r in segmentos) <= 600
+
+    # Otro proceso (reinicio) retoma los segmentos pendientes y continúa la numeración
+    reabierto = Spool(str(tmp_path), max_bytes=10 ** 6, segmento_max_bytes=200)
+    reabierto.agregar([FILA])
+    reabierto.sellar()
+    assert reabierto.segmentos()[:-1] == segmentos and not reabierto.vacio
+
+
+def test_metricas_sin_listar_el_directorio(tmp_path, monkeypatch):
+    spool = Spool(str(tmp_path), max_bytes=10 ** 6, segmento_max_bytes=200)
+
+    # agregar() y eliminar() mantienen los contadores sin recorrer el directorio
+    def listar(*args):
+        raise AssertionError("os.listdir en el camino de escritura")
+
+    monkeypatch.setattr(os, "listdir", listar)
+    for _ in range(5):
+        spool.agregar([FILA])
+    spool.sellar()
+    monkeypatch.undo()
+
+    segmentos = spool.segmentos()
+    assert REGISTRY.get_sample_value("spool_segments") == len(segmentos) > 1
+    assert REGISTRY.get_sample_value("spool_bytes") == sum(os.path.getsize(r) for r in segmentos)
+    spool.eliminar(segmentos[0])
+    assert REGISTRY.get_sample_value("spool_segments") == len(segmentos) - 1
+    assert REGISTRY.get_sample_value("spool_bytes") == sum(os.path.getsize(r) for r in segmentos[1:])
@@ -0,0 +1,107 @@
+import os
+import re
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+from utils.stations import ESTACIONES_SQL, CacheEstaciones, Estacion
+from utils.validation import ESTACION_DESCONOCIDA, FUERA_DE_RANGO, ErrorValidacion, validar_lote
+
+ESTACIONES = [
+    (1, "Estacion Norte", "Ciudad A", "Colombia", 4.7, -74.05, 2550.0),
+    (2, "Estacion Sur", "Ciudad B", "Chile", 4.5, -74.1, 2450.0),
+]
+
+
+INIT_SQL = os.path.join(os.path.dirname(__file__), "..", "..", "..", "init", "init.sql")
+
+
+def estaciones_de_init_sql():
+    """Filas de weather_stations que crea init/init.sql en una base nueva (id SERIAL desde 1)."""
+    with open(INIT_SQL, encoding="utf-8") as f:
+        texto = f.read()
+    inserciones = re.findall(r"INSERT INTO weather_stations\b.*?;", texto, re.S)
+    assert len(inserciones) == 1, "init.sql solo debe crear las estaciones reales"
+    valores = re.findall(r"\('([^']*)',\s*'([^']*)',\s*'([^']*)',\s*([-\d.]+),\s*([-\d.]+),\s*([-\d.]+)\)",
+                         inserciones[0])
+    return [(i, nombre, ciudad, pais, float(lat), float(lon), float(alt))
+            for i, (nombre, ciudad, pais, lat, lon, alt) in enumerate(valores, start=1)]
+
+
+def lectura(id_station, temperatura=20.0):
+    return {"id_station": id_station, "dates": datetime(2024, 1, 1).isoformat(), "temperature_celsius": temperatura,
+            "humidity": 50, "wind": "N", "wind_speed": 10, "pressure": 1000}
+
+
+class Cursor:
+    def __init__(self, filas):
+        self.filas, self.sql = filas, []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        self.sql.append(sql)
+
+    def fetchall(self):
+        return self.filas
+
+
+class Conexion:
+    def __init__(self, filas):
+        self.cur = Cursor(filas)
+
+    def cursor(self):
+        return self.cur
+
+
+def test_sin_cargar_acepta_todas_las_estaciones():
+    cache = CacheEstaciones()
+    assert not cache.cargada and cache.edad_s() is None
+    assert cache.conocida(12345)
+    fila = (12345, datetime(2024, 1, 1))
+    assert cache.verificar(fila) is fila
+
+
+def test_carga_y_metadatos():
+    reloj = iter([10.0, 25.0])
+    cache = CacheEstaciones(reloj=lambda: next(reloj))
+    conn = Conexion(ESTACIONES)
+    cache.cargar(conn, "inicio")
+    assert conn.cur.sql == [ESTACIONES_SQL]
+    assert len(cache) == 2 and cache.edad_s() == 15.0
+    assert cache.get(2) == Estacion(2, "Estacion Sur", "Ciudad B", "Chile", 4.5, -74.1, 2450.0)
+    assert cache.get(3) is None
+    with pytest.raises(ErrorValidacion) as info:
+        cache.verificar((3, datetime(2024, 1, 1)))
+    assert (info.value.codigo, info.value.campo) == (ESTACION_DESCONOCIDA, "id_station")
+
+
+def test_filtrar_lote():
+    cache = CacheEstaciones()
+    cache.reemplazar(ESTACIONES)
+    validas, errores = cache.filtrar(*validar_lote([lectura(1), lectura(7), lectura(2, 99), lectura(2)]))
+    assert [i for i, _ in validas] == [0, 3]
+    assert [(i, e.codigo) for i, e in errores] == [(1, ESTACION_DESCONOCIDA), (2, FUERA_DE_RANGO)]
+    # Al recargar (p. ej. tras un NOTIFY) la estación nueva ya se acepta
+    cache.reemplazar(ESTACIONES + [(7, "Estacion Nueva", None, None, None, None, None)])
+    validas, errores = cache.filtrar(*validar_lote([lectura(7)]))
+    assert [i for i, _ in validas] == [0] and errores == []
+
+
+@pytest.mark.skipif(not os.path.exists(INIT_SQL), reason="init/ no está disponible")
+def test_esquema_por_defecto_rechaza_estaciones_no_creadas():
+    # Con las estaciones del esquema que se despliega, no con una caché construida a mano: un
+    # id dentro del rango de la validación pero sin estación no debe llegar a la FK.
+    cache = CacheEstaciones()
+    cache.reemplazar(estaciones_de_init_sql())
+    assert len(cache) == 5 and cache.get(1).nombre == "Estacion Norte"
+    validas, errores = cache.filtrar(*validar_lote([lectura(1), lectura(42), lectura(9000), lectura(5)]))
+    assert [i for i, _ in validas] == [0, 3]
+    assert [(i, e.codigo) for i, e in errores] == [(1, ESTACION_DESCONOCIDA), (2, ESTACION_DESCONOCIDA)]
@@ -0,0 +1,60 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "consumers_service"))
+
+import pytest
+
+from utils.validation import (
+    CAMPO_FALTANTE, FECHA_INVALIDA, FUERA_DE_RANGO, PAYLOAD_INVALIDO, TIPO_INVALIDO, VALOR_NO_PERMITIDO,
+    ErrorValidacion, normalizar, validar_datos, validar_lote
+)
+
+
+def payload(**cambios):
+    data = {
+        "id_station": 1, "dates": "2025-01-01T10:00:00", "temperature_celsius": 20.5,
+        "humidity": 50, "wind": "ne", "wind_speed": 10, "pressure": 1013.2,
+    }
+    data.update(cambios)
+    return data
+
+
+def test_normaliza_en_orden_de_columnas():
+    fila = normalizar(payload(id_station="3"))
+    assert fila == (3, datetime(2025, 1, 1, 10, 0), 20.5, 50.0, "NE", 10.0, 1013.2)
+    assert isinstance(fila[3], float)
+
+@pytest.mark.parametrize("cambios, codigo, campo", [
+    ({"temperature_celsius": 71}, FUERA_DE_RANGO, "temperature_celsius"),
+    ({"humidity": float("nan")}, FUERA_DE_RANGO, "humidity"),
+    ({"pressure": "alta"}, TIPO_INVALIDO, "pressure"),
+    ({"dates": "ayer"}, FECHA_INVALIDA, "dates"),
+    ({"wind": "NNE"}, VALOR_NO_PERMITIDO, "wind"),
+    ({"id_station": 0}, FUERA_DE_RANGO, "id_station"),
+])
+def test_codigos_de_error(cambios, codigo, campo):
+    with pytest.raises(ErrorValidacion) as info:
+        normalizar(payload(**cambios))
+    assert info.value.codigo == codigo
+    assert info.value.campo == campo
+
+def test_campo_faltante_y_payload_no_objeto():
+    data = payload()
+    del data["wind_speed"]
+    with pytest.raises(ErrorValidacion) as info:
+        normalizar(data)
+    assert (info.value.codigo, info.value.campo) == (CAMPO_FALTANTE, "wind_speed")
+    with pytest.raises(ErrorValidacion) as info:
+        normalizar([1, 2])
+    assert info.value.codigo == PAYLOAD_INVALIDO
+
+def test_validar_lote():
+    validos, errores = validar_lote([payload(), payload(humidity=101), payload(id_station=2)])
+    assert [i for i, _ in validos] == [0, 2]
+    assert [(i, e.codigo) for i, e in errores] == [(1, FUERA_DE_RANGO)]
+
+def test_validar_datos_compatible():
+    assert validar_datos(payload()) is True
+    assert validar_datos(payload(wind="X")) is False